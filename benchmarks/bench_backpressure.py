@@ -0,0 +1,145 @@
+import argparse
+import base64
+import json
+import socket
+import threading
+import time
+
+from benchutil import (connect_client, free_port, percentile, print_table, raise_fd_limit,
+                       start_server_process, stop_server_process)
+
+from chat_server import ENGINES
+from framing import FRAME_TEXT, encode_frame, read_frame
+
+class Receiver(threading.Thread):
+    def __init__(self, sock, decoder):
+        super().__init__(daemon=True)
+        self.sock = sock
+        self.decoder = decoder
+        self.latencies = []
+        self.frames = []
+
+    def run(self):
+        try:
+            while True:
+                kind, payload = read_frame(self.sock, self.decoder)
+                if kind != FRAME_TEXT or not payload.startswith(b"{"):
+                    continue
+                frame = json.loads(payload)
+                if frame.get('type') == 'encrypted_message':
+                    self.latencies.append(time.time() - frame['data']['ts'])
+                else:
+                    self.frames.append(frame)
+        except (OSError, ValueError):
+            pass
+
+    def wait_for(self, msg_type, timeout=5.0):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            for frame in self.frames:
+                if frame.get('type') == msg_type:
+                    self.frames.remove(frame)
+                    return frame
+            time.sleep(0.01)
+        return None
+
+def connect_slow(port, nickname):
+    sock, decoder = connect_client(port, nickname)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    return sock, decoder
+
+def listed_users(receiver, sock):
+    sock.sendall(encode_frame(json.dumps({'type': 'user_list_request'})))
+    reply = receiver.wait_for('user_list')
+    return {u['nickname'] for u in reply['users']} if reply else set()
+
+def run_engine(engine, fast_count, messages, payload_size, server_args):
+    port = free_port()
+    proc = start_server_process(port, '--engine', engine, *server_args)
+    result = {'engine': engine}
+    socks = []
+    try:
+        sender, sender_decoder = connect_client(port, "sender")
+        socks.append(sender)
+        sender_rx = Receiver(sender, sender_decoder)
+        sender_rx.start()
+
+        receivers = []
+        for i in range(fast_count):
+            sock, decoder = connect_client(port, f"fast{i}")
+            socks.append(sock)
+            receiver = Receiver(sock, decoder)
+            receiver.start()
+            receivers.append(receiver)
+
+        slow_chat, _ = connect_slow(port, "slow_chat")
+        slow_voice, slow_voice_decoder = connect_slow(port, "slow_voice")
+        socks.extend([slow_chat, slow_voice])
+
+        sender.sendall(encode_frame(json.dumps({'type': 'call_request', 'target': 'slow_voice'})))
+        call = sender_rx.wait_for('call_response')
+        call_id = call.get('call_id') if call else None
+        kind, payload = read_frame(slow_voice, slow_voice_decoder)
+        while b'incoming_call' not in payload:
+            kind, payload = read_frame(slow_voice, slow_voice_decoder)
+        slow_voice.sendall(encode_frame(json.dumps({'type': 'call_answer', 'call_id': call_id,
+                                                    'action': 'accept'})))
+        sender_rx.wait_for('call_started')
+
+        voice_frame = encode_frame(json.dumps({'type': 'voice_data', 'call_id': call_id,
+                                               'audio_data': base64.b64encode(b"\0" * 2048).decode('ascii')}))
+        filler = "x" * payload_size
+        targets = [f"fast{i}" for i in range(fast_count)] + ["slow_chat"]
+        blocked = []
+        started = time.time()
+        for i in range(messages):
+            before = time.time()
+            for target in targets:
+                sender.sendall(encode_frame(json.dumps({'type': 'encrypted_message', 'sender': 'sender',
+                                                        'target': target,
+                                                        'data': {'ts': time.time(), 'filler': filler}})))
+            sender.sendall(voice_frame)
+            blocked.append(time.time() - before)
+            time.sleep(0.001)
+        result['send_seconds'] = round(time.time() - started, 2)
+        time.sleep(1.0)
+
+        latencies = sorted(l for r in receivers for l in r.latencies)
+        delivered = sum(len(r.latencies) for r in receivers)
+        blocked.sort()
+        users = listed_users(sender_rx, sender)
+        result.update({
+            'delivered_pct': round(100.0 * delivered / (messages * fast_count), 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'max_send_block_ms': round(blocked[-1] * 1000, 2) if blocked else 0,
+            'slow_chat_connected': 'slow_chat' in users,
+            'slow_voice_connected': 'slow_voice' in users,
+        })
+    finally:
+        for sock in socks:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        stop_server_process(proc)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Relay behaviour with clients that stop reading")
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--fast', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--payload', type=int, default=4096)
+    parser.add_argument('--server-args', default='', help="extra chat_server.py arguments")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    results = [run_engine(engine, args.fast, args.messages, args.payload, args.server_args.split())
+               for engine in args.engines.split(',')]
+    headers = ['engine', 'send_seconds', 'delivered_pct', 'p50_ms', 'p99_ms', 'max_send_block_ms',
+               'slow_chat_connected', 'slow_voice_connected']
+    print_table(headers, [[r.get(h, '-') for h in headers] for r in results])
+
+if __name__ == "__main__":
+    main()
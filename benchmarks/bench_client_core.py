@@ -0,0 +1,160 @@
+import argparse
+import asyncio
+import os
+import threading
+import time
+
+from benchutil import (PASSWORD, free_port, print_table, process_stats, raise_fd_limit, start_server_process,
+                       stop_server_process)
+
+from chat_server import ENGINES
+from client_core import ClientCore
+from identity import generate_identity
+
+def start_clients(port, count, identities, heartbeat):
+    clients = []
+    for i in range(count):
+        core = ClientCore(f"bot{i}", identities[i % len(identities)], heartbeat=heartbeat)
+        core.connect('127.0.0.1', port, PASSWORD)
+        clients.append(core)
+    return clients
+
+def chat_round(clients, timeout):
+    expected = len(clients) - 1
+    received = {c.nickname: set() for c in clients}
+    errors = []
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def on_message(core):
+        def handler(event, data):
+            with lock:
+                if data['text'] != f"hello from {data['sender']}":
+                    errors.append(data['text'])
+                received[core.nickname].add(data['sender'])
+                if all(len(s) >= expected for s in received.values()):
+                    done.set()
+        return handler
+
+    handlers = [(c, on_message(c)) for c in clients]
+    for core, handler in handlers:
+        core.on('message', handler)
+    started = time.perf_counter()
+    for core in clients:
+        core.send_message(f"hello from {core.nickname}")
+    done.wait(timeout)
+    elapsed = time.perf_counter() - started
+    for core, handler in handlers:
+        core.off('message', handler)
+    delivered = sum(len(s) for s in received.values())
+    assert not errors, f"bad plaintext: {errors[:3]}"
+    return delivered, len(clients) * expected, elapsed
+
+def call_check(caller, callee, frames):
+    started = {}
+    ended = {}
+    both = threading.Event()
+    hung_up = threading.Event()
+
+    def on_started(event, data):
+        started[data['call_id'], len(started)] = data
+        if len(started) == 2:
+            both.set()
+
+    def on_ended(event, data):
+        ended.update(data)
+        hung_up.set()
+
+    callee.on('incoming_call', lambda event, data: callee.answer(data['call_id']))
+    caller.on('call_started', on_started)
+    callee.on('call_started', on_started)
+    callee.on('call_ended', on_ended)
+    caller.call(callee.nickname)
+    assert both.wait(10), "call did not start"
+
+    played = []
+
+    def player():
+        idle = 0
+        while callee.in_call and idle < 3:
+            audio = callee.next_voice(timeout=0.1)
+            idle = idle + 1 if audio is None else 0
+            if audio is not None and audio != callee.silence:
+                played.append(audio)
+
+    thread = threading.Thread(target=player, daemon=True)
+    thread.start()
+    tone = bytes(range(256)) * (caller.chunk * 2 // 256)
+    for _ in range(frames):
+        caller.send_voice(tone)
+        time.sleep(caller.chunk / caller.rate)
+    thread.join(5)
+    caller.hangup()
+    assert hung_up.wait(10), "call did not end"
+    info = list(started.values())
+    return {'encrypted': all(d['encrypted'] for d in info), 'codec': info[0]['codec'], 'frames_sent': frames,
+            'frames_played': len(played), 'end_reason': ended['reason']}
+
+async def stream_check(port, identity):
+    core = ClientCore("streamer", identity, heartbeat=None)
+    seen = []
+
+    async def consume():
+        async for event, data in core.stream():
+            seen.append(event)
+
+    task = asyncio.ensure_future(consume())
+    await asyncio.sleep(0)
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, core.connect, '127.0.0.1', port, PASSWORD)
+    await asyncio.sleep(0.2)
+    core.disconnect()
+    await asyncio.wait_for(task, 5)
+    assert seen[0] == 'authenticated' and 'connected' in seen and seen[-1] == 'disconnected', seen
+    print(f"stream: async iterator saw {', '.join(seen)} OK")
+
+def run(engine, count, identities, heartbeat, frames, stream=False):
+    port = free_port()
+    proc = start_server_process(port, '--engine', engine)
+    clients = []
+    try:
+        before = process_stats(os.getpid())
+        started = time.perf_counter()
+        clients = start_clients(port, count, identities, heartbeat)
+        connect_s = time.perf_counter() - started
+        time.sleep(0.5)
+        after = process_stats(os.getpid())
+        delivered, expected, chat_s = chat_round(clients, 60)
+        call = call_check(clients[0], clients[1], frames)
+        if stream:
+            asyncio.run(stream_check(port, identities[0]))
+        return {'engine': engine, 'clients': count, 'connect_ms_per_client': round(connect_s / count * 1000, 2),
+                'kb_per_client': round((after['rss_kb'] - before['rss_kb']) / count, 1),
+                'threads_per_client': round((after['threads'] - before['threads']) / count, 2),
+                'delivered': f"{delivered}/{expected}", 'chat_round_s': round(chat_s, 2), **call}
+    finally:
+        for core in clients:
+            core.disconnect()
+        stop_server_process(proc)
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless ClientCore instances against a local server")
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--clients', default='20,100')
+    parser.add_argument('--identities', type=int, default=4, help="RSA keys shared round-robin by the clients")
+    parser.add_argument('--heartbeat', type=float, default=0, help="PING interval, 0 disables the thread")
+    parser.add_argument('--frames', type=int, default=40, help="voice frames sent in the call check")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    identities = [generate_identity() for _ in range(args.identities)]
+    rows = []
+    for engine in args.engines.split(','):
+        for count in [int(n) for n in args.clients.split(',')]:
+            rows.append(run(engine, count, identities, args.heartbeat or None, args.frames, not rows))
+    headers = ['engine', 'clients', 'connect_ms_per_client', 'kb_per_client', 'threads_per_client', 'delivered',
+               'chat_round_s', 'encrypted', 'codec', 'frames_sent', 'frames_played', 'end_reason']
+    print_table(headers, [[r[h] for h in headers] for r in rows])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+from benchutil import (PASSWORD, ROOT, connect_client, free_port, percentile, print_table, send_json, setup_call,
+                       start_server_process, stop_server_process, wait_json)
+
+from cluster import LinkAuth, event_frame, link_key, read_event, sign
+from framing import FRAME_TEXT, FRAME_VOICE, FrameDecoder, encode_frame, encode_voice_frame, read_frame
+
+CLUSTER_SECRET = "bench cluster secret"
+
+class Cluster:
+    def __init__(self, size, *extra):
+        self.ports = [free_port() for _ in range(size)]
+        self.bus_ports = [free_port() for _ in range(size)]
+        self.extra = extra
+        self.procs = [None] * size
+
+    def nodes(self):
+        return ",".join(f"127.0.0.1:{port}" for port in self.bus_ports)
+
+    def start(self, index):
+        self.procs[index] = start_server_process(self.ports[index], '--nodes', self.nodes(), '--node-id', str(index),
+                                                 '--cluster-secret', CLUSTER_SECRET, *self.extra)
+
+    def start_all(self):
+        for index in range(len(self.ports)):
+            self.start(index)
+
+    def stop(self):
+        for proc in self.procs:
+            if proc is not None:
+                try:
+                    os.kill(proc.pid, signal.SIGCONT)
+                except OSError:
+                    pass
+                stop_server_process(proc)
+
+def wait_text(peer, predicate, timeout=15.0):
+    sock, decoder = peer
+    deadline = time.time() + timeout
+    sock.settimeout(timeout)
+    try:
+        while time.time() < deadline:
+            kind, payload = read_frame(sock, decoder)
+            if kind == FRAME_TEXT and not payload.startswith(b"{") and predicate(payload.decode('utf-8')):
+                return time.perf_counter()
+    finally:
+        sock.settimeout(None)
+    raise RuntimeError("timed out waiting for text")
+
+def user_list(peer):
+    send_json(peer[0], {'type': 'user_list_request'})
+    return {user['nickname'] for user in wait_json(*peer, 'user_list')['users']}
+
+def wait_users(peer, expected, timeout=15.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        users = user_list(peer)
+        if expected <= users:
+            return users
+        time.sleep(0.05)
+    raise RuntimeError(f"users missing: {sorted(expected - users)}")
+
+def read_voice(peer, count, timeout=10.0):
+    sock, decoder = peer
+    sock.settimeout(timeout)
+    received = 0
+    try:
+        while received < count:
+            kind, _ = read_frame(sock, decoder)
+            if kind == FRAME_VOICE:
+                received += 1
+    finally:
+        sock.settimeout(None)
+    return received
+
+def checks(cluster, size):
+    peers = [connect_client(cluster.ports[i], f"node{i}") for i in range(size)]
+    try:
+        for i, peer in enumerate(peers):
+            wait_users(peer, {f"node{j}" for j in range(size) if j != i})
+        for i in range(size):
+            for port in cluster.ports:
+                try:
+                    connect_client(port, f"node{i}")[0].close()
+                    raise AssertionError("duplicate nickname accepted across nodes")
+                except RuntimeError as e:
+                    assert "nickname in use" in str(e)
+        for i, (sock, _) in enumerate(peers):
+            target = (i + 1) % size
+            send_json(sock, {'type': 'encrypted_message', 'sender': f"node{i}", 'target': f"node{target}",
+                             'data': {'encrypted_message': f"{i}->{target}"}})
+        for j, peer in enumerate(peers):
+            got = wait_json(*peer, 'encrypted_message')['data']['encrypted_message']
+            assert got == f"{(j - 1) % size}->{j}", got
+        call = setup_call(peers[0], peers[1], "node1")
+        for seq in range(20):
+            peers[0][0].sendall(encode_voice_frame(call['slot'], seq, b"a" * 160))
+            peers[1][0].sendall(encode_voice_frame(call['slot'], seq, b"b" * 160))
+        assert read_voice(peers[1], 20) == 20 and read_voice(peers[0], 20) == 20
+        send_json(peers[1][0], {'type': 'call_end', 'call_id': call['call_id']})
+        assert wait_json(*peers[0], 'call_ended')['call_id'] == call['call_id']
+
+        sock = socket.create_connection(('127.0.0.1', cluster.bus_ports[0]), timeout=5)
+        decoder = FrameDecoder()
+        nonce = json.loads(read_frame(sock, decoder)[1])['nonce']
+        auth = sign(PASSWORD.encode('utf-8'), nonce, 1)
+        sock.sendall(encode_frame(json.dumps({'op': 'hello', 'worker': 1, 'auth': auth}), 20))
+        sock.sendall(encode_frame(json.dumps({'op': 'join', 'nickname': 'intruder'}), 20))
+        assert sock.recv(1) == b"", "unauthenticated bus link was kept open"
+        sock.close()
+        assert 'intruder' not in user_list(peers[1])
+        env = {name: value for name, value in os.environ.items() if name != 'E2E_CHAT_CLUSTER_SECRET'}
+        started = subprocess.run([sys.executable, os.path.join(ROOT, 'chat_server.py'), '--port', str(free_port()),
+                                  '--nodes', cluster.nodes(), '--node-id', '0'], env=env, capture_output=True)
+        assert started.returncode == 2 and b"--cluster-secret" in started.stderr, "node started without a secret"
+        print(f"checks ({size} nodes): presence, unique nicknames, cross-node messages, cross-node call, "
+              f"link signed with the chat password rejected, node without a cluster secret refused OK")
+    finally:
+        for sock, _ in peers:
+            sock.close()
+
+def tamper_check():
+    cluster = Cluster(2, '--no-metrics')
+    secret = CLUSTER_SECRET.encode('utf-8')
+    sock = watcher = None
+    try:
+        cluster.start(0)
+        watcher = connect_client(cluster.ports[0], "tamper_watch")
+        sock = socket.create_connection(('127.0.0.1', cluster.bus_ports[0]), timeout=5)
+        decoder = FrameDecoder()
+        challenge = read_event(sock, decoder)['nonce']
+        nonce = os.urandom(16).hex()
+        sock.sendall(event_frame(op='hello', worker=1, nonce=nonce, auth=sign(secret, challenge, 1)))
+        assert read_event(sock, decoder)['auth'] == sign(secret, nonce, 0, 'welcome'), "listener did not prove the secret"
+        link = LinkAuth(link_key(secret, challenge, nonce, 1, 0))
+        sock.sendall(link.seal([event_frame(op='join', nickname='honest', status='idle')]))
+        wait_users(watcher, {'honest'})
+        frame = bytearray(link.seal([event_frame(op='join', nickname='tampered', status='idle')]))
+        frame[frame.index(b'tampered')] ^= 0x20
+        sock.sendall(frame)
+        assert sock.recv(1) == b"", "tampered bus frame was accepted"
+        users = user_list(watcher)
+        assert not {'tampered', 'Tampered', 'honest'} & users, users
+        print("tamper check: listener proves the secret, sealed frames accepted, a tampered frame closes the link OK")
+    finally:
+        for peer in (sock, watcher and watcher[0]):
+            if peer is not None:
+                peer.close()
+        cluster.stop()
+
+def claim_stall(cluster, size):
+    victim = size - 1
+    nickname = next(f"stalled{n}" for n in range(1000) if zlib.crc32(f"stalled{n}".encode('utf-8')) % size == victim)
+    observer = connect_client(cluster.ports[0], "claim_watch")
+    outcome = []
+
+    def join():
+        try:
+            connect_client(cluster.ports[0], nickname)[0].close()
+            outcome.append('joined')
+        except RuntimeError as e:
+            outcome.append(str(e))
+
+    os.kill(cluster.procs[victim].pid, signal.SIGSTOP)
+    joining = threading.Thread(target=join)
+    try:
+        joining.start()
+        time.sleep(0.2)
+        started = time.perf_counter()
+        user_list(observer)
+        waited = time.perf_counter() - started
+        joining.join(5)
+        assert outcome, "claim never answered"
+        assert waited < 0.5, f"node stalled {waited:.2f} s behind a pending nickname claim"
+        print(f"claim check: a claim waiting on a frozen node delays other clients by {waited * 1000:.1f} ms OK")
+    finally:
+        os.kill(cluster.procs[victim].pid, signal.SIGCONT)
+        joining.join()
+        observer[0].close()
+
+def relay_latency(cluster, count, cross):
+    sender = connect_client(cluster.ports[0], "lat_a")
+    receiver = connect_client(cluster.ports[1 if cross else 0], "lat_b")
+    try:
+        wait_users(sender, {"lat_b"})
+        samples = []
+        for n in range(count):
+            started = time.perf_counter()
+            send_json(sender[0], {'type': 'encrypted_message', 'sender': "lat_a", 'target': "lat_b",
+                                  'data': {'encrypted_message': str(n)}})
+            wait_json(*receiver, 'encrypted_message')
+            samples.append(time.perf_counter() - started)
+        samples.sort()
+        return ['cross-node' if cross else 'same node', count, round(percentile(samples, 50) * 1000, 3),
+                round(percentile(samples, 99) * 1000, 3), round(samples[-1] * 1000, 3)]
+    finally:
+        sender[0].close()
+        receiver[0].close()
+
+def membership(cluster, size, rounds):
+    observers = [connect_client(cluster.ports[i], f"observer{i}") for i in range(size)]
+    local, joins, leaves = [], [], []
+    try:
+        for i, observer in enumerate(observers):
+            wait_users(observer, {f"observer{j}" for j in range(size) if j != i})
+        for n in range(rounds):
+            home = n % size
+            nickname = f"member{n}"
+            started = time.perf_counter()
+            peer = connect_client(cluster.ports[home], nickname)
+            local.append(wait_text(observers[home], lambda text: nickname in text and "joined" in text) - started)
+            joins.append(max(wait_text(observers[i], lambda text: nickname in text and "joined" in text)
+                             for i in range(size) if i != home) - started)
+            started = time.perf_counter()
+            peer[0].close()
+            leaves.append(max(wait_text(observers[i], lambda text: nickname in text and "left" in text)
+                              for i in range(size) if i != home) - started)
+        rows = []
+        for name, samples in (('join, same node', local), ('join', joins), ('leave', leaves)):
+            samples.sort()
+            rows.append([name, len(samples), round(percentile(samples, 50) * 1000, 2),
+                         round(percentile(samples, 99) * 1000, 2), round(samples[-1] * 1000, 2)])
+        return rows
+    finally:
+        for sock, _ in observers:
+            sock.close()
+
+def node_loss(cluster, size, sig, name):
+    victim = size - 1
+    observer = connect_client(cluster.ports[0], f"watch_{name}")
+    caller = connect_client(cluster.ports[0], f"caller_{name}")
+    lost = [connect_client(cluster.ports[victim], f"lost_{name}{i}") for i in range(3)]
+    try:
+        wait_users(observer, {f"lost_{name}{i}" for i in range(3)} | {f"caller_{name}"})
+        call = setup_call(caller, lost[0], f"lost_{name}0")
+        started = time.perf_counter()
+        os.kill(cluster.procs[victim].pid, sig)
+        for _ in lost:
+            finished = wait_text(observer, lambda text: f"lost_{name}" in text and "left" in text, timeout=30)
+        ended = wait_json(*caller, 'call_ended', timeout=30)
+        assert ended['call_id'] == call['call_id'] and ended['reason'] == 'disconnected'
+        remaining = user_list(observer)
+        assert not any(nick.startswith(f"lost_{name}") for nick in remaining), remaining
+        row = [f"node {name}", 3, round((finished - started) * 1000, 1)]
+        if sig == signal.SIGSTOP:
+            os.kill(cluster.procs[victim].pid, signal.SIGCONT)
+            for sock, _ in lost:
+                sock.close()
+            lost = []
+        else:
+            cluster.procs[victim].wait()
+            cluster.start(victim)
+        started = time.perf_counter()
+        rejoined = connect_client(cluster.ports[victim], f"back_{name}")
+        wait_users(observer, {f"back_{name}"})
+        wait_users(rejoined, {f"watch_{name}", f"caller_{name}"})
+        row.append(round((time.perf_counter() - started) * 1000, 1))
+        rejoined[0].close()
+        return row
+    finally:
+        for sock, _ in [observer, caller] + lost:
+            sock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-node cluster: cross-node relay latency and membership convergence")
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=30)
+    parser.add_argument('--engine', default='thread')
+    args = parser.parse_args()
+
+    cluster = Cluster(args.nodes, '--engine', args.engine, '--no-metrics')
+    try:
+        cluster.start_all()
+        checks(cluster, args.nodes)
+        claim_stall(cluster, args.nodes)
+        tamper_check()
+        print()
+        print_table(['path', 'messages', 'p50_ms', 'p99_ms', 'max_ms'],
+                    [relay_latency(cluster, args.messages, False), relay_latency(cluster, args.messages, True)])
+        print()
+        print_table(['event', 'rounds', 'p50_ms', 'p99_ms', 'max_ms'], membership(cluster, args.nodes, args.rounds))
+        print("join/leave: time until observers on every other node see the change; join includes the client handshake")
+        print()
+        rows = [node_loss(cluster, args.nodes, signal.SIGKILL, 'killed'),
+                node_loss(cluster, args.nodes, signal.SIGSTOP, 'frozen')]
+        print_table(['failure', 'users', 'users_dropped_ms', 'rejoin_visible_ms'], rows)
+        print("killed: links close at once; frozen: detected by missed bus heartbeats")
+    finally:
+        cluster.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import argparse
+import json
+import socket
+import threading
+import time
+import urllib.request
+
+from benchutil import (Drain, connect_client, free_port, percentile, print_table, process_stats, send_json,
+                       start_server_process, stop_server_process, wait_json)
+
+from framing import FrameDecoder, encode_frame, send_frames
+from outbound import OutboundQueue
+
+def checks():
+    left, right = socket.socketpair()
+    left.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    left.settimeout(10)
+    frames = [encode_frame(bytes([n % 251]) * (n * 37 % 3000)) for n in range(3000)]
+    received = []
+
+    def reader():
+        decoder = FrameDecoder()
+        while len(received) < len(frames):
+            data = right.recv(65536)
+            if not data:
+                break
+            decoder.feed(data)
+            received.extend(payload for _, payload in decoder)
+            time.sleep(0.0005)
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    calls = send_frames(left, frames)
+    thread.join(10)
+    left.close()
+    right.close()
+    assert [encode_frame(payload) for payload in received] == frames, "frames corrupted by partial sendmsg"
+    assert calls < len(frames)
+
+    queue = OutboundQueue()
+    for n in range(10):
+        queue.put(b"c" * 1000)
+    queue.put(b"v", 'voice')
+    first = queue.take(2500)
+    assert first[0] == b"v" and len(first) == 4, [len(frame) for frame in first]
+    queue.put(b"w", 'voice')
+    assert queue.take(2500)[0] == b"w", "voice frame waited behind queued chat"
+    assert len(queue.take()) == 4 and queue.empty()
+    print(f"checks: {len(frames)} frames through a 4 KB send buffer in {calls} sendmsg calls intact, "
+          f"voice ahead of chat batches OK")
+
+def server_stats(metrics_port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/stats", timeout=5) as response:
+        metrics = json.loads(response.read())['metrics']
+    return {name: metrics[name]['samples'][0]['value']
+            for name in ('chat_sent_frames_total', 'chat_socket_writes_total')}
+
+def fan_in(engine, batch_kb, senders, messages):
+    port, metrics_port = free_port(), free_port()
+    proc = start_server_process(port, '--engine', engine, '--write-batch-kb', str(batch_kb),
+                                '--chat-queue-frames', '100000', '--metrics-port', str(metrics_port))
+    peers = []
+    try:
+        receiver = connect_client(port, "sink")
+        peers = [connect_client(port, f"src{i}") for i in range(senders)]
+        drain = Drain([receiver] + peers, collect=b'{"type": "encrypted_message"')
+        drain.start()
+        drain.wait_quiet(idle=0.5)
+        frame = encode_frame(json.dumps({'type': 'encrypted_message', 'sender': "src", 'target': "sink",
+                                         'data': {'encrypted_message': 'x' * 120}}))
+        per_sender = messages // senders
+        before = server_stats(metrics_port)
+        cpu_before = process_stats(proc.pid)['cpu_seconds']
+        started = time.perf_counter()
+
+        def blast(sock):
+            burst = frame * 50
+            for _ in range(per_sender // 50):
+                sock.sendall(burst)
+
+        threads = [threading.Thread(target=blast, args=(sock,)) for sock, _ in peers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        sent = (per_sender // 50) * 50 * senders
+        deadline = time.time() + 60
+        while len(drain.collected) < sent and time.time() < deadline:
+            time.sleep(0.005)
+        elapsed = time.perf_counter() - started
+        cpu = process_stats(proc.pid)['cpu_seconds'] - cpu_before
+        after = server_stats(metrics_port)
+        drain.running = False
+        frames = after['chat_sent_frames_total'] - before['chat_sent_frames_total']
+        writes = after['chat_socket_writes_total'] - before['chat_socket_writes_total']
+        assert len(drain.collected) == sent, f"lost messages: {len(drain.collected)}/{sent}"
+        return [engine, f"{batch_kb} KB" if batch_kb else "off", sent, int(sent / elapsed), int(writes),
+                round(frames / max(1, writes), 1), round(cpu / sent * 1e6, 1)]
+    finally:
+        for sock, _ in peers:
+            sock.close()
+        stop_server_process(proc)
+
+def small_frame_latency(engine, nodelay, rounds):
+    port = free_port()
+    args = ['--engine', engine, '--no-metrics'] + ([] if nodelay else ['--no-nodelay'])
+    proc = start_server_process(port, *args)
+    try:
+        handshakes = []
+        for n in range(rounds):
+            started = time.perf_counter()
+            connect_client(port, f"hs{n}", nodelay=nodelay)[0].close()
+            handshakes.append(time.perf_counter() - started)
+        sender = connect_client(port, "pa", nodelay=nodelay)
+        receiver = connect_client(port, "pb", nodelay=nodelay)
+        pairs = []
+        for n in range(rounds):
+            started = time.perf_counter()
+            for part in range(2):
+                send_json(sender[0], {'type': 'encrypted_message', 'sender': "pa", 'target': "pb",
+                                      'data': {'encrypted_message': f"{n}.{part}"}})
+            wait_json(*receiver, 'encrypted_message')
+            wait_json(*receiver, 'encrypted_message')
+            pairs.append(time.perf_counter() - started)
+            time.sleep(0.002)
+        sender[0].close()
+        receiver[0].close()
+        rows = []
+        for name, samples in (('handshake', handshakes), ('2 back-to-back msgs', pairs)):
+            samples.sort()
+            rows.append([engine, 'on' if nodelay else 'off', name, round(percentile(samples, 50) * 1000, 2),
+                         round(percentile(samples, 99) * 1000, 2)])
+        return rows
+    finally:
+        stop_server_process(proc)
+
+def main():
+    parser = argparse.ArgumentParser(description="Write coalescing and TCP_NODELAY: socket writes and small-frame latency")
+    parser.add_argument('--engines', default='thread,asyncio')
+    parser.add_argument('--senders', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=40000)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--skip-checks', action='store_true')
+    args = parser.parse_args()
+
+    if not args.skip_checks:
+        checks()
+        print()
+    engines = args.engines.split(',')
+    rows = [fan_in(engine, batch_kb, args.senders, args.messages) for engine in engines for batch_kb in (0, 256)]
+    print_table(['engine', 'coalescing', 'messages', 'msgs_per_s', 'socket_writes', 'frames_per_write',
+                 'server_us_per_msg'], rows)
+    print("fan-in: all senders target one receiver, so its outbound queue builds a backlog")
+    print()
+    rows = [row for engine in engines for nodelay in (False, True)
+            for row in small_frame_latency(engine, nodelay, args.rounds)]
+    print_table(['engine', 'nodelay', 'exchange', 'p50_ms', 'p99_ms'], rows)
+    print("nodelay applies to both the server's client sockets and the benchmark clients")
+
+if __name__ == "__main__":
+    main()
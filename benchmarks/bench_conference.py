@@ -0,0 +1,218 @@
+import argparse
+import selectors
+import threading
+import time
+
+from benchutil import (PASSWORD, connect_client, free_port, print_table, process_stats, raise_fd_limit, send_json,
+                       start_server_process, stop_server_process, wait_json)
+
+from client_core import ClientCore
+from conference import Conference
+from framing import FRAME_VOICE, encode_conference_frame, parse_conference_frame
+from identity import generate_identity
+
+FPS = 50
+RATE = 16000
+CHUNK = RATE // FPS
+LOUD = 12
+MURMUR = 60
+SILENT = 127
+
+class Listener(threading.Thread):
+    def __init__(self, peers):
+        super().__init__(daemon=True)
+        self.selector = selectors.DefaultSelector()
+        self.sources = {}
+        self.frames = {}
+        self.bytes = {}
+        for index, (sock, decoder) in enumerate(peers):
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ, (index, decoder))
+            self.sources[index] = set()
+            self.frames[index] = self.bytes[index] = 0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            for key, _ in self.selector.select(timeout=0.1):
+                index, decoder = key.data
+                try:
+                    data = key.fileobj.recv(262144)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except OSError:
+                    data = b""
+                if not data:
+                    self.selector.unregister(key.fileobj)
+                    continue
+                decoder.feed(data)
+                for kind, payload in decoder:
+                    if kind == FRAME_VOICE:
+                        self.frames[index] += 1
+                        self.bytes[index] += len(payload)
+                        self.sources[index].add(parse_conference_frame(payload)[2])
+
+def start_conference(port, size, prefix="p"):
+    nicks = [f"{prefix}{i:03d}" for i in range(size)]
+    peers = [connect_client(port, nick) for nick in nicks]
+    send_json(peers[0][0], {'type': 'conference_create', 'nicknames': nicks[1:], 'codecs': ['pcm16']})
+    started = [wait_json(*peers[0], 'conference_started')]
+    for peer in peers[1:]:
+        invite = wait_json(*peer, 'conference_invite')
+        send_json(peer[0], {'type': 'conference_join', 'call_id': invite['call_id']})
+        started.append(wait_json(*peer, 'conference_started'))
+    return nicks, peers, started
+
+def levels(size, speakers):
+    return [LOUD + i * 3 if i < speakers else MURMUR if i == speakers else SILENT for i in range(size)]
+
+def raw_checks(engine):
+    port = free_port()
+    proc = start_server_process(port, '--engine', engine, '--no-metrics', '--conference-speakers', '2')
+    peers = []
+    try:
+        nicks, peers, started = start_conference(port, 5)
+        assert [s['source'] for s in started] == [1, 2, 3, 4, 5], started
+        listener = Listener(peers)
+        slot = started[0]['slot']
+        sent = levels(5, 2)
+        for seq in range(20):
+            for index, peer in enumerate(peers):
+                peer[0].sendall(encode_conference_frame(slot, seq, index + 1, sent[index], b"a" * 64))
+            peers[4][0].sendall(encode_conference_frame(slot, seq, 1, LOUD, b"spoofed!" * 8))
+            time.sleep(0.02)
+        listener.start()
+        time.sleep(0.3)
+        listener.running = False
+        listener.join()
+        sources = listener.sources
+        assert sources[0] == {2, 3} and sources[1] == {1, 3}, sources
+        assert sources[2] == sources[3] == sources[4] == {1, 2}, sources
+        send_json(peers[1][0], {'type': 'conference_leave', 'call_id': started[0]['call_id']})
+        print(f"checks ({engine}): top-2 speakers to everyone, 3rd speaker only to the top 2, silent sources dropped, "
+              "spoofed source ignored")
+    finally:
+        for sock, _ in peers:
+            sock.close()
+        stop_server_process(proc)
+
+def core_checks():
+    port = free_port()
+    proc = start_server_process(port, '--no-metrics')
+    cores = {}
+    try:
+        for nick in ("alice", "bob", "carol"):
+            core = cores[nick] = ClientCore(nick, generate_identity(), rate=RATE, chunk=CHUNK, heartbeat=None,
+                                            codecs=['pcm16'])
+            core.on('conference_invite', lambda event, data, core=core: core.join_conference(data['call_id']))
+            core.connect('127.0.0.1', port, PASSWORD)
+        members = set()
+        joined = threading.Event()
+        left = threading.Event()
+
+        def member(event, data):
+            if data['action'] == 'join':
+                members.add(data['nickname'])
+                if len(members) == 2:
+                    joined.set()
+            elif data['nickname'] == "carol":
+                left.set()
+        cores['alice'].on('conference', member)
+        cores['alice'].conference(["bob", "carol"])
+        assert joined.wait(10), "bob and carol did not join"
+        deadline = time.time() + 5
+        while not all(core.in_call for core in cores.values()) and time.time() < deadline:
+            time.sleep(0.02)
+        assert all(core.in_call and core.voice_cipher for core in cores.values()), "conference is not encrypted"
+        tone = b"\x00\x10" * CHUNK
+        for _ in range(10):
+            cores['alice'].send_voice(tone)
+            time.sleep(0.02)
+        mixed = None
+        deadline = time.time() + 5
+        while mixed is None and time.time() < deadline:
+            mixed = cores['carol'].next_voice(timeout=0.1)
+        assert mixed == tone, "carol did not hear alice"
+        assert cores['carol'].voice_cipher.rejected == 0
+        cores['carol'].hangup()
+        assert left.wait(10), "carol's leave not announced"
+        print("checks (ClientCore): invite, key wrap, per-sender encrypted frames decrypted and mixed, leave OK")
+    finally:
+        for core in cores.values():
+            core.disconnect()
+        stop_server_process(proc)
+
+def rank_cost(size, rounds):
+    conference = Conference("bench", 'pcm16')
+    clients = [object() for _ in range(size)]
+    for index, client in enumerate(clients):
+        conference.add(client, f"p{index}")
+    sent = levels(size, conference.speakers)
+    started = time.perf_counter()
+    now = 0.0
+    for _ in range(rounds):
+        now += 1.0 / FPS
+        for index, client in enumerate(clients):
+            conference.route(client, index + 1, sent[index], now)
+    return (time.perf_counter() - started) / (rounds * size) * 1e6
+
+def load(size, speakers, duration, audio_bytes):
+    port = free_port()
+    proc = start_server_process(port, '--no-metrics', '--conference-speakers', str(speakers))
+    peers = []
+    try:
+        nicks, peers, started = start_conference(port, size)
+        slot = started[0]['slot']
+        sent = levels(size, 3)
+        audio = b"v" * audio_bytes
+        listener = Listener(peers)
+        listener.start()
+        before = process_stats(proc.pid)['cpu_seconds']
+        began = time.perf_counter()
+        seq = 0
+        while time.perf_counter() - began < duration:
+            for index, peer in enumerate(peers):
+                peer[0].sendall(encode_conference_frame(slot, seq, index + 1, sent[index], audio))
+            seq += 1
+            delay = began + seq / float(FPS) - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        elapsed = time.perf_counter() - began
+        time.sleep(0.5)
+        cpu = process_stats(proc.pid)['cpu_seconds'] - before
+        listener.running = False
+        listener.join()
+        frames = sorted(listener.frames.values())
+        streams = max(len(sources) for sources in listener.sources.values())
+        received = sum(frames)
+        return [f"top-{speakers}" if speakers else "forward all", size, round(seq / elapsed, 1),
+                round(received / elapsed / size, 1), round(sum(listener.bytes.values()) * 8 / elapsed / size / 1000, 1),
+                streams, round(received / elapsed), round(cpu / elapsed * 100, 1)]
+    finally:
+        for sock, _ in peers:
+            sock.close()
+        stop_server_process(proc)
+
+def main():
+    parser = argparse.ArgumentParser(description="Selective forwarding conference load test on loopback")
+    parser.add_argument('--participants', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--audio-bytes', type=int, default=160, help="payload per 20 ms frame (160: 64 kbit/s)")
+    parser.add_argument('--skip-checks', action='store_true')
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    if not args.skip_checks:
+        for engine in ('thread', 'asyncio'):
+            raw_checks(engine)
+        core_checks()
+        print()
+    rows = [load(args.participants, speakers, args.duration, args.audio_bytes) for speakers in (3, 0)]
+    print_table(['mode', 'participants', 'send_fps', 'recv_fps_per_listener', 'recv_kbps_per_listener',
+                 'max_streams_per_listener', 'server_frames_out_per_s', 'server_cpu_pct'], rows)
+    print(f"3 loud speakers, 1 murmur, {args.participants - 4} silent; every participant sends {FPS} frames/s")
+    print(f"Conference.route: {rank_cost(args.participants, 200):.2f} µs per frame "
+          f"({args.participants} participants, re-ranked every 20 ms)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import json
+import selectors
+import threading
+import time
+
+from benchutil import (connect_client, free_port, print_table, process_stats, raise_fd_limit,
+                       start_server_process, stop_server_process)
+
+from chat_server import ENGINES
+from framing import encode_frame
+
+class Drain(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.running = True
+        self.bytes_received = 0
+        self.relayed = 0
+
+    def add(self, sock, decoder):
+        sock.setblocking(False)
+        with self.lock:
+            self.selector.register(sock, selectors.EVENT_READ, decoder)
+
+    def run(self):
+        while self.running:
+            with self.lock:
+                if not self.selector.get_map():
+                    events = []
+                else:
+                    events = self.selector.select(timeout=0)
+            if not events:
+                time.sleep(0.001)
+                continue
+            for key, _ in events:
+                try:
+                    data = key.fileobj.recv(65536)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except OSError:
+                    data = b""
+                if not data:
+                    with self.lock:
+                        self.selector.unregister(key.fileobj)
+                    continue
+                self.bytes_received += len(data)
+                key.data.feed(data)
+                for kind, payload in key.data:
+                    if payload.startswith(b'{"type": "encrypted_message"'):
+                        self.relayed += 1
+
+def send_nowait(sock, frame):
+    try:
+        n = sock.send(frame)
+    except (BlockingIOError, InterruptedError):
+        return False
+    view = memoryview(frame)[n:]
+    while view:
+        try:
+            view = view[sock.send(view):]
+        except (BlockingIOError, InterruptedError):
+            time.sleep(0.0005)
+    return True
+
+def run_engine(engine, connections, active, duration):
+    port = free_port()
+    proc = start_server_process(port, '--engine', engine)
+    drain = Drain()
+    drain.start()
+    socks = []
+    result = {'engine': engine, 'connections': connections}
+    try:
+        baseline = process_stats(proc.pid)
+        started = time.time()
+        for i in range(connections):
+            sock, decoder = connect_client(port, f"bench{i}")
+            socks.append(sock)
+            drain.add(sock, decoder)
+        result['connect_seconds'] = round(time.time() - started, 2)
+
+        time.sleep(1.0)
+        idle_start = process_stats(proc.pid)
+        time.sleep(duration)
+        idle_end = process_stats(proc.pid)
+        result['threads'] = idle_end['threads']
+        if idle_end['rss_kb'] is not None and baseline['rss_kb'] is not None:
+            result['rss_mb'] = round(idle_end['rss_kb'] / 1024.0, 1)
+            result['kb_per_conn'] = round((idle_end['rss_kb'] - baseline['rss_kb']) / max(connections, 1), 1)
+        if idle_end['cpu_seconds'] is not None:
+            result['idle_cpu_pct'] = round(100.0 * (idle_end['cpu_seconds'] - idle_start['cpu_seconds']) / duration, 1)
+
+        pairs = [(socks[i], f"bench{i ^ 1}") for i in range(min(active, connections - connections % 2))]
+        payload = {'type': 'encrypted_message', 'sender': 'bench', 'target': None,
+                   'data': {'encrypted_message': 'x' * 128}}
+        frames = []
+        for sock, target in pairs:
+            payload['target'] = target
+            frames.append((sock, encode_frame(json.dumps(payload))))
+
+        relayed_before = drain.relayed
+        cpu_before = process_stats(proc.pid)['cpu_seconds']
+        deadline = time.time() + duration
+        sent = 0
+        while time.time() < deadline:
+            for sock, frame in frames:
+                if send_nowait(sock, frame):
+                    sent += 1
+            time.sleep(0.001)
+        time.sleep(0.5)
+        cpu_after = process_stats(proc.pid)['cpu_seconds']
+        result['active'] = len(pairs)
+        result['sent_per_s'] = int(sent / duration)
+        result['relayed_per_s'] = int((drain.relayed - relayed_before) / duration)
+        if cpu_after is not None and cpu_before is not None:
+            result['active_cpu_pct'] = round(100.0 * (cpu_after - cpu_before) / duration, 1)
+    finally:
+        drain.running = False
+        for sock in socks:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        stop_server_process(proc)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare idle and active connection capacity per server engine")
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--connections', default='100,500,1000')
+    parser.add_argument('--active', type=int, default=100, help="connections sending during the active phase")
+    parser.add_argument('--duration', type=float, default=3.0)
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    results = []
+    for count in [int(c) for c in args.connections.split(',')]:
+        for engine in args.engines.split(','):
+            result = run_engine(engine, count, args.active, args.duration)
+            results.append(result)
+            print(f"  {engine:8s} {count:6d} connections done")
+
+    headers = ['engine', 'connections', 'connect_seconds', 'threads', 'rss_mb', 'kb_per_conn',
+               'idle_cpu_pct', 'active', 'sent_per_s', 'relayed_per_s', 'active_cpu_pct']
+    print_table(headers, [[r.get(h, '-') for h in headers] for r in results])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
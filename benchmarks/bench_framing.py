@@ -0,0 +1,127 @@
+import argparse
+import json
+import random
+import time
+
+import benchutil  # noqa: F401
+
+from framing import FRAME_TEXT, MAX_FRAME_SIZE, FrameDecoder, FrameError, HEADER, encode_frame
+
+def legacy_parse(chunks):
+    frames = 0
+    buf = ""
+    for chunk in chunks:
+        buf += chunk.decode('utf-8', errors='replace')
+        while '\n' in buf:
+            line, buf = buf.split('\n', 1)
+            if line.strip():
+                frames += 1
+    return frames
+
+def decoder_parse(chunks):
+    frames = 0
+    decoder = FrameDecoder()
+    for chunk in chunks:
+        decoder.feed(chunk)
+        for _ in decoder:
+            frames += 1
+    return frames
+
+def random_bytes(rng, size):
+    return rng.getrandbits(size * 8).to_bytes(size, 'big')
+
+def random_payload(rng):
+    kind = rng.random()
+    if kind < 0.1:
+        return b""
+    if kind < 0.4:
+        text = ''.join(rng.choice("aé€😀\n{}\"") for _ in range(rng.randint(1, 64)))
+        return text.encode('utf-8')
+    if kind < 0.9:
+        return random_bytes(rng, rng.randint(1, 512))
+    return random_bytes(rng, rng.randint(16384, 70000))
+
+def segment(stream, rng):
+    chunks = []
+    i = 0
+    while i < len(stream):
+        mode = rng.random()
+        if mode < 0.3:
+            size = 1
+        elif mode < 0.8:
+            size = rng.randint(1, 64)
+        else:
+            size = rng.randint(1, 100000)
+        chunks.append(stream[i:i + size])
+        i += size
+    return chunks
+
+def fuzz(iterations, seed):
+    rng = random.Random(seed)
+    for _ in range(iterations):
+        frames = [(rng.randint(0, 3), random_payload(rng)) for _ in range(rng.randint(1, 40))]
+        stream = b"".join(encode_frame(payload, kind) for kind, payload in frames)
+        decoder = FrameDecoder()
+        decoded = []
+        for chunk in segment(stream, rng):
+            decoder.feed(rng.choice((bytes, bytearray, memoryview))(chunk))
+            decoded.extend(decoder)
+        assert decoded == frames, "segmentation changed the decoded frames"
+        assert decoder.pending() == 0
+
+    decoder = FrameDecoder()
+    decoder.feed(HEADER.pack(FRAME_TEXT, MAX_FRAME_SIZE + 1))
+    try:
+        decoder.next_frame()
+        raise AssertionError("oversized frame was accepted")
+    except FrameError:
+        pass
+
+def build_stream(frame_count, payload_size):
+    message = json.dumps({'type': 'encrypted_message', 'target': 'peer',
+                          'data': {'encrypted_message': 'x' * payload_size}})
+    legacy = ((message + '\n') * frame_count).encode('utf-8')
+    framed = encode_frame(message) * frame_count
+    return legacy, framed
+
+def chunked(stream, size):
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+def timed(fn, chunks, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        count = fn(chunks)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return count, best
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame parser throughput and segmentation fuzzing")
+    parser.add_argument('--fuzz', type=int, default=300, help="fuzz iterations (0 to skip)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.fuzz:
+        started = time.perf_counter()
+        fuzz(args.fuzz, args.seed)
+        print(f"fuzz: {args.fuzz} random streams decoded identically under arbitrary segmentation "
+              f"({time.perf_counter() - started:.1f}s)")
+
+    rows = []
+    for frame_count, payload_size, chunk_size in [(5000, 64, None), (1000, 200, 4096), (20000, 64, 65536),
+                                                  (2000, 200, 1024 * 1024), (200, 20000, 4096)]:
+        legacy, framed = build_stream(frame_count, payload_size)
+        legacy_chunk = chunk_size or len(legacy) // frame_count
+        framed_chunk = chunk_size or len(framed) // frame_count
+        legacy_count, legacy_time = timed(legacy_parse, chunked(legacy, legacy_chunk), args.repeat)
+        framed_count, framed_time = timed(decoder_parse, chunked(framed, framed_chunk), args.repeat)
+        assert legacy_count == framed_count == frame_count
+        rows.append([frame_count, payload_size, chunk_size or "1 frame",
+                     f"{len(legacy) / legacy_time / 1e6:.1f}", f"{len(framed) / framed_time / 1e6:.1f}",
+                     f"{legacy_time / framed_time:.1f}x"])
+    benchutil.print_table(['frames', 'payload', 'recv_chunk', 'legacy_MB/s', 'decoder_MB/s', 'speedup'], rows)
+
+if __name__ == "__main__":
+    main()
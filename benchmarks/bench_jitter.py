@@ -0,0 +1,94 @@
+import argparse
+import heapq
+import random
+
+import benchutil
+
+from jitter_buffer import LOST, SEQ_MOD, JitterBuffer, seq_diff
+
+FRAME_MS = 1024 * 1000.0 / 44100
+
+def network(frames, base_ms, jitter_ms, spike_pct, loss_pct, rng, first_seq=0):
+    arrivals = []
+    for i in range(frames):
+        if rng.random() * 100 < loss_pct:
+            continue
+        delay = base_ms + rng.expovariate(1.0 / jitter_ms) if jitter_ms else base_ms
+        if rng.random() * 100 < spike_pct:
+            delay += rng.uniform(100, 250)
+        seq = (first_seq + i) % SEQ_MOD
+        heapq.heappush(arrivals, (i * FRAME_MS + delay, seq, i * FRAME_MS))
+    return arrivals
+
+def simulate(buffer, arrivals):
+    sent_at = {}
+    latencies = []
+    played = []
+    silent_ticks = 0
+    tick = arrivals[0][0] if arrivals else 0.0
+    while arrivals or (buffer.playing and buffer.depth()):
+        while arrivals and arrivals[0][0] <= tick:
+            arrived, seq, sent = heapq.heappop(arrivals)
+            sent_at[seq] = sent
+            buffer.put(seq, seq, now=arrived / 1000.0)
+        frame = buffer.pop(timeout=0)
+        if frame is None or frame is LOST:
+            silent_ticks += 1
+        else:
+            latencies.append(tick - sent_at[frame])
+            played.append(frame)
+        tick += FRAME_MS
+    return latencies, played, silent_ticks
+
+def run(name, buffer, args, seed):
+    rng = random.Random(seed)
+    arrivals = network(args.frames, args.base_ms, args.jitter_ms, args.spike_pct, args.loss_pct, rng)
+    latencies, _, silent = simulate(buffer, arrivals)
+    latencies.sort()
+    st = buffer.stats()
+    return [name, st['played'], st['lost'] + st['late'] + st['trimmed'], st['underruns'], silent,
+            round(benchutil.percentile(latencies, 50), 1), round(benchutil.percentile(latencies, 99), 1),
+            st['target_ms'], st['max_depth']]
+
+def fuzz(iterations, seed=11):
+    rng = random.Random(seed)
+    for _ in range(iterations):
+        first = rng.choice([0, SEQ_MOD - rng.randint(1, 200), rng.randrange(SEQ_MOD)])
+        buffer = JitterBuffer(FRAME_MS, rng.choice([20, 60, 120]), rng.choice([150, 300]),
+                              adaptive=rng.random() < 0.5)
+        arrivals = network(rng.randint(1, 400), rng.uniform(5, 80), rng.uniform(0, 60), rng.uniform(0, 10),
+                           rng.uniform(0, 20), rng, first_seq=first)
+        for _ in range(rng.randint(0, 20)):
+            if arrivals:
+                arrival = rng.choice(arrivals)
+                heapq.heappush(arrivals, (arrival[0] + rng.uniform(0, 50), arrival[1], arrival[2]))
+        _, played, _ = simulate(buffer, arrivals)
+        for previous, current in zip(played, played[1:]):
+            assert seq_diff(current, previous) > 0, (previous, current)
+        assert len(set(played)) == len(played)
+        assert buffer.max_depth <= buffer.capacity
+    print(f"fuzz: {iterations} randomised streams (wraparound, duplicates, reordering) OK")
+
+def main():
+    parser = argparse.ArgumentParser(description="Jitter buffer playout under simulated network jitter")
+    parser.add_argument('--frames', type=int, default=3000)
+    parser.add_argument('--base-ms', type=float, default=30.0)
+    parser.add_argument('--jitter-ms', type=float, default=15.0, help="mean of the exponential delay component")
+    parser.add_argument('--spike-pct', type=float, default=1.0, help="percentage of frames delayed 100-250 ms")
+    parser.add_argument('--loss-pct', type=float, default=1.0)
+    parser.add_argument('--fuzz', type=int, default=300)
+    args = parser.parse_args()
+
+    rows = [
+        run('fixed 1 frame (no buffering)', JitterBuffer(FRAME_MS, FRAME_MS, FRAME_MS, adaptive=False), args, 1),
+        run('fixed 60 ms', JitterBuffer(FRAME_MS, 60, 60, adaptive=False), args, 1),
+        run('fixed 200 ms', JitterBuffer(FRAME_MS, 200, 200, adaptive=False), args, 1),
+        run('adaptive 60-300 ms', JitterBuffer(FRAME_MS, 60, 300), args, 1),
+    ]
+    headers = ['buffer', 'played', 'dropped', 'underruns', 'silent_ticks', 'p50_latency_ms', 'p99_latency_ms',
+               'final_target_ms', 'max_depth']
+    benchutil.print_table(headers, rows)
+    fuzz(args.fuzz)
+
+if __name__ == "__main__":
+    main()
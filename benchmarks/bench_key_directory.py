@@ -0,0 +1,157 @@
+import argparse
+import json
+import random
+import time
+
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.backends import default_backend
+
+from benchutil import (Drain, connect_client, free_port, print_table, process_stats, raise_fd_limit,
+                       start_server_process, stop_server_process)
+
+from chat_server import ENGINES
+from client_core import ClientCore
+from e2e_crypto import KeyCache, SessionKeys
+from framing import encode_frame
+from keydir import KeyDirectory, fingerprint
+
+def key_records(count, identities):
+    records = []
+    for i in range(count):
+        key = identities[i % len(identities)]
+        pem = key.public_key().public_bytes(encoding=serialization.Encoding.PEM,
+                                            format=serialization.PublicFormat.SubjectPublicKeyInfo)
+        records.append({'public_key': pem.decode('utf-8'), **SessionKeys(f"user{i}", key).public_record()})
+    return records
+
+def storm(engine, mode, users, senders, records):
+    port = free_port()
+    proc = start_server_process(port, '--engine', engine)
+    peers = []
+    try:
+        peers = [connect_client(port, f"user{i}") for i in range(users)]
+        drain = Drain(peers)
+        drain.start()
+        drain.wait_quiet()
+        cpu_before = process_stats(proc.pid)['cpu_seconds']
+        frames_before, bytes_before = drain.frames, drain.bytes
+
+        for i, (sock, _) in enumerate(peers):
+            message = {'type': 'public_key', 'nickname': f"user{i}", **records[i]}
+            if mode == 'directory':
+                message['directory'] = True
+            sock.sendall(encode_frame(json.dumps(message)))
+        drain.wait_quiet()
+        storm_frames, storm_bytes = drain.frames - frames_before, drain.bytes - bytes_before
+        storm_cpu = process_stats(proc.pid)['cpu_seconds'] - cpu_before
+
+        if mode == 'directory':
+            for sock, _ in peers[:senders]:
+                sock.sendall(encode_frame(json.dumps({'type': 'key_lookup', 'known': {}})))
+            drain.wait_quiet()
+        lookup_frames = drain.frames - frames_before - storm_frames
+        lookup_bytes = drain.bytes - bytes_before - storm_bytes
+        drain.running = False
+        assert drain.is_alive(), "drain thread died"
+        return {'engine': engine, 'mode': mode, 'users': users, 'storm_frames': storm_frames,
+                'storm_kb': storm_bytes // 1024, 'storm_server_ms': int(storm_cpu * 1000),
+                'first_send_frames': lookup_frames, 'first_send_kb': lookup_bytes // 1024}
+    finally:
+        for sock, _ in peers:
+            sock.close()
+        stop_server_process(proc)
+
+def parse_cost(records, repeat):
+    uncached = KeyCache(max_keys=0)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for record in records:
+            uncached.load(record)
+    reparse = (time.perf_counter() - started) / (repeat * len(records))
+    cache = KeyCache()
+    for record in records:
+        cache.load(record)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for record in records:
+            cache.load(record)
+    cached = (time.perf_counter() - started) / (repeat * len(records))
+    return round(reparse * 1e6, 1), round(cached * 1e6, 1)
+
+def reconnect_check(records, identity):
+    cache = KeyCache()
+    for _ in range(3):
+        core = ClientCore("viewer", identity, heartbeat=None, key_cache=cache)
+        core.session_keys = SessionKeys("viewer", identity)
+        for i, record in enumerate(records):
+            assert core.install_peer_key(f"user{i}", record)
+    unique = len({fingerprint(record) for record in records})
+    assert cache.parsed == unique, f"reconnects re-parsed keys ({cache.parsed} parses for {unique} keys)"
+    print(f"reconnect: {len(records)} peer keys loaded over 3 connects with {cache.parsed} parses OK")
+
+def fuzz(iterations, records, seed=17):
+    rng = random.Random(seed)
+    directory = KeyDirectory()
+    online = {}
+    for _ in range(iterations):
+        nick = f"user{rng.randrange(40)}"
+        action = rng.random()
+        if action < 0.4:
+            record = rng.choice(records)
+            _, changed = directory.publish(nick, record)
+            assert changed == (nick in online and online[nick] != fingerprint(record))
+            online[nick] = fingerprint(record)
+        elif action < 0.55:
+            directory.remove(nick)
+            online.pop(nick, None)
+        else:
+            asked = rng.sample([f"user{i}" for i in range(40)], rng.randint(0, 10)) if rng.random() < 0.5 else None
+            known = {n: fp if rng.random() < 0.5 else "stale" for n, fp in online.items() if rng.random() < 0.5}
+            found, unchanged, missing = directory.lookup(nick, asked, known)
+            for n, record in found.items():
+                assert online[n] == record['fingerprint'] and known.get(n) != record['fingerprint']
+            for n in unchanged:
+                assert known[n] == online[n]
+            for n in missing:
+                assert n not in online
+            if asked is None:
+                assert set(found) | set(unchanged) == set(online) - {nick}
+    for i in range(40):
+        directory.remove(f"user{i}")
+    assert not directory.records and not any(directory.watchers.values()) and not any(directory.watching.values())
+    print(f"fuzz: {iterations} publish/lookup/remove operations against a model OK")
+
+def main():
+    parser = argparse.ArgumentParser(description="Key distribution: push to everyone vs lazy key directory")
+    parser.add_argument('--users', default='50,200')
+    parser.add_argument('--senders', type=int, default=5, help="clients that message the room after the storm")
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--fuzz', type=int, default=20000)
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    user_counts = [int(n) for n in args.users.split(',')]
+    identities = [rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+                  for _ in range(8)]
+    records = key_records(max(user_counts), identities)
+
+    rows = []
+    for engine in args.engines.split(','):
+        for users in user_counts:
+            for mode in ('push', 'directory'):
+                rows.append(storm(engine, mode, users, args.senders, records))
+    headers = ['engine', 'mode', 'users', 'storm_frames', 'storm_kb', 'storm_server_ms', 'first_send_frames',
+               'first_send_kb']
+    print_table(headers, [[r[h] for h in headers] for r in rows])
+    print(f"first_send: {args.senders} clients fetch all keys before their first room message")
+    print()
+
+    reparse_us, cached_us = parse_cost(records, 20)
+    print_table(['client key load', 'us_per_key'], [['PEM parse + dh_sig verify', reparse_us],
+                                                    ['fingerprint cache hit', cached_us]])
+    reconnect_check(records[:20], identities[0])
+    fuzz(args.fuzz, records[:12])
+
+if __name__ == "__main__":
+    main()
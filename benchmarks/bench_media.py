@@ -0,0 +1,356 @@
+import argparse
+import os
+import random
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+from benchutil import (PASSWORD, connect_client, free_port, percentile, print_table, send_json, setup_call,
+                       start_server_process, stop_server_process, wait_json)
+
+from client_core import ClientCore
+from framing import (FRAME_VOICE, MEDIA_HEADER, VOICE_HEADER, encode_media_packet, encode_voice_frame, media_clock,
+                     read_frame)
+from identity import generate_identity
+
+FPS = 50
+SENT_AT = struct.Struct('!d')
+LATE_MS = 100
+
+class TcpLossProxy:
+    def __init__(self, target_port, loss, recovery, host='127.0.0.1', seed=1):
+        self.target_port = target_port
+        self.loss = loss
+        self.recovery = recovery
+        self.rng = random.Random(seed)
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, 0))
+        self.listener.listen(16)
+        self.host = host
+        self.port = self.listener.getsockname()[1]
+        self.sockets = [self.listener]
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(('127.0.0.1', self.target_port))
+            for sock in (client, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sockets += [client, upstream]
+            self.pump(client, upstream)
+            self.pump(upstream, client)
+
+    def pump(self, source, sink):
+        pending = deque()
+        ready = threading.Condition()
+
+        def read():
+            release = 0.0
+            while True:
+                try:
+                    data = source.recv(65536)
+                except OSError:
+                    data = b""
+                now = time.perf_counter()
+                lost = self.loss and self.rng.random() < self.loss
+                release = max(release, now + (self.recovery if lost else 0.0))
+                with ready:
+                    pending.append((release, data))
+                    ready.notify()
+                if not data:
+                    return
+
+        def write():
+            while True:
+                with ready:
+                    while not pending:
+                        ready.wait()
+                    release, data = pending.popleft()
+                delay = release - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                if not data:
+                    try:
+                        sink.shutdown(socket.SHUT_WR)
+                    except OSError:
+                        pass
+                    return
+                try:
+                    sink.sendall(data)
+                except OSError:
+                    return
+
+        threading.Thread(target=read, daemon=True).start()
+        threading.Thread(target=write, daemon=True).start()
+
+    def close(self):
+        for sock in self.sockets:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+class UdpLossProxy:
+    def __init__(self, target_port, loss, seed=2):
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.front = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.front.bind(('127.0.0.1', 0))
+        self.port = self.front.getsockname()[1]
+        self.back = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.back.connect(('127.0.0.1', target_port))
+        self.client = None
+        threading.Thread(target=self.upstream, daemon=True).start()
+        threading.Thread(target=self.downstream, daemon=True).start()
+
+    def dropped(self):
+        return self.loss and self.rng.random() < self.loss
+
+    def upstream(self):
+        while True:
+            try:
+                packet, self.client = self.front.recvfrom(65535)
+                if not self.dropped():
+                    self.back.send(packet)
+            except OSError:
+                return
+
+    def downstream(self):
+        while True:
+            try:
+                packet = self.back.recv(65535)
+                if self.client and not self.dropped():
+                    self.front.sendto(packet, self.client)
+            except OSError:
+                return
+
+    def close(self):
+        for sock in (self.front, self.back):
+            sock.close()
+
+def open_udp(peer, call_id, proxy_port):
+    send_json(peer[0], {'type': 'media_request', 'call_id': call_id})
+    offer = wait_json(*peer, 'media_offer')
+    token = bytes.fromhex(offer['token'])
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect(('127.0.0.1', proxy_port))
+    sock.settimeout(0.1)
+    for _ in range(100):
+        sock.send(encode_media_packet(token, media_clock()))
+        try:
+            if len(sock.recv(65535)) == MEDIA_HEADER.size:
+                return sock, token
+        except OSError:
+            pass
+    raise RuntimeError("UDP probe never acknowledged")
+
+def receive(sock, decoder, udp, arrivals, stop):
+    sock.settimeout(0.2)
+    while not stop.is_set():
+        try:
+            if udp:
+                packet = sock.recv(65535)
+                if len(packet) <= MEDIA_HEADER.size:
+                    continue
+                payload = packet[MEDIA_HEADER.size:]
+            else:
+                kind, payload = read_frame(sock, decoder)
+                if kind != FRAME_VOICE:
+                    continue
+        except socket.timeout:
+            continue
+        except OSError:
+            return
+        seq = VOICE_HEADER.unpack_from(payload)[1]
+        arrivals[seq] = time.perf_counter() - SENT_AT.unpack_from(payload, VOICE_HEADER.size)[0]
+
+def latency_run(transport, loss, recovery, seconds, audio_bytes):
+    port, udp_port = free_port(), free_port()
+    proc = start_server_process(port, '--no-metrics', '--udp-port', str(udp_port))
+    proxies = []
+    peers = []
+    stop = threading.Event()
+    try:
+        tcp_loss = loss if transport == 'tcp' else 0.0
+        for seed in (1, 2):
+            proxies.append(TcpLossProxy(port, tcp_loss, recovery, seed=seed))
+        caller, callee = [connect_client(proxy.port, nick) for proxy, nick in zip(proxies, ("caller", "callee"))]
+        peers += [caller, callee]
+        call = setup_call(caller, callee, "callee")
+        slot = call['slot']
+        sender = receiver = token = None
+        if transport == 'udp':
+            udp_proxies = [UdpLossProxy(udp_port, loss, seed=seed) for seed in (3, 4)]
+            proxies += udp_proxies
+            sender, token = open_udp(caller, call['call_id'], udp_proxies[0].port)
+            receiver, _ = open_udp(callee, call['call_id'], udp_proxies[1].port)
+        arrivals = {}
+        thread = threading.Thread(target=receive, args=(receiver or callee[0], callee[1], transport == 'udp',
+                                                        arrivals, stop), daemon=True)
+        thread.start()
+        padding = os.urandom(audio_bytes - SENT_AT.size)
+        frames = int(seconds * FPS)
+        began = time.perf_counter()
+        for seq in range(frames):
+            audio = SENT_AT.pack(time.perf_counter()) + padding
+            if sender:
+                sender.send(encode_media_packet(token, media_clock(), VOICE_HEADER.pack(slot, seq) + audio))
+            else:
+                caller[0].sendall(encode_voice_frame(slot, seq, audio))
+            delay = began + (seq + 1) / float(FPS) - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        time.sleep(max(0.5, recovery * 3))
+        stop.set()
+        thread.join(2)
+        delays = sorted(d * 1000 for d in arrivals.values())
+        late = sum(1 for d in delays if d > LATE_MS)
+        label = "udp" if transport == 'udp' else f"tcp (recovery {int(recovery * 1000)} ms)"
+        return [label, f"{loss * 100:g}%", frames, round(100.0 * len(delays) / frames, 1),
+                round(percentile(delays, 50), 1), round(percentile(delays, 95), 1),
+                round(percentile(delays, 99), 1), round(delays[-1], 1),
+                round(100.0 * (frames - len(delays) + late) / frames, 1)]
+    finally:
+        stop.set()
+        for sock, _ in peers:
+            sock.close()
+        for proxy in proxies:
+            proxy.close()
+        stop_server_process(proc)
+
+def start_core_call(port, names=("alice", "bob"), callee_host='127.0.0.1', callee_port=None):
+    cores = [ClientCore(nick, generate_identity(), heartbeat=None, codecs=['pcm16'], vad=False) for nick in names]
+    transports = {}
+    ready = threading.Event()
+    started = threading.Event()
+
+    def on_media(core):
+        def handler(event, data):
+            transports[core.nickname] = data['transport']
+            if len(transports) == 2:
+                ready.set()
+        return handler
+
+    for core in cores:
+        core.on('media', on_media(core))
+    cores[1].on('incoming_call', lambda event, data: cores[1].answer(data['call_id']))
+    cores[0].on('call_started', lambda event, data: started.set())
+    cores[0].connect('127.0.0.1', port, PASSWORD)
+    cores[1].connect(callee_host, callee_port or port, PASSWORD)
+    cores[0].call(names[1])
+    assert started.wait(10), "call did not start"
+    assert ready.wait(10), "media transport not negotiated"
+    return cores, transports
+
+def exchange(cores, frames=20):
+    tone = bytes(range(256)) * (cores[0].chunk * 2 // 256)
+    heard = {core.nickname: 0 for core in cores}
+
+    def player(core):
+        idle = 0
+        while core.in_call and idle < 5:
+            audio = core.next_voice(timeout=0.1)
+            idle = idle + 1 if audio is None else 0
+            if audio == tone:
+                heard[core.nickname] += 1
+
+    threads = [threading.Thread(target=player, args=(core,), daemon=True) for core in cores]
+    for thread in threads:
+        thread.start()
+    for _ in range(frames):
+        for core in cores:
+            core.send_voice(tone)
+        time.sleep(cores[0].chunk / float(cores[0].rate))
+    for thread in threads:
+        thread.join(5)
+    return heard
+
+def checks():
+    port, udp_port = free_port(), free_port()
+    proc = start_server_process(port, '--no-metrics', '--udp-port', str(udp_port))
+    cores = []
+    proxy = None
+    try:
+        cores, transports = start_core_call(port)
+        assert transports == {'alice': 'udp', 'bob': 'udp'}, transports
+        heard = exchange(cores)
+        assert min(heard.values()) >= 15, heard
+        assert all(core.media.sent >= 20 and core.media.received >= 15 for core in cores)
+        assert abs(((media_clock() - cores[1].media.last_stamp) & 0xFFFFFFFF)) < 5000, "timestamp not relayed"
+
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        probe.connect(('127.0.0.1', udp_port))
+        probe.settimeout(0.5)
+        probe.send(encode_media_packet(os.urandom(8), media_clock(), VOICE_HEADER.pack(1, 0) + b"forged"))
+        probe.send(encode_media_packet(os.urandom(8), media_clock()))
+        try:
+            probe.recv(65535)
+            raise AssertionError("relay answered a packet with a forged token")
+        except socket.timeout:
+            pass
+        probe.close()
+        for core in cores:
+            core.disconnect()
+        print("checks (udp): both sides negotiated UDP, audio both ways, timestamps relayed, forged token ignored")
+
+        proxy = TcpLossProxy(port, 0.0, 0.0, host='127.0.0.2')
+        cores, transports = start_core_call(port, ("carol", "dave"), '127.0.0.2', proxy.port)
+        assert transports == {'carol': 'udp', 'dave': 'tcp'}, transports
+        heard = exchange(cores)
+        assert min(heard.values()) >= 15, heard
+        assert cores[1].media is None
+        for core in cores:
+            core.disconnect()
+        print("checks (fallback): UDP blocked for dave -> dave on TCP, carol on UDP, audio both ways")
+    finally:
+        for core in cores:
+            core.disconnect()
+        if proxy:
+            proxy.close()
+        stop_server_process(proc)
+
+    port = free_port()
+    proc = start_server_process(port, '--no-metrics')
+    cores = []
+    try:
+        cores, transports = start_core_call(port)
+        assert transports == {'alice': 'tcp', 'bob': 'tcp'}, transports
+        assert min(exchange(cores).values()) >= 15
+        print("checks (no relay): server without --udp-port -> both on TCP, audio both ways")
+    finally:
+        for core in cores:
+            core.disconnect()
+        stop_server_process(proc)
+
+def main():
+    parser = argparse.ArgumentParser(description="Voice latency over TCP vs the UDP media relay with injected loss")
+    parser.add_argument('--seconds', type=float, default=6.0)
+    parser.add_argument('--loss', default='0,0.01,0.05', help="packet loss rates to inject, per direction")
+    parser.add_argument('--audio-bytes', type=int, default=160)
+    parser.add_argument('--recovery-ms', default='60,200',
+                        help="TCP loss recovery delays: fast retransmit after 3 frames, minimum RTO")
+    parser.add_argument('--skip-checks', action='store_true')
+    args = parser.parse_args()
+
+    if not args.skip_checks:
+        checks()
+        print()
+    rows = []
+    for loss in [float(value) for value in args.loss.split(',')]:
+        rows.append(latency_run('udp', loss, 0.0, args.seconds, args.audio_bytes))
+        for recovery in [int(value) / 1000.0 for value in args.recovery_ms.split(',')]:
+            rows.append(latency_run('tcp', loss, recovery, args.seconds, args.audio_bytes))
+    print_table(['transport', 'loss', 'frames', 'delivered_pct', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms',
+                 f'lost_or_late_{LATE_MS}ms_pct'], rows)
+    print("loss is injected on every hop (client->server and server->client) by userspace proxies; a lost TCP segment "
+          "holds back everything behind it for the recovery delay")
+
+if __name__ == "__main__":
+    main()
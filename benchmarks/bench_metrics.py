@@ -0,0 +1,137 @@
+import argparse
+import json
+import threading
+import time
+import urllib.request
+
+from benchutil import (Drain, connect_client, free_port, print_table, process_stats, raise_fd_limit, setup_call,
+                       start_server_process, stop_server_process)
+
+from chat_server import ENGINES
+from framing import encode_frame, encode_voice_frame
+from metrics import Counter, Histogram, NullMetrics, ServerMetrics
+from sessions import SessionRegistry
+
+class FakeServer:
+    def __init__(self):
+        self.sessions = SessionRegistry()
+
+def per_call_ns(fn, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return round((time.perf_counter() - started) / count * 1e9)
+
+def micro(count):
+    counter = Counter()
+    histogram = Histogram()
+    metrics = ServerMetrics(FakeServer())
+    null = NullMetrics()
+    rows = [['Counter.inc', per_call_ns(counter.inc, count)],
+            ['Histogram.observe', per_call_ns(lambda: histogram.observe(0.0003), count)],
+            ['ServerMetrics.frame', per_call_ns(lambda: metrics.frame('encrypted_message', 300, 0.0003), count)],
+            ['NullMetrics.frame', per_call_ns(lambda: null.frame('encrypted_message', 300, 0.0003), count)],
+            ['time.perf_counter x2', per_call_ns(lambda: (time.perf_counter(), time.perf_counter()), count)]]
+    print_table(['operation', 'ns_per_call'], rows)
+
+    threads = [threading.Thread(target=lambda: [histogram.observe(0.001) for _ in range(count // 10)])
+               for _ in range(8)]
+    before = histogram.count
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert histogram.count - before == 8 * (count // 10), "histogram lost updates under contention"
+    print("contention: 8 threads observing concurrently, no lost updates OK")
+
+def scrape(port, path):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5) as response:
+        return response.read().decode('utf-8')
+
+def sample(stats, name, **labels):
+    for entry in stats['metrics'][name]['samples']:
+        if all(entry['labels'].get(k) == v for k, v in labels.items()):
+            return entry
+    return None
+
+def relay(engine, mode, clients, messages, voice_frames):
+    port = free_port()
+    metrics_port = free_port()
+    extra = ['--no-metrics'] if mode == 'off' else ['--metrics-port', str(metrics_port)]
+    proc = start_server_process(port, '--engine', engine, '--voice-queue-frames', '1024', *extra)
+    peers = []
+    try:
+        peers = [connect_client(port, f"user{i}") for i in range(clients)]
+        call = setup_call(peers[0], peers[1], "user1")
+        drain = Drain(peers, collect=b'{"type": "encrypted_message"')
+        drain.start()
+        drain.wait_quiet(idle=0.5)
+        frames = [encode_frame(json.dumps({'type': 'encrypted_message', 'sender': f"user{i}",
+                                           'target': f"user{(i + 1) % clients}",
+                                           'data': {'encrypted_message': 'x' * 256}}))
+                  for i in range(clients)]
+        voice = [encode_voice_frame(call['slot'], seq, b"v" * 372) for seq in range(voice_frames)]
+
+        cpu_before = process_stats(proc.pid)['cpu_seconds']
+        started = time.perf_counter()
+        for _ in range(messages // clients):
+            for (sock, _), frame in zip(peers, frames):
+                sock.sendall(frame)
+        for frame in voice:
+            peers[0][0].sendall(frame)
+        sent = (messages // clients) * clients
+        deadline = time.time() + 30
+        while len(drain.collected) < sent and time.time() < deadline:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        drain.wait_quiet(idle=0.5)
+        cpu = process_stats(proc.pid)['cpu_seconds'] - cpu_before
+        drain.running = False
+        result = {'engine': engine, 'metrics': mode, 'relayed': len(drain.collected),
+                  'msgs_per_s': int(len(drain.collected) / elapsed),
+                  'server_us_per_frame': round(cpu / (sent + voice_frames) * 1e6, 2)}
+
+        if mode == 'on':
+            text = scrape(metrics_port, '/metrics')
+            stats = json.loads(scrape(metrics_port, '/stats'))
+            assert f'chat_handler_seconds_count{{type="encrypted_message"}} {sent}' in text, "frame count mismatch"
+            assert '# TYPE chat_handler_seconds histogram' in text
+            assert '# TYPE chat_outbound_dropped_frames_total counter' in text
+            handler = sample(stats, 'chat_handler_seconds', type='encrypted_message')
+            assert handler['count'] == sent
+            assert sample(stats, 'chat_voice_bytes_total')['value'] == 372 * voice_frames
+            assert sample(stats, 'chat_sessions_active')['value'] == clients
+            assert sample(stats, 'chat_call_setup_seconds')['count'] == 1
+            result['handler_p50_ms'] = handler['p50'] * 1000
+            result['handler_p99_ms'] = handler['p99'] * 1000
+            wait = sample(stats, 'chat_outbound_wait_seconds')
+            result['queue_wait_p99_ms'] = wait['p99'] * 1000 if wait['p99'] is not None else '-'
+        return result
+    finally:
+        for sock, _ in peers:
+            sock.close()
+        stop_server_process(proc)
+
+def main():
+    parser = argparse.ArgumentParser(description="Metrics registry cost: micro-operations and relay overhead")
+    parser.add_argument('--count', type=int, default=200000)
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--voice-frames', type=int, default=500)
+    args = parser.parse_args()
+
+    micro(args.count)
+    print()
+    raise_fd_limit()
+    rows = []
+    for engine in args.engines.split(','):
+        for mode in ('off', 'on'):
+            rows.append(relay(engine, mode, args.clients, args.messages, args.voice_frames))
+    headers = ['engine', 'metrics', 'relayed', 'msgs_per_s', 'server_us_per_frame', 'handler_p50_ms',
+               'handler_p99_ms', 'queue_wait_p99_ms']
+    print_table(headers, [[r.get(h, '-') for h in headers] for r in rows])
+    print("histogram quantiles are bucket upper bounds; counters checked against frames sent")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import json
+import time
+
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.backends import default_backend
+
+from benchutil import (Drain, connect_client, free_port, print_table, process_stats, raise_fd_limit, send_json,
+                       start_server_process, stop_server_process, wait_json)
+
+from chat_server import ENGINES
+from e2e_crypto import decrypt_message, encrypt_envelope
+from framing import encode_frame
+
+def legacy_frames(sender, msg, public_keys):
+    frames = []
+    for peer, key in public_keys.items():
+        envelope = encrypt_envelope(msg, {peer: key})
+        data = {'encrypted_key': envelope['keys'][peer], 'iv': envelope['iv'],
+                'encrypted_message': envelope['encrypted_message']}
+        frames.append(encode_frame(json.dumps({'type': 'encrypted_message', 'sender': sender,
+                                               'target': peer, 'data': data})))
+    return frames
+
+def multicast_frames(sender, msg, public_keys):
+    envelope = encrypt_envelope(msg, public_keys)
+    return [encode_frame(json.dumps({'type': 'multicast_message', 'sender': sender, 'data': envelope}))]
+
+PATHS = {'legacy': legacy_frames, 'multicast': multicast_frames}
+
+def client_cost(path, recipients, size, public_key, repeat):
+    keys = {f"peer{i}": public_key for i in range(recipients)}
+    msg = "x" * size
+    started = time.perf_counter()
+    for _ in range(repeat):
+        frames = PATHS[path]("sender", msg, keys)
+    elapsed = time.perf_counter() - started
+    return {'path': path, 'recipients': recipients, 'msg_bytes': size,
+            'client_ms_per_msg': round(elapsed / repeat * 1000, 2),
+            'upstream_frames': len(frames), 'upstream_bytes': sum(len(f) for f in frames)}
+
+def relay_cost(engine, path, recipients, size, private_key, messages):
+    port = free_port()
+    proc = start_server_process(port, '--engine', engine)
+    peers = []
+    try:
+        sender, _ = connect_client(port, "sender")
+        peers = [connect_client(port, f"peer{i}") for i in range(recipients)]
+        drain = Drain(peers, collect=b'{"type": "encrypted_message"')
+        drain.start()
+        keys = {f"peer{i}": private_key.public_key() for i in range(recipients)}
+        msg = "x" * size
+        batches = [PATHS[path]("sender", f"{n}:{msg}", keys) for n in range(messages)]
+        time.sleep(0.3)
+
+        cpu_before = process_stats(proc.pid)['cpu_seconds']
+        bytes_before = drain.bytes
+        sent = 0
+        for frames in batches:
+            for frame in frames:
+                sender.sendall(frame)
+                sent += len(frame)
+        deadline = time.time() + 10
+        while len(drain.collected) < messages * recipients and time.time() < deadline:
+            time.sleep(0.05)
+        cpu = process_stats(proc.pid)['cpu_seconds'] - cpu_before
+        drain.running = False
+
+        delivered = len(drain.collected)
+        for payload in drain.collected[::max(1, delivered // 20)]:
+            text = decrypt_message(private_key, json.loads(payload)['data'])
+            assert text.endswith(msg), "multicast payload failed to decrypt"
+        return {'engine': engine, 'path': path, 'recipients': recipients, 'msg_bytes': size,
+                'delivered': delivered, 'upstream_bytes_per_msg': sent // messages,
+                'downstream_bytes_per_msg': (drain.bytes - bytes_before) // messages,
+                'server_us_per_msg': round(cpu / messages * 1e6, 1)}
+    finally:
+        for sock, _ in peers:
+            sock.close()
+        stop_server_process(proc)
+
+def envelope_check(engine):
+    port = free_port()
+    proc = start_server_process(port, '--engine', engine)
+    peers = []
+    try:
+        sender, peer = peers[:] = [connect_client(port, nick) for nick in ("sender", "peer0")]
+        send_json(sender[0], {'type': 'multicast_message', 'sender': "sender", 'data': {'keys': {'peer0': "k0"}}})
+        message = wait_json(*peer, 'encrypted_message')
+        assert message['data'] == {'encrypted_key': "k0"}, message
+        print(f"check ({engine}): envelope with only wrapped keys relayed as valid JSON")
+    finally:
+        for sock, _ in peers:
+            sock.close()
+        stop_server_process(proc)
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-peer encrypted_message vs encrypt-once multicast envelope")
+    parser.add_argument('--recipients', default='1,10,50,200')
+    parser.add_argument('--sizes', default='64,4096')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--relay-recipients', type=int, default=50)
+    parser.add_argument('--relay-messages', type=int, default=100)
+    args = parser.parse_args()
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    rows = []
+    for recipients in [int(n) for n in args.recipients.split(',')]:
+        for size in [int(n) for n in args.sizes.split(',')]:
+            for path in PATHS:
+                rows.append(client_cost(path, recipients, size, private_key.public_key(), args.repeat))
+    headers = ['path', 'recipients', 'msg_bytes', 'client_ms_per_msg', 'upstream_frames', 'upstream_bytes']
+    print_table(headers, [[r[h] for h in headers] for r in rows])
+    print()
+
+    raise_fd_limit()
+    for engine in args.engines.split(','):
+        envelope_check(engine)
+    print()
+    rows = []
+    for engine in args.engines.split(','):
+        for size in [int(n) for n in args.sizes.split(',')]:
+            for path in PATHS:
+                rows.append(relay_cost(engine, path, args.relay_recipients, size, private_key,
+                                       args.relay_messages))
+    headers = ['engine', 'path', 'recipients', 'msg_bytes', 'delivered', 'upstream_bytes_per_msg',
+               'downstream_bytes_per_msg', 'server_us_per_msg']
+    print_table(headers, [[r[h] for h in headers] for r in rows])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from benchutil import (PASSWORD, connect_client, free_port, print_table, send_json, start_server_process,
+                       stop_server_process, wait_json)
+
+from client_core import ClientCore
+from framing import FRAME_TEXT, read_frame
+from identity import generate_identity
+from offline import OfflineStore
+
+def store_checks(directory):
+    store = OfflineStore(os.path.join(directory, 'basic'))
+    for n in range(10):
+        assert store.put('bob', f"m{n}")
+    store.put('carol', "only")
+    batch = store.peek('bob', limit=4)
+    assert [payload for _, payload in batch] == [b"m0", b"m1", b"m2", b"m3"]
+    store.ack('bob', batch[-1][0])
+    store.close()
+    store = OfflineStore(os.path.join(directory, 'basic'))
+    assert [payload for _, payload in store.peek('bob')] == [f"m{n}".encode() for n in range(4, 10)], \
+        "acked messages came back after reopen"
+    assert store.pending('carol') == 1
+    store.ack('bob', store.peek('bob')[-1][0])
+    store.close()
+
+    path = os.path.join(directory, 'basic', max(os.listdir(os.path.join(directory, 'basic'))))
+    with open(path, 'ab') as f:
+        f.write(b"\x00garbage tail")
+    store = OfflineStore(os.path.join(directory, 'basic'))
+    assert store.pending('bob') == 0 and [p for _, p in store.peek('carol')] == [b"only"], "damaged tail not handled"
+    store.close()
+
+    store = OfflineStore(os.path.join(directory, 'ttl'), ttl=0.05)
+    store.put('dave', "soon gone")
+    time.sleep(0.1)
+    assert store.peek('dave') == [] and store.sweep(force=True) == 0 and store.stats()['expired'] == 1
+    store.close()
+
+    store = OfflineStore(os.path.join(directory, 'caps'), max_per_user=5)
+    for n in range(8):
+        store.put('erin', f"m{n}")
+    assert [p for _, p in store.peek('erin')] == [f"m{n}".encode() for n in range(3, 8)], "per-user cap"
+    store.close()
+
+    store = OfflineStore(os.path.join(directory, 'compact'), segment_bytes=64 * 1024)
+    for n in range(2000):
+        store.put(f"user{n % 20}", "x" * 300)
+    before = store.disk_bytes()
+    for n in range(19):
+        nickname = f"user{n}"
+        store.ack(nickname, store.peek(nickname, limit=1000)[-1][0])
+    after = store.disk_bytes()
+    assert after * 4 < before, f"compaction did not shrink the store ({before} -> {after})"
+    assert store.pending('user19') == 100
+    store.close()
+    store = OfflineStore(os.path.join(directory, 'compact'), segment_bytes=64 * 1024)
+    assert store.pending('user19') == 100 and store.messages == 100, "compaction lost or resurrected messages"
+    store.close()
+
+    store = OfflineStore(os.path.join(directory, 'dry'), segment_bytes=4096)
+
+    def fill(nickname):
+        first = store.active
+        while store.active is first:
+            store.put(nickname, "z" * 300)
+    for n in range(5):
+        store.put('frank', "f" * 300)
+    fill('gina')
+    store.ack('frank', store.peek('frank')[-1][0])
+    store.ack('gina', store.peek('gina')[-1][0])
+    fill('hana')
+    store.put('frank', "again")
+    store.ack('hana', store.peek('hana')[-1][0])
+    assert [p for _, p in store.peek('frank')] == [b"again"], "second compaction after a dry mailbox failed"
+    store.close()
+    store = OfflineStore(os.path.join(directory, 'dry'), segment_bytes=4096)
+    assert [p for _, p in store.peek('frank')] == [b"again"] and store.messages == 1
+    store.close()
+
+    store = OfflineStore(os.path.join(directory, 'disk'), max_bytes=256 * 1024)
+    for n in range(3000):
+        store.put(f"user{n % 10}", "y" * 300)
+    stats = store.stats()
+    assert stats['disk_bytes'] <= 256 * 1024 and stats['dropped'] > 0, stats
+    newest = store.peek('user9', limit=5000)
+    assert newest and newest[-1][1] == b"y" * 300
+    store.close()
+    print("store checks: round trip, persistence, tombstones, damaged tail, TTL, per-user cap, compaction, "
+          "compaction after a dry mailbox, disk cap OK")
+
+def read_messages(peer, count, timeout=30.0, ack=True):
+    sock, decoder = peer
+    sock.settimeout(timeout)
+    got = []
+    try:
+        while True:
+            kind, payload = read_frame(sock, decoder)
+            if kind != FRAME_TEXT:
+                continue
+            if payload.startswith(b'{"type": "encrypted_message"'):
+                got.append(json.loads(payload)['data']['encrypted_message'])
+            elif payload.startswith(b'{"type": "offline_batch"'):
+                if ack:
+                    send_json(sock, {'type': 'offline_ack', 'seq': json.loads(payload)['seq']})
+                if len(got) >= count:
+                    break
+    finally:
+        sock.settimeout(None)
+    return got
+
+def server_checks(directory):
+    port = free_port()
+    proc = start_server_process(port, '--offline-dir', directory, '--no-metrics')
+    try:
+        sender = connect_client(port, "alice")
+        for n in range(50):
+            send_json(sender[0], {'type': 'encrypted_message', 'sender': "alice", 'target': "bob",
+                                  'data': {'encrypted_message': str(n)}})
+        send_json(sender[0], {'type': 'user_list_request'})
+        wait_json(*sender, 'user_list')
+        stop_server_process(proc)
+        sender[0].close()
+        proc = start_server_process(port, '--offline-dir', directory, '--no-metrics')
+        receiver = connect_client(port, "bob")
+        assert read_messages(receiver, 50, ack=False) == [str(n) for n in range(50)], "offline messages out of order"
+        receiver[0].close()
+        time.sleep(0.3)
+        receiver = connect_client(port, "bob")
+        assert read_messages(receiver, 50) == [str(n) for n in range(50)], "unacknowledged messages not redelivered"
+        receiver[0].close()
+        time.sleep(0.3)
+        again = connect_client(port, "bob")
+        again[0].settimeout(0.5)
+        try:
+            extra = read_messages(again, 1, timeout=0.5)
+        except OSError:
+            extra = []
+        assert not extra, "messages delivered twice"
+        again[0].close()
+        print("server checks: messages kept across a restart, delivered in order on login, redelivered until "
+              "acknowledged, then not again OK")
+    finally:
+        stop_server_process(proc)
+
+def wait_for(predicate, what, timeout=10.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError(f"timed out waiting for {what}")
+        time.sleep(0.02)
+
+def core_checks(directory):
+    port = free_port()
+    proc = start_server_process(port, '--offline-dir', directory, '--no-metrics')
+    bob_key = generate_identity()
+    cores = [ClientCore(nick, key, heartbeat=None) for nick, key in
+             (("alice", generate_identity()), ("bob", bob_key), ("carol", generate_identity()))]
+    alice, bob, carol = cores
+    try:
+        for core in cores:
+            core.connect('127.0.0.1', port, PASSWORD)
+        wait_for(lambda: {"bob", "carol"} <= alice.rooms.get('lobby', set()), "alice to see the lobby")
+        bob.disconnect()
+        wait_for(lambda: "bob" in alice.room_absent.get('lobby', ()), "bob to be marked absent")
+        alice.send_message("while you were away")
+        assert carol.wait('message')['text'] == "while you were away"
+        assert alice.session_keys.has_peer("carol") and not alice.session_keys.has_peer("bob"), \
+            "offline peer not sent the RSA envelope"
+        bob = ClientCore("bob", bob_key, heartbeat=None)
+        cores.append(bob)
+        inbox = []
+        bob.on('message', lambda event, data: inbox.append((data['sender'], data['text'])))
+        bob.connect('127.0.0.1', port, PASSWORD)
+        wait_for(lambda: inbox, "the stored room message")
+        assert inbox == [("alice", "while you were away")], inbox
+        bob.disconnect()
+        time.sleep(0.3)
+        bob = ClientCore("bob", bob_key, heartbeat=None)
+        cores.append(bob)
+        bob.on('message', lambda event, data: inbox.append((data['sender'], data['text'])))
+        bob.connect('127.0.0.1', port, PASSWORD)
+        time.sleep(0.5)
+        assert len(inbox) == 1, f"acknowledged message delivered again: {inbox}"
+        print("core checks: room message to an absent member sealed to their identity key, stored, decrypted "
+              "after they reconnect, and acknowledged OK")
+    finally:
+        for core in cores:
+            core.disconnect()
+        stop_server_process(proc)
+
+def cluster_checks(directory):
+    port = free_port()
+    bus_dir = tempfile.mkdtemp(prefix='bench-bus-')
+    proc = start_server_process(port, '--workers', '2', '--bus-dir', bus_dir, '--offline-dir', directory,
+                                '--no-metrics')
+    try:
+        deadline = time.time() + 20
+        while len([n for n in os.listdir(bus_dir) if n.endswith('.sock')]) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.5)
+        senders = [connect_client(port, f"sender{i}") for i in range(4)]
+        for i, (sock, _) in enumerate(senders):
+            for target in range(4):
+                send_json(sock, {'type': 'encrypted_message', 'sender': f"sender{i}", 'target': f"away{target}",
+                                 'data': {'encrypted_message': f"{i}:{target}"}})
+        for peer in senders:
+            send_json(peer[0], {'type': 'user_list_request'})
+            wait_json(*peer, 'user_list')
+        time.sleep(0.3)
+        for target in range(4):
+            for attempt in range(3):
+                peer = connect_client(port, f"away{target}")
+                got = read_messages(peer, 4) if attempt == 0 else []
+                peer[0].close()
+                if attempt == 0:
+                    assert sorted(got) == [f"{i}:{target}" for i in range(4)], got
+                time.sleep(0.1)
+        print("worker checks: messages for a user reach whichever worker they log in to OK")
+    finally:
+        stop_server_process(proc)
+        shutil.rmtree(bus_dir, ignore_errors=True)
+
+def store_speed(directory, count, size):
+    store = OfflineStore(directory)
+    payload = b"z" * size
+    started = time.perf_counter()
+    for _ in range(count):
+        store.put('bench', payload)
+    put = time.perf_counter() - started
+    started = time.perf_counter()
+    drained = 0
+    while True:
+        batch = store.peek('bench')
+        if not batch:
+            break
+        store.ack('bench', batch[-1][0])
+        drained += len(batch)
+    drain = time.perf_counter() - started
+    stats = store.stats()
+    store.close()
+    assert drained == count
+    return [['put', count, int(count / put), round(put / count * 1e6, 1)],
+            ['peek+ack', count, int(count / drain), round(drain / count * 1e6, 1)]], stats
+
+def drain_speed(directory, count, size, engine):
+    port = free_port()
+    proc = start_server_process(port, '--offline-dir', directory, '--engine', engine, '--no-metrics')
+    try:
+        sender = connect_client(port, "filler")
+        text = "q" * size
+        for n in range(count):
+            send_json(sender[0], {'type': 'encrypted_message', 'sender': "filler", 'target': "late",
+                                  'data': {'encrypted_message': text}})
+        send_json(sender[0], {'type': 'user_list_request'})
+        wait_json(*sender, 'user_list', timeout=60)
+        sender[0].close()
+        started = time.perf_counter()
+        receiver = connect_client(port, "late")
+        got = read_messages(receiver, count, timeout=60)
+        elapsed = time.perf_counter() - started
+        receiver[0].close()
+        assert len(got) == count
+        return [f"login drain ({engine})", count, int(count / elapsed), round(elapsed * 1000, 1)]
+    finally:
+        stop_server_process(proc)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline store: correctness and backlog drain speed")
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--size', type=int, default=300, help="message payload bytes")
+    parser.add_argument('--skip-checks', action='store_true')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench-offline-')
+    try:
+        if not args.skip_checks:
+            store_checks(os.path.join(directory, 'checks'))
+            server_checks(os.path.join(directory, 'server'))
+            core_checks(os.path.join(directory, 'core'))
+            cluster_checks(os.path.join(directory, 'workers'))
+            print()
+        rows, stats = store_speed(os.path.join(directory, 'speed'), args.messages, args.size)
+        print_table(['operation', 'messages', 'msgs_per_s', 'us_per_msg'], rows)
+        print(f"disk after drain: {stats['disk_bytes']} bytes in {stats['segments']} segment(s)")
+        print()
+        rows = [drain_speed(os.path.join(directory, f'drain-{engine}'), args.messages, args.size, engine)
+                for engine in ('thread', 'asyncio')]
+        print_table(['path', 'messages', 'msgs_per_s', 'total_ms'], rows)
+        print("login drain: from connect until the last stored message is read by the client")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
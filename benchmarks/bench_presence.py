@@ -0,0 +1,167 @@
+import argparse
+import threading
+import time
+
+from benchutil import (PASSWORD, connect_client, free_port, print_table, send_json, setup_call, start_server_process,
+                       stop_server_process, wait_json)
+
+from chat_server import ChatServer
+from client_core import ClientCore
+from identity import generate_identity
+from metrics import NullMetrics
+from outbound import OutboundQueue
+from presence import apply_changes
+
+def wait_presence(peer, version, timeout=10.0):
+    while True:
+        message = wait_json(*peer, 'presence', timeout)
+        if message['version'] >= version:
+            return message
+
+def checks(engine):
+    port = free_port()
+    proc = start_server_process(port, '--engine', engine, '--no-metrics')
+    peers = []
+    try:
+        watcher = ClientCore("watcher", generate_identity(), heartbeat=None)
+        seen = threading.Event()
+        watcher.on('users', lambda event, data: seen.set())
+        watcher.connect('127.0.0.1', port, PASSWORD)
+
+        alice = connect_client(port, "alice")
+        peers.append(alice)
+        send_json(alice[0], {'type': 'presence_subscribe'})
+        snapshot = wait_json(*alice, 'presence_snapshot')
+        assert {'alice', 'watcher'} <= set(snapshot['users']), snapshot
+        users, version, epoch = dict(snapshot['users']), snapshot['version'], snapshot['epoch']
+        first = version
+
+        bob = connect_client(port, "bob")
+        peers.append(bob)
+        delta = wait_json(*alice, 'presence')
+        assert delta['from'] == version and ['+', 'bob', 'idle'] in delta['changes'], delta
+        apply_changes(users, delta['changes'])
+        version = delta['version']
+
+        call = setup_call(alice, bob, "bob")
+        send_json(bob[0], {'type': 'call_end', 'call_id': call['call_id']})
+        wait_json(*alice, 'call_ended')
+        bob[0].close()
+        peers.remove(bob)
+        deadline = time.time() + 5
+        while 'bob' in users and time.time() < deadline:
+            delta = wait_json(*alice, 'presence')
+            assert delta['from'] == version, f"gap: {delta['from']} != {version}"
+            apply_changes(users, delta['changes'])
+            version = delta['version']
+        assert 'bob' not in users and users['alice'] == 'idle'
+
+        send_json(alice[0], {'type': 'presence_subscribe', 'epoch': epoch, 'version': first})
+        replay = wait_json(*alice, 'presence')
+        assert replay['from'] == first and replay['version'] == version
+        assert apply_changes(dict(snapshot['users']), replay['changes']) == users, "resync replay differs"
+        statuses = [change[2] for change in replay['changes'] if change[1] == 'alice']
+        assert 'calling' in statuses and 'in_call' in statuses, statuses
+
+        send_json(alice[0], {'type': 'presence_subscribe', 'epoch': 'stale', 'version': version})
+        assert wait_json(*alice, 'presence_snapshot')['users'] == users, "snapshot after epoch change differs"
+
+        deadline = time.time() + 5
+        while {u['nickname'] for u in watcher.users} != {'alice'} and time.time() < deadline:
+            time.sleep(0.02)
+        assert {u['nickname'] for u in watcher.users} == {'alice'}, watcher.users
+        watcher.disconnect()
+        print(f"checks ({engine}): snapshot, join/status/leave deltas without gaps, resync from a version, "
+              f"snapshot on epoch change, ClientCore roster OK")
+    finally:
+        for sock, _ in peers:
+            sock.close()
+        stop_server_process(proc)
+
+class Roster:
+    def __init__(self, users):
+        self.server = ChatServer()
+        self.server.metrics = NullMetrics()
+        self.server.presence_flush_delay = 0
+        limits = {'chat': {'max_frames': 1 << 30, 'max_bytes': 1 << 40}}
+        self.clients = []
+        for i in range(users):
+            client = object()
+            session = self.server.sessions.add(client, f"user{i:05d}")
+            session.outbound = OutboundQueue(limits)
+            self.server.presence_update(session.nickname)
+            self.clients.append(client)
+        for client in self.clients:
+            self.server.handle_presence_subscribe(client, {'epoch': self.server.presence.epoch,
+                                                           'version': self.server.presence.version})
+
+    def drain(self):
+        total = 0
+        for session in self.server.sessions.sessions():
+            total += sum(len(frame) for frame in session.outbound.take())
+        return total
+
+def deltas(roster, changes, batch):
+    server = roster.server
+    roster.drain()
+    server.presence_flush_delay = 0 if batch == 1 else 60
+    started = time.process_time()
+    for n in range(changes):
+        client = roster.clients[n % len(roster.clients)]
+        server.set_call_status(client, 'idle' if server.get_call_status(client) != 'idle' else 'in_call')
+        if batch > 1 and (n + 1) % batch == 0:
+            server.flush_presence()
+    server.flush_presence()
+    cpu = time.process_time() - started
+    if server.presence_timer:
+        server.presence_timer.cancel()
+        server.presence_timer = None
+    sent = roster.drain()
+    users = len(roster.clients)
+    return [f"deltas, {batch} per batch", users, changes, round(sent / changes / users, 1),
+            round(sent / changes / 1024, 1), round(cpu / changes * 1000, 3)]
+
+def full_lists(roster, changes):
+    server = roster.server
+    roster.drain()
+    started = time.process_time()
+    for n in range(changes):
+        server.handle_user_list_request(roster.clients[n % len(roster.clients)])
+    cpu = time.process_time() - started
+    sent = roster.drain()
+    users = len(roster.clients)
+    per_request = sent / changes
+    return ["full user_list to everyone", users, changes, round(per_request, 1), round(per_request * users / 1024, 1),
+            round(cpu / changes * users * 1000, 3)]
+
+def snapshot_cost(roster, count):
+    server = roster.server
+    roster.drain()
+    started = time.process_time()
+    for n in range(count):
+        server.handle_presence_subscribe(roster.clients[n], {})
+    cpu = time.process_time() - started
+    sent = roster.drain()
+    return ["snapshot (one subscriber)", len(roster.clients), count, round(sent / count, 1),
+            round(sent / count / 1024, 1), round(cpu / count * 1000, 3)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Presence subscription: deltas vs full user lists")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--changes', type=int, default=200)
+    parser.add_argument('--skip-checks', action='store_true')
+    args = parser.parse_args()
+
+    if not args.skip_checks:
+        for engine in ('thread', 'asyncio'):
+            checks(engine)
+        print()
+    roster = Roster(args.users)
+    rows = [deltas(roster, args.changes, 1), deltas(roster, args.changes * 10, 10),
+            deltas(roster, args.changes * 10, 100), full_lists(roster, 20), snapshot_cost(roster, 20)]
+    print_table(['mode', 'users', 'changes', 'bytes_per_subscriber', 'kb_per_change', 'cpu_ms_per_change'], rows)
+    print("per change: what one join/leave/status change costs the server across all subscribers; the full-list "
+          "row is one user_list_request per client")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import argparse
+import json
+import threading
+import time
+
+from benchutil import (PASSWORD, connect_client, free_port, print_table, send_json, start_server_process,
+                       stop_server_process, wait_json)
+
+from chat_server import ChatServer
+from client_core import ClientCore
+from framing import FRAME_TEXT, read_frame
+from identity import generate_identity
+from metrics import NullMetrics
+from outbound import OutboundQueue
+
+WRAPPED_KEY = "k" * 344
+
+def publish(peer, nickname):
+    send_json(peer[0], {'type': 'public_key', 'nickname': nickname, 'public_key': f"pem-{nickname}",
+                        'directory': True})
+
+def envelope(targets):
+    return {'iv': "i" * 24, 'message': "m" * 64, 'keys': {nick: WRAPPED_KEY for nick in targets}}
+
+def wait_room_event(peer, room):
+    while True:
+        event = wait_json(*peer, 'room_event')
+        if event['room'] == room:
+            return event
+
+def join(peer, room):
+    send_json(peer[0], {'type': 'room_join', 'room': room})
+    return wait_json(*peer, 'room_joined')
+
+def received_json(peer, timeout=0.3):
+    sock, decoder = peer
+    seen = []
+    sock.settimeout(timeout)
+    try:
+        while True:
+            kind, payload = read_frame(sock, decoder)
+            if kind == FRAME_TEXT and payload.startswith(b"{"):
+                seen.append(json.loads(payload))
+    except OSError:
+        pass
+    finally:
+        sock.settimeout(None)
+    return seen
+
+def checks(engine):
+    port = free_port()
+    proc = start_server_process(port, '--engine', engine, '--no-metrics')
+    peers = []
+    try:
+        alice, bob, carol = [connect_client(port, nick) for nick in ("alice", "bob", "carol")]
+        peers += [alice, bob, carol]
+        for peer, nick in ((alice, "alice"), (bob, "bob"), (carol, "carol")):
+            assert nick in wait_json(*peer, 'room_joined')['members']
+            publish(peer, nick)
+
+        assert join(alice, "ops")['members'] == ["alice"]
+        assert set(join(bob, "ops")['members']) == {"alice", "bob"}
+        event = wait_json(*alice, 'room_event')
+        assert (event['room'], event['nickname'], event['event']) == ("ops", "bob", "join"), event
+
+        send_json(alice[0], {'type': 'multicast_message', 'id': 1, 'room': "ops",
+                             'data': [envelope(["bob", "carol"])]})
+        message = wait_json(*bob, 'encrypted_message')
+        assert message['room'] == "ops" and message['data']['encrypted_key'] == WRAPPED_KEY, message
+        missing = wait_json(*alice, 'multicast_missing')
+        assert missing['gone'] == ["carol"] and missing['nicknames'] == [], missing
+        assert not [m for m in received_json(carol) if m['type'] == 'encrypted_message'], "carol got an ops message"
+
+        send_json(carol[0], {'type': 'multicast_message', 'id': 2, 'room': "ops", 'data': [envelope(["alice"])]})
+        assert wait_json(*carol, 'room_error')['room'] == "ops"
+
+        send_json(alice[0], {'type': 'multicast_message', 'id': 3, 'room': "ops", 'data': [envelope([])]})
+        assert wait_json(*alice, 'multicast_missing')['nicknames'] == ["bob"], "uncovered room member not reported"
+
+        send_json(carol[0], {'type': 'key_lookup', 'id': 4})
+        assert set(wait_json(*carol, 'key_records')['keys']) == {"alice", "bob"}
+        for peer, nick in ((alice, "alice"), (bob, "bob")):
+            send_json(peer[0], {'type': 'room_leave', 'room': "lobby"})
+            wait_json(*peer, 'room_left')
+        send_json(carol[0], {'type': 'key_lookup', 'id': 5})
+        assert wait_json(*carol, 'key_records')['keys'] == {}, "keys leaked outside shared rooms"
+
+        send_json(bob[0], {'type': 'room_leave', 'room': "ops"})
+        assert wait_json(*bob, 'room_left')['room'] == "ops"
+        event = wait_json(*alice, 'room_event')
+        assert (event['nickname'], event['event']) == ("bob", "leave"), event
+        send_json(alice[0], {'type': 'multicast_message', 'id': 6, 'room': "ops", 'data': [envelope(["bob"])]})
+        assert wait_json(*alice, 'multicast_missing')['gone'] == ["bob"]
+
+        core_checks(port)
+        print(f"checks ({engine}): membership events, room-scoped fanout, non-member rejected, uncovered members "
+              f"reported, key lookups limited to shared rooms, ClientCore room chat OK")
+    finally:
+        for sock, _ in peers:
+            sock.close()
+        stop_server_process(proc)
+
+def core_checks(port):
+    cores = {nick: ClientCore(nick, generate_identity(), heartbeat=None) for nick in ("dan", "erin", "frank")}
+    inbox = {nick: [] for nick in cores}
+    ready = threading.Event()
+    joined = threading.Event()
+    for nick, core in cores.items():
+        core.on('message', lambda event, data, nick=nick: inbox[nick].append((data['room'], data['text'])))
+        core.connect('127.0.0.1', port, PASSWORD)
+    cores['erin'].on('room', lambda event, data: data['action'] == 'joined' and data['room'] == "team" and ready.set())
+    cores['erin'].on('room', lambda event, data: data.get('nickname') == "dan" and joined.set())
+    cores['erin'].join_room("team")
+    assert ready.wait(10), "erin did not join team"
+    cores['dan'].join_room("team")
+    assert joined.wait(10), "erin did not see dan join"
+    assert cores['dan'].room == "team" and cores['erin'].room == "team"
+    cores['dan'].send_message("for the team")
+    cores['erin'].wait('message')
+    assert set(cores['dan'].peer_public_keys) == {"erin"}, "dan fetched keys outside the room"
+    cores['frank'].send_message("for the lobby", "lobby")
+    deadline = time.time() + 10
+    while len(inbox['dan']) + len(inbox['erin']) < 3 and time.time() < deadline:
+        time.sleep(0.02)
+    assert inbox['erin'][0] == ("team", "for the team"), inbox
+    assert ("lobby", "for the lobby") in inbox['dan'] and ("lobby", "for the lobby") in inbox['erin'], inbox
+    assert inbox['frank'] == [], inbox
+    for core in cores.values():
+        core.disconnect()
+
+def cluster_checks():
+    ports = [free_port() for _ in range(2)]
+    nodes = ",".join(f"127.0.0.1:{free_port()}" for _ in range(2))
+    procs = [start_server_process(port, '--nodes', nodes, '--node-id', str(index), '--no-metrics',
+                                  '--cluster-secret', "bench cluster secret")
+             for index, port in enumerate(ports)]
+    peers = []
+    try:
+        alice = connect_client(ports[0], "alice")
+        peers.append(alice)
+        join(alice, "ops")
+        bob, carol = connect_client(ports[1], "bob"), connect_client(ports[1], "carol")
+        peers += [bob, carol]
+        if "alice" not in join(bob, "ops")['members']:
+            assert wait_room_event(bob, "ops")['nickname'] == "alice", "remote member missing from room"
+        assert wait_room_event(alice, "ops")['nickname'] == "bob"
+
+        send_json(alice[0], {'type': 'multicast_message', 'id': 1, 'room': "ops",
+                             'data': [envelope(["bob", "carol"])]})
+        assert wait_json(*bob, 'encrypted_message')['room'] == "ops"
+        assert wait_json(*alice, 'multicast_missing')['gone'] == ["carol"]
+        bob[0].close()
+        peers.remove(bob)
+        event = wait_room_event(alice, "ops")
+        assert (event['nickname'], event['event']) == ("bob", "leave"), event
+        print("checks (2 nodes): membership replicated, cross-node room fanout and leave events OK")
+    finally:
+        for sock, _ in peers:
+            sock.close()
+        for proc in procs:
+            stop_server_process(proc)
+
+class Server:
+    def __init__(self, users, room_size):
+        self.server = ChatServer()
+        self.server.metrics = NullMetrics()
+        limits = {'chat': {'max_frames': 1 << 30, 'max_bytes': 1 << 40}}
+        self.clients = []
+        for i in range(users):
+            client = object()
+            nickname = f"user{i:05d}"
+            session = self.server.sessions.add(client, nickname)
+            session.outbound = OutboundQueue(limits)
+            self.server.sessions.join_room(f"room{i // room_size}", nickname, client)
+            self.clients.append(client)
+
+    def drain(self):
+        frames = 0
+        for session in self.server.sessions.sessions():
+            frames += len(session.outbound.take())
+        return frames
+
+def fanout(users, room_size, messages):
+    rooms = Server(users, room_size)
+    server = rooms.server
+    server.default_room = ''
+    everyone = [session.nickname for session in server.sessions.sessions()]
+    rows = []
+    for label, scoped in (("global (every key, every socket)", False), (f"rooms of {room_size}", True)):
+        rooms.drain()
+        keys = 0
+        started = time.process_time()
+        for n in range(messages):
+            sender = n * 7919 % users
+            nickname = f"user{sender:05d}"
+            data = {'type': 'multicast_message'}
+            if scoped:
+                data['room'] = f"room{sender // room_size}"
+                nicks = list(server.sessions.room_members(data['room']))
+            else:
+                nicks = everyone
+            targets = [nick for nick in nicks if nick != nickname]
+            keys += len(targets)
+            data['data'] = [envelope(targets)]
+            server.handle_multicast_message(rooms.clients[sender], data)
+        cpu = time.process_time() - started
+        frames = rooms.drain()
+        rows.append([label, users, messages, round(keys / messages, 1), round(frames / messages, 1),
+                     round(cpu / messages * 1e6, 1)])
+    return rows
+
+def notices(users, room_size, count):
+    rooms = Server(users, room_size)
+    server = rooms.server
+    started = time.process_time()
+    for n in range(count):
+        server.broadcast_frame(b"notice")
+    broadcast_cpu = time.process_time() - started
+    broadcast_frames = rooms.drain()
+    started = time.process_time()
+    for n in range(count):
+        server.room_broadcast(f"room{n * 7919 % users // room_size}", b"notice")
+    room_cpu = time.process_time() - started
+    room_frames = rooms.drain()
+    return [["join/leave notice, whole server", users, count, "-", round(broadcast_frames / count, 1),
+             round(broadcast_cpu / count * 1e6, 1)],
+            [f"join/leave notice, room of {room_size}", users, count, "-", round(room_frames / count, 1),
+             round(room_cpu / count * 1e6, 1)]]
+
+def main():
+    parser = argparse.ArgumentParser(description="Room-scoped fanout vs server-wide broadcast")
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--room-size', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--skip-checks', action='store_true')
+    args = parser.parse_args()
+
+    if not args.skip_checks:
+        for engine in ('thread', 'asyncio'):
+            checks(engine)
+        cluster_checks()
+        print()
+    rows = fanout(args.users, args.room_size, args.messages) + notices(args.users, args.room_size, args.messages)
+    print_table(['mode', 'users', 'messages', 'keys_wrapped_per_msg', 'frames_per_msg', 'server_us_per_msg'], rows)
+    print(f"{args.users // args.room_size} rooms; keys wrapped is what the sending client encrypts, frames is what "
+          f"the server queues")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import random
+import time
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.backends import default_backend
+
+from benchutil import (connect_client, free_port, print_table, send_json, start_server_process, stop_server_process,
+                       wait_json)
+
+from e2e_crypto import SessionKeys, decrypt_message, encrypt_envelope
+
+def identity():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+
+def pair(name_a, key_a, name_b, key_b, **options):
+    a = SessionKeys(name_a, key_a, **options)
+    b = SessionKeys(name_b, key_b, **options)
+    record_a, record_b = a.public_record(), b.public_record()
+    assert a.set_peer(name_b, record_b['dh_key'], record_b['dh_sig'], key_b.public_key())
+    assert b.set_peer(name_a, record_a['dh_key'], record_a['dh_sig'], key_a.public_key())
+    return a, b
+
+def delivered(envelope, recipient):
+    data = {k: v for k, v in envelope.items() if k != 'keys'}
+    data['encrypted_key'] = envelope['keys'][recipient]
+    return data
+
+def rate(count, fn):
+    started = time.perf_counter()
+    for i in range(count):
+        fn(i)
+    return count / (time.perf_counter() - started)
+
+def run(size, count, alice_key, bob_key):
+    msg = "x" * size
+    public = {'bob': bob_key.public_key()}
+    legacy = [delivered(encrypt_envelope(msg, public), 'bob') for _ in range(count)]
+    rows = [['rsa-oaep + aes-cfb', size,
+             int(rate(count, lambda i: encrypt_envelope(msg, public))),
+             int(rate(count, lambda i: decrypt_message(bob_key, legacy[i])))]]
+
+    alice, bob = pair('alice', alice_key, 'bob', bob_key)
+    sealed = [delivered(alice.seal(msg, ['bob']), 'bob') for _ in range(count)]
+    rows.append(['x25519 session + aes-gcm', size,
+                 int(rate(count, lambda i: alice.seal(msg, ['bob']))),
+                 int(rate(count, lambda i: bob.open('alice', sealed[i])))])
+    return rows
+
+def fuzz(iterations, alice_key, bob_key, seed=5):
+    rng = random.Random(seed)
+    alice, bob = pair('alice', alice_key, 'bob', bob_key, lifetime=3600, max_messages=7, max_keys=3)
+    for i in range(iterations):
+        msg = "".join(chr(rng.randint(32, 0x2FFF)) for _ in range(rng.randint(0, 64)))
+        data = delivered(alice.seal(msg, ['bob']), 'bob')
+        assert bob.open('alice', data) == msg
+        field = rng.choice(['encrypted_key', 'iv', 'encrypted_message', 'epoch', 'sender'])
+        try:
+            if field == 'sender':
+                bob.set_peer('mallory', alice.public_record()['dh_key'])
+                bob.open('mallory', data)
+            elif field == 'epoch':
+                bob.open('alice', dict(data, epoch=data['epoch'] + 1))
+            else:
+                raw = bytearray(data[field].encode('ascii'))
+                raw[rng.randrange(len(raw) - 4)] ^= 1
+                bob.open('alice', dict(data, **{field: raw.decode('ascii')}))
+            raise AssertionError(f"tampered {field} accepted")
+        except (InvalidTag, ValueError):
+            pass
+    assert alice.stats()['epoch'] == (iterations - 1) // 7
+    assert len(bob.cache) <= 3
+    print(f"fuzz: {iterations} messages across {alice.stats()['epoch'] + 1} key epochs with tampering OK")
+
+def relay_check(alice_key, bob_key):
+    port = free_port()
+    proc = start_server_process(port)
+    clients = {}
+    sessions = {}
+    try:
+        for name, key in (('alice', alice_key), ('bob', bob_key)):
+            clients[name] = connect_client(port, name)
+            sessions[name] = SessionKeys(name, key)
+            pem = key.public_key().public_bytes(encoding=serialization.Encoding.PEM,
+                                                format=serialization.PublicFormat.SubjectPublicKeyInfo)
+            send_json(clients[name][0], {'type': 'public_key', 'nickname': name, 'public_key': pem.decode('utf-8'),
+                                         **sessions[name].public_record()})
+        announced = wait_json(*clients['alice'], 'public_key')
+        assert sessions['alice'].set_peer('bob', announced['dh_key'], announced['dh_sig'], bob_key.public_key())
+        envelope = sessions['alice'].seal("through the relay", ['bob'])
+        send_json(clients['alice'][0], {'type': 'multicast_message', 'sender': 'alice', 'data': envelope})
+        announced = wait_json(*clients['bob'], 'public_key')
+        sessions['bob'].set_peer('alice', announced['dh_key'], announced['dh_sig'], alice_key.public_key())
+        relayed = wait_json(*clients['bob'], 'encrypted_message')
+        assert sessions['bob'].open(relayed['sender'], relayed['data']) == "through the relay"
+        print("relay: session envelope survives server fan-out OK")
+    finally:
+        for sock, _ in clients.values():
+            sock.close()
+        stop_server_process(proc)
+
+def main():
+    parser = argparse.ArgumentParser(description="Messages per second: per-message RSA vs cached session keys")
+    parser.add_argument('--sizes', default='64,1024')
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--fuzz', type=int, default=500)
+    args = parser.parse_args()
+
+    alice_key, bob_key = identity(), identity()
+    rows = []
+    for size in [int(n) for n in args.sizes.split(',')]:
+        rows.extend(run(size, args.count, alice_key, bob_key))
+    print_table(['scheme', 'msg_bytes', 'encrypt_per_s', 'decrypt_per_s'], rows)
+    fuzz(args.fuzz, alice_key, bob_key)
+    relay_check(alice_key, bob_key)
+
+if __name__ == "__main__":
+    main()
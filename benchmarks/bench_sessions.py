@@ -0,0 +1,80 @@
+import argparse
+import random
+import time
+
+import benchutil
+
+from sessions import SessionRegistry
+
+class FakeSocket:
+    def __init__(self, fd):
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+class LegacyLists:
+    def __init__(self):
+        self.clients = []
+        self.nicknames = []
+
+    def add(self, client, nickname):
+        self.clients.append(client)
+        self.nicknames.append(nickname)
+
+    def route(self, sender, target_nick):
+        try:
+            sender_nick = self.nicknames[self.clients.index(sender)]
+            target = self.clients[self.nicknames.index(target_nick)]
+        except ValueError:
+            return None
+        return sender_nick, target
+
+class Registry:
+    def __init__(self):
+        self.registry = SessionRegistry()
+
+    def add(self, client, nickname):
+        self.registry.add(client, nickname)
+
+    def route(self, sender, target_nick):
+        sender_session = self.registry.get(sender)
+        target_session = self.registry.get_by_nickname(target_nick)
+        if sender_session is None or target_session is None:
+            return None
+        return sender_session.nickname, target_session.client
+
+def measure(impl_cls, size, lookups, rng):
+    impl = impl_cls()
+    clients = [FakeSocket(i) for i in range(size)]
+    for i, client in enumerate(clients):
+        impl.add(client, f"user{i}")
+    pairs = [(clients[rng.randrange(size)], f"user{rng.randrange(size)}") for _ in range(lookups)]
+    route = impl.route
+    started = time.perf_counter()
+    for sender, target in pairs:
+        route(sender, target)
+    return (time.perf_counter() - started) / lookups * 1e9
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-message routing cost by number of sessions")
+    parser.add_argument('--sizes', default='10,100,1000,10000,100000')
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--legacy-max', type=int, default=10000,
+                        help="skip the list-based lookup above this many sessions")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    rows = []
+    for size in [int(s) for s in args.sizes.split(',')]:
+        registry_ns = measure(Registry, size, args.lookups, rng)
+        if size <= args.legacy_max:
+            legacy_ns = measure(LegacyLists, size, max(200, args.lookups // max(1, size // 100)), rng)
+            legacy = f"{legacy_ns:.0f}"
+        else:
+            legacy = '-'
+        rows.append([size, legacy, f"{registry_ns:.0f}"])
+    benchutil.print_table(['sessions', 'lists_ns_per_route', 'registry_ns_per_route'], rows)
+
+if __name__ == "__main__":
+    main()
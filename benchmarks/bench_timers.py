@@ -0,0 +1,204 @@
+import argparse
+import random
+import threading
+import time
+
+from benchutil import (connect_client, free_port, percentile, print_table, process_stats, raise_fd_limit, send_json,
+                       start_server_process, stop_server_process, wait_json)
+
+from framing import read_frame
+from timers import TimerWheel
+
+def checks():
+    wheel = TimerWheel(resolution=0.002, slots=16, levels=3)
+    fired = {}
+    lock = threading.Lock()
+
+    def record(n, deadline):
+        with lock:
+            fired[n] = time.monotonic() - deadline
+
+    rng = random.Random(7)
+    timers = []
+    for n in range(2000):
+        delay = rng.choice([rng.uniform(0, 0.03), rng.uniform(0.03, 0.5), rng.uniform(0.5, 2.0)])
+        timers.append((n, wheel.schedule(delay, record, n, time.monotonic() + delay)))
+    cancelled = {n for n, timer in timers[::2] if timer.cancel()}
+    ticks = []
+    periodic = wheel.every(0.05, lambda: ticks.append(time.monotonic()))
+    time.sleep(2.2)
+    periodic.cancel()
+    count = len(ticks)
+    time.sleep(0.1)
+    wheel.stop()
+    assert len(cancelled) > 900 and not cancelled & set(fired), "cancelled timers fired"
+    assert len(fired) == 2000 - len(cancelled), f"{len(fired)} of {2000 - len(cancelled)} timers fired"
+    early = min(fired.values())
+    assert early >= -0.0005, f"timer fired {-early * 1000:.2f} ms early"
+    assert 35 <= count <= 45 and len(ticks) == count, f"periodic timer fired {count} times in 2.2 s"
+    assert len(wheel) == 0
+    late = sorted(fired.values())
+    print(f"checks: {len(fired)} timers across 3 wheel levels fired, none early (p99 {percentile(late, 99) * 1000:.1f} "
+          f"ms late at 2 ms ticks), {len(cancelled)} cancelled never fired, periodic timer {count}x in 2.2 s OK")
+
+def stall_check():
+    wheel = TimerWheel()
+    done = threading.Event()
+    fired = []
+    for delay in (60, 3000, 80000):
+        wheel.schedule(delay, fired.append, delay)
+    wheel.schedule(86000, done.set)
+    time.sleep(0.05)
+    started = time.monotonic()
+    with wheel.cond:
+        wheel.origin -= 86400
+        wheel.cond.notify()
+    assert done.wait(2.0), "timers did not fire after a stall"
+    caught_up = time.monotonic() - started
+    wheel.schedule(0.02, done.clear)
+    time.sleep(0.2)
+    wheel.stop()
+    assert fired == [60, 3000, 80000] and not done.is_set(), fired
+    assert caught_up < 0.5, f"catching up a 24 h stall took {caught_up:.2f} s"
+    print(f"stall check: 24 h of overdue ticks caught up in {caught_up * 1000:.1f} ms, timers fired in order OK")
+
+def wheel_cost(count):
+    wheel = TimerWheel()
+    rng = random.Random(1)
+    delays = [rng.uniform(30, 600) for _ in range(count)]
+    started = time.perf_counter()
+    timers = [wheel.schedule(delay, print) for delay in delays]
+    scheduled = time.perf_counter() - started
+    threads = threading.active_count()
+    started = time.perf_counter()
+    for timer in timers:
+        timer.cancel()
+    cancelled = time.perf_counter() - started
+    assert len(wheel) == 0 and wheel.fired == 0
+    wheel.stop()
+    return ['timer wheel', count, round(scheduled / count * 1e6, 2), round(cancelled / count * 1e6, 2), threads]
+
+def thread_timer_cost(count):
+    started = time.perf_counter()
+    timers = []
+    for _ in range(count):
+        timer = threading.Timer(600, print)
+        timer.daemon = True
+        timer.start()
+        timers.append(timer)
+    scheduled = time.perf_counter() - started
+    threads = threading.active_count()
+    started = time.perf_counter()
+    for timer in timers:
+        timer.cancel()
+    for timer in timers:
+        timer.join()
+    cancelled = time.perf_counter() - started
+    return ['threading.Timer', count, round(scheduled / count * 1e6, 2), round(cancelled / count * 1e6, 2), threads]
+
+def lateness(count, spread):
+    wheel = TimerWheel()
+    samples = []
+    done = threading.Event()
+
+    def record(deadline):
+        samples.append(time.monotonic() - deadline)
+        if len(samples) == count:
+            done.set()
+
+    rng = random.Random(3)
+    for _ in range(count):
+        delay = rng.uniform(0, spread)
+        wheel.schedule(delay, record, time.monotonic() + delay)
+    done.wait(spread + 10)
+    wheel.stop()
+    samples.sort()
+    return [count, spread, round(samples[0] * 1000, 2), round(percentile(samples, 50) * 1000, 2),
+            round(percentile(samples, 99) * 1000, 2), round(samples[-1] * 1000, 2)]
+
+def ringing_calls(engine, calls):
+    port = free_port()
+    proc = start_server_process(port, '--engine', engine, '--no-metrics', '--ring-timeout', '2')
+    peers = []
+    try:
+        for i in range(calls):
+            peers.append((connect_client(port, f"caller{i}"), connect_client(port, f"callee{i}")))
+        time.sleep(0.3)
+        idle = process_stats(proc.pid)['threads']
+        started = time.perf_counter()
+        for i, (caller, _) in enumerate(peers):
+            send_json(caller[0], {'type': 'call_request', 'target': f"callee{i}"})
+        for caller, callee in peers:
+            wait_json(*callee, 'incoming_call')
+        ringing = process_stats(proc.pid)['threads']
+        for caller, _ in peers[:calls // 2]:
+            response = wait_json(*caller, 'call_response')
+            send_json(caller[0], {'type': 'call_end', 'call_id': response['call_id']})
+        ended = []
+        for caller, _ in peers[calls // 2:]:
+            wait_json(*caller, 'call_response')
+            message = wait_json(*caller, 'call_ended', timeout=10)
+            assert message['reason'] == 'timeout', message
+            ended.append(time.perf_counter() - started)
+        for caller, _ in peers[:calls // 2]:
+            assert wait_json(*caller, 'call_ended')['reason'] == 'ended'
+        ended.sort()
+        return [engine, calls, idle, ringing, round(ended[0], 2), round(ended[-1], 2)]
+    finally:
+        for caller, callee in peers:
+            caller[0].close()
+            callee[0].close()
+        stop_server_process(proc)
+
+def idle_ping(engine):
+    port = free_port()
+    proc = start_server_process(port, '--engine', engine, '--no-metrics', '--idle-timeout', '1')
+    try:
+        quiet = connect_client(port, "quiet")
+        chatty = connect_client(port, "chatty")
+        started = time.perf_counter()
+        sock, decoder = quiet
+        sock.settimeout(5)
+        while True:
+            kind, payload = read_frame(sock, decoder)
+            if payload == b"PING":
+                break
+        waited = time.perf_counter() - started
+        assert 0.9 <= waited < 2.5, waited
+        quiet[0].close()
+        chatty[0].close()
+        return waited
+    finally:
+        stop_server_process(proc)
+
+def main():
+    parser = argparse.ArgumentParser(description="Timer wheel: schedule/cancel cost, firing accuracy, ring timeouts")
+    parser.add_argument('--counts', default='10000,100000,500000')
+    parser.add_argument('--thread-timers', type=int, default=1000)
+    parser.add_argument('--calls', type=int, default=100)
+    parser.add_argument('--skip-checks', action='store_true')
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    if not args.skip_checks:
+        checks()
+        stall_check()
+        waits = [idle_ping(engine) for engine in ('thread', 'asyncio')]
+        print(f"idle check: silent clients pinged after {waits[0]:.2f} s (thread) and {waits[1]:.2f} s (asyncio) "
+              f"with --idle-timeout 1 OK")
+        print()
+    rows = [thread_timer_cost(args.thread_timers)]
+    rows += [wheel_cost(int(count)) for count in args.counts.split(',')]
+    print_table(['timers', 'count', 'schedule_us', 'cancel_us', 'threads'], rows)
+    print("delays 30-600 s; threads: live threads in this process while the timers are pending")
+    print()
+    print_table(['timers', 'spread_s', 'min_late_ms', 'p50_late_ms', 'p99_late_ms', 'max_late_ms'],
+                [lateness(10000, 1.0), lateness(10000, 5.0)])
+    print("10 ms ticks: timers never fire early and are rounded up to the next tick")
+    print()
+    rows = [ringing_calls(engine, args.calls) for engine in ('thread', 'asyncio')]
+    print_table(['engine', 'calls', 'threads_idle', 'threads_ringing', 'first_timeout_s', 'last_timeout_s'], rows)
+    print("half of the calls are ended by the caller (their ring timers are cancelled), half ring out after 2 s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import argparse
+import threading
+import time
+import wave
+
+from benchutil import PASSWORD, free_port, print_table, start_server_process, stop_server_process
+
+import numpy as np
+
+from client_core import ClientCore
+from e2e_crypto import TAG_SIZE
+from framing import HEADER, VOICE_HEADER
+from jitter_buffer import JitterBuffer
+from identity import generate_identity
+from vad import COMFORT, HANGOVER_MS, SPEECH, ComfortNoise, VoiceActivityDetector, frame_features
+from voice_codec import VoicePipeline
+
+DEVICE_RATE = 44100
+CHUNK = 1024
+OVERHEAD = HEADER.size + VOICE_HEADER.size + TAG_SIZE
+
+def background(count, rng, level_db):
+    white = rng.randn(count + 64)
+    pink = np.convolve(white, np.ones(64) / 8.0, mode='valid')[:count] + 0.3 * white[:count]
+    pink *= 32768 * 10 ** (level_db / 20.0) / pink.std()
+    t = np.arange(count) / float(DEVICE_RATE)
+    return pink + 32768 * 10 ** ((level_db - 6) / 20.0) * np.sin(2 * np.pi * 50 * t)
+
+def word(rng, seconds):
+    n = int(seconds * DEVICE_RATE)
+    t = np.arange(n) / float(DEVICE_RATE)
+    pitch = rng.uniform(100, 220) * (1 + 0.15 * np.sin(2 * np.pi * rng.uniform(1, 4) * t))
+    phase = 2 * np.pi * np.cumsum(pitch) / DEVICE_RATE
+    voiced = sum(np.sin(k * phase) * rng.uniform(0.3, 1.0) / k for k in range(1, 14))
+    envelope = np.sin(np.pi * np.arange(n) / n) ** 0.6
+    signal = voiced * envelope * 10 ** (rng.uniform(-22, -10) / 20.0) * 32768 / 1.5
+    if rng.rand() < 0.4:
+        hiss = min(n, int(rng.uniform(0.05, 0.12) * DEVICE_RATE))
+        fricative = np.diff(rng.randn(hiss + 1)) * 32768 * 10 ** (rng.uniform(-34, -26) / 20.0)
+        signal[:hiss] = signal[:hiss] * np.linspace(0, 1, hiss) + fricative
+    return signal
+
+def conversation(seconds, seed=7, noise_db=(-58, -50)):
+    rng = np.random.RandomState(seed)
+    count = int(seconds * DEVICE_RATE)
+    channels = [background(count, rng, level) for level in noise_db]
+    truth = [np.zeros(count, dtype=bool) for _ in noise_db]
+    position = int(rng.uniform(0.3, 1.0) * DEVICE_RATE)
+    speaker = 0
+    while position < count:
+        turn_end = position + int(rng.uniform(1.5, 5.0) * DEVICE_RATE)
+        while position < min(turn_end, count):
+            signal = word(rng, rng.uniform(0.15, 0.45))
+            end = min(count, position + len(signal))
+            channels[speaker][position:end] += signal[:end - position]
+            truth[speaker][position:end] = True
+            position = end + int(rng.uniform(0.05, 0.2) * DEVICE_RATE)
+        position += int(rng.uniform(0.2, 1.2) * DEVICE_RATE)
+        speaker = 1 - speaker if rng.rand() < 0.85 else speaker
+    pcm = [np.clip(np.round(channel), -32768, 32767).astype(np.int16) for channel in channels]
+    return [(f"talker {name} (noise {level} dBov)", samples, mask)
+            for name, samples, mask, level in zip("AB", pcm, truth, noise_db)]
+
+def read_wav(path):
+    with wave.open(path, 'rb') as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"{path}: only 16-bit WAV files are supported")
+        samples = np.frombuffer(f.readframes(f.getnframes()), dtype='<i2')
+        samples = samples.reshape(-1, f.getnchannels())[:, 0]
+        rate = f.getframerate()
+    if rate != DEVICE_RATE:
+        positions = np.arange(int(len(samples) * DEVICE_RATE / rate)) * (rate / float(DEVICE_RATE))
+        samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.int16)
+    return path, samples, None
+
+def frames_of(samples):
+    usable = len(samples) // CHUNK * CHUNK
+    return samples[:usable].reshape(-1, CHUNK)
+
+def wire_bytes(frames, decisions, codec):
+    pipeline = VoicePipeline(codec, DEVICE_RATE)
+    sizes = [len(pipeline.encode(frame.tobytes())) for frame in frames]
+    full = sum(sizes) + OVERHEAD * len(sizes)
+    sent = sum(size + OVERHEAD for size, decision in zip(sizes, decisions) if decision == SPEECH)
+    sent += sum(1 + OVERHEAD for decision in decisions if decision == COMFORT)
+    return full, sent
+
+def measure(name, samples, mask, codec):
+    frames = frames_of(samples)
+    decisions = VoiceActivityDetector(DEVICE_RATE, CHUNK).process_all(frames)
+    seconds = len(frames) * CHUNK / float(DEVICE_RATE)
+    full, sent = wire_bytes(frames, decisions, codec)
+    row = [name, codec, round(seconds, 1), round(full * 8 / seconds / 1000, 1), round(sent * 8 / seconds / 1000, 1),
+           round(100 - 100.0 * sent / full, 1)]
+    if mask is None:
+        return row + ["-", "-"]
+    speech = frames_of(mask).mean(axis=1) > 0.1
+    sent_mask = np.array([decision == SPEECH for decision in decisions])
+    clipped = np.count_nonzero(speech & ~sent_mask) / float(max(1, np.count_nonzero(speech)))
+    return row + [round(100.0 * speech.mean(), 1), round(100.0 * clipped, 2)]
+
+def playback(samples, decisions):
+    comfort = ComfortNoise(DEVICE_RATE, CHUNK, seed=1)
+    vad = VoiceActivityDetector(DEVICE_RATE, CHUNK)
+    out = []
+    for frame, decision in zip(frames_of(samples), decisions):
+        pcm = frame.tobytes()
+        if decision == SPEECH:
+            out.append(comfort.resume(pcm))
+        elif decision == COMFORT:
+            vad.quiet_db = frame_features(pcm)[0]
+            out.append(comfort.update(vad.marker()))
+        else:
+            out.append(comfort.fill())
+    return np.frombuffer(b"".join(out), dtype='<i2')
+
+def gap_check(name, samples):
+    frames = frames_of(samples)
+    decisions = VoiceActivityDetector(DEVICE_RATE, CHUNK).process_all(frames)
+    filled = playback(samples, decisions)
+    gaps = np.repeat([decision != SPEECH for decision in decisions], CHUNK)
+    original = frames.reshape(-1).astype(np.float64)
+    level = lambda x: 20 * np.log10(max(np.sqrt(np.mean(x.astype(np.float64) ** 2)), 1e-9) / 32768)
+    edges = np.flatnonzero(np.diff(gaps.astype(np.int8))) + 1
+    jumps = np.abs(np.diff(filled.astype(np.float64)))
+    step = max(jumps[edges - 1]) if len(edges) else 0.0
+    typical = np.percentile(np.abs(np.diff(original)), 99.9)
+    assert step <= typical, f"{name}: {step} sample step at a talkspurt edge (99.9th pct {typical})"
+    return [name, round(level(original[gaps]), 1), round(level(filled[gaps]), 1), "-inf (zero fill)",
+            int(step), int(typical)]
+
+def playout_targets(decisions, arrivals, vad, resync):
+    frame_ms = CHUNK * 1000.0 / DEVICE_RATE
+    jitter = JitterBuffer(frame_ms, resync_ms=HANGOVER_MS if resync else None)
+    targets = []
+    seq = 0
+    for index, decision in enumerate(decisions):
+        if vad and decision is None:
+            continue
+        jitter.put(seq, b"", now=arrivals[index])
+        seq += 1
+        if vad and decision == COMFORT and resync:
+            jitter.pause()
+        if decision == COMFORT and index and decisions[index - 1] == SPEECH:
+            targets.append(jitter.stats()['target_ms'])
+    return targets
+
+def playout_check(name, samples, seed=5):
+    decisions = VoiceActivityDetector(DEVICE_RATE, CHUNK).process_all(frames_of(samples))
+    rng = np.random.RandomState(seed)
+    frame_s = CHUNK / float(DEVICE_RATE)
+    arrivals = np.arange(len(decisions)) * frame_s + 0.005 + rng.exponential(0.008, len(decisions))
+    rows = []
+    for mode, vad, resync in (("always on", False, False), ("vad, transit history kept", True, False),
+                              ("vad, resync after pauses", True, True)):
+        targets = playout_targets(decisions, arrivals.tolist(), vad, resync)
+        rows.append([name, mode, len(targets), round(float(np.median(targets)), 1), round(max(targets), 1)])
+    baseline, resynced = rows[0][4], rows[2][4]
+    assert resynced <= baseline + frame_s * 1000, f"{name}: playout target {resynced} ms after pauses vs {baseline} ms"
+    return rows
+
+def vad_cost(samples):
+    frames = frames_of(samples)
+    pcm = [frame.tobytes() for frame in frames]
+    vad = VoiceActivityDetector(DEVICE_RATE, CHUNK)
+    started = time.perf_counter()
+    for chunk in pcm:
+        vad.process(chunk)
+    single = (time.perf_counter() - started) / len(pcm) * 1e6
+    started = time.perf_counter()
+    VoiceActivityDetector(DEVICE_RATE, CHUNK).process_all(frames)
+    batch = (time.perf_counter() - started) / len(pcm) * 1e6
+    return single, batch
+
+def call_check(samples):
+    port = free_port()
+    proc = start_server_process(port, '--no-metrics')
+    cores = []
+    try:
+        caller, callee = cores[:] = [ClientCore(nick, generate_identity(), heartbeat=None, codecs=['pcm16'])
+                                     for nick in ("alice", "bob")]
+        for core in cores:
+            core.connect('127.0.0.1', port, PASSWORD)
+        started = threading.Semaphore(0)
+        ended = {}
+        done = threading.Event()
+        callee.on('incoming_call', lambda event, data: callee.answer(data['call_id']))
+        for core in cores:
+            core.on('call_started', lambda event, data: started.release())
+        caller.on('call_ended', lambda event, data: (ended.update(data), done.set()))
+        caller.call("bob")
+        assert started.acquire(timeout=10) and started.acquire(timeout=10), "call did not start"
+        played = []
+
+        def player():
+            while callee.in_call:
+                audio = callee.next_voice(timeout=0.1)
+                if audio is not None:
+                    played.append(audio)
+                    time.sleep(CHUNK / float(DEVICE_RATE))
+
+        thread = threading.Thread(target=player, daemon=True)
+        thread.start()
+        frames = frames_of(samples)
+        for frame in frames:
+            caller.send_voice(frame.tobytes())
+            time.sleep(CHUNK / float(DEVICE_RATE))
+        stats = dict(callee.jitter.stats())
+        comfort = callee.comfort.filled
+        caller.hangup()
+        assert done.wait(10), "call did not end"
+        thread.join(5)
+        vad = ended['vad']
+        assert vad['frames'] == len(frames) and vad['comfort'] > 0 and vad['suppressed'] > 0, vad
+        assert stats['received'] == vad['speech'] + vad['comfort'], (stats, vad)
+        assert comfort > 0, "receiver never filled a gap with comfort noise"
+        assert all(len(audio) == CHUNK * 2 for audio in played)
+        print(f"check (call): {vad['speech']} speech + {vad['comfort']} comfort noise frames of {vad['frames']} sent, "
+              f"receiver got all of them and filled {comfort} frames of silence with comfort noise")
+    finally:
+        for core in cores:
+            core.disconnect()
+        stop_server_process(proc)
+
+def main():
+    parser = argparse.ArgumentParser(description="Voice activity detection: bandwidth saved and speech clipped")
+    parser.add_argument('--seconds', type=float, default=60.0, help="length of the synthesized conversation")
+    parser.add_argument('--wav', nargs='*', default=[], help="16-bit WAV recordings to measure instead")
+    parser.add_argument('--codecs', default='adpcm,pcm16')
+    parser.add_argument('--skip-checks', action='store_true')
+    args = parser.parse_args()
+
+    samples = [read_wav(path) for path in args.wav] or conversation(args.seconds)
+    if not args.skip_checks:
+        call_check(conversation(8.0, seed=11)[0][1])
+        print()
+    rows = [measure(name, pcm, mask, codec) for codec in args.codecs.split(',') for name, pcm, mask in samples]
+    print_table(['recording', 'codec', 'seconds', 'kbps_always_on', 'kbps_vad', 'saved_pct', 'speech_pct',
+                 'speech_frames_clipped_pct'], rows)
+    print(f"kbps include {OVERHEAD} bytes of framing and GCM tag per frame; comfort noise markers are 1 byte")
+    print()
+    print_table(['recording', 'gap_level_dbov', 'filled_level_dbov', 'without_comfort_noise', 'max_edge_step',
+                 'p99.9_step'], [gap_check(name, pcm) for name, pcm, _ in samples])
+    print()
+    print_table(['recording', 'mode', 'talk_spurts', 'median_target_ms', 'max_target_ms'],
+                [row for name, pcm, _ in samples for row in playout_check(name, pcm)])
+    print("jitter buffer playout target at the end of each talk spurt, same network jitter in every mode")
+    single, batch = vad_cost(samples[0][1])
+    print(f"VAD cost per {CHUNK}-sample frame: {single:.1f} µs live, {batch:.1f} µs batched")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import time
+
+import benchutil
+
+import numpy as np
+
+from framing import HEADER, VOICE_HEADER
+from voice_codec import VoicePipeline, available_codecs
+
+DEVICE_RATE = 44100
+CHUNK = 1024
+
+def speech_like(seconds, rate=DEVICE_RATE, seed=3):
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(seconds * rate)) / float(rate)
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 12))
+    envelope = np.clip(np.sin(2 * np.pi * 2.5 * t), 0, None) ** 0.5
+    signal = 6000 * voiced * envelope + 300 * rng.randn(len(t))
+    return np.clip(signal, -32768, 32767).astype(np.int16)
+
+def snr_db(reference, decoded):
+    n = min(len(reference), len(decoded)) - 200
+    ref = reference[100:n].astype(np.float64)
+    best = None
+    for delay in range(0, 64):
+        out = decoded[100 + delay:n + delay].astype(np.float64)
+        if len(out) < len(ref):
+            break
+        err = np.sum((ref - out) ** 2)
+        best = err if best is None else min(best, err)
+    return 10 * np.log10(np.sum(ref ** 2) / max(best, 1e-9))
+
+def run_codec(name, signal):
+    sender = VoicePipeline(name, DEVICE_RATE)
+    receiver = VoicePipeline(name, DEVICE_RATE)
+    chunks = [signal[i:i + CHUNK].tobytes() for i in range(0, len(signal) - CHUNK + 1, CHUNK)]
+    encode_time = decode_time = 0.0
+    wire_bytes = 0
+    decoded = []
+    for chunk in chunks:
+        started = time.perf_counter()
+        encoded = sender.encode(chunk)
+        middle = time.perf_counter()
+        decoded.append(receiver.decode(encoded))
+        decode_time += time.perf_counter() - middle
+        encode_time += middle - started
+        wire_bytes += HEADER.size + VOICE_HEADER.size + len(encoded)
+    seconds = len(chunks) * CHUNK / float(DEVICE_RATE)
+    decoded = np.frombuffer(b"".join(decoded), dtype='<i2')
+    return {
+        'codec': name,
+        'encode_us': round(encode_time / len(chunks) * 1e6, 1),
+        'decode_us': round(decode_time / len(chunks) * 1e6, 1),
+        'bytes_per_frame': int(wire_bytes / len(chunks)),
+        'bytes_per_s': int(wire_bytes / seconds),
+        'kbit_per_s': round(wire_bytes * 8 / seconds / 1000, 1),
+        'legacy_json_bytes_per_s': int(len(chunks) * (CHUNK * 2 * 4 / 3 + 90) / seconds) if name == 'pcm16' else '-',
+        'snr_db': round(snr_db(signal, decoded), 1) if name != 'pcm16' else 'lossless',
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-frame voice codec CPU cost and bitrate")
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+
+    signal = speech_like(args.seconds)
+    rows = [run_codec(name, signal) for name in available_codecs()]
+    headers = ['codec', 'encode_us', 'decode_us', 'bytes_per_frame', 'bytes_per_s', 'kbit_per_s',
+               'legacy_json_bytes_per_s', 'snr_db']
+    benchutil.print_table(headers, [[r[h] for h in headers] for r in rows])
+    print(f"frame = {CHUNK} samples at {DEVICE_RATE} Hz ({CHUNK * 1000.0 / DEVICE_RATE:.1f} ms); "
+          "bytes include frame and voice headers")
+
+if __name__ == "__main__":
+    main()
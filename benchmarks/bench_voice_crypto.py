@@ -0,0 +1,111 @@
+import argparse
+import os
+import random
+import time
+
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+from cryptography.hazmat.backends import default_backend
+
+from benchutil import (connect_client, free_port, print_table, send_json, start_server_process, stop_server_process,
+                       wait_json)
+
+from e2e_crypto import CALL_KEY_SIZE, VoiceCipher, unwrap_call_key, wrap_call_key
+from framing import FRAME_VOICE, encode_voice_frame, parse_voice_frame, read_frame
+
+FRAME_MS = 1024 * 1000.0 / 44100
+SIZES = {'adpcm': 196, 'mulaw': 372, 'pcm16': 2048}
+
+def per_frame_us(fn, count):
+    started = time.perf_counter()
+    for seq in range(count):
+        fn(seq)
+    return (time.perf_counter() - started) / count * 1e6
+
+def run(codec, size, count):
+    key = os.urandom(CALL_KEY_SIZE)
+    sender = VoiceCipher(key, "call", "alice", "bob")
+    receiver = VoiceCipher(key, "call", "bob", "alice")
+    audio = os.urandom(size)
+    frames = [bytes(sender.seal_frame(1, seq, audio)) for seq in range(count)]
+    parsed = [parse_voice_frame(frame[5:]) for frame in frames]
+    plain = per_frame_us(lambda seq: encode_voice_frame(1, seq, audio), count)
+    seal = per_frame_us(lambda seq: sender.seal_frame(1, seq, audio), count)
+    opened = per_frame_us(lambda seq: receiver.open_frame(*parsed[seq]), count)
+
+    chacha = ChaCha20Poly1305(ChaCha20Poly1305.generate_key())
+    nonce = bytes(12)
+    chacha_us = per_frame_us(lambda seq: chacha.encrypt(nonce, audio, b"header12"), count)
+    total = seal + opened
+    return [codec, size, round(plain, 2), round(seal, 2), round(opened, 2), round(chacha_us, 2),
+            round(100 * total / (FRAME_MS * 1000), 3)]
+
+def fuzz(iterations, seed=23):
+    rng = random.Random(seed)
+    key = os.urandom(CALL_KEY_SIZE)
+    sender = VoiceCipher(key, "call", "alice", "bob")
+    receiver = VoiceCipher(key, "call", "bob", "alice")
+    echo = VoiceCipher(key, "call", "alice", "bob")
+    for seq in range(iterations):
+        audio = os.urandom(rng.randint(0, 3000))
+        frame = bytes(sender.seal_frame(rng.randrange(1 << 32), seq, audio))
+        slot, got_seq, body = parse_voice_frame(frame[5:])
+        assert receiver.open_frame(slot, got_seq, body) == audio
+        assert echo.open_frame(slot, got_seq, body) is None, "own direction key accepted"
+        choice = rng.randrange(3)
+        if choice == 0:
+            tampered = bytearray(body)
+            tampered[rng.randrange(len(tampered))] ^= 1 << rng.randrange(8)
+            assert receiver.open_frame(slot, got_seq, bytes(tampered)) is None
+        elif choice == 1:
+            assert receiver.open_frame(slot, (got_seq + 1) & 0xFFFFFFFF, body) is None
+        else:
+            assert receiver.open_frame((slot + 1) & 0xFFFFFFFF, got_seq, body) is None
+    print(f"fuzz: {iterations} frames, tampered body/seq/slot and reflected frames rejected OK")
+
+def relay_check():
+    identity = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    port = free_port()
+    proc = start_server_process(port)
+    peers = []
+    try:
+        caller = connect_client(port, "alice")
+        callee = connect_client(port, "bob")
+        peers = [caller, callee]
+        call_key = os.urandom(CALL_KEY_SIZE)
+        send_json(caller[0], {'type': 'call_request', 'target': 'bob',
+                              'call_key': wrap_call_key(identity.public_key(), call_key)})
+        incoming = wait_json(*callee, 'incoming_call')
+        callee_key = unwrap_call_key(identity, incoming['call_key'])
+        send_json(callee[0], {'type': 'call_answer', 'call_id': incoming['call_id'], 'action': 'accept',
+                              'encrypted': True})
+        started = wait_json(*caller, 'call_started')
+        assert started['encrypted'] and wait_json(*callee, 'call_started')['encrypted']
+        sender = VoiceCipher(call_key, started['call_id'], "alice", "bob")
+        receiver = VoiceCipher(callee_key, started['call_id'], "bob", "alice")
+        caller[0].sendall(sender.seal_frame(started['slot'], 9, b"voice" * 40))
+        kind, payload = read_frame(*callee)
+        while kind != FRAME_VOICE:
+            kind, payload = read_frame(*callee)
+        assert receiver.open_frame(*parse_voice_frame(payload)) == b"voice" * 40
+        print("relay: sealed voice frame relayed unchanged and authenticated OK")
+    finally:
+        for sock, _ in peers:
+            sock.close()
+        stop_server_process(proc)
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-frame voice AEAD cost against the 23.2 ms frame interval")
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--fuzz', type=int, default=3000)
+    args = parser.parse_args()
+
+    rows = [run(codec, size, args.count) for codec, size in SIZES.items()]
+    print_table(['codec', 'bytes', 'plain_frame_us', 'aesgcm_seal_us', 'aesgcm_open_us', 'chacha20_seal_us',
+                 'pct_of_frame_interval'], rows)
+    print(f"frame interval {FRAME_MS:.1f} ms; pct covers seal + open of one frame")
+    fuzz(args.fuzz)
+    relay_check()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import base64
+import json
+import selectors
+import threading
+import time
+
+from benchutil import (connect_client, free_port, print_table, process_stats, raise_fd_limit, setup_call,
+                       start_server_process, stop_server_process)
+
+from chat_server import ENGINES
+from framing import FRAME_VOICE, encode_frame, encode_voice_frame
+
+FRAMES_PER_SECOND = 44100 / 1024.0
+
+class VoiceDrain(threading.Thread):
+    def __init__(self, peers):
+        super().__init__(daemon=True)
+        self.selector = selectors.DefaultSelector()
+        for sock, decoder in peers:
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ, decoder)
+        self.running = True
+        self.frames = 0
+
+    def run(self):
+        while self.running:
+            for key, _ in self.selector.select(timeout=0.1):
+                try:
+                    data = key.fileobj.recv(262144)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except OSError:
+                    data = b""
+                if not data:
+                    self.selector.unregister(key.fileobj)
+                    continue
+                key.data.feed(data)
+                for kind, payload in key.data:
+                    if kind == FRAME_VOICE or payload.startswith(b'{"type": "voice_data"'):
+                        self.frames += 1
+
+def voice_frames(mode, call, audio):
+    if mode == 'binary':
+        return lambda seq: encode_voice_frame(call['slot'], seq, audio)
+    encoded = base64.b64encode(audio).decode('ascii')
+    frame = encode_frame(json.dumps({'type': 'voice_data', 'call_id': call['call_id'], 'audio_data': encoded}))
+    return lambda seq: frame
+
+def run(engine, mode, calls, duration, chunk_bytes):
+    port = free_port()
+    proc = start_server_process(port, '--engine', engine, '--voice-queue-frames', '256')
+    peers = []
+    senders = []
+    try:
+        audio = bytes(range(256)) * (chunk_bytes // 256)
+        for i in range(calls):
+            caller = connect_client(port, f"caller{i}")
+            callee = connect_client(port, f"callee{i}")
+            call = setup_call(caller, callee, f"callee{i}")
+            peers.extend([caller, callee])
+            make = voice_frames(mode, call, audio)
+            senders.append((caller[0], make))
+            senders.append((callee[0], make))
+
+        drain = VoiceDrain(peers)
+        drain.start()
+        time.sleep(0.5)
+
+        cpu_before = process_stats(proc.pid)['cpu_seconds']
+        relayed_before = drain.frames
+        deadline = time.time() + duration
+        seq = 0
+        sent = 0
+        while time.time() < deadline:
+            for sock, make in senders:
+                frame = make(seq)
+                view = memoryview(frame)
+                while view:
+                    try:
+                        view = view[sock.send(view):]
+                    except (BlockingIOError, InterruptedError):
+                        time.sleep(0.0005)
+                sent += 1
+            seq += 1
+        time.sleep(0.5)
+        cpu_after = process_stats(proc.pid)['cpu_seconds']
+        drain.running = False
+
+        relayed = drain.frames - relayed_before
+        cpu = (cpu_after - cpu_before) if cpu_after is not None and cpu_before is not None else None
+        result = {'engine': engine, 'mode': mode, 'calls': calls, 'sent': sent, 'relayed': relayed,
+                  'relayed_per_s': int(relayed / duration)}
+        if cpu and relayed:
+            us_per_frame = cpu / relayed * 1e6
+            result['server_us_per_frame'] = round(us_per_frame, 1)
+            result['calls_per_core'] = int(1e6 / (us_per_frame * 2 * FRAMES_PER_SECOND))
+        return result
+    finally:
+        for sock, _ in peers:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        stop_server_process(proc)
+
+def main():
+    parser = argparse.ArgumentParser(description="Voice relay cost: JSON voice_data vs binary voice frames")
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--modes', default='json,binary')
+    parser.add_argument('--calls', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=3.0)
+    parser.add_argument('--chunk-bytes', type=int, default=2048, help="audio bytes per frame (1024 x int16)")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    results = []
+    for engine in args.engines.split(','):
+        for mode in args.modes.split(','):
+            results.append(run(engine, mode, args.calls, args.duration, args.chunk_bytes))
+    headers = ['engine', 'mode', 'calls', 'sent', 'relayed', 'relayed_per_s', 'server_us_per_frame',
+               'calls_per_core']
+    print_table(headers, [[r.get(h, '-') for h in headers] for r in results])
+    print("calls_per_core assumes both directions at 44100/1024 frames per second")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import urllib.request
+
+from benchutil import (Drain, connect_client, free_port, print_table, process_stats, raise_fd_limit, send_json,
+                       setup_call, start_server_process, stop_server_process, wait_json)
+
+from framing import FRAME_VOICE, encode_frame, encode_voice_frame, read_frame
+
+def start_cluster(port, workers, metrics_port, *extra):
+    if workers == 1:
+        proc = start_server_process(port, '--metrics-port', str(metrics_port), *extra)
+        return proc, None
+    directory = tempfile.mkdtemp(prefix='bench-bus-')
+    proc = start_server_process(port, '--workers', str(workers), '--bus-dir', directory,
+                                '--metrics-port', str(metrics_port), *extra)
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        if len([name for name in os.listdir(directory) if name.endswith('.sock')]) == workers:
+            break
+        time.sleep(0.05)
+    time.sleep(0.5)
+    return proc, directory
+
+def stop_cluster(proc, directory):
+    stop_server_process(proc)
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def worker_pids(proc):
+    try:
+        with open(f'/proc/{proc.pid}/task/{proc.pid}/children') as f:
+            children = [int(pid) for pid in f.read().split()]
+    except OSError:
+        children = []
+    return children or [proc.pid]
+
+def cpu_seconds(pids):
+    return sum(process_stats(pid)['cpu_seconds'] or 0.0 for pid in pids)
+
+def connections(metrics_port, workers):
+    counts = []
+    for index in range(workers):
+        url = f"http://127.0.0.1:{metrics_port + index}/stats"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            stats = json.loads(response.read())
+        counts.append(stats['metrics']['chat_connections_total']['samples'][0]['value'])
+    return counts
+
+def connect_placed(port, nickname, metrics_port, workers):
+    before = connections(metrics_port, workers)
+    peer = connect_client(port, nickname)
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        after = connections(metrics_port, workers)
+        for index, (old, new) in enumerate(zip(before, after)):
+            if new > old:
+                return peer, index
+        time.sleep(0.01)
+    raise RuntimeError(f"{nickname} did not register")
+
+def read_voice(peer, count, timeout=10.0):
+    sock, decoder = peer
+    sock.settimeout(timeout)
+    received = 0
+    try:
+        while received < count:
+            kind, _ = read_frame(sock, decoder)
+            if kind == FRAME_VOICE:
+                received += 1
+    finally:
+        sock.settimeout(None)
+    return received
+
+def checks(port, workers, metrics_port, clients=8, voice_frames=20):
+    peers = []
+    placement = []
+    for i in range(clients):
+        peer, index = connect_placed(port, f"user{i}", metrics_port, workers)
+        peers.append(peer)
+        placement.append(index)
+    try:
+        deadline = time.time() + 10
+        while True:
+            send_json(peers[0][0], {'type': 'user_list_request'})
+            users = {u['nickname'] for u in wait_json(*peers[0], 'user_list')['users']}
+            if users == {f"user{i}" for i in range(1, clients)} or time.time() > deadline:
+                break
+            time.sleep(0.1)
+        assert users == {f"user{i}" for i in range(1, clients)}, f"user list incomplete: {sorted(users)}"
+
+        for attempt in range(2 * workers):
+            try:
+                connect_client(port, "user3")[0].close()
+                raise AssertionError("duplicate nickname accepted")
+            except RuntimeError as e:
+                assert "nickname in use" in str(e)
+
+        for i, (sock, _) in enumerate(peers):
+            for j in range(clients):
+                if i != j:
+                    send_json(sock, {'type': 'encrypted_message', 'sender': f"user{i}", 'target': f"user{j}",
+                                     'data': {'encrypted_message': f"{i}->{j}"}})
+        for j, peer in enumerate(peers):
+            got = {wait_json(*peer, 'encrypted_message')['data']['encrypted_message'] for _ in range(clients - 1)}
+            assert got == {f"{i}->{j}" for i in range(clients) if i != j}, f"user{j} missed messages"
+
+        cross = [(a, b) for a in range(clients) for b in range(clients)
+                 if a < b and placement[a] != placement[b]]
+        pairs = []
+        for a, b in cross:
+            if not any(a in pair or b in pair for pair in pairs):
+                pairs.append((a, b))
+        for a, b in pairs:
+            call = setup_call(peers[a], peers[b], f"user{b}")
+            for seq in range(voice_frames):
+                peers[a][0].sendall(encode_voice_frame(call['slot'], seq, b"a" * 160))
+                peers[b][0].sendall(encode_voice_frame(call['slot'], seq, b"b" * 160))
+            assert read_voice(peers[b], voice_frames) == voice_frames
+            assert read_voice(peers[a], voice_frames) == voice_frames
+            send_json(peers[b][0], {'type': 'call_end', 'call_id': call['call_id']})
+            assert wait_json(*peers[a], 'call_ended')['call_id'] == call['call_id']
+        print(f"checks ({workers} workers, placement {placement}): presence, unique nicknames, "
+              f"{clients * (clients - 1)} messages, {len(pairs)} cross-worker calls OK")
+    finally:
+        for sock, _ in peers:
+            sock.close()
+
+def sender(port, group, clients, messages, results):
+    peers = [connect_client(port, f"g{group}u{i}") for i in range(clients)]
+    frames = [encode_frame(json.dumps({'type': 'encrypted_message', 'sender': f"g{group}u{i}",
+                                       'target': f"g{group}u{(i + 1) % clients}",
+                                       'data': {'encrypted_message': 'x' * 256}}))
+              for i in range(clients)]
+    drain = Drain(peers, collect=b'{"type": "encrypted_message"')
+    drain.start()
+    drain.wait_quiet(idle=0.5)
+    sent = (messages // clients) * clients
+    started = time.perf_counter()
+    for _ in range(messages // clients):
+        for (sock, _), frame in zip(peers, frames):
+            sock.sendall(frame)
+    deadline = time.time() + 60
+    while len(drain.collected) < sent and time.time() < deadline:
+        time.sleep(0.005)
+    results.put((sent, len(drain.collected), time.perf_counter() - started))
+    drain.running = False
+    for sock, _ in peers:
+        sock.close()
+
+def throughput(port, workers, senders, clients, messages):
+    metrics_port = free_port()
+    proc, directory = start_cluster(port, workers, metrics_port, '--no-metrics')
+    try:
+        pids = worker_pids(proc)
+        cpu_before = cpu_seconds(pids)
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=sender, args=(port, group, clients, messages // senders, results))
+                 for group in range(senders)]
+        for p in procs:
+            p.start()
+        runs = [results.get(timeout=120) for _ in procs]
+        for p in procs:
+            p.join()
+        cpu = cpu_seconds(pids) - cpu_before
+        sent = sum(run[0] for run in runs)
+        delivered = sum(run[1] for run in runs)
+        elapsed = max(run[2] for run in runs)
+        return {'workers': workers, 'sent': sent, 'delivered': delivered, 'msgs_per_s': int(delivered / elapsed),
+                'server_cpu_s': round(cpu, 2), 'server_us_per_msg': round(cpu / max(1, delivered) * 1e6, 1)}
+    finally:
+        stop_cluster(proc, directory)
+
+def main():
+    parser = argparse.ArgumentParser(description="Relay throughput by SO_REUSEPORT worker count")
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--senders', type=int, default=4, help="load generator processes")
+    parser.add_argument('--clients', type=int, default=16, help="clients per load generator process")
+    parser.add_argument('--messages', type=int, default=40000)
+    parser.add_argument('--skip-checks', action='store_true')
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    counts = [int(n) for n in args.workers.split(',')]
+    if not args.skip_checks:
+        for workers in counts:
+            if workers > 1:
+                port, metrics_port = free_port(), free_port()
+                proc, directory = start_cluster(port, workers, metrics_port)
+                try:
+                    checks(port, workers, metrics_port)
+                finally:
+                    stop_cluster(proc, directory)
+    rows = [throughput(free_port(), workers, args.senders, args.clients, args.messages) for workers in counts]
+    headers = ['workers', 'sent', 'delivered', 'msgs_per_s', 'server_cpu_s', 'server_us_per_msg']
+    print_table(headers, [[row[h] for h in headers] for row in rows])
+    print(f"CPUs available: {os.cpu_count()}; scaling needs at least as many cores as workers plus load generators")
+
+if __name__ == "__main__":
+    main()
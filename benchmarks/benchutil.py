@@ -0,0 +1,185 @@
+import json
+import os
+import selectors
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+PASSWORD = "fidelio"
+
+def raise_fd_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return hard
+    except (ImportError, ValueError, OSError):
+        return None
+
+def free_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+def start_server_process(port, *extra_args):
+    cmd = [sys.executable, os.path.join(ROOT, 'chat_server.py'),
+           '--host', '127.0.0.1', '--port', str(port)] + list(extra_args)
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not wait_for_port(port):
+        proc.kill()
+        raise RuntimeError(f"server did not start: {' '.join(cmd)}")
+    return proc
+
+def stop_server_process(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+def process_stats(pid):
+    stats = {'rss_kb': None, 'threads': None, 'cpu_seconds': None}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    stats['rss_kb'] = int(line.split()[1])
+                elif line.startswith('Threads:'):
+                    stats['threads'] = int(line.split()[1])
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        ticks = os.sysconf('SC_CLK_TCK')
+        stats['cpu_seconds'] = (int(fields[11]) + int(fields[12])) / ticks
+    except (OSError, ValueError, IndexError):
+        pass
+    return stats
+
+def connect_client(port, nickname, password=PASSWORD, timeout=30, nodelay=True):
+    from framing import FrameDecoder, read_text, send_frame, tune_socket
+    sock = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+    tune_socket(sock, {'nodelay': nodelay})
+    decoder = FrameDecoder()
+    if read_text(sock, decoder) != "PASSWORD":
+        raise RuntimeError("unexpected handshake")
+    send_frame(sock, password)
+    if read_text(sock, decoder) != "AUTH_SUCCESS":
+        raise RuntimeError("authentication failed")
+    if read_text(sock, decoder) != "NICK":
+        raise RuntimeError("unexpected handshake")
+    send_frame(sock, nickname)
+    if read_text(sock, decoder) == "NICK_TAKEN":
+        raise RuntimeError(f"nickname in use: {nickname}")
+    sock.settimeout(None)
+    return sock, decoder
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def print_table(headers, rows):
+    widths = [max(len(str(h)), *(len(str(r[i])) for r in rows)) if rows else len(str(h))
+              for i, h in enumerate(headers)]
+    print("  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for row in rows:
+        print("  ".join(str(v).ljust(w) for v, w in zip(row, widths)))
+
+def send_json(sock, data):
+    from framing import encode_frame
+    sock.sendall(encode_frame(json.dumps(data)))
+
+def wait_json(sock, decoder, msg_type, timeout=10.0):
+    from framing import FRAME_TEXT, read_frame
+    deadline = time.time() + timeout
+    sock.settimeout(timeout)
+    try:
+        while time.time() < deadline:
+            kind, payload = read_frame(sock, decoder)
+            if kind == FRAME_TEXT and payload.startswith(b"{"):
+                data = json.loads(payload)
+                if data.get('type') == msg_type:
+                    return data
+    finally:
+        sock.settimeout(None)
+    raise RuntimeError(f"timed out waiting for {msg_type}")
+
+def setup_call(caller, callee, callee_nick, request_extra=None, answer_extra=None):
+    caller_sock, caller_decoder = caller
+    callee_sock, callee_decoder = callee
+    request = {'type': 'call_request', 'target': callee_nick}
+    request.update(request_extra or {})
+    send_json(caller_sock, request)
+    incoming = wait_json(callee_sock, callee_decoder, 'incoming_call')
+    answer = {'type': 'call_answer', 'call_id': incoming['call_id'], 'action': 'accept'}
+    answer.update(answer_extra or {})
+    send_json(callee_sock, answer)
+    started = wait_json(caller_sock, caller_decoder, 'call_started')
+    wait_json(callee_sock, callee_decoder, 'call_started')
+    return started
+
+class Drain(threading.Thread):
+    def __init__(self, peers, collect=None):
+        super().__init__(daemon=True)
+        self.selector = selectors.DefaultSelector()
+        for sock, decoder in peers:
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ, decoder)
+        self.collect = collect
+        self.running = True
+        self.frames = 0
+        self.bytes = 0
+        self.collected = []
+
+    def run(self):
+        while self.running:
+            for key, _ in self.selector.select(timeout=0.1):
+                try:
+                    data = key.fileobj.recv(262144)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except OSError:
+                    data = b""
+                if not data:
+                    self.selector.unregister(key.fileobj)
+                    continue
+                self.bytes += len(data)
+                key.data.feed(data)
+                for _, payload in key.data:
+                    self.frames += 1
+                    if self.collect and payload.startswith(self.collect):
+                        self.collected.append(payload)
+
+    def wait_quiet(self, idle=1.0, timeout=60.0):
+        deadline = time.time() + timeout
+        last = (-1, -1)
+        quiet_since = time.time()
+        while time.time() < deadline:
+            current = (self.frames, self.bytes)
+            if current != last:
+                last = current
+                quiet_since = time.time()
+            elif time.time() - quiet_since >= idle:
+                return
+            time.sleep(0.05)
@@ -0,0 +1,375 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import struct
+import time
+
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.backends import default_backend
+
+from benchutil import (PASSWORD, free_port, percentile, print_table, process_stats, raise_fd_limit,
+                       start_server_process, stop_server_process)
+
+from chat_server import ENGINES
+from framing import FRAME_TEXT, FRAME_VOICE, FrameDecoder, encode_frame, encode_voice_frame, parse_voice_frame
+
+FRAME_MS = 1024 * 1000.0 / 44100
+STAMP = struct.Struct('!d')
+READ_SIZE = 262144
+LATENCY_TYPES = ['connect', 'key_lookup', 'call_setup', 'encrypted_message', 'voice']
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {name: [] for name in LATENCY_TYPES}
+        self.sent = {}
+        self.received = {}
+        self.errors = 0
+        self.window = None
+
+    def count_sent(self, kind):
+        self.sent[kind] = self.sent.get(kind, 0) + 1
+
+    def record(self, kind, started, now=None):
+        now = time.perf_counter() if now is None else now
+        self.received[kind] = self.received.get(kind, 0) + 1
+        if self.window is None or self.window[0] <= started < self.window[1] or kind not in ('encrypted_message',
+                                                                                               'voice'):
+            self.latencies[kind].append(now - started)
+
+    def summary(self, duration):
+        results = {}
+        for kind, values in self.latencies.items():
+            values.sort()
+            entry = {'sent': self.sent.get(kind, 0), 'received': self.received.get(kind, 0),
+                     'samples': len(values)}
+            if kind in ('encrypted_message', 'voice'):
+                entry['per_s'] = round(len(values) / duration, 1) if duration else 0.0
+            for name, pct in (('p50_ms', 50), ('p99_ms', 99), ('p999_ms', 99.9)):
+                entry[name] = round(percentile(values, pct) * 1000, 3)
+            entry['max_ms'] = round(values[-1] * 1000, 3) if values else 0.0
+            results[kind] = entry
+        return results
+
+class LoadClient:
+    def __init__(self, nickname, recorder, voice_mode):
+        self.nickname = nickname
+        self.recorder = recorder
+        self.voice_mode = voice_mode
+        self.decoder = FrameDecoder()
+        self.reader = None
+        self.writer = None
+        self.waiters = {}
+        self.call = None
+        self.closed = False
+
+    async def read_frame(self):
+        while True:
+            frame = self.decoder.next_frame()
+            if frame is not None:
+                return frame
+            data = await self.reader.read(READ_SIZE)
+            if not data:
+                raise ConnectionError("connection closed")
+            self.decoder.feed(data)
+
+    async def read_text(self):
+        kind, payload = await self.read_frame()
+        if kind != FRAME_TEXT:
+            raise ConnectionError(f"expected text frame, got kind {kind}")
+        return payload.decode('utf-8')
+
+    async def connect(self, host, port, password):
+        started = time.perf_counter()
+        self.recorder.count_sent('connect')
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        if await self.read_text() != "PASSWORD":
+            raise ConnectionError("unexpected handshake")
+        self.writer.write(encode_frame(password))
+        if await self.read_text() != "AUTH_SUCCESS":
+            raise ConnectionError("authentication failed")
+        if await self.read_text() != "NICK":
+            raise ConnectionError("unexpected handshake")
+        self.writer.write(encode_frame(self.nickname))
+        response = await self.read_text()
+        if response == "NICK_TAKEN":
+            raise ConnectionError(f"nickname in use: {self.nickname}")
+        self.recorder.record('connect', started)
+        if response.startswith("{"):
+            self.handle_json(json.loads(response))
+
+    async def send(self, frame):
+        self.writer.write(frame)
+        await self.writer.drain()
+
+    async def send_json(self, data):
+        await self.send(encode_frame(json.dumps(data)))
+
+    def expect(self, msg_type):
+        future = asyncio.get_event_loop().create_future()
+        self.waiters.setdefault(msg_type, []).append(future)
+        return future
+
+    async def run(self):
+        try:
+            while True:
+                data = await self.reader.read(READ_SIZE)
+                if not data:
+                    break
+                self.decoder.feed(data)
+                now = time.perf_counter()
+                for kind, payload in self.decoder:
+                    if kind == FRAME_VOICE:
+                        audio = parse_voice_frame(payload)[2]
+                        self.recorder.record('voice', STAMP.unpack_from(audio)[0], now)
+                    elif payload.startswith(b"{"):
+                        self.handle_json(json.loads(payload), now)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.closed = True
+            for futures in self.waiters.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(ConnectionError("connection closed"))
+
+    def handle_json(self, data, now=None):
+        msg_type = data.get('type')
+        if msg_type == 'encrypted_message':
+            self.recorder.record('encrypted_message', data['data']['sent'], now)
+        elif msg_type == 'voice_data':
+            audio = base64.b64decode(data['audio_data'])
+            self.recorder.record('voice', STAMP.unpack_from(audio)[0], now)
+        elif msg_type == 'incoming_call':
+            self.call = {'call_id': data['call_id']}
+            asyncio.ensure_future(self.send_json({'type': 'call_answer', 'call_id': data['call_id'],
+                                                  'action': 'accept', 'codec': 'pcm16'}))
+        elif msg_type == 'call_started':
+            self.call = data
+        elif msg_type == 'call_response' and data.get('status') not in ('calling', None):
+            self.recorder.errors += 1
+        futures = self.waiters.pop(msg_type, None)
+        for future in futures or ():
+            if not future.done():
+                future.set_result(data)
+
+    def voice_frame(self, seq, audio, stamp):
+        audio[:STAMP.size] = STAMP.pack(stamp)
+        if self.voice_mode == 'binary':
+            return encode_voice_frame(self.call['slot'], seq, audio)
+        return encode_frame(json.dumps({'type': 'voice_data', 'call_id': self.call['call_id'],
+                                        'audio_data': base64.b64encode(audio).decode('ascii')}))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+def key_records(count):
+    records = []
+    for _ in range(count):
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+        pem = key.public_key().public_bytes(encoding=serialization.Encoding.PEM,
+                                            format=serialization.PublicFormat.SubjectPublicKeyInfo)
+        records.append(pem.decode('utf-8'))
+    return records
+
+async def paced(interval, duration, started, send):
+    n = 0
+    while True:
+        due = started + n * interval
+        if due >= started + duration:
+            return
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await send(n, due)
+        n += 1
+
+async def message_sender(client, peers, rate, duration, started, size, rng):
+    blob = base64.b64encode(os.urandom(size)).decode('ascii')
+    data = {'encrypted_key': blob[:344], 'iv': blob[:24], 'encrypted_message': blob, 'sent': 0.0}
+    message = {'type': 'encrypted_message', 'sender': client.nickname, 'target': None, 'data': data}
+
+    async def send(n, due):
+        message['target'] = rng.choice(peers)
+        data['sent'] = due
+        client.recorder.count_sent('encrypted_message')
+        await client.send_json(message)
+
+    offset = rng.random() / rate
+    await paced(1.0 / rate, duration - offset, started + offset, send)
+
+async def voice_sender(client, duration, started, chunk_bytes):
+    audio = bytearray(os.urandom(max(chunk_bytes, STAMP.size)))
+
+    async def send(n, due):
+        client.recorder.count_sent('voice')
+        await client.send(client.voice_frame(n, audio, due))
+
+    await paced(FRAME_MS / 1000.0, duration, started, send)
+
+async def place_call(caller, callee):
+    started = time.perf_counter()
+    answered = caller.expect('call_started')
+    callee.expect('call_started')
+    await caller.send_json({'type': 'call_request', 'target': callee.nickname, 'codecs': ['pcm16']})
+    caller.recorder.count_sent('call_setup')
+    await asyncio.wait_for(answered, 10)
+    caller.recorder.record('call_setup', started)
+
+async def lookup_keys(client, peers):
+    started = time.perf_counter()
+    reply = client.expect('key_records')
+    client.recorder.count_sent('key_lookup')
+    await client.send_json({'type': 'key_lookup', 'nicknames': peers})
+    await asyncio.wait_for(reply, 10)
+    client.recorder.record('key_lookup', started)
+
+async def gather_limited(coros, limit):
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(c) for c in coros))
+
+async def run_load(host, port, args, records, pid=None):
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    clients = [LoadClient(f"load{i}", recorder, args.voice) for i in range(args.users)]
+    readers = []
+    try:
+        await gather_limited([c.connect(host, port, args.password) for c in clients], args.connect_concurrency)
+        readers = [asyncio.ensure_future(c.run()) for c in clients]
+
+        for i, client in enumerate(clients):
+            await client.send_json({'type': 'public_key', 'nickname': client.nickname, 'directory': True,
+                                    'public_key': records[i % len(records)]})
+        nicknames = [c.nickname for c in clients]
+        neighbours = {}
+        for i, client in enumerate(clients):
+            neighbours[client.nickname] = [nicknames[(i + k) % len(clients)]
+                                           for k in range(1, min(args.fanout, len(clients) - 1) + 1)]
+        await gather_limited([lookup_keys(c, neighbours[c.nickname]) for c in clients], args.connect_concurrency)
+
+        pairs = [(clients[2 * i], clients[2 * i + 1]) for i in range(min(args.calls, len(clients) // 2))]
+        await gather_limited([place_call(a, b) for a, b in pairs], args.connect_concurrency)
+
+        warmup = args.warmup
+        started = time.perf_counter() + 0.1
+        recorder.window = (started + warmup, started + warmup + args.duration)
+        total = warmup + args.duration
+        cpu_before = time.process_time()
+        server_before = process_stats(pid) if pid else None
+        tasks = []
+        if args.rate > 0:
+            for client in clients:
+                tasks.append(message_sender(client, neighbours[client.nickname], args.rate, total, started,
+                                            args.msg_bytes, random.Random(rng.random())))
+        for caller, callee in pairs:
+            tasks.append(voice_sender(caller, total, started, args.chunk_bytes))
+            tasks.append(voice_sender(callee, total, started, args.chunk_bytes))
+        await asyncio.gather(*tasks)
+        await asyncio.sleep(args.grace)
+        loadgen_cpu = time.process_time() - cpu_before
+        result = {'latency': recorder.summary(args.duration), 'errors': recorder.errors,
+                  'disconnected': sum(1 for c in clients if c.closed),
+                  'loadgen_cpu_pct': round(100.0 * loadgen_cpu / (total + args.grace), 1)}
+        if server_before:
+            server = process_stats(pid)
+            if server['cpu_seconds'] is not None and server_before['cpu_seconds'] is not None:
+                result['server_cpu_pct'] = round(100.0 * (server['cpu_seconds'] - server_before['cpu_seconds']) /
+                                                 (total + args.grace), 1)
+            if server['rss_kb'] is not None:
+                result['server_rss_mb'] = round(server['rss_kb'] / 1024.0, 1)
+            result['server_threads'] = server['threads']
+        return result
+    finally:
+        for client in clients:
+            client.close()
+        for task in readers:
+            task.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+
+def run_engine(engine, args, records):
+    if args.port:
+        return dict(asyncio.run(run_load(args.host, args.port, args, records)), engine=engine or 'external')
+    port = free_port()
+    proc = start_server_process(port, '--engine', engine, '--voice-queue-frames', '256')
+    try:
+        return dict(asyncio.run(run_load('127.0.0.1', port, args, records, proc.pid)), engine=engine)
+    finally:
+        stop_server_process(proc)
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {run['engine']: run for run in json.load(f)['runs']}
+    rows = []
+    for run in results:
+        old = baseline.get(run['engine'])
+        if not old:
+            continue
+        for kind, entry in run['latency'].items():
+            before = old['latency'].get(kind)
+            if not before or not entry['samples'] or not before['samples']:
+                continue
+            rows.append([run['engine'], kind, before['p99_ms'], entry['p99_ms'],
+                         f"{(entry['p99_ms'] - before['p99_ms']) / max(before['p99_ms'], 1e-6) * 100:+.0f}%",
+                         before.get('per_s', '-'), entry.get('per_s', '-')])
+    print_table(['engine', 'type', 'base_p99_ms', 'p99_ms', 'p99_change', 'base_per_s', 'per_s'], rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless load generator: simulated clients over loopback")
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, help="load an already running server instead of starting one")
+    parser.add_argument('--password', default=PASSWORD)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--calls', type=int, default=20, help="concurrent voice calls between user pairs")
+    parser.add_argument('--rate', type=float, default=2.0, help="encrypted messages per second per user")
+    parser.add_argument('--fanout', type=int, default=5, help="peers each user looks up and messages")
+    parser.add_argument('--msg-bytes', type=int, default=256)
+    parser.add_argument('--chunk-bytes', type=int, default=2048, help="audio bytes per voice frame")
+    parser.add_argument('--voice', choices=['binary', 'json'], default='binary')
+    parser.add_argument('--duration', type=float, default=10.0, help="measured seconds after warmup")
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--grace', type=float, default=1.0, help="seconds to wait for in-flight frames")
+    parser.add_argument('--connect-concurrency', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="write results to this file")
+    parser.add_argument('--compare', help="results file from an earlier run to compare against")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    records = key_records(4)
+    engines = [None] if args.port else args.engines.split(',')
+    results = []
+    for engine in engines:
+        results.append(run_engine(engine, args, records))
+        print(f"  {results[-1]['engine']:8s} done")
+
+    headers = ['engine', 'type', 'sent', 'received', 'samples', 'per_s', 'p50_ms', 'p99_ms', 'p999_ms', 'max_ms']
+    rows = []
+    for run in results:
+        for kind, entry in run['latency'].items():
+            rows.append([run['engine'], kind] + [entry.get(h, '-') for h in headers[2:]])
+    print_table(headers, rows)
+    print()
+    headers = ['engine', 'errors', 'disconnected', 'loadgen_cpu_pct', 'server_cpu_pct', 'server_rss_mb',
+               'server_threads']
+    print_table(headers, [[run.get(h, '-') for h in headers] for run in results])
+
+    config = {k: v for k, v in vars(args).items() if k not in ('json', 'compare', 'password')}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': config, 'time': time.time(), 'runs': results}, f, indent=2)
+    if args.compare:
+        print()
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,15 @@
 import tkinter as tk
 from tkinter import scrolledtext, messagebox, simpledialog
-import socket
 import threading
 import time
-import json
 import pyaudio
-import base64
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
 import os
 import datetime
 
+from e2e_crypto import KeyCache
+from client_core import ClientCore, HandshakeError
+from identity import IdentityStore, generate_identity
+
 LANG = {
     'tr': {'title': '🔒 Güvenli E2E Sesli Chat', 'connect': '🔗 Bağlan', 'disconnect': '🔌 Kes', 
            'connected': '✅ Bağlı | 🔐 E2E: Aktif', 'disconnected': '❌ Bağlı değil | 🔓 E2E: Pasif',
@@ -20,37 +17,39 @@ LANG = {
            'password_title': '🔒 Şifre', 'password_prompt': 'Şifre girin:', 'error': '❌ Hata',
            'enter_nickname': 'Kullanıcı adı girin!', 'connecting': '🔄 Bağlanılıyor...',
            'password_ok': '✅ Şifre doğru!', 'password_wrong': '❌ Yanlış şifre!',
+           'nick_taken': '❌ Bu kullanıcı adı kullanımda!',
            'success': '🎉 Bağlantı başarılı!', 'e2e_active': '🔐 E2E aktif!',
            'select_user': 'Kullanıcı seçin!', 'already_calling': 'Zaten aramada!',
            'incoming': 'Gelen Arama', 'incoming_text': ' arıyor!\n\nCevapla?',
-           'started': ' ile arama başladı!', 'calling': '📞 Aranıyor...', 'warning': 'Uyarı'},
+           'started': ' ile arama başladı!', 'calling': '📞 Aranıyor...', 'warning': 'Uyarı',
+           'conference_text': ' konferansa davet ediyor!\n\nKatıl?', 'identity_title': '🔑 Kimlik anahtarı',
+           'identity_prompt': 'Kimlik anahtarı parolası:'},
     'en': {'title': '🔒 Secure E2E Voice Chat', 'connect': '🔗 Connect', 'disconnect': '🔌 Disconnect',
            'connected': '✅ Connected | 🔐 E2E: Active', 'disconnected': '❌ Disconnected | 🔓 E2E: Inactive',
            'voice_call': '📞 Call', 'end_call': '📞 End Call', 'refresh': '🔄 Refresh', 'send': '📤 Send',
            'password_title': '🔒 Password', 'password_prompt': 'Enter password:', 'error': '❌ Error',
            'enter_nickname': 'Enter nickname!', 'connecting': '🔄 Connecting...',
            'password_ok': '✅ Password OK!', 'password_wrong': '❌ Wrong password!',
+           'nick_taken': '❌ Nickname already in use!',
            'success': '🎉 Connected!', 'e2e_active': '🔐 E2E active!',
            'select_user': 'Select user!', 'already_calling': 'Already in call!',
            'incoming': 'Incoming Call', 'incoming_text': ' is calling!\n\nAnswer?',
-           'started': ' call started!', 'calling': '📞 Calling...', 'warning': 'Warning'}
+           'started': ' call started!', 'calling': '📞 Calling...', 'warning': 'Warning',
+           'conference_text': ' invites you to a conference!\n\nJoin?', 'identity_title': '🔑 Identity key',
+           'identity_prompt': 'Identity key passphrase:'}
 }
 
 class ChatClient:
     def __init__(self):
-        self.client = None
-        self.nickname = None
-        self.connected = False
+        self.core = None
         self.lang = 'en'
         
-        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
-        self.public_key = self.private_key.public_key()
-        self.peer_public_keys = {}
+        self.private_key = None
+        self.key_cache = KeyCache()
         
         self.audio = pyaudio.PyAudio()
-        self.is_in_call = False
-        self.current_call_id = None
         self.voice_send_thread = None
+        self.voice_play_thread = None
         self.audio_stream_in = None
         self.audio_stream_out = None
         
@@ -58,12 +57,26 @@ class ChatClient:
         self.FORMAT = pyaudio.paInt16
         self.CHANNELS = 1
         self.RATE = 44100
+        self.JITTER_TARGET_MS = int(os.environ.get('E2E_CHAT_JITTER_MS', 60))
+        self.JITTER_MAX_MS = int(os.environ.get('E2E_CHAT_JITTER_MAX_MS', 300))
         
         self.root = tk.Tk()
         self.root.title(LANG[self.lang]['title'])
         self.root.geometry("700x650")
         self.root.configure(bg='#1a1a2e')
         self.setup_gui()
+        self.identity = IdentityStore(prompt=self.ask_passphrase).start()
+    
+    def ask_passphrase(self):
+        return simpledialog.askstring(self.t('identity_title'), self.t('identity_prompt'), show='*', parent=self.root)
+    
+    @property
+    def connected(self):
+        return bool(self.core and self.core.connected)
+    
+    @property
+    def is_in_call(self):
+        return bool(self.core and self.core.in_call)
         
     def t(self, k):
         return LANG[self.lang].get(k, k)
@@ -150,40 +163,6 @@ class ChatClient:
         
         self.root.protocol("WM_DELETE_WINDOW", self.close)
     
-    def get_key_pem(self):
-        return self.public_key.public_bytes(encoding=serialization.Encoding.PEM,
-                                           format=serialization.PublicFormat.SubjectPublicKeyInfo).decode('utf-8')
-    
-    def load_key(self, pem):
-        return serialization.load_pem_public_key(pem.encode('utf-8'), backend=default_backend())
-    
-    def encrypt(self, msg, peer):
-        if peer not in self.peer_public_keys:
-            return None
-        aes_key = os.urandom(32)
-        iv = os.urandom(16)
-        cipher = Cipher(algorithms.AES(aes_key), modes.CFB(iv), backend=default_backend())
-        enc = cipher.encryptor()
-        enc_msg = enc.update(msg.encode('utf-8')) + enc.finalize()
-        enc_key = self.peer_public_keys[peer].encrypt(aes_key, padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None))
-        return {'encrypted_key': base64.b64encode(enc_key).decode('utf-8'),
-                'iv': base64.b64encode(iv).decode('utf-8'),
-                'encrypted_message': base64.b64encode(enc_msg).decode('utf-8')}
-    
-    def decrypt(self, data):
-        try:
-            enc_key = base64.b64decode(data['encrypted_key'])
-            aes_key = self.private_key.decrypt(enc_key, padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None))
-            iv = base64.b64decode(data['iv'])
-            enc_msg = base64.b64decode(data['encrypted_message'])
-            cipher = Cipher(algorithms.AES(aes_key), modes.CFB(iv), backend=default_backend())
-            dec = cipher.decryptor()
-            return (dec.update(enc_msg) + dec.finalize()).decode('utf-8')
-        except Exception as e:
-            return f"[Decrypt error: {e}]"
-    
     def toggle_conn(self):
         if not self.connected:
             self.connect()
@@ -198,8 +177,8 @@ class ChatClient:
             except:
                 port = 12345
             
-            self.nickname = self.nick.get().strip()
-            if not self.nickname:
+            nickname = self.nick.get().strip()
+            if not nickname:
                 messagebox.showerror(self.t('error'), self.t('enter_nickname'))
                 return
             
@@ -209,132 +188,100 @@ class ChatClient:
                     return
                 self.pwd = pwd
             
+            if self.private_key is None:
+                if not self.identity.done():
+                    self.log("🔑 Generating identity key...")
+                try:
+                    self.private_key = self.identity.result()
+                except Exception as e:
+                    self.log(f"⚠️ Identity key error: {e} - using a temporary key")
+                    self.private_key = generate_identity()
+            
             self.log(self.t('connecting'))
-            self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client.settimeout(15)
-            self.client.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-            self.client.connect((ip, port))
+            self.core = ClientCore(nickname, self.private_key, self.RATE, self.CHUNK,
+                                   self.JITTER_TARGET_MS, self.JITTER_MAX_MS, key_cache=self.key_cache)
+            for event, handler in (('authenticated', self.on_authenticated), ('connected', self.on_connected),
+                                   ('disconnected', self.on_disconnected), ('log', self.on_log),
+                                   ('key', self.on_key), ('message', self.on_message),
+                                   ('users', self.on_users), ('incoming_call', self.on_incoming_call),
+                                   ('call_response', self.on_call_response),
+                                   ('call_started', self.on_call_started), ('call_ended', self.on_call_ended),
+                                   ('room', self.on_room), ('conference_invite', self.on_conference_invite),
+                                   ('conference', self.on_conference), ('media', self.on_media)):
+                self.core.on(event, handler)
             
-            if self.client.recv(1024).decode('utf-8') == "PASSWORD":
-                self.client.send(self.pwd.encode('utf-8'))
-                result = self.client.recv(1024).decode('utf-8')
-                if result == "AUTH_SUCCESS":
-                    self.log(self.t('password_ok'))
-                else:
+            try:
+                self.core.connect(ip, port, self.pwd)
+            except HandshakeError as e:
+                if e.reason == 'auth':
                     self.log(self.t('password_wrong'))
-                    self.client.close()
                     if hasattr(self, 'pwd'):
                         delattr(self, 'pwd')
-                    return
-            
-            if self.client.recv(1024).decode('utf-8') == "NICK":
-                self.client.send(self.nickname.encode('utf-8'))
-            
-            self.connected = True
-            self.client.settimeout(None)
-            
-            threading.Thread(target=self.recv, daemon=True).start()
-            threading.Thread(target=self.heartbeat, daemon=True).start()
-            
-            self.client.send((json.dumps({'type': 'public_key', 'nickname': self.nickname,
-                                         'public_key': self.get_key_pem()}) + '\n').encode('utf-8'))
+                else:
+                    self.log(self.t('nick_taken'))
+                return
             
-            self.update_ui()
             self.log(f"{self.t('success')} {ip}:{port}")
             self.log(self.t('e2e_active'))
-            time.sleep(1.0)
-            self.req_users()
         except Exception as e:
             self.log(f"Connection error: {e}")
     
     def req_users(self):
-        if self.connected:
-            try:
-                self.client.send((json.dumps({'type': 'user_list_request'}) + '\n').encode('utf-8'))
-            except:
-                pass
+        if self.core:
+            self.core.request_users()
     
-    def heartbeat(self):
-        while self.connected:
-            try:
-                time.sleep(10)
-                if self.connected and self.client:
-                    self.client.send("PING\n".encode('utf-8'))
-            except:
-                if self.connected:
-                    self.conn_lost()
-                break
+    def on_authenticated(self, event, data):
+        self.log(self.t('password_ok'))
     
-    def process(self, msg):
-        if not msg or msg in ["PING", "PONG"]:
-            if msg == "PING":
-                try:
-                    self.client.send("PONG\n".encode('utf-8'))
-                except:
-                    pass
-            return
-        
-        try:
-            data = json.loads(msg)
-            t = data.get('type')
-            
-            if t == 'public_key':
-                nick = data.get('nickname')
-                key = data.get('public_key')
-                if nick and key:
-                    try:
-                        self.peer_public_keys[nick] = self.load_key(key)
-                        self.log(f"🔑 {nick} - key received")
-                    except Exception as e:
-                        self.log(f"❌ {nick} key error: {e}")
-            elif t == 'encrypted_message':
-                self.log(f"🔒 {data.get('sender')}: {self.decrypt(data.get('data'))}")
-            elif t == 'user_list':
-                self.update_users(data.get('users', []))
-            elif t == 'incoming_call':
-                self.incoming(data.get('caller'), data.get('call_id'))
-            elif t == 'call_response':
-                s = data.get('status')
-                if s == 'calling':
-                    self.call_status.config(text=self.t('calling'))
-                elif s in ['user_not_found', 'user_busy']:
-                    messagebox.showerror(self.t('error') if s == 'user_not_found' else self.t('warning'), data.get('message'))
-                    self.call_status.config(text="")
-            elif t == 'call_started':
-                self.start_call(data.get('peer'), data.get('call_id'))
-            elif t == 'call_ended':
-                self.end_call(data.get('reason'))
-            elif t == 'voice_data':
-                if self.is_in_call and self.audio_stream_out:
-                    self.audio_stream_out.write(base64.b64decode(data.get('audio_data')))
-        except json.JSONDecodeError:
-            if not msg.startswith("{"):
-                self.log(msg)
-    
-    def recv(self):
-        buf = ""
-        while self.connected:
-            try:
-                data = self.client.recv(4096).decode('utf-8')
-                if not data:
-                    self.conn_lost()
-                    break
-                buf += data
-                while '\n' in buf:
-                    line, buf = buf.split('\n', 1)
-                    if line.strip():
-                        self.process(line.strip())
-            except:
-                if self.connected:
-                    pass
-                break
+    def on_connected(self, event, data):
+        self.update_ui()
+    
+    def on_disconnected(self, event, data):
+        if data['reason'] == 'lost':
+            self.log("⚠️ Connection lost!")
+            self.update_ui()
+        else:
+            self.update_ui()
+            self.log("🔌 Disconnected.")
+    
+    def on_log(self, event, data):
+        self.log(data['text'])
+    
+    def on_key(self, event, data):
+        if data['session']:
+            self.log(f"🔑 {data['nickname']} - key received (session)")
+        else:
+            self.log(f"🔑 {data['nickname']} - key received")
     
-    def update_users(self, users):
+    def on_message(self, event, data):
+        room = f"#{data['room']} " if data.get('room') else ""
+        self.log(f"🔒 {room}{data['sender']}: {data['text']}")
+    
+    def on_room(self, event, data):
+        room = data['room']
+        if data['action'] == 'joined':
+            self.log(f"🚪 #{room}: {', '.join(data['members'])}")
+        elif data['action'] == 'left':
+            self.log(f"🚪 #{room} left")
+        elif data['action'] == 'error':
+            self.log(f"⚠️ #{room}: {data['message']}")
+        else:
+            self.log(f"🚪 #{room}: {data['nickname']} {data['action']}")
+    
+    def on_users(self, event, data):
         self.users.delete(0, tk.END)
-        for u in users:
+        for u in data['users']:
             icon = "🟢" if u.get('status', 'idle') == 'idle' else "🔴"
             self.users.insert(tk.END, f"{icon} {u.get('nickname')}")
     
+    def on_call_response(self, event, data):
+        s = data['status']
+        if s == 'calling':
+            self.call_status.config(text=self.t('calling'))
+        elif s in ['user_not_found', 'user_busy']:
+            messagebox.showerror(self.t('error') if s == 'user_not_found' else self.t('warning'), data['message'])
+            self.call_status.config(text="")
+    
     def call(self):
         sel = self.users.curselection()
         if not sel:
@@ -345,24 +292,38 @@ class ChatClient:
             messagebox.showwarning(self.t('warning'), self.t('already_calling'))
             return
         try:
-            self.client.send(json.dumps({'type': 'call_request', 'target': target}).encode('utf-8'))
+            self.core.call(target)
             self.call_status.config(text=f"📞 {target} {self.t('calling')}")
         except Exception as e:
             messagebox.showerror(self.t('error'), f"Call error: {e}")
     
-    def incoming(self, caller, cid):
+    def on_incoming_call(self, event, data):
+        caller = data['caller']
         resp = messagebox.askyesno(self.t('incoming'), f"📞 {caller}{self.t('incoming_text')}")
         try:
-            self.client.send(json.dumps({'type': 'call_answer', 'call_id': cid,
-                                        'action': 'accept' if resp else 'reject'}).encode('utf-8'))
+            self.core.answer(data['call_id'], resp)
             if resp:
                 self.call_status.config(text=f"📞 {caller}...")
         except Exception as e:
             self.log(f"Answer error: {e}")
     
-    def start_call(self, peer, cid):
-        self.is_in_call = True
-        self.current_call_id = cid
+    def on_conference_invite(self, event, data):
+        members = ", ".join(data['members'])
+        resp = messagebox.askyesno(self.t('incoming'), f"🎧 {data['caller']}{self.t('conference_text')}\n{members}")
+        try:
+            if self.core.join_conference(data['call_id'], resp):
+                self.call_status.config(text=f"🎧 {data['caller']}...")
+        except Exception as e:
+            self.log(f"Answer error: {e}")
+    
+    def on_media(self, event, data):
+        self.log("📡 Voice over UDP" if data['transport'] == 'udp' else "📡 Voice over TCP")
+    
+    def on_conference(self, event, data):
+        self.log(f"🎧 {data['nickname']} {data['action']}")
+    
+    def on_call_started(self, event, data):
+        peer = data['peer'] or "🎧 " + ", ".join(data['members'])
         self.log(f"🎙️ {peer}{self.t('started')}")
         self.call_status.config(text=f"🔴 {peer}", fg='#e74c3c')
         self.call_btn.config(text=self.t('end_call'), command=self.end_call_btn, bg='#e74c3c')
@@ -374,44 +335,47 @@ class ChatClient:
                                                     output=True, frames_per_buffer=self.CHUNK)
             self.voice_send_thread = threading.Thread(target=self.send_audio, daemon=True)
             self.voice_send_thread.start()
+            self.voice_play_thread = threading.Thread(target=self.play_audio, daemon=True)
+            self.voice_play_thread.start()
         except Exception as e:
             self.log(f"Audio error: {e}")
-            self.end_call("error")
+            self.core.end_call("error")
     
     def send_audio(self):
-        while self.is_in_call:
+        core = self.core
+        while core.in_call:
             try:
-                if not self.audio_stream_in or not self.is_in_call:
+                if not self.audio_stream_in or not core.in_call:
                     break
                 data = self.audio_stream_in.read(self.CHUNK, exception_on_overflow=False)
-                if not self.is_in_call:
-                    break
-                if self.connected and self.client:
-                    self.client.send((json.dumps({'type': 'voice_data', 'call_id': self.current_call_id,
-                                                  'audio_data': base64.b64encode(data).decode('utf-8')}) + '\n').encode('utf-8'))
-                else:
+                if not core.send_voice(data):
                     break
             except:
                 break
     
-    def end_call_btn(self):
-        if self.is_in_call:
+    def play_audio(self):
+        core = self.core
+        while core.in_call:
             try:
-                self.client.send(json.dumps({'type': 'call_end', 'call_id': self.current_call_id}).encode('utf-8'))
+                audio = core.next_voice(timeout=0.1)
+                stream = self.audio_stream_out
+                if audio is None or not stream:
+                    continue
+                stream.write(audio)
             except:
-                pass
+                break
     
-    def end_call(self, reason):
-        if not self.is_in_call:
-            return
-        
-        self.is_in_call = False
-        
-        if self.voice_send_thread and self.voice_send_thread.is_alive():
-            try:
-                self.voice_send_thread.join(timeout=2.0)
-            except:
-                pass
+    def end_call_btn(self):
+        if self.is_in_call:
+            self.core.hangup()
+    
+    def on_call_ended(self, event, data):
+        for thread in (self.voice_send_thread, self.voice_play_thread):
+            if thread and thread.is_alive() and thread is not threading.current_thread():
+                try:
+                    thread.join(timeout=2.0)
+                except:
+                    pass
         
         if self.audio_stream_in:
             try:
@@ -431,67 +395,63 @@ class ChatClient:
         
         reasons = {'ended': 'Call ended', 'rejected': 'Rejected', 'timeout': 'Timeout',
                   'disconnected': 'Disconnected', 'error': 'Error'}
-        self.log(f"📞 {reasons.get(reason, 'Call finished')}")
+        self.log(f"📞 {reasons.get(data['reason'], 'Call finished')}")
+        st = data['jitter']
+        if st:
+            self.log(f"📊 Jitter: target {st['target_ms']}ms, max depth {st['max_depth']}, "
+                     f"lost {st['lost']}, late {st['late']}, underruns {st['underruns']}")
+        if data['rejected']:
+            self.log(f"⚠️ {data['rejected']} voice frames failed authentication")
+        vad = data['vad']
+        if vad and vad['frames']:
+            self.log(f"🔇 Silence suppression: sent {vad['sent_pct']}% of {vad['frames']} frames "
+                     f"({vad['comfort']} comfort noise)")
         
         try:
             self.call_status.config(text="", fg='#3498db')
             self.call_btn.config(text=self.t('voice_call'), command=self.call, bg='#9b59b6')
         except:
             pass
-        
-        self.current_call_id = None
-        try:
-            if self.connected:
-                self.req_users()
-        except:
-            pass
     
     def send(self, e=None):
-        if self.connected and self.client:
+        if self.connected:
             m = self.msg.get().strip()
             if m:
                 try:
                     if m.lower() == "/quit":
                         self.disconnect()
                         return
-                    self.log(f"🔒 {self.t('you') if self.lang == 'en' else 'Sen'}: {m}")
+                    command, _, arg = m.partition(' ')
+                    if command.lower() in ('/join', '/leave', '/room'):
+                        self.msg.delete(0, tk.END)
+                        self.room_command(command.lower(), arg.strip())
+                        return
+                    if command.lower() == '/conf' and arg.split():
+                        self.msg.delete(0, tk.END)
+                        self.core.conference(arg.split())
+                        return
+                    room = f"#{self.core.room} " if self.core.room else ""
+                    self.log(f"🔒 {room}{self.t('you') if self.lang == 'en' else 'Sen'}: {m}")
                     self.msg.delete(0, tk.END)
-                    sent = 0
-                    for peer in list(self.peer_public_keys.keys()):
-                        enc = self.encrypt(m, peer)
-                        if enc:
-                            self.client.send((json.dumps({'type': 'encrypted_message', 'sender': self.nickname,
-                                                         'target': peer, 'data': enc}) + '\n').encode('utf-8'))
-                            sent += 1
-                    if sent == 0:
-                        self.log("⚠️ No keys available!")
+                    self.core.send_message(m)
                 except Exception as e:
                     self.log(f"Send error: {e}")
     
-    def conn_lost(self):
-        self.log("⚠️ Connection lost!")
-        self.connected = False
-        if self.is_in_call:
-            self.end_call("disconnected")
-        self.update_ui()
-        if self.client:
-            try:
-                self.client.close()
-            except:
-                pass
+    def room_command(self, command, room):
+        core = self.core
+        if command == '/join' and room:
+            core.join_room(room)
+        elif command == '/leave':
+            core.leave_room(room or None)
+        elif command == '/room' and room:
+            if not core.set_room(room):
+                self.log(f"⚠️ #{room}: /join {room}")
+        else:
+            self.log(f"🚪 {', '.join('#' + r for r in sorted(core.rooms))} (→ #{core.room})")
     
     def disconnect(self):
-        self.connected = False
-        if self.is_in_call:
-            self.end_call("ended")
-        if self.client:
-            try:
-                self.client.shutdown(socket.SHUT_RDWR)
-                self.client.close()
-            except:
-                pass
-        self.update_ui()
-        self.log("🔌 Disconnected.")
+        if self.core:
+            self.core.disconnect()
     
     def update_ui(self):
         if self.connected:
@@ -524,7 +484,7 @@ class ChatClient:
     
     def close(self):
         if self.is_in_call:
-            self.end_call("ended")
+            self.core.end_call("ended")
             time.sleep(0.5)
         if self.connected:
             self.disconnect()
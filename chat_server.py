@@ -3,111 +3,341 @@ import threading
 import time
 import json
 import uuid
+import argparse
+import os
+import sys
+
+from framing import (FrameDecoder, FrameError, FRAME_VOICE, HEADER, VOICE_HEADER, CONFERENCE_HEADER, encode_frame,
+                     read_text, send_frame, send_frames, tune_socket, RECV_SIZE, SOCKET_OPTIONS,
+                     WRITE_BATCH_BYTES)
+from sessions import SessionRegistry
+from outbound import OutboundQueue, POLICIES, copy_limits
+from keydir import KeyDirectory
+from metrics import NullMetrics, ServerMetrics, serve_metrics
+from offline import OfflineStore
+from timers import TimerWheel
+from presence import PresenceLog
+from conference import Conference, MAX_PARTICIPANTS, SPEAKERS
+from media import MediaRelay
+from cluster import ClusterBus, RemoteClient, parse_address, run_workers, unix_addresses
+
+MESSAGE_TYPES = {'public_key', 'encrypted_message', 'multicast_message', 'key_lookup', 'call_request', 'call_answer',
+                 'call_end', 'voice_data', 'user_list_request', 'presence_subscribe', 'room_join', 'room_leave',
+                 'conference_create', 'conference_invite', 'conference_join', 'conference_leave',
+                 'media_request', 'media_transport', 'offline_ack'}
+DEFAULT_ROOM = 'lobby'
+MAX_ROOMS = 256
+MAX_ROOM_NAME = 64
+
+def valid_room(room):
+    return isinstance(room, str) and 0 < len(room) <= MAX_ROOM_NAME and room.isprintable()
 
 class ChatServer:
+    engine = 'thread'
+    
     def __init__(self, host='0.0.0.0', port=12345):
         self.host = host
         self.port = port
-        self.clients = []
-        self.nicknames = []
-        self.client_public_keys = {}
+        self.backlog = 128
+        self.idle_timeout = 60
+        self.ring_timeout = 30.0
+        self.housekeeping_interval = 5.0
+        self.timers = TimerWheel()
+        self.presence = PresenceLog()
+        self.presence_subscribers = set()
+        self.presence_flushed = 0
+        self.presence_flush_delay = 0.05
+        self.presence_timer = None
+        self.default_room = DEFAULT_ROOM
+        self.max_rooms = MAX_ROOMS
+        self.conference_speakers = SPEAKERS
+        self.conference_size = MAX_PARTICIPANTS
+        self.report_interval = 30
+        self.last_report = time.time()
+        self.outbound_limits = copy_limits()
+        self.socket_options = dict(SOCKET_OPTIONS)
+        self.write_batch_bytes = WRITE_BATCH_BYTES
+        self.sessions = SessionRegistry()
+        self.key_directory = KeyDirectory()
         self.password = "fidelio"
         self.server_running = True
+        self.metrics = ServerMetrics(self)
+        self.metrics_server = None
+        self.reuse_port = False
+        self.bus = None
+        self.offline = None
+        self.offline_batch = 256
+        self.media = None
         
-        self.active_calls = {}
-        self.client_call_status = {}
-        
-    def authenticate_client(self, client):
+    def authenticate_client(self, client, decoder):
         try:
-            client.send("PASSWORD".encode('utf-8'))
+            send_frame(client, "PASSWORD")
             client.settimeout(30)
-            received_password = client.recv(1024).decode('utf-8')
+            received_password = read_text(client, decoder)
             
             if received_password == self.password:
-                client.send("AUTH_SUCCESS".encode('utf-8'))
+                send_frame(client, "AUTH_SUCCESS")
                 return True
             else:
-                client.send("AUTH_FAILED".encode('utf-8'))
+                self.metrics.auth_failures.inc()
+                send_frame(client, "AUTH_FAILED")
                 return False
         except Exception as e:
             print(f"⚠️ Authentication error: {e}")
             return False
     
     def broadcast(self, message, sender_client=None):
-        disconnected_clients = []
-        
-        for client in self.clients[:]:
+        frame = encode_frame(message)
+        self.broadcast_frame(frame, sender_client)
+        if self.bus:
+            self.bus.broadcast(frame)
+    
+    def broadcast_frame(self, frame, sender_client=None):
+        for client in self.sessions.clients():
             if client != sender_client:
-                try:
-                    if isinstance(message, str):
-                        if not message.endswith('\n'):
-                            message = message + '\n'
-                        message = message.encode('utf-8')
-                    client.send(message)
-                except:
-                    disconnected_clients.append(client)
-        
-        for client in disconnected_clients:
-            self.remove_client(client)
+                self.send_frame_to_client(client, frame)
     
-    def send_to_client(self, target_client, message):
-        try:
-            if isinstance(message, str):
-                if not message.endswith('\n'):
-                    message = message + '\n'
-                message = message.encode('utf-8')
-            target_client.send(message)
+    def room_broadcast(self, room, frame, sender_client=None, relay=True):
+        workers = set()
+        for member in self.sessions.room_members(room).values():
+            if isinstance(member, RemoteClient):
+                workers.add(member.worker)
+            elif member is not sender_client:
+                self.send_frame_to_client(member, frame)
+        if relay and workers and self.bus:
+            self.bus.room_broadcast(workers, room, frame)
+    
+    def send_to_client(self, target_client, message, channel='chat'):
+        return self.send_frame_to_client(target_client, encode_frame(message), channel)
+    
+    def send_frame_to_client(self, target_client, frame, channel='chat'):
+        session = self.sessions.get(target_client)
+        if session is None or session.outbound is None:
+            if isinstance(target_client, RemoteClient):
+                return target_client.send_frame(frame, channel)
+            try:
+                target_client.sendall(frame)
+                return True
+            except:
+                self.remove_client(target_client)
+                return False
+        
+        if session.outbound.put(frame, channel):
             return True
-        except:
-            self.remove_client(target_client)
-            return False
+        
+        print(f"🐢 {session.nickname} {channel} queue overflow, disconnecting")
+        self.remove_client(target_client)
+        return False
+    
+    def start_writer(self, session):
+        session.outbound = OutboundQueue(self.outbound_limits)
+        thread = threading.Thread(target=self.write_outbound, args=(session,))
+        thread.daemon = True
+        thread.start()
+    
+    def write_outbound(self, session):
+        queue = session.outbound
+        client = session.client
+        while True:
+            frames = queue.get(max_bytes=self.write_batch_bytes or None)
+            if not frames:
+                break
+            try:
+                if self.write_batch_bytes:
+                    writes = send_frames(client, frames, self.check_running)
+                else:
+                    for frame in frames:
+                        self.send_fully(client, frame)
+                    writes = len(frames)
+                self.metrics.flushed(queue.last_wait, frames, writes)
+            except:
+                queue.done()
+                self.remove_client(client)
+                break
+            queue.done()
+    
+    def check_running(self):
+        if not self.server_running:
+            raise socket.timeout("server stopping")
+    
+    def send_fully(self, client, data):
+        view = memoryview(data)
+        while view:
+            try:
+                sent = client.send(view)
+            except socket.timeout:
+                if not self.server_running:
+                    raise
+                continue
+            view = view[sent:]
+    
+    def flush_outbound(self, timeout=1.0):
+        deadline = time.time() + timeout
+        for session in self.sessions.sessions():
+            if session.outbound:
+                session.outbound.wait_idle(max(0.0, deadline - time.time()))
+    
+    def outbound_stats(self):
+        return {session.nickname: session.outbound.stats()
+                for session in self.sessions.sessions() if session.outbound}
+    
+    def report_slow_links(self):
+        if self.offline:
+            self.offline.sweep()
+        now = time.time()
+        if now - self.last_report < self.report_interval:
+            return
+        self.last_report = now
+        for nickname, stats in self.outbound_stats().items():
+            depth = sum(stats['depth'].values())
+            dropped = sum(stats['dropped'].values())
+            if depth or dropped:
+                print(f"🐢 {nickname}: queued={depth} max={stats['max_depth']} dropped={stats['dropped']}")
     
     def get_client_by_nickname(self, nickname):
-        try:
-            index = self.nicknames.index(nickname)
-            return self.clients[index]
-        except:
-            return None
+        session = self.sessions.get_by_nickname(nickname)
+        if session:
+            return session.client
+        return self.bus.remote(nickname) if self.bus else None
     
     def get_nickname_by_client(self, client):
-        try:
-            index = self.clients.index(client)
-            return self.nicknames[index]
-        except:
-            return "Unknown"
+        session = self.sessions.get(client)
+        if session:
+            return session.nickname
+        return client.nickname if isinstance(client, RemoteClient) else "Unknown"
+    
+    def get_call_status(self, client):
+        session = self.sessions.get(client)
+        if session:
+            return session.status
+        return client.status if isinstance(client, RemoteClient) else 'idle'
+    
+    def set_call_status(self, client, status, call_id=None):
+        session = self.sessions.get(client)
+        if session:
+            session.set_status(status, call_id)
+            if status == 'idle':
+                self.close_media(session)
+            self.presence_update(session.nickname)
+            if self.bus:
+                self.bus.status(session.nickname, status)
+        elif isinstance(client, RemoteClient):
+            self.bus.set_status(client, status, call_id)
     
     def handle_public_key(self, client, data):
         try:
-            nickname = data.get('nickname')
-            public_key = data.get('public_key')
-            
-            self.client_public_keys[nickname] = public_key
-            print(f"🔑 {nickname} public key received")
-            
-            for nick, pub_key in self.client_public_keys.items():
-                if nick != nickname:
-                    existing_key = {
-                        'type': 'public_key',
-                        'nickname': nick,
-                        'public_key': pub_key
-                    }
-                    self.send_to_client(client, json.dumps(existing_key))
-                    print(f"  📤 {nick}'s key sent to {nickname}")
-            
-            key_broadcast = {
-                'type': 'public_key',
-                'nickname': nickname,
-                'public_key': public_key
-            }
-            for other_client in self.clients:
-                if other_client != client:
-                    self.send_to_client(other_client, json.dumps(key_broadcast))
-                    other_nick = self.get_nickname_by_client(other_client)
-                    print(f"  📤 {nickname}'s key sent to {other_nick}")
+            nickname = self.get_nickname_by_client(client)
+            record, changed = self.key_directory.publish(nickname, data)
+            session = self.sessions.get(client)
+            if session:
+                session.lazy_keys = bool(data.get('directory'))
+            print(f"🔑 {nickname} public key published ({record['fingerprint'][:16]})")
+            
+            members = self.sessions.co_members(nickname)
+            if not data.get('directory'):
+                self.send_keys(client, members)
+            self.share_key(nickname, record, members)
+            
+            if changed:
+                self.notify_key_watchers(nickname, {nickname: record}, [])
+            if self.bus:
+                self.bus.publish_key(nickname, record, changed)
             
         except Exception as e:
             print(f"⚠️ Public key processing error: {e}")
     
+    def send_keys(self, client, nicknames):
+        for nick in nicknames:
+            existing = self.key_directory.get(nick)
+            if existing:
+                self.send_to_client(client, json.dumps({'type': 'public_key', 'nickname': nick, **existing}))
+    
+    def share_key(self, nickname, record, members):
+        key_broadcast = None
+        for member in members.values():
+            session = self.sessions.get(member)
+            if session and session.lazy_keys is False:
+                key_broadcast = key_broadcast or json.dumps({'type': 'public_key', 'nickname': nickname, **record})
+                self.send_to_client(session.client, key_broadcast)
+    
+    def remote_key_published(self, nickname, record, changed):
+        record = self.key_directory.publish(nickname, record)[0]
+        self.share_key(nickname, record, self.sessions.co_members(nickname))
+        if changed:
+            self.notify_key_watchers(nickname, {nickname: record}, [])
+    
+    def remote_client_left(self, nickname):
+        self.retire_key(nickname)
+        absent = self.key_directory.is_offline(nickname)
+        rooms = self.sessions.leave_rooms(nickname, absent) if self.get_client_by_nickname(nickname) is None else []
+        self.presence_update(nickname)
+        for room in rooms:
+            self.room_event(room, nickname, 'leave', absent=absent)
+    
+    def retire_key(self, nickname):
+        watchers = self.key_directory.remove(nickname, keep=self.offline is not None)
+        if not watchers:
+            return
+        record = self.key_directory.get(nickname)
+        if record:
+            self.notify_key_watchers(nickname, {nickname: record}, [], watchers)
+        else:
+            self.notify_key_watchers(nickname, {}, [nickname], watchers)
+    
+    def remote_room_changed(self, remote, room, joined):
+        if joined:
+            changed = self.sessions.join_room(room, remote.nickname, remote)
+        else:
+            changed = self.sessions.leave_room(room, remote.nickname)
+        if changed:
+            self.room_event(room, remote.nickname, 'join' if joined else 'leave')
+    
+    def remote_member_lost(self, member, nicknames):
+        for call_id in self.sessions.call_ids():
+            call_info = self.sessions.get_call(call_id)
+            if call_info and 'conference' in call_info:
+                for client in call_info['conference'].clients():
+                    if isinstance(client, RemoteClient) and client.worker == member:
+                        self.leave_conference(client, call_id, 'disconnected')
+            elif call_info and any(isinstance(c, RemoteClient) and c.worker == member
+                                   for c in (call_info['caller'], call_info['callee'])):
+                self.end_call(call_id, 'disconnected')
+        for session in self.sessions.sessions():
+            if session.call_id and self.bus.call_owner(session.call_id) == member:
+                call_id = session.call_id
+                self.set_call_status(session.client, 'idle')
+                self.send_to_client(session.client, json.dumps({'type': 'call_ended', 'call_id': call_id,
+                                                                'reason': 'disconnected'}))
+        for nickname in nicknames:
+            self.remote_client_left(nickname)
+    
+    def handle_key_lookup(self, client, data):
+        try:
+            nickname = self.get_nickname_by_client(client)
+            nicknames = data.get('nicknames')
+            if nicknames is None:
+                nicknames = self.sessions.co_members(nickname)
+            found, unchanged, missing = self.key_directory.lookup(nickname, list(nicknames), data.get('known'))
+            response = {
+                'type': 'key_records',
+                'keys': found,
+                'unchanged': unchanged,
+                'missing': missing
+            }
+            if data.get('id') is not None:
+                response['id'] = data['id']
+            self.send_to_client(client, json.dumps(response))
+            
+        except Exception as e:
+            print(f"⚠️ Key lookup error: {e}")
+    
+    def notify_key_watchers(self, nickname, keys, missing, watchers=None):
+        update = json.dumps({'type': 'key_records', 'keys': keys, 'unchanged': [], 'missing': missing})
+        for watcher in watchers if watchers is not None else self.key_directory.watchers_of(nickname):
+            session = self.sessions.get_by_nickname(watcher)
+            if session and session.lazy_keys:
+                self.send_to_client(session.client, update)
+    
     def handle_encrypted_message(self, sender_client, data):
         try:
             target_nick = data.get('target')
@@ -115,12 +345,78 @@ class ChatServer:
             
             if target_client:
                 self.send_to_client(target_client, json.dumps(data))
+            elif self.offline and isinstance(target_nick, str) and target_nick:
+                self.store_offline(target_nick, json.dumps(data).encode('utf-8'))
             else:
                 print(f"⚠️ Target not found: {target_nick}")
                 
         except Exception as e:
             print(f"⚠️ Encrypted message relay error: {e}")
     
+    def handle_multicast_message(self, sender_client, data):
+        try:
+            sender_nick = self.get_nickname_by_client(sender_client)
+            room = data.get('room') or self.default_room
+            members = self.sessions.room_members(room) if room else None
+            if members is not None and sender_nick not in members:
+                self.send_to_client(sender_client, json.dumps({'type': 'room_error', 'room': room,
+                                                               'message': f'not a member of {room}'}))
+                return
+            envelopes = data.get('data') or {}
+            if isinstance(envelopes, dict):
+                envelopes = [envelopes]
+            covered = set()
+            gone = []
+            stale = []
+            
+            for envelope in envelopes:
+                keys = envelope.get('keys') or {}
+                message = {'type': 'encrypted_message', 'sender': sender_nick}
+                if room:
+                    message['room'] = room
+                message['data'] = {k: v for k, v in envelope.items() if k != 'keys'}
+                prefix = json.dumps(message)[:-2] + (', "encrypted_key": ' if message['data'] else '"encrypted_key": ')
+                for target_nick, wrapped_key in keys.items():
+                    if members is not None:
+                        target_client = members.get(target_nick)
+                    else:
+                        target_client = self.get_client_by_nickname(target_nick)
+                    if target_client and target_client is not sender_client:
+                        self.send_to_client(target_client, prefix + json.dumps(wrapped_key) + "}}")
+                        covered.add(target_nick)
+                    elif not self.offline or not self.key_directory.is_offline(target_nick):
+                        gone.append(target_nick)
+                    elif envelope.get('v'):
+                        stale.append(target_nick)
+                    else:
+                        self.store_offline(target_nick, (prefix + json.dumps(wrapped_key) + "}}").encode('utf-8'))
+                        covered.add(target_nick)
+            
+            if data.get('id') is None:
+                return
+            if members is not None:
+                absent = self.absent_members(room)
+                expected = len(members) - 1 + len(absent)
+                everyone = list(members) + absent
+            else:
+                directory = self.key_directory
+                expected = len(directory) - (1 if sender_nick in directory else 0)
+                everyone = directory.others(sender_nick)
+            uncovered = []
+            if len(covered) < expected:
+                uncovered = [nick for nick in everyone if nick != sender_nick and nick not in covered]
+            uncovered += [nick for nick in stale if nick not in uncovered]
+            if uncovered or gone:
+                self.send_to_client(sender_client, json.dumps({
+                    'type': 'multicast_missing',
+                    'id': data['id'],
+                    'nicknames': uncovered,
+                    'gone': gone
+                }))
+                
+        except Exception as e:
+            print(f"⚠️ Multicast relay error: {e}")
+    
     def handle_call_request(self, caller_client, data):
         try:
             caller_nick = self.get_nickname_by_client(caller_client)
@@ -136,8 +432,7 @@ class ChatServer:
                 self.send_to_client(caller_client, json.dumps(response))
                 return
             
-            target_status = self.client_call_status.get(target_client, {}).get('status', 'idle')
-            if target_status != 'idle':
+            if self.get_call_status(target_client) != 'idle':
                 response = {
                     'type': 'call_response',
                     'status': 'user_busy',
@@ -146,18 +441,20 @@ class ChatServer:
                 self.send_to_client(caller_client, json.dumps(response))
                 return
             
-            call_id = str(uuid.uuid4())
-            self.active_calls[call_id] = {
+            call_id = self.bus.new_call_id() if self.bus else str(uuid.uuid4())
+            self.sessions.add_call(call_id, {
                 'caller': caller_client,
                 'callee': target_client,
                 'caller_nick': caller_nick,
                 'callee_nick': target_nick,
                 'status': 'ringing',
+                'codecs': data.get('codecs') or ['pcm16'],
+                'call_key': data.get('call_key'),
                 'start_time': time.time()
-            }
+            })
             
-            self.client_call_status[caller_client] = {'status': 'calling', 'call_id': call_id}
-            self.client_call_status[target_client] = {'status': 'ringing', 'call_id': call_id}
+            self.set_call_status(caller_client, 'calling', call_id)
+            self.set_call_status(target_client, 'ringing', call_id)
             
             response = {
                 'type': 'call_response',
@@ -170,14 +467,17 @@ class ChatServer:
             incoming_call = {
                 'type': 'incoming_call',
                 'caller': caller_nick,
-                'call_id': call_id
+                'call_id': call_id,
+                'codecs': self.sessions.get_call(call_id)['codecs']
             }
+            if data.get('call_key'):
+                incoming_call['call_key'] = data['call_key']
             self.send_to_client(target_client, json.dumps(incoming_call))
             
             print(f"📞 Call initiated: {caller_nick} -> {target_nick}")
             
-            timer = threading.Timer(30.0, self.timeout_call, [call_id])
-            timer.start()
+            self.sessions.get_call(call_id)['ring_timer'] = self.timers.schedule(self.ring_timeout,
+                                                                               self.timeout_call, call_id)
             
         except Exception as e:
             print(f"⚠️ Call request error: {e}")
@@ -187,27 +487,37 @@ class ChatServer:
             call_id = data.get('call_id')
             action = data.get('action')
             
-            if call_id not in self.active_calls:
+            call_info = self.sessions.get_call(call_id)
+            if not call_info and self.bus and self.bus.forward_call(client, call_id, data):
+                return
+            if not call_info or client != call_info.get('callee'):
                 return
             
-            call_info = self.active_calls[call_id]
             caller_client = call_info['caller']
             caller_nick = call_info['caller_nick']
             callee_nick = call_info['callee_nick']
             
+            self.cancel_ring(call_info)
             if action == 'accept':
+                self.metrics.call_answered(call_info)
                 call_info['status'] = 'active'
-                self.client_call_status[caller_client]['status'] = 'in_call'
-                self.client_call_status[client]['status'] = 'in_call'
+                codec = data.get('codec')
+                call_info['codec'] = codec if codec in call_info['codecs'] else 'pcm16'
+                call_info['encrypted'] = bool(call_info.get('call_key') and data.get('encrypted'))
+                self.set_call_status(caller_client, 'in_call', call_id)
+                self.set_call_status(client, 'in_call', call_id)
                 
                 call_started = {
                     'type': 'call_started',
                     'call_id': call_id,
-                    'peer': caller_nick if client != caller_client else callee_nick
+                    'slot': self.sessions.assign_slot(call_info),
+                    'codec': call_info['codec'],
+                    'encrypted': call_info['encrypted'],
+                    'peer': callee_nick
                 }
                 
                 self.send_to_client(caller_client, json.dumps(call_started))
-                call_started['peer'] = callee_nick
+                call_started['peer'] = caller_nick
                 self.send_to_client(client, json.dumps(call_started))
                 
                 print(f"✅ Call accepted: {caller_nick} <-> {callee_nick}")
@@ -222,23 +532,31 @@ class ChatServer:
     def handle_call_end(self, client, data):
         try:
             call_id = data.get('call_id')
+            if self.get_call_status(client) == 'conference':
+                self.leave_conference(client, call_id)
+                return
             self.end_call(call_id, 'ended')
         except Exception as e:
             print(f"⚠️ Call end error: {e}")
     
     def end_call(self, call_id, reason='ended'):
         try:
-            if call_id not in self.active_calls:
+            call_info = self.sessions.pop_call(call_id)
+            if not call_info:
+                if self.bus:
+                    self.bus.end_call(call_id, reason)
                 return
             
-            call_info = self.active_calls[call_id]
+            if 'conference' in call_info:
+                self.end_conference(call_id, call_info, reason)
+                return
             caller_client = call_info['caller']
             callee_client = call_info['callee']
+            self.cancel_ring(call_info)
+            self.metrics.call_ended(call_info, reason)
             
-            if caller_client in self.client_call_status:
-                self.client_call_status[caller_client] = {'status': 'idle'}
-            if callee_client in self.client_call_status:
-                self.client_call_status[callee_client] = {'status': 'idle'}
+            self.set_call_status(caller_client, 'idle')
+            self.set_call_status(callee_client, 'idle')
             
             call_ended = {
                 'type': 'call_ended',
@@ -249,56 +567,257 @@ class ChatServer:
             self.send_to_client(caller_client, json.dumps(call_ended))
             self.send_to_client(callee_client, json.dumps(call_ended))
             
-            del self.active_calls[call_id]
-            
             print(f"📞 Call ended: {call_info['caller_nick']} <-> {call_info['callee_nick']} ({reason})")
             
         except Exception as e:
             print(f"⚠️ Call termination error: {e}")
     
+    def cancel_ring(self, call_info):
+        timer = call_info.pop('ring_timer', None)
+        if timer:
+            timer.cancel()
+    
     def timeout_call(self, call_id):
-        if call_id in self.active_calls and self.active_calls[call_id]['status'] == 'ringing':
+        call_info = self.sessions.get_call(call_id)
+        if call_info and call_info['status'] == 'ringing':
             self.end_call(call_id, 'timeout')
     
     def handle_voice_data(self, sender_client, data):
         try:
             call_id = data.get('call_id')
-            if call_id not in self.active_calls:
+            call_info = self.sessions.get_call(call_id)
+            if not call_info and self.bus and self.bus.forward_call(sender_client, call_id, data):
                 return
-            
-            call_info = self.active_calls[call_id]
-            if call_info['status'] != 'active':
+            if not call_info or call_info['status'] != 'active' or 'conference' in call_info:
                 return
             
             if sender_client == call_info['caller']:
                 target_client = call_info['callee']
-            else:
+            elif sender_client == call_info['callee']:
                 target_client = call_info['caller']
+            else:
+                return
             
+            self.metrics.voice(call_info, len(data.get('audio_data') or ''))
             voice_packet = {
                 'type': 'voice_data',
                 'call_id': call_id,
                 'audio_data': data.get('audio_data')
             }
             
-            self.send_to_client(target_client, json.dumps(voice_packet))
+            self.send_to_client(target_client, json.dumps(voice_packet), channel='voice')
             
         except Exception as e:
             print(f"⚠️ Voice data transmission error: {e}")
     
+    def handle_voice_frame(self, sender_client, payload, stamp=0):
+        if len(payload) < VOICE_HEADER.size:
+            return
+        
+        slot = VOICE_HEADER.unpack_from(payload)[0]
+        call_info = self.sessions.get_call_by_slot(slot)
+        if not call_info and self.bus:
+            self.bus.forward_voice(sender_client, slot, payload)
+            return
+        if not call_info or call_info['status'] != 'active':
+            return
+        if 'conference' in call_info:
+            self.relay_conference_frame(sender_client, call_info, payload, stamp)
+            return
+        
+        if sender_client == call_info['caller']:
+            target_client = call_info['callee']
+        elif sender_client == call_info['callee']:
+            target_client = call_info['caller']
+        else:
+            return
+        
+        self.metrics.voice(call_info, len(payload) - VOICE_HEADER.size)
+        self.send_voice_frame(target_client, payload, stamp)
+    
+    def send_voice_frame(self, target_client, payload, stamp=0, frame=None):
+        session = self.sessions.get(target_client)
+        if session is not None and session.media_addr is not None:
+            return self.media.send(session.media_addr, stamp, payload)
+        if frame is None:
+            frame = HEADER.pack(FRAME_VOICE, len(payload)) + payload
+        return self.send_frame_to_client(target_client, frame, 'voice')
+    
+    def relay_conference_frame(self, sender_client, call_info, payload, stamp=0):
+        if len(payload) < CONFERENCE_HEADER.size:
+            return
+        _, _, source, level = CONFERENCE_HEADER.unpack_from(payload)
+        targets = call_info['conference'].route(sender_client, source, level)
+        if not targets:
+            self.metrics.conference_frame(0)
+            return
+        self.metrics.voice(call_info, len(payload) - CONFERENCE_HEADER.size)
+        self.metrics.conference_frame(len(targets))
+        frame = HEADER.pack(FRAME_VOICE, len(payload)) + payload
+        for target_client in targets:
+            self.send_voice_frame(target_client, payload, stamp, frame)
+    
+    def handle_media_request(self, client, data):
+        session = self.sessions.get(client)
+        call_id = data.get('call_id')
+        offer = {'type': 'media_offer', 'call_id': call_id}
+        if (self.media and session and session.call_id == call_id and
+                session.status in ('in_call', 'conference')):
+            if session.media_token is None:
+                session.media_token = self.media.issue(client)
+            offer.update(port=self.media.port, token=session.media_token.hex())
+        self.send_to_client(client, json.dumps(offer))
+    
+    def handle_media_transport(self, client, data):
+        session = self.sessions.get(client)
+        if session and data.get('transport') == 'tcp':
+            session.media_addr = None
+    
+    def handle_media_packet(self, client, address, stamp, payload):
+        session = self.sessions.get(client)
+        if session is None or session.media_token is None:
+            return
+        session.media_addr = address
+        if not payload:
+            self.media.send(address, stamp, b"")
+            return
+        self.handle_voice_frame(client, payload, stamp)
+    
+    def close_media(self, session):
+        if session.media_token is not None:
+            self.media.revoke(session.media_token)
+            session.media_token = None
+        session.media_addr = None
+    
+    def start_media(self, host='0.0.0.0', port=0):
+        self.media = MediaRelay(self, host, port)
+        self.media.start()
+        print(f"🎧 UDP media relay: {host}:{self.media.port}")
+    
+    def handle_conference_create(self, client, data):
+        try:
+            nickname = self.get_nickname_by_client(client)
+            if self.get_call_status(client) != 'idle':
+                self.send_to_client(client, json.dumps({'type': 'call_response', 'status': 'user_busy',
+                                                        'message': 'already in a call'}))
+                return
+            call_id = self.bus.new_call_id() if self.bus else str(uuid.uuid4())
+            codec = (data.get('codecs') or ['pcm16'])[0]
+            conference = Conference(call_id, codec, self.conference_speakers, self.conference_size)
+            call_info = {'conference': conference, 'status': 'active', 'codec': codec,
+                         'caller_nick': nickname, 'start_time': time.time()}
+            self.sessions.add_call(call_id, call_info)
+            self.sessions.assign_slot(call_info)
+            self.metrics.call_answered(call_info)
+            self.join_conference(client, nickname, call_id, call_info)
+            self.invite_conference(client, call_info, data)
+            print(f"🎧 Conference started by {nickname} ({call_id})")
+        except Exception as e:
+            print(f"⚠️ Conference create error: {e}")
+    
+    def handle_conference_invite(self, client, data):
+        try:
+            call_id = data.get('call_id')
+            call_info = self.sessions.get_call(call_id)
+            if not call_info and self.bus and self.bus.forward_call(client, call_id, data):
+                return
+            if call_info and 'conference' in call_info and call_info['conference'].get(client):
+                self.invite_conference(client, call_info, data)
+        except Exception as e:
+            print(f"⚠️ Conference invite error: {e}")
+    
+    def invite_conference(self, client, call_info, data):
+        conference = call_info['conference']
+        nickname = self.get_nickname_by_client(client)
+        keys = data.get('keys') or {}
+        for target_nick in (data.get('nicknames') or [])[:conference.max_participants]:
+            target_client = self.get_client_by_nickname(target_nick)
+            if not target_client or target_client is client:
+                continue
+            conference.invited.add(target_nick)
+            invite = {'type': 'conference_invite', 'call_id': conference.call_id, 'caller': nickname,
+                      'codec': conference.codec, 'members': sorted(conference.roster())}
+            if keys.get(target_nick):
+                invite['call_key'] = keys[target_nick]
+            self.send_to_client(target_client, json.dumps(invite))
+    
+    def handle_conference_join(self, client, data):
+        try:
+            call_id = data.get('call_id')
+            call_info = self.sessions.get_call(call_id)
+            if not call_info and self.bus and self.bus.forward_call(client, call_id, data):
+                return
+            nickname = self.get_nickname_by_client(client)
+            if not call_info or 'conference' not in call_info or nickname not in call_info['conference'].invited:
+                self.send_to_client(client, json.dumps({'type': 'call_ended', 'call_id': call_id,
+                                                        'reason': 'not_invited'}))
+                return
+            if self.get_call_status(client) != 'idle':
+                return
+            self.join_conference(client, nickname, call_id, call_info)
+        except Exception as e:
+            print(f"⚠️ Conference join error: {e}")
+    
+    def join_conference(self, client, nickname, call_id, call_info):
+        conference = call_info['conference']
+        participant = conference.add(client, nickname)
+        if participant is None:
+            self.send_to_client(client, json.dumps({'type': 'call_ended', 'call_id': call_id, 'reason': 'full'}))
+            return
+        self.set_call_status(client, 'conference', call_id)
+        self.send_to_client(client, json.dumps({'type': 'conference_started', 'call_id': call_id,
+                                                'slot': call_info['slot'], 'source': participant.source,
+                                                'codec': conference.codec, 'speakers': conference.speakers,
+                                                'members': conference.roster()}))
+        self.conference_event(conference, {'type': 'conference_member', 'call_id': call_id, 'event': 'join',
+                                           'nickname': nickname, 'source': participant.source}, client)
+    
+    def handle_conference_leave(self, client, data):
+        try:
+            call_id = data.get('call_id')
+            if not self.sessions.get_call(call_id) and self.bus and self.bus.forward_call(client, call_id, data):
+                return
+            self.leave_conference(client, call_id)
+        except Exception as e:
+            print(f"⚠️ Conference leave error: {e}")
+    
+    def leave_conference(self, client, call_id, reason='left'):
+        call_info = self.sessions.get_call(call_id)
+        if not call_info:
+            if self.bus and not isinstance(client, RemoteClient):
+                self.bus.forward_call(client, call_id, {'type': 'conference_leave', 'call_id': call_id})
+            return
+        conference = call_info.get('conference')
+        participant = conference.remove(client) if conference else None
+        if participant is None:
+            return
+        if reason != 'disconnected':
+            self.set_call_status(client, 'idle')
+            self.send_to_client(client, json.dumps({'type': 'call_ended', 'call_id': call_id, 'reason': reason}))
+        self.conference_event(conference, {'type': 'conference_member', 'call_id': call_id, 'event': 'leave',
+                                           'nickname': participant.nickname, 'source': participant.source})
+        if not len(conference):
+            self.end_call(call_id, 'ended')
+    
+    def end_conference(self, call_id, call_info, reason):
+        self.metrics.call_ended(call_info, reason)
+        call_ended = json.dumps({'type': 'call_ended', 'call_id': call_id, 'reason': reason})
+        for client in call_info['conference'].clients():
+            self.set_call_status(client, 'idle')
+            self.send_to_client(client, call_ended)
+        print(f"🎧 Conference ended: {call_id} ({reason})")
+    
+    def conference_event(self, conference, event, sender_client=None):
+        frame = encode_frame(json.dumps(event))
+        for client in conference.clients():
+            if client != sender_client:
+                self.send_frame_to_client(client, frame)
+    
     def handle_user_list_request(self, client):
         try:
-            current_nick = self.get_nickname_by_client(client)
-            user_list = []
-            
-            for i, nick in enumerate(self.nicknames):
-                if nick != current_nick:
-                    client_obj = self.clients[i]
-                    status = self.client_call_status.get(client_obj, {}).get('status', 'idle')
-                    user_list.append({
-                        'nickname': nick,
-                        'status': status
-                    })
+            nickname = self.get_nickname_by_client(client)
+            user_list = [{'nickname': nick, 'status': status}
+                         for nick, status in self.presence.snapshot()[1].items() if nick != nickname]
             
             response = {
                 'type': 'user_list',
@@ -310,108 +829,303 @@ class ChatServer:
         except Exception as e:
             print(f"⚠️ User list error: {e}")
     
+    def presence_update(self, nickname):
+        session = self.sessions.get_by_nickname(nickname)
+        if session:
+            status = session.status
+        else:
+            remote = self.bus.remote(nickname) if self.bus else None
+            status = remote.status if remote else None
+        with self.presence.lock:
+            if self.presence.set(nickname, status) and self.presence_subscribers:
+                if not self.presence_flush_delay:
+                    self.flush_presence()
+                elif self.presence_timer is None:
+                    self.presence_timer = self.timers.schedule(self.presence_flush_delay, self.flush_presence)
+    
+    def flush_presence(self):
+        overflowed = []
+        with self.presence.lock:
+            self.presence_timer = None
+            start, version = self.presence_flushed, self.presence.version
+            if start == version:
+                return
+            self.presence_flushed = version
+            changes = self.presence.since(start)
+            if changes is None:
+                message = {'type': 'presence_snapshot', 'epoch': self.presence.epoch, 'version': version,
+                           'users': self.presence.snapshot()[1]}
+            else:
+                message = {'type': 'presence', 'epoch': self.presence.epoch, 'from': start, 'version': version,
+                           'changes': changes}
+            frame = encode_frame(json.dumps(message))
+            for session in self.presence_subscribers:
+                if session.outbound and not session.outbound.put(frame):
+                    overflowed.append(session.client)
+            self.metrics.presence_flushed(len(self.presence_subscribers), len(frame))
+        for client in overflowed:
+            self.send_frame_to_client(client, frame)
+    
+    def handle_presence_subscribe(self, client, data):
+        session = self.sessions.get(client)
+        if session is None:
+            return
+        with self.presence.lock:
+            self.flush_presence()
+            changes = None
+            if data.get('epoch') == self.presence.epoch and isinstance(data.get('version'), int):
+                changes = self.presence.since(data['version'])
+            if changes is None:
+                version, users = self.presence.snapshot()
+                response = {'type': 'presence_snapshot', 'epoch': self.presence.epoch, 'version': version,
+                            'users': users}
+            elif changes:
+                response = {'type': 'presence', 'epoch': self.presence.epoch, 'from': data['version'],
+                            'version': self.presence.version, 'changes': changes}
+            else:
+                response = None
+            if response:
+                self.send_to_client(client, json.dumps(response))
+            self.presence_subscribers.add(session)
+            session.presence = True
+    
+    def handle_room_join(self, client, data):
+        try:
+            room = data.get('room')
+            nickname = self.get_nickname_by_client(client)
+            if not valid_room(room):
+                error = 'invalid room name'
+            elif (len(self.sessions.rooms_of(nickname)) >= self.max_rooms and
+                  not self.sessions.in_room(room, nickname)):
+                error = f'room limit reached ({self.max_rooms})'
+            else:
+                self.join_room(client, nickname, room)
+                return
+            self.send_to_client(client, json.dumps({'type': 'room_error', 'room': room, 'message': error}))
+        except Exception as e:
+            print(f"⚠️ Room join error: {e}")
+    
+    def handle_room_leave(self, client, data):
+        try:
+            room = data.get('room')
+            nickname = self.get_nickname_by_client(client)
+            if self.sessions.leave_room(room, nickname):
+                if self.bus:
+                    self.bus.room(nickname, room, False)
+                self.room_event(room, nickname, 'leave')
+            self.send_to_client(client, json.dumps({'type': 'room_left', 'room': room}))
+        except Exception as e:
+            print(f"⚠️ Room leave error: {e}")
+    
+    def join_room(self, client, nickname, room):
+        joined = self.sessions.join_room(room, nickname, client)
+        members = self.sessions.room_members(room)
+        joined_message = {'type': 'room_joined', 'room': room, 'members': list(members)}
+        absent = self.absent_members(room)
+        if absent:
+            joined_message['absent'] = absent
+        self.send_to_client(client, json.dumps(joined_message))
+        if not joined:
+            return
+        if self.bus:
+            self.bus.room(nickname, room, True)
+        self.room_event(room, nickname, 'join', client)
+        del members[nickname]
+        session = self.sessions.get(client)
+        record = self.key_directory.get(nickname)
+        if session and session.lazy_keys is False:
+            self.send_keys(client, members)
+        if record:
+            self.share_key(nickname, record, members)
+    
+    def absent_members(self, room):
+        if not self.offline:
+            return []
+        return [nick for nick in self.sessions.absent_members(room) if self.key_directory.is_offline(nick)]
+    
+    def room_event(self, room, nickname, event, sender_client=None, absent=False):
+        message = {'type': 'room_event', 'room': room, 'nickname': nickname, 'event': event}
+        if absent:
+            message['absent'] = True
+        frame = encode_frame(json.dumps(message))
+        if room == self.default_room:
+            frame += encode_frame(f"🎉 {nickname} joined the chat!" if event == 'join' else
+                                  f"👋 {nickname} left the chat!")
+        self.room_broadcast(room, frame, sender_client, relay=False)
+    
     def remove_client(self, client):
         try:
-            client_status = self.client_call_status.get(client, {})
-            if client_status.get('status') in ['calling', 'in_call', 'ringing']:
-                call_id = client_status.get('call_id')
-                if call_id:
-                    self.end_call(call_id, 'disconnected')
-            
-            if client in self.client_call_status:
-                del self.client_call_status[client]
-            
-            if client in self.clients:
-                index = self.clients.index(client)
-                self.clients.remove(client)
+            session = self.sessions.get(client)
+            if session and session.status in ['calling', 'in_call', 'ringing'] and session.call_id:
+                self.end_call(session.call_id, 'disconnected')
+            elif session and session.status == 'conference' and session.call_id:
+                self.leave_conference(client, session.call_id, 'disconnected')
+            
+            session = self.sessions.remove(client)
+            if session:
+                nickname = session.nickname
+                self.close_media(session)
+                if session.idle_timer:
+                    session.idle_timer.cancel()
+                if session.presence:
+                    with self.presence.lock:
+                        self.presence_subscribers.discard(session)
+                self.presence_update(nickname)
+                if session.outbound:
+                    session.outbound.close()
+                self.metrics.session_closed(session)
                 
-                if index < len(self.nicknames):
-                    nickname = self.nicknames[index]
-                    self.nicknames.remove(nickname)
-                    
-                    if nickname in self.client_public_keys:
-                        del self.client_public_keys[nickname]
-                    
-                    try:
-                        self.broadcast(f"👋 {nickname} left the chat!\n".encode('utf-8'))
-                        print(f"👋 {nickname} disconnected")
-                    except:
-                        pass
+                self.retire_key(nickname)
+                absent = self.key_directory.is_offline(nickname)
+                rooms = self.sessions.leave_rooms(nickname, absent)
+                if self.bus:
+                    self.bus.leave(nickname)
                 
                 try:
-                    client.close()
+                    for room in rooms:
+                        self.room_event(room, nickname, 'leave', absent=absent)
+                    print(f"👋 {nickname} disconnected")
                 except:
                     pass
+            
+            self.close_client(client)
                     
         except Exception as e:
             print(f"⚠️ Client removal error: {e}")
     
-    def handle_client(self, client):
-        nickname = "Unknown"
-        last_activity = time.time()
+    def close_client(self, client):
+        try:
+            client.shutdown(socket.SHUT_RDWR)
+        except:
+            pass
+        try:
+            client.close()
+        except:
+            pass
+    
+    def watch_idle(self, session, delay=None):
+        session.idle_timer = self.timers.schedule(self.idle_timeout if delay is None else delay,
+                                                  self.check_idle, session)
+    
+    def check_idle(self, session):
+        if self.sessions.get(session.client) is not session:
+            return
+        idle = time.time() - session.last_activity
+        if idle < self.idle_timeout:
+            self.watch_idle(session, self.idle_timeout - idle)
+            return
+        print(f"⏰ {session.nickname} inactive for too long")
+        if self.send_to_client(session.client, "PING"):
+            session.last_activity = time.time()
+            self.watch_idle(session)
+        else:
+            print(f"💔 {session.nickname} heartbeat failed")
+    
+    def start_housekeeping(self):
+        self.timers.every(self.housekeeping_interval, self.report_slow_links)
+    
+    def dispatch_frame(self, client, kind, payload):
+        started = time.perf_counter()
+        if kind == FRAME_VOICE:
+            self.handle_voice_frame(client, payload)
+            msg_type = 'voice_frame'
+        else:
+            msg_type = self.dispatch_message(client, payload)
+        self.metrics.frame(msg_type, len(payload), time.perf_counter() - started)
+    
+    def dispatch_message(self, client, message):
+        decoded_message = message.decode('utf-8')
+        
+        if decoded_message == "PING":
+            self.send_to_client(client, "PONG")
+            return 'ping'
+        elif decoded_message == "PONG":
+            return 'pong'
         
         try:
-            self.client_call_status[client] = {'status': 'idle'}
+            msg_data = json.loads(decoded_message)
+            msg_type = msg_data.get('type')
+            
+            if msg_type == 'public_key':
+                self.handle_public_key(client, msg_data)
+            elif msg_type == 'encrypted_message':
+                self.handle_encrypted_message(client, msg_data)
+            elif msg_type == 'multicast_message':
+                self.handle_multicast_message(client, msg_data)
+            elif msg_type == 'key_lookup':
+                self.handle_key_lookup(client, msg_data)
+            elif msg_type == 'call_request':
+                self.handle_call_request(client, msg_data)
+            elif msg_type == 'call_answer':
+                self.handle_call_answer(client, msg_data)
+            elif msg_type == 'call_end':
+                self.handle_call_end(client, msg_data)
+            elif msg_type == 'voice_data':
+                self.handle_voice_data(client, msg_data)
+            elif msg_type == 'user_list_request':
+                self.handle_user_list_request(client)
+            elif msg_type == 'presence_subscribe':
+                self.handle_presence_subscribe(client, msg_data)
+            elif msg_type == 'room_join':
+                self.handle_room_join(client, msg_data)
+            elif msg_type == 'room_leave':
+                self.handle_room_leave(client, msg_data)
+            elif msg_type == 'conference_create':
+                self.handle_conference_create(client, msg_data)
+            elif msg_type == 'conference_invite':
+                self.handle_conference_invite(client, msg_data)
+            elif msg_type == 'conference_join':
+                self.handle_conference_join(client, msg_data)
+            elif msg_type == 'conference_leave':
+                self.handle_conference_leave(client, msg_data)
+            elif msg_type == 'media_request':
+                self.handle_media_request(client, msg_data)
+            elif msg_type == 'media_transport':
+                self.handle_media_transport(client, msg_data)
+            elif msg_type == 'offline_ack':
+                self.handle_offline_ack(client, msg_data)
+            else:
+                self.relay_text(client, message)
+            return msg_type if msg_type in MESSAGE_TYPES else 'other'
             
+        except json.JSONDecodeError:
+            self.relay_text(client, message)
+            print(f"📨 Message: {decoded_message}")
+            return 'text'
+    
+    def relay_text(self, client, message):
+        if self.sessions.in_room(self.default_room, self.get_nickname_by_client(client)):
+            self.room_broadcast(self.default_room, encode_frame(message), client)
+    
+    def handle_client(self, client, decoder):
+        session = self.sessions.get(client)
+        nickname = session.nickname if session else self.get_nickname_by_client(client)
+        client.settimeout(None)
+        
+        try:
             while self.server_running:
                 try:
-                    client.settimeout(1.0)
-                    message = client.recv(16384)
+                    for kind, payload in decoder:
+                        self.dispatch_frame(client, kind, payload)
                     
-                    if message:
-                        decoded_message = message.decode('utf-8')
-                        last_activity = time.time()
-                        
-                        if decoded_message == "PING":
-                            client.send("PONG\n".encode('utf-8'))
-                            continue
-                        elif decoded_message == "PONG":
-                            continue
-                        
-                        try:
-                            msg_data = json.loads(decoded_message)
-                            msg_type = msg_data.get('type')
-                            
-                            if msg_type == 'public_key':
-                                self.handle_public_key(client, msg_data)
-                            elif msg_type == 'encrypted_message':
-                                self.handle_encrypted_message(client, msg_data)
-                            elif msg_type == 'call_request':
-                                self.handle_call_request(client, msg_data)
-                            elif msg_type == 'call_answer':
-                                self.handle_call_answer(client, msg_data)
-                            elif msg_type == 'call_end':
-                                self.handle_call_end(client, msg_data)
-                            elif msg_type == 'voice_data':
-                                self.handle_voice_data(client, msg_data)
-                            elif msg_type == 'user_list_request':
-                                self.handle_user_list_request(client)
-                            else:
-                                self.broadcast(message, client)
-                            
-                        except json.JSONDecodeError:
-                            self.broadcast(message, client)
-                            print(f"📨 Message: {decoded_message}")
-                        
+                    data = client.recv(RECV_SIZE)
+                    
+                    if data:
+                        if session:
+                            session.last_activity = time.time()
+                        decoder.feed(data)
                     else:
                         print(f"⚠️ {nickname} sent empty message")
                         break
-                        
-                except socket.timeout:
-                    if time.time() - last_activity > 60:
-                        print(f"⏰ {nickname} inactive for too long")
-                        try:
-                            client.send("PING".encode('utf-8'))
-                            last_activity = time.time()
-                        except:
-                            print(f"💔 {nickname} heartbeat failed")
-                            break
-                    continue
                     
                 except ConnectionResetError:
                     print(f"🔌 {nickname} closed connection")
                     break
                     
+                except FrameError as e:
+                    print(f"⚠️ {nickname} protocol error: {e}")
+                    break
+                    
                 except Exception as e:
                     print(f"⚠️ {nickname} message reception error: {e}")
                     break
@@ -421,6 +1135,12 @@ class ChatServer:
         finally:
             self.remove_client(client)
     
+    def start_metrics(self, host='127.0.0.1', port=9100):
+        if self.metrics.registry is None:
+            return
+        self.metrics_server = serve_metrics(self.metrics.registry, host, port)
+        print(f"📈 Metrics: http://{host}:{self.metrics_server.server_address[1]}/metrics (JSON: /stats)")
+    
     def get_server_ip(self):
         try:
             s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -431,28 +1151,147 @@ class ChatServer:
         except:
             return "localhost"
     
+    def print_banner(self):
+        server_ip = self.get_server_ip()
+        print("="*70)
+        print("🚀 ENHANCED E2E ENCRYPTED VOICE CHAT SERVER")
+        print("="*70)
+        print(f"🏠 Local Address: localhost:{self.port}")
+        print(f"🌐 Network Address: {server_ip}:{self.port}")
+        print(f"🔒 Chat Password: {self.password}")
+        print(f"🔐 End-to-End Encryption: Active (RSA 2048 + AES 256)")
+        print(f"🎙️ Voice Calling: Active (Real-time P2P)")
+        print(f"🔏 Anonymous Communication: Server cannot see messages")
+        print(f"⚙️ Engine: {self.engine}")
+        if self.bus:
+            print(f"🧩 Cluster member: {self.bus.index + 1}/{self.bus.size} ({self.bus.transport} bus)")
+        print("="*70)
+        print("⏳ Waiting for connections...")
+        print("="*70)
+    
+    def register_client(self, client, nickname, address):
+        session = self.sessions.add(client, nickname, address)
+        if session is not None and self.bus and not self.bus.claim(nickname):
+            self.sessions.remove(client)
+            session = None
+        return self.admit_client(client, nickname, address, session)
+    
+    def admit_client(self, client, nickname, address, session):
+        if session is None:
+            print(f"⚠️ Nickname already in use: {nickname} ({str(address)})")
+            try:
+                client.sendall(encode_frame("NICK_TAKEN"))
+                client.close()
+            except:
+                pass
+            return None
+        
+        self.start_writer(session)
+        self.watch_idle(session)
+        self.presence_update(nickname)
+        self.metrics.connections.inc()
+        if self.bus:
+            self.bus.join(nickname)
+        
+        print(f"👤 User joined: {nickname} ({str(address)})")
+        print(f"📊 Active users: {len(self.sessions)}")
+        
+        self.send_to_client(client, "✅ Successfully connected to server! 🔐 E2E active")
+        if self.default_room:
+            self.join_room(client, nickname, self.default_room)
+        if self.offline:
+            if self.bus and self.bus.home(nickname) != self.bus.index:
+                self.bus.fetch_offline(nickname)
+            elif self.offline.pending(nickname):
+                thread = threading.Thread(target=self.deliver_offline, args=(session,))
+                thread.daemon = True
+                thread.start()
+        return session
+    
+    def store_offline(self, nickname, payload):
+        if self.bus and self.bus.home(nickname) != self.bus.index:
+            self.bus.store_offline(nickname, payload)
+        elif self.offline.put(nickname, payload):
+            print(f"📦 Stored for offline user: {nickname}")
+    
+    def offline_chunk(self, nickname):
+        batch = self.offline.peek(nickname, self.offline_batch)
+        if not batch:
+            return 0, b""
+        seq = batch[-1][0]
+        frames = [encode_frame(payload) for _, payload in batch]
+        frames.append(encode_frame(json.dumps({'type': 'offline_batch', 'seq': seq})))
+        return seq, b"".join(frames)
+    
+    def wait_for_room(self, queue, size):
+        limit = self.outbound_limits['chat']
+        while not queue.closed and (queue.queued_bytes['chat'] + size > limit['max_bytes'] // 2 or
+                                    len(queue.queues['chat']) >= limit['max_frames'] // 2):
+            time.sleep(0.005)
+        return not queue.closed
+    
+    def deliver_offline(self, session):
+        try:
+            seq, chunk = self.offline_chunk(session.nickname)
+            if chunk and self.wait_for_room(session.outbound, len(chunk)):
+                session.offline_seq = seq
+                self.send_frame_to_client(session.client, chunk)
+        except Exception as e:
+            print(f"⚠️ Offline delivery error for {session.nickname}: {e}")
+    
+    def handle_offline_ack(self, client, data):
+        try:
+            session = self.sessions.get(client)
+            seq = data.get('seq')
+            if not session or not seq or seq != session.offline_seq:
+                return
+            session.offline_seq = 0
+            nickname = session.nickname
+            if self.bus and self.bus.home(nickname) != self.bus.index:
+                self.bus.fetch_offline(nickname, seq)
+                return
+            self.offline.ack(nickname, seq)
+            if not self.offline.pending(nickname):
+                print(f"📬 {nickname}: offline messages delivered")
+                return
+            thread = threading.Thread(target=self.deliver_offline, args=(session,))
+            thread.daemon = True
+            thread.start()
+        except Exception as e:
+            print(f"⚠️ Offline ack error: {e}")
+    
+    def serve_offline(self, member, nickname, ack):
+        if not self.offline:
+            return
+        if ack:
+            self.offline.ack(nickname, ack)
+        seq, chunk = self.offline_chunk(nickname)
+        if chunk:
+            self.bus.send_offline(member, nickname, seq, chunk)
+    
+    def receive_offline(self, nickname, seq, chunk):
+        def deliver():
+            session = self.sessions.get_by_nickname(nickname)
+            if session and session.outbound and self.wait_for_room(session.outbound, len(chunk)):
+                session.offline_seq = seq
+                self.send_frame_to_client(session.client, chunk)
+        thread = threading.Thread(target=deliver)
+        thread.daemon = True
+        thread.start()
+    
     def start_server(self):
         try:
             server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             server.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
             
             server.bind((self.host, self.port))
-            server.listen(10)
-            
-            server_ip = self.get_server_ip()
-            print("="*70)
-            print("🚀 ENHANCED E2E ENCRYPTED VOICE CHAT SERVER")
-            print("="*70)
-            print(f"🏠 Local Address: localhost:{self.port}")
-            print(f"🌐 Network Address: {server_ip}:{self.port}")
-            print(f"🔒 Chat Password: {self.password}")
-            print(f"🔐 End-to-End Encryption: Active (RSA 2048 + AES 256)")
-            print(f"🎙️ Voice Calling: Active (Real-time P2P)")
-            print(f"🔏 Anonymous Communication: Server cannot see messages")
-            print("="*70)
-            print("⏳ Waiting for connections...")
-            print("="*70)
+            server.listen(self.backlog)
+            
+            self.print_banner()
+            self.start_housekeeping()
             
             while self.server_running:
                 try:
@@ -462,27 +1301,21 @@ class ChatServer:
                     print(f"🔄 New connection attempt: {str(address)}")
                     
                     client.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                    tune_socket(client, self.socket_options)
                     
-                    if self.authenticate_client(client):
+                    decoder = FrameDecoder()
+                    if self.authenticate_client(client, decoder):
                         print(f"✅ Password verified: {str(address)}")
                         
-                        client.send("NICK".encode('utf-8'))
+                        send_frame(client, "NICK")
                         client.settimeout(30)
-                        nickname = client.recv(1024).decode('utf-8')
+                        nickname = read_text(client, decoder)
                         client.settimeout(None)
                         
-                        self.nicknames.append(nickname)
-                        self.clients.append(client)
-                        
-                        print(f"👤 User joined: {nickname} ({str(address)})")
-                        print(f"📊 Active users: {len(self.clients)}")
-                        
-                        self.broadcast(f"🎉 {nickname} joined the chat!\n".encode('utf-8'))
-                        client.send("✅ Successfully connected to server! 🔐 E2E active\n".encode('utf-8'))
-                        
-                        thread = threading.Thread(target=self.handle_client, args=(client,))
-                        thread.daemon = True
-                        thread.start()
+                        if self.register_client(client, nickname, address):
+                            thread = threading.Thread(target=self.handle_client, args=(client, decoder))
+                            thread.daemon = True
+                            thread.start()
                         
                     else:
                         print(f"❌ Wrong password: {str(address)}")
@@ -506,31 +1339,126 @@ class ChatServer:
         print("\n🛑 Shutting down server...")
         self.server_running = False
         
-        for call_id in list(self.active_calls.keys()):
+        for call_id in self.sessions.call_ids():
             self.end_call(call_id, 'server_shutdown')
         
         try:
-            self.broadcast("🛑 Server shutting down...\n".encode('utf-8'))
+            self.broadcast("🛑 Server shutting down...")
+            self.flush_outbound()
         except:
             pass
         
-        for client in self.clients[:]:
-            try:
-                client.close()
-            except:
-                pass
+        for client in self.sessions.clients():
+            self.close_client(client)
         
-        self.clients.clear()
-        self.nicknames.clear()
-        self.active_calls.clear()
-        self.client_call_status.clear()
-        self.client_public_keys.clear()
+        self.timers.stop()
+        self.sessions.clear()
+        self.key_directory.clear()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+            self.metrics_server = None
+        if self.bus:
+            self.bus.close()
+        if self.offline:
+            self.offline.close()
+        if self.media:
+            self.media.close()
         
         print("✅ Server closed")
 
+ENGINES = ['thread', 'asyncio']
+
+def create_server(engine='thread', host='0.0.0.0', port=12345):
+    if engine == 'asyncio':
+        from chat_server_async import AsyncChatServer
+        return AsyncChatServer(host, port)
+    return ChatServer(host, port)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="E2E encrypted voice chat server")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=12345)
+    parser.add_argument('--engine', choices=ENGINES, default='thread',
+                        help="thread: one thread per client, asyncio: single event loop")
+    for channel, limit in copy_limits().items():
+        parser.add_argument(f'--{channel}-queue-frames', type=int, default=limit['max_frames'],
+                            help=f"outbound {channel} frames queued per client")
+        parser.add_argument(f'--{channel}-queue-policy', choices=POLICIES, default=limit['policy'],
+                            help=f"what to do when a client's {channel} queue is full")
+    parser.add_argument('--ring-timeout', type=float, default=30.0, help="seconds an unanswered call keeps ringing")
+    parser.add_argument('--idle-timeout', type=float, default=60, help="seconds of silence before a client is pinged")
+    parser.add_argument('--no-nodelay', action='store_true', help="leave Nagle's algorithm on for client sockets")
+    parser.add_argument('--sndbuf', type=int, default=0, help="SO_SNDBUF for client sockets (default: OS)")
+    parser.add_argument('--rcvbuf', type=int, default=0, help="SO_RCVBUF for client sockets (default: OS)")
+    parser.add_argument('--write-batch-kb', type=int, default=WRITE_BATCH_BYTES // 1024,
+                        help="coalesce queued frames into writes of up to this size (0: one write per frame)")
+    parser.add_argument('--default-room', default=DEFAULT_ROOM,
+                        help="room every client joins on connect (empty: none)")
+    parser.add_argument('--max-rooms', type=int, default=MAX_ROOMS, help="rooms one client may join")
+    parser.add_argument('--conference-speakers', type=int, default=SPEAKERS,
+                        help="loudest speakers forwarded to each conference participant (0: everyone)")
+    parser.add_argument('--conference-size', type=int, default=MAX_PARTICIPANTS, help="participants per conference")
+    parser.add_argument('--udp-port', type=int,
+                        help="relay call audio over UDP on this port (clients fall back to TCP without it)")
+    parser.add_argument('--metrics-port', type=int, help="serve Prometheus text on /metrics and JSON on /stats")
+    parser.add_argument('--metrics-host', default='127.0.0.1')
+    parser.add_argument('--no-metrics', action='store_true', help="skip metric updates on the hot paths")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="worker processes sharing the port with SO_REUSEPORT")
+    parser.add_argument('--bus-dir', help="directory for the workers' Unix bus sockets (default: temporary)")
+    parser.add_argument('--worker-index', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--nodes', help="comma-separated host:port bus addresses of all cluster nodes, in node id order")
+    parser.add_argument('--node-id', type=int, help="this node's position in --nodes")
+    parser.add_argument('--cluster-secret', default=os.environ.get('E2E_CHAT_CLUSTER_SECRET'),
+                        help="shared secret for bus links, separate from the chat password "
+                             "(or E2E_CHAT_CLUSTER_SECRET; random for --workers)")
+    parser.add_argument('--offline-dir', help="keep encrypted messages for offline users in this directory")
+    parser.add_argument('--offline-ttl', type=float, default=7 * 24,
+                        help="hours an offline message is kept (default 168)")
+    parser.add_argument('--offline-max-mb', type=int, default=256, help="disk budget of the offline store")
+    args = parser.parse_args()
+    if args.nodes and (args.node_id is None or args.workers > 1):
+        parser.error("--nodes needs --node-id and runs one process per node (no --workers)")
+    if (args.nodes or args.worker_index is not None) and not args.cluster_secret:
+        parser.error("cluster links need --cluster-secret or E2E_CHAT_CLUSTER_SECRET")
+    
     try:
-        server = ChatServer()
+        if args.workers > 1 and args.worker_index is None:
+            run_workers(sys.argv[1:], args.workers, args.bus_dir, args.cluster_secret)
+            sys.exit(0)
+        server = create_server(args.engine, args.host, args.port)
+        for channel, limit in server.outbound_limits.items():
+            limit['max_frames'] = getattr(args, f'{channel}_queue_frames')
+            limit['policy'] = getattr(args, f'{channel}_queue_policy')
+        server.socket_options.update(nodelay=not args.no_nodelay, sndbuf=args.sndbuf, rcvbuf=args.rcvbuf)
+        server.write_batch_bytes = args.write_batch_kb * 1024
+        server.ring_timeout = args.ring_timeout
+        server.idle_timeout = args.idle_timeout
+        server.default_room = args.default_room
+        server.max_rooms = args.max_rooms
+        server.conference_speakers = args.conference_speakers
+        server.conference_size = args.conference_size
+        secret = args.cluster_secret
+        if args.offline_dir:
+            offline_dir = args.offline_dir
+            if args.worker_index is not None:
+                offline_dir = os.path.join(offline_dir, f"worker-{args.worker_index}")
+            server.offline = OfflineStore(offline_dir, ttl=args.offline_ttl * 3600,
+                                          max_bytes=args.offline_max_mb * 1024 * 1024)
+        if args.worker_index is not None:
+            server.reuse_port = True
+            server.bus = ClusterBus(server, args.worker_index, unix_addresses(args.bus_dir, args.workers), secret)
+            server.bus.start()
+        elif args.nodes:
+            addresses = [parse_address(address) for address in args.nodes.split(',')]
+            server.bus = ClusterBus(server, args.node_id, addresses, secret)
+            server.bus.start()
+        if args.udp_port is not None:
+            server.start_media(args.host, args.udp_port + (args.worker_index or 0))
+        if args.no_metrics:
+            server.metrics = NullMetrics()
+        elif args.metrics_port is not None:
+            server.start_metrics(args.metrics_host, args.metrics_port + (args.worker_index or 0))
         server.start_server()
     except KeyboardInterrupt:
         print("\n🛑 Stopping server...")
@@ -0,0 +1,194 @@
+import asyncio
+import socket
+import threading
+import time
+
+from chat_server import ChatServer
+from framing import FrameDecoder, FrameError, FRAME_TEXT, RECV_SIZE, encode_frame, tune_socket
+from outbound import OutboundQueue
+
+class AsyncConnection:
+    def __init__(self, reader, writer, loop):
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.address = writer.get_extra_info('peername')
+        self.closed = False
+        self.decoder = FrameDecoder()
+        self.ready = asyncio.Event()
+
+    def in_loop(self):
+        return threading.get_ident() == self.loop_thread
+
+    def wake(self):
+        if self.in_loop():
+            self.ready.set()
+        else:
+            self.loop.call_soon_threadsafe(self.ready.set)
+
+    def send(self, data):
+        if self.closed or self.writer.is_closing():
+            raise ConnectionError("connection closed")
+        if self.in_loop():
+            self.writer.write(data)
+        else:
+            self.loop.call_soon_threadsafe(self.writer.write, data)
+        return len(data)
+
+    sendall = send
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.in_loop():
+            self.writer.close()
+        else:
+            self.loop.call_soon_threadsafe(self.writer.close)
+
+    def fileno(self):
+        sock = self.writer.get_extra_info('socket')
+        return sock.fileno() if sock else -1
+
+class AsyncChatServer(ChatServer):
+    engine = 'asyncio'
+
+    def __init__(self, host='0.0.0.0', port=12345):
+        super().__init__(host, port)
+        self.handshake_timeout = 30
+        self.loop = None
+
+    async def read_frame(self, conn):
+        while True:
+            frame = conn.decoder.next_frame()
+            if frame is not None:
+                return frame
+            data = await conn.reader.read(RECV_SIZE)
+            if not data:
+                raise ConnectionError("connection closed")
+            conn.decoder.feed(data)
+
+    async def read_handshake(self, conn):
+        kind, payload = await asyncio.wait_for(self.read_frame(conn), self.handshake_timeout)
+        if kind != FRAME_TEXT:
+            raise FrameError(f"expected text frame, got kind {kind}")
+        return payload.decode('utf-8')
+
+    async def handle_connection(self, reader, writer):
+        conn = AsyncConnection(reader, writer, self.loop)
+        address = conn.address
+        print(f"🔄 New connection attempt: {str(address)}")
+
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            tune_socket(sock, self.socket_options)
+
+        try:
+            conn.send(encode_frame("PASSWORD"))
+            if await self.read_handshake(conn) != self.password:
+                print(f"❌ Wrong password: {str(address)}")
+                self.metrics.auth_failures.inc()
+                conn.send(encode_frame("AUTH_FAILED"))
+                conn.close()
+                return
+            conn.send(encode_frame("AUTH_SUCCESS"))
+            print(f"✅ Password verified: {str(address)}")
+
+            conn.send(encode_frame("NICK"))
+            nickname = await self.read_handshake(conn)
+        except Exception as e:
+            print(f"⚠️ Authentication error: {e}")
+            conn.close()
+            return
+
+        session = await self.register_async(conn, nickname, address)
+        if not session:
+            return
+
+        try:
+            while self.server_running:
+                for kind, payload in conn.decoder:
+                    self.dispatch_frame(conn, kind, payload)
+                data = await reader.read(RECV_SIZE)
+                if not data:
+                    print(f"⚠️ {nickname} sent empty message")
+                    break
+                session.last_activity = time.time()
+                conn.decoder.feed(data)
+        except ConnectionResetError:
+            print(f"🔌 {nickname} closed connection")
+        except FrameError as e:
+            print(f"⚠️ {nickname} protocol error: {e}")
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"⚠️ {nickname} message reception error: {e}")
+        finally:
+            self.remove_client(conn)
+
+    async def register_async(self, conn, nickname, address):
+        session = self.sessions.add(conn, nickname, address)
+        if session is not None and self.bus and not await asyncio.wrap_future(self.bus.claim_future(nickname)):
+            self.sessions.remove(conn)
+            session = None
+        return self.admit_client(conn, nickname, address, session)
+
+    def start_writer(self, session):
+        session.outbound = OutboundQueue(self.outbound_limits, on_ready=session.client.wake)
+        asyncio.ensure_future(self.write_outbound(session))
+
+    async def write_outbound(self, session):
+        conn = session.client
+        queue = session.outbound
+        try:
+            while not queue.closed:
+                frames = queue.take(self.write_batch_bytes or None)
+                if not frames:
+                    conn.ready.clear()
+                    if queue.empty() and not queue.closed:
+                        await conn.ready.wait()
+                    continue
+                if self.write_batch_bytes:
+                    conn.writer.writelines(frames)
+                    self.metrics.flushed(queue.last_wait, frames, 1)
+                else:
+                    for frame in frames:
+                        conn.writer.write(frame)
+                    self.metrics.flushed(queue.last_wait, frames, len(frames))
+                await conn.writer.drain()
+        except Exception:
+            self.remove_client(conn)
+
+    def flush_outbound(self, timeout=1.0):
+        for session in self.sessions.sessions():
+            if session.outbound:
+                for frame in session.outbound.take():
+                    try:
+                        session.client.writer.write(frame)
+                    except Exception:
+                        pass
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port,
+                                            reuse_address=True, reuse_port=self.reuse_port or None,
+                                            backlog=self.backlog)
+        self.print_banner()
+        self.start_housekeeping()
+        try:
+            async with server:
+                while self.server_running:
+                    await asyncio.sleep(1.0)
+        finally:
+            self.shutdown_server()
+            await asyncio.sleep(0.1)
+
+    def start_server(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            raise
+        except Exception as e:
+            print(f"💥 Server startup error: {e}")
@@ -0,0 +1,826 @@
+import asyncio
+import base64
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+from cryptography.hazmat.primitives import serialization
+
+from e2e_crypto import (CALL_KEY_SIZE, SESSION_VERSION, ConferenceCipher, KeyCache, SessionKeys, VoiceCipher,
+                        decrypt_message, encrypt_envelope, unwrap_call_key, wrap_call_key)
+from identity import generate_identity
+from jitter_buffer import JitterBuffer, LOST
+from voice_codec import VoicePipeline, audio_level, available_codecs, mix, negotiate
+from presence import apply_changes
+from vad import COMFORT, COMFORT_NOISE_SIZE, HANGOVER_MS, ComfortNoise, VoiceActivityDetector
+from media import MediaLink
+from framing import (FrameDecoder, FrameError, FRAME_TEXT, FRAME_VOICE, HEADER, RECV_SIZE, encode_conference_frame,
+                     encode_frame, encode_voice_frame, parse_conference_frame, parse_voice_frame, read_text,
+                     send_frame, tune_socket, SOCKET_OPTIONS)
+
+CHUNK = 1024
+RATE = 44100
+MAX_PENDING_MESSAGES = 64
+
+class HandshakeError(ConnectionError):
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+class ClientCore:
+    def __init__(self, nickname, private_key=None, rate=RATE, chunk=CHUNK, jitter_target_ms=60,
+                 jitter_max_ms=300, heartbeat=10.0, codecs=None, vad=True, udp=True, key_cache=None):
+        self.nickname = nickname
+        self.client = None
+        self.connected = False
+        self.handlers = {}
+        self.handler_lock = threading.Lock()
+
+        self.private_key = private_key or generate_identity()
+        self.public_key = self.private_key.public_key()
+        self.peer_public_keys = {}
+        self.peer_fingerprints = {}
+        self.key_cache = key_cache if key_cache is not None else KeyCache()
+        self.pending_messages = OrderedDict()
+        self.undecrypted = {}
+        self.message_counter = 0
+        self.session_keys = None
+        self.send_lock = threading.Lock()
+        self.decoder = FrameDecoder()
+        self.heartbeat_interval = heartbeat
+        self.socket_options = dict(SOCKET_OPTIONS)
+        self.users = []
+        self.presence = {}
+        self.presence_epoch = None
+        self.presence_version = 0
+        self.rooms = {}
+        self.room_absent = {}
+        self.room = None
+        self.switch_room = None
+
+        self.rate = rate
+        self.chunk = chunk
+        self.codecs = codecs
+        self.jitter_target_ms = jitter_target_ms
+        self.jitter_max_ms = jitter_max_ms
+        self.in_call = False
+        self.current_call_id = None
+        self.call_peer = None
+        self.call_slot = None
+        self.voice_pipeline = None
+        self.voice_seq = 0
+        self.legacy_seq = 0
+        self.jitter = None
+        self.voice_cipher = None
+        self.call_keys = {}
+        self.incoming_calls = {}
+        self.pending_call = None
+        self.silence = b"\0" * (chunk * 2)
+        self.use_vad = vad
+        self.vad = None
+        self.comfort = None
+        self.use_udp = udp
+        self.media = None
+        self.server_host = None
+        self.conference_key = None
+        self.conference_source = None
+        self.conference_sources = None
+        self.conference_invites = {}
+        self.pending_conference = None
+        self.streams = {}
+        self.voice_ready = threading.Event()
+
+    def on(self, event, callback):
+        with self.handler_lock:
+            self.handlers.setdefault(event, []).append(callback)
+        return callback
+
+    def off(self, event, callback):
+        with self.handler_lock:
+            callbacks = self.handlers.get(event)
+            if callbacks and callback in callbacks:
+                callbacks.remove(callback)
+
+    def emit(self, event, **data):
+        with self.handler_lock:
+            callbacks = self.handlers.get(event, []) + self.handlers.get('*', [])
+        for callback in callbacks:
+            try:
+                callback(event, data)
+            except Exception as e:
+                print(f"⚠️ {self.nickname} {event} handler error: {e}")
+
+    def wait(self, event, timeout=10.0, match=None):
+        done = threading.Event()
+        result = {}
+
+        def waiter(name, data):
+            if not done.is_set() and (match is None or match(data)):
+                result.update(data)
+                done.set()
+
+        self.on(event, waiter)
+        try:
+            if not done.wait(timeout):
+                raise TimeoutError(f"{self.nickname}: no {event} within {timeout}s")
+            return result
+        finally:
+            self.off(event, waiter)
+
+    async def stream(self):
+        loop = asyncio.get_event_loop()
+        events = asyncio.Queue()
+
+        def forward(event, data):
+            loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+        self.on('*', forward)
+        try:
+            while True:
+                event, data = await events.get()
+                yield event, data
+                if event == 'disconnected':
+                    return
+        finally:
+            self.off('*', forward)
+
+    def get_key_pem(self):
+        return self.public_key.public_bytes(encoding=serialization.Encoding.PEM,
+                                           format=serialization.PublicFormat.SubjectPublicKeyInfo).decode('utf-8')
+
+    def install_peer_key(self, nick, record):
+        fp, key, dh_ok = self.key_cache.load(record)
+        self.peer_public_keys[nick] = key
+        self.peer_fingerprints[nick] = fp
+        if dh_ok and not record.get('offline'):
+            self.session_keys.set_peer(nick, record['dh_key'])
+            return True
+        self.session_keys.forget_peer(nick)
+        return False
+
+    def drop_peer_key(self, nick):
+        self.peer_public_keys.pop(nick, None)
+        self.peer_fingerprints.pop(nick, None)
+        if self.session_keys:
+            self.session_keys.forget_peer(nick)
+
+    def request_keys(self, nicknames=None, msg_id=None):
+        request = {'type': 'key_lookup', 'known': dict(self.peer_fingerprints)}
+        if nicknames is not None:
+            request['nicknames'] = list(nicknames)
+        if msg_id is not None:
+            request['id'] = msg_id
+        self.send_json(request)
+
+    def send_encrypted(self, text, peers, msg_id, room=None):
+        envelopes = self.encrypt(text, peers)
+        if envelopes:
+            message = {'type': 'multicast_message', 'sender': self.nickname, 'id': msg_id, 'data': envelopes}
+            if room:
+                message['room'] = room
+            self.send_json(message)
+        return bool(envelopes)
+
+    def encrypt(self, msg, peers):
+        sessions = self.session_keys
+        fast = [p for p in peers if sessions and sessions.has_peer(p)]
+        slow = {p: self.peer_public_keys[p] for p in peers if p in self.peer_public_keys and p not in fast}
+        return [env for env in (sessions.seal(msg, fast) if fast else None, encrypt_envelope(msg, slow)) if env]
+
+    def decrypt(self, data, sender=None):
+        try:
+            if data.get('v') == SESSION_VERSION and self.session_keys:
+                return self.session_keys.open(sender, data)
+            return decrypt_message(self.private_key, data)
+        except Exception as e:
+            return f"[Decrypt error: {e}]"
+
+    def send_frame(self, frame):
+        with self.send_lock:
+            self.client.sendall(frame)
+
+    def send_json(self, data):
+        self.send_frame(encode_frame(json.dumps(data)))
+
+    def connect(self, host, port, password, timeout=15):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.settimeout(timeout)
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        tune_socket(client, self.socket_options)
+        try:
+            client.connect((host, port))
+            self.decoder = FrameDecoder()
+
+            if read_text(client, self.decoder) == "PASSWORD":
+                send_frame(client, password)
+                if read_text(client, self.decoder) != "AUTH_SUCCESS":
+                    raise HandshakeError('auth', "wrong password")
+                self.emit('authenticated')
+
+            welcome = None
+            if read_text(client, self.decoder) == "NICK":
+                send_frame(client, self.nickname)
+                welcome = read_text(client, self.decoder)
+                if welcome == "NICK_TAKEN":
+                    raise HandshakeError('nick_taken', f"nickname in use: {self.nickname}")
+        except:
+            client.close()
+            raise
+
+        client.settimeout(None)
+        self.client = client
+        self.server_host = host
+        self.connected = True
+        self.session_keys = SessionKeys(self.nickname, self.private_key)
+        self.peer_public_keys = {}
+        self.peer_fingerprints = {}
+        self.pending_messages.clear()
+        self.undecrypted = {}
+        self.presence = {}
+        self.presence_epoch = None
+        self.presence_version = 0
+        self.rooms = {}
+        self.room_absent = {}
+        self.room = None
+
+        threading.Thread(target=self.recv, daemon=True).start()
+        if self.heartbeat_interval:
+            threading.Thread(target=self.heartbeat, daemon=True).start()
+
+        self.send_json({'type': 'public_key', 'nickname': self.nickname,
+                        'public_key': self.get_key_pem(), 'directory': True,
+                        **self.session_keys.public_record()})
+        self.send_json({'type': 'presence_subscribe'})
+        self.emit('connected', host=host, port=port)
+        if welcome:
+            self.process(welcome)
+
+    def request_users(self):
+        if self.connected:
+            if self.presence_epoch:
+                self.emit_users()
+            self.resync_presence()
+
+    def resync_presence(self):
+        try:
+            self.send_json({'type': 'presence_subscribe', 'epoch': self.presence_epoch,
+                            'version': self.presence_version})
+        except:
+            pass
+
+    def emit_users(self):
+        self.users = [{'nickname': nick, 'status': status} for nick, status in sorted(self.presence.items())
+                      if nick != self.nickname]
+        self.emit('users', users=self.users)
+
+    def heartbeat(self):
+        while self.connected:
+            try:
+                time.sleep(self.heartbeat_interval)
+                if self.connected and self.client:
+                    self.send_frame(encode_frame("PING"))
+            except:
+                if self.connected:
+                    self.conn_lost()
+                break
+
+    def process(self, msg):
+        if not msg or msg in ["PING", "PONG"]:
+            if msg == "PING":
+                try:
+                    self.send_frame(encode_frame("PONG"))
+                except:
+                    pass
+            return
+
+        try:
+            data = json.loads(msg)
+        except json.JSONDecodeError:
+            if not msg.startswith("{"):
+                self.emit('log', text=msg)
+            return
+
+        t = data.get('type')
+        if t == 'public_key':
+            nick = data.get('nickname')
+            if nick and data.get('public_key'):
+                try:
+                    self.emit('key', nickname=nick, session=self.install_peer_key(nick, data))
+                except Exception as e:
+                    self.emit('log', text=f"❌ {nick} key error: {e}")
+        elif t == 'key_records':
+            for nick, record in (data.get('keys') or {}).items():
+                try:
+                    self.install_peer_key(nick, record)
+                except Exception as e:
+                    self.emit('log', text=f"❌ {nick} key error: {e}")
+            for nick in data.get('missing') or []:
+                self.drop_peer_key(nick)
+            for nick in list(self.undecrypted):
+                if nick in self.peer_public_keys or nick in (data.get('missing') or []):
+                    for payload, room in self.undecrypted.pop(nick):
+                        self.emit('message', sender=nick, text=self.decrypt(payload, nick), room=room)
+            if self.pending_call and self.pending_call in self.peer_public_keys:
+                target, self.pending_call = self.pending_call, None
+                self.send_call_request(target)
+            if self.pending_conference:
+                nicknames, self.pending_conference = self.pending_conference, None
+                self.send_conference(nicknames)
+            pending = self.pending_messages.get(data.get('id'))
+            if pending:
+                text, room, targets, retry = pending
+                peers = list(self.peer_public_keys) if targets is None else targets
+                if not self.send_encrypted(text, peers, data.get('id'), room) and not retry:
+                    self.emit('log', text="⚠️ No keys available!")
+        elif t == 'multicast_missing':
+            for nick in data.get('gone') or []:
+                self.drop_peer_key(nick)
+            pending = self.pending_messages.get(data.get('id'))
+            if pending and data.get('nicknames'):
+                self.pending_messages[data['id']] = (pending[0], pending[1], data['nicknames'], True)
+                self.request_keys(data['nicknames'], data['id'])
+        elif t == 'offline_batch':
+            self.send_json({'type': 'offline_ack', 'seq': data.get('seq')})
+        elif t == 'room_joined':
+            room = data.get('room')
+            self.rooms[room] = set(data.get('members') or [])
+            self.room_absent[room] = set(data.get('absent') or [])
+            if self.room is None or room == self.switch_room:
+                self.room = room
+                self.switch_room = None
+            self.emit('room', room=room, action='joined', members=sorted(self.rooms[room]))
+        elif t == 'room_left':
+            room = data.get('room')
+            self.rooms.pop(room, None)
+            self.room_absent.pop(room, None)
+            if self.room == room:
+                self.room = next(iter(sorted(self.rooms)), None)
+            self.emit('room', room=room, action='left')
+        elif t == 'room_event':
+            room, nick = data.get('room'), data.get('nickname')
+            members = self.rooms.get(room)
+            if members is not None:
+                absent = self.room_absent.setdefault(room, set())
+                if data.get('event') == 'join':
+                    members.add(nick)
+                    absent.discard(nick)
+                else:
+                    members.discard(nick)
+                    if data.get('absent'):
+                        absent.add(nick)
+            self.emit('room', room=room, action=data.get('event'), nickname=nick)
+        elif t == 'room_error':
+            if self.switch_room == data.get('room'):
+                self.switch_room = None
+            self.emit('room', room=data.get('room'), action='error', message=data.get('message'))
+        elif t == 'encrypted_message':
+            sender = data.get('sender')
+            payload = data.get('data') or {}
+            sessions = self.session_keys
+            if payload.get('v') == SESSION_VERSION and sessions and not sessions.has_peer(sender):
+                waiting = self.undecrypted.setdefault(sender, [])
+                if len(waiting) < MAX_PENDING_MESSAGES:
+                    waiting.append((payload, data.get('room')))
+                if len(waiting) == 1:
+                    self.request_keys([sender])
+                return
+            self.emit('message', sender=sender, text=self.decrypt(payload, sender), room=data.get('room'))
+        elif t == 'user_list':
+            self.users = data.get('users', [])
+            self.emit('users', users=self.users)
+        elif t == 'presence_snapshot':
+            self.presence = dict(data.get('users') or {})
+            self.presence_epoch = data.get('epoch')
+            self.presence_version = data.get('version', 0)
+            self.emit_users()
+        elif t == 'presence':
+            if data.get('epoch') == self.presence_epoch and data.get('from') == self.presence_version:
+                apply_changes(self.presence, data.get('changes') or [])
+                self.presence_version = data.get('version', 0)
+                self.emit_users()
+            elif data.get('epoch') != self.presence_epoch or data.get('version', 0) > self.presence_version:
+                self.resync_presence()
+        elif t == 'incoming_call':
+            cid = data.get('call_id')
+            self.incoming_calls[cid] = data
+            self.emit('incoming_call', caller=data.get('caller'), call_id=cid,
+                      encrypted=bool(data.get('call_key')))
+        elif t == 'call_response':
+            self.emit('call_response', status=data.get('status'), message=data.get('message'),
+                      target=data.get('target'), call_id=data.get('call_id'))
+        elif t == 'call_started':
+            self.start_call(data.get('peer'), data.get('call_id'), data.get('slot'), data.get('codec'),
+                            data.get('encrypted'))
+        elif t == 'call_ended':
+            self.incoming_calls.pop(data.get('call_id'), None)
+            self.conference_invites.pop(data.get('call_id'), None)
+            if data.get('call_id') in (None, self.current_call_id):
+                self.end_call(data.get('reason'))
+        elif t == 'conference_invite':
+            cid = data.get('call_id')
+            self.conference_invites[cid] = data
+            self.emit('conference_invite', caller=data.get('caller'), call_id=cid,
+                      members=data.get('members') or [], encrypted=bool(data.get('call_key')))
+        elif t == 'conference_started':
+            self.start_conference(data)
+        elif t == 'media_offer':
+            if self.in_call and data.get('call_id') == self.current_call_id:
+                if data.get('port') and data.get('token'):
+                    threading.Thread(target=self.open_media, args=(data['call_id'], data['port'], data['token']),
+                                     daemon=True).start()
+                else:
+                    self.emit('media', transport='tcp', call_id=data.get('call_id'))
+        elif t == 'conference_member':
+            sources = self.conference_sources
+            if sources is None or data.get('call_id') != self.current_call_id:
+                return
+            nick, source = data.get('nickname'), data.get('source')
+            if data.get('event') == 'join':
+                sources[source] = nick
+            else:
+                sources.pop(source, None)
+                self.streams.pop(source, None)
+                if self.voice_cipher:
+                    self.voice_cipher.forget(nick, source)
+            self.emit('conference', action=data.get('event'), nickname=nick)
+        elif t == 'voice_data':
+            jitter = self.jitter
+            if self.in_call and jitter:
+                jitter.put(self.legacy_seq, ('raw', base64.b64decode(data.get('audio_data'))))
+                self.legacy_seq = (self.legacy_seq + 1) & 0xFFFFFFFF
+
+    def recv(self):
+        while self.connected:
+            try:
+                for kind, payload in self.decoder:
+                    if kind == FRAME_VOICE:
+                        self.receive_voice(payload)
+                    elif kind == FRAME_TEXT:
+                        msg = payload.decode('utf-8').strip()
+                        if msg:
+                            self.process(msg)
+                data = self.client.recv(RECV_SIZE)
+                if not data:
+                    self.conn_lost()
+                    break
+                self.decoder.feed(data)
+            except FrameError as e:
+                self.emit('log', text=f"Protocol error: {e}")
+                self.conn_lost()
+                break
+            except:
+                if self.connected:
+                    self.conn_lost()
+                break
+
+    def send_message(self, text, room=None):
+        room = room or self.room
+        if room is None and not self.rooms:
+            targets = None
+        elif room in self.rooms:
+            targets = [nick for nick in self.rooms[room] | self.room_absent.get(room, set()) if nick != self.nickname]
+            if not targets:
+                return None
+        else:
+            self.emit('log', text=f"⚠️ Not in room {room}!")
+            return None
+        self.message_counter += 1
+        msg_id = self.message_counter
+        self.pending_messages[msg_id] = (text, room, targets, False)
+        while len(self.pending_messages) > MAX_PENDING_MESSAGES:
+            self.pending_messages.popitem(last=False)
+        if targets is None:
+            self.request_keys(None, msg_id)
+        elif not self.send_encrypted(text, [nick for nick in targets if nick in self.peer_public_keys], msg_id, room):
+            self.request_keys(targets, msg_id)
+        return msg_id
+
+    def join_room(self, room, switch=True):
+        if switch:
+            if room in self.rooms:
+                self.room = room
+            else:
+                self.switch_room = room
+        self.send_json({'type': 'room_join', 'room': room})
+
+    def leave_room(self, room=None):
+        self.send_json({'type': 'room_leave', 'room': room or self.room})
+
+    def set_room(self, room):
+        if room not in self.rooms:
+            return False
+        self.room = room
+        return True
+
+    def call(self, target):
+        if target in self.peer_public_keys:
+            self.send_call_request(target)
+        else:
+            self.pending_call = target
+            self.request_keys([target])
+
+    def send_call_request(self, target):
+        request = {'type': 'call_request', 'target': target, 'codecs': self.codecs or available_codecs()}
+        if target in self.peer_public_keys:
+            call_key = os.urandom(CALL_KEY_SIZE)
+            self.call_keys[target] = call_key
+            request['call_key'] = wrap_call_key(self.peer_public_keys[target], call_key)
+        self.send_json(request)
+
+    def answer(self, call_id, accept=True):
+        offer = self.incoming_calls.pop(call_id, None) or {}
+        caller = offer.get('caller')
+        encrypted = False
+        if accept and offer.get('call_key'):
+            try:
+                self.call_keys[caller] = unwrap_call_key(self.private_key, offer['call_key'])
+                encrypted = True
+            except Exception as e:
+                self.emit('log', text=f"❌ Call key error: {e}")
+        self.send_json({'type': 'call_answer', 'call_id': call_id, 'encrypted': encrypted,
+                        'action': 'accept' if accept else 'reject',
+                        'codec': negotiate(offer.get('codecs'), self.codecs)})
+
+    def conference(self, nicknames):
+        missing = [nick for nick in nicknames if nick not in self.peer_public_keys]
+        if missing:
+            self.pending_conference = list(nicknames)
+            self.request_keys(missing)
+        else:
+            self.send_conference(nicknames)
+
+    def send_conference(self, nicknames):
+        if self.conference_sources is None:
+            self.conference_key = os.urandom(CALL_KEY_SIZE)
+        invited = [nick for nick in nicknames if nick in self.peer_public_keys]
+        for nick in nicknames:
+            if nick not in self.peer_public_keys:
+                self.emit('log', text=f"⚠️ {nick}: no key, not invited")
+        if not invited:
+            return
+        request = {'nicknames': invited,
+                   'keys': {nick: wrap_call_key(self.peer_public_keys[nick], self.conference_key) for nick in invited}}
+        if self.conference_sources is not None:
+            request.update(type='conference_invite', call_id=self.current_call_id)
+        else:
+            request.update(type='conference_create', codecs=self.codecs or available_codecs())
+        self.send_json(request)
+
+    def join_conference(self, call_id, accept=True):
+        invite = self.conference_invites.pop(call_id, None)
+        if not accept or not invite or self.in_call:
+            return False
+        self.conference_key = None
+        if invite.get('call_key'):
+            try:
+                self.conference_key = unwrap_call_key(self.private_key, invite['call_key'])
+            except Exception as e:
+                self.emit('log', text=f"❌ Call key error: {e}")
+                return False
+        self.send_json({'type': 'conference_join', 'call_id': call_id})
+        return True
+
+    def hangup(self):
+        if self.in_call and self.conference_sources is not None:
+            try:
+                self.send_json({'type': 'conference_leave', 'call_id': self.current_call_id})
+            except:
+                pass
+        elif self.in_call:
+            try:
+                self.send_json({'type': 'call_end', 'call_id': self.current_call_id})
+            except:
+                pass
+
+    def start_call(self, peer, cid, slot=None, codec=None, encrypted=False):
+        self.current_call_id = cid
+        self.call_peer = peer
+        self.call_slot = slot
+        call_key = self.call_keys.pop(peer, None)
+        self.voice_cipher = VoiceCipher(call_key, cid, self.nickname, peer) if encrypted and call_key else None
+        self.voice_seq = 0
+        self.legacy_seq = 0
+        self.voice_pipeline = VoicePipeline(codec or 'pcm16', self.rate)
+        self.jitter = self.new_jitter()
+        self.vad = VoiceActivityDetector(self.rate, self.chunk) if self.use_vad and slot is not None else None
+        self.comfort = ComfortNoise(self.rate, self.chunk)
+        self.in_call = True
+        self.emit('call_started', peer=peer, call_id=cid, codec=self.voice_pipeline.codec_name,
+                  encrypted=self.voice_cipher is not None)
+        if slot is not None:
+            self.request_media()
+
+    def start_conference(self, data):
+        cid, source = data.get('call_id'), data.get('source')
+        self.current_call_id = cid
+        self.call_peer = None
+        self.call_slot = data.get('slot')
+        self.conference_source = source
+        self.conference_sources = {s: nick for nick, s in (data.get('members') or {}).items()}
+        key = self.conference_key
+        self.voice_cipher = ConferenceCipher(key, cid, self.nickname, source) if key else None
+        self.voice_seq = 0
+        self.voice_pipeline = VoicePipeline(data.get('codec') or 'pcm16', self.rate)
+        self.vad = VoiceActivityDetector(self.rate, self.chunk) if self.use_vad else None
+        self.streams = {}
+        self.jitter = None
+        self.in_call = True
+        self.emit('call_started', peer=None, call_id=cid, codec=self.voice_pipeline.codec_name,
+                  encrypted=self.voice_cipher is not None, conference=True,
+                  members=sorted(nick for nick in self.conference_sources.values() if nick != self.nickname))
+        self.request_media()
+
+    def request_media(self):
+        if self.use_udp and self.connected:
+            self.send_json({'type': 'media_request', 'call_id': self.current_call_id})
+
+    def open_media(self, cid, port, token):
+        try:
+            link = MediaLink(self.server_host, port, bytes.fromhex(token), self.receive_voice)
+        except (OSError, ValueError) as e:
+            link = None
+            self.emit('log', text=f"⚠️ UDP media unavailable: {e}")
+        if link and link.probe() and self.in_call and self.current_call_id == cid:
+            self.media = link
+            self.emit('media', transport='udp', call_id=cid)
+            return
+        if link:
+            link.close()
+        if self.in_call and self.current_call_id == cid:
+            try:
+                self.send_json({'type': 'media_transport', 'call_id': cid, 'transport': 'tcp'})
+            except:
+                pass
+            self.emit('media', transport='tcp', call_id=cid)
+
+    def send_voice(self, pcm):
+        if not self.in_call or not self.connected or not self.client:
+            return False
+        decision = self.vad.process(pcm) if self.vad else None
+        if self.vad and decision is None:
+            return True
+        if self.conference_sources is not None:
+            if decision == COMFORT:
+                return True
+            audio = self.voice_pipeline.encode(pcm)
+            level = audio_level(pcm)
+            cipher = self.voice_cipher
+            if cipher:
+                frame = cipher.seal_frame(self.call_slot, self.voice_seq, self.conference_source, level, audio)
+            else:
+                frame = encode_conference_frame(self.call_slot, self.voice_seq, self.conference_source, level, audio)
+            self.send_voice_frame(frame)
+            self.voice_seq = (self.voice_seq + 1) & 0xFFFFFFFF
+        elif self.call_slot is not None:
+            audio = self.vad.marker() if decision == COMFORT else self.voice_pipeline.encode(pcm)
+            cipher = self.voice_cipher
+            if cipher:
+                self.send_voice_frame(cipher.seal_frame(self.call_slot, self.voice_seq, audio))
+            else:
+                self.send_voice_frame(encode_voice_frame(self.call_slot, self.voice_seq, audio))
+            self.voice_seq = (self.voice_seq + 1) & 0xFFFFFFFF
+        else:
+            self.send_json({'type': 'voice_data', 'call_id': self.current_call_id,
+                            'audio_data': base64.b64encode(pcm).decode('utf-8')})
+        return True
+
+    def send_voice_frame(self, frame):
+        media = self.media
+        if media is None or not media.send(memoryview(frame)[HEADER.size:]):
+            self.send_frame(frame)
+
+    def new_jitter(self):
+        return JitterBuffer(self.chunk * 1000.0 / self.rate, self.jitter_target_ms, self.jitter_max_ms,
+                            resync_ms=HANGOVER_MS)
+
+    def receive_voice(self, payload):
+        sources = self.conference_sources
+        if self.in_call and sources is not None:
+            slot, seq, source, _, audio = parse_conference_frame(payload)
+            nick = sources.get(source)
+            if slot != self.call_slot or nick is None or source == self.conference_source:
+                return
+            cipher = self.voice_cipher
+            if cipher:
+                audio = cipher.open_frame(nick, payload)
+                if audio is None:
+                    return
+            stream = self.streams.get(source)
+            if len(audio) == COMFORT_NOISE_SIZE:
+                if stream:
+                    stream[0].pause()
+                return
+            if stream is None:
+                stream = self.streams[source] = (
+                    self.new_jitter(),
+                    VoicePipeline(self.voice_pipeline.codec_name, self.rate))
+            stream[0].put(seq, audio)
+            self.voice_ready.set()
+            return
+        jitter = self.jitter
+        if self.in_call and jitter:
+            slot, seq, audio = parse_voice_frame(payload)
+            if slot != self.call_slot:
+                return
+            cipher = self.voice_cipher
+            if cipher:
+                audio = cipher.open_frame(slot, seq, audio)
+                if audio is None:
+                    return
+            if len(audio) == COMFORT_NOISE_SIZE:
+                jitter.put(seq, ('comfort', audio))
+                jitter.pause()
+            else:
+                jitter.put(seq, ('codec', audio))
+
+    def next_mix(self, timeout):
+        frames = []
+        for jitter, pipeline in list(self.streams.values()):
+            frame = jitter.pop(timeout=0)
+            if frame:
+                frames.append(pipeline.decode(frame))
+        if frames:
+            return mix(frames)
+        self.voice_ready.clear()
+        self.voice_ready.wait(timeout)
+        return None
+
+    def next_voice(self, timeout=0.1):
+        if self.conference_sources is not None:
+            return self.next_mix(timeout)
+        jitter = self.jitter
+        pipeline = self.voice_pipeline
+        comfort = self.comfort
+        if not jitter:
+            return None
+        frame = jitter.pop(timeout=0 if comfort and comfort.active else timeout)
+        if frame is None:
+            return comfort.fill() if comfort and comfort.active else None
+        if frame is LOST:
+            return comfort.fill() if comfort and comfort.active else self.silence
+        kind, audio = frame
+        if kind == 'comfort':
+            return comfort.update(audio)
+        pcm = audio if kind == 'raw' else pipeline.decode(audio)
+        return comfort.resume(pcm) if comfort else pcm
+
+    def end_call(self, reason):
+        if not self.in_call:
+            return
+
+        self.in_call = False
+        if self.jitter:
+            self.jitter.wake()
+        self.voice_ready.set()
+        media, self.media = self.media, None
+        if media:
+            media.close()
+        self.emit('call_ended', reason=reason, peer=self.call_peer,
+                  jitter=self.jitter.stats() if self.jitter else None,
+                  rejected=self.voice_cipher.rejected if self.voice_cipher else 0,
+                  conference=self.conference_sources is not None,
+                  vad=self.vad.stats() if self.vad else None)
+
+        self.current_call_id = None
+        self.call_peer = None
+        self.call_slot = None
+        self.voice_pipeline = None
+        self.jitter = None
+        self.voice_cipher = None
+        self.vad = None
+        self.comfort = None
+        self.call_keys.clear()
+        self.pending_call = None
+        self.conference_key = None
+        self.conference_source = None
+        self.conference_sources = None
+        self.pending_conference = None
+        self.streams = {}
+
+    def conn_lost(self):
+        self.connected = False
+        if self.in_call:
+            self.end_call("disconnected")
+        if self.client:
+            try:
+                self.client.close()
+            except:
+                pass
+        self.emit('disconnected', reason='lost')
+
+    def disconnect(self):
+        if not self.connected:
+            return
+        self.connected = False
+        if self.in_call:
+            self.end_call("ended")
+        if self.client:
+            try:
+                self.client.shutdown(socket.SHUT_RDWR)
+                self.client.close()
+            except:
+                pass
+        self.emit('disconnected', reason='closed')
@@ -0,0 +1,557 @@
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import Future
+
+from framing import FrameDecoder, FrameError, HEADER, RECV_SIZE
+from outbound import OutboundQueue, DROP_NEWEST, DROP_OLDEST
+
+OP_DELIVER = 16
+OP_VOICE = 17
+OP_DISPATCH = 18
+OP_BROADCAST = 19
+OP_EVENT = 20
+OP_PING = 21
+OP_STORE = 22
+OP_OFFLINE = 23
+OP_ROOM = 24
+
+CHANNELS = ['chat', 'voice']
+ROUTE = struct.Struct('!BH')
+SEQ = struct.Struct('!Q')
+SLOT_BITS = 24
+MAX_MEMBERS = 255
+HEARTBEAT = 1.0
+DEAD_AFTER = 5.0
+TAG_SIZE = 16
+
+BUS_LIMITS = {
+    'chat': {'max_frames': 65536, 'max_bytes': 64 * 1024 * 1024, 'policy': DROP_NEWEST},
+    'voice': {'max_frames': 4096, 'max_bytes': 8 * 1024 * 1024, 'policy': DROP_OLDEST},
+}
+
+def slot_range(index):
+    return max(1, index << SLOT_BITS), ((index + 1) << SLOT_BITS) - 1
+
+def parse_address(text):
+    host, _, port = text.strip().rpartition(':')
+    return (host or '127.0.0.1', int(port))
+
+def unix_addresses(directory, count):
+    return [os.path.join(directory, f"worker-{index}.sock") for index in range(count)]
+
+def bus_frame(op, payload):
+    return HEADER.pack(op, len(payload)) + payload
+
+def event_frame(**event):
+    return bus_frame(OP_EVENT, json.dumps(event).encode('utf-8'))
+
+def sign(secret, nonce, index, role='hello'):
+    return hmac.new(secret, f"{role}:{nonce}:{index}".encode('utf-8'), hashlib.sha256).hexdigest()
+
+def link_key(secret, challenge, nonce, dialer, listener):
+    return hmac.digest(secret, f"link:{challenge}:{nonce}:{dialer}:{listener}".encode('utf-8'), 'sha256')
+
+def read_event(sock, decoder):
+    while True:
+        frame = decoder.next_frame()
+        if frame is not None:
+            return json.loads(frame[1])
+        data = sock.recv(4096)
+        if not data:
+            raise ConnectionError("peer closed during handshake")
+        decoder.feed(data)
+
+class LinkAuth:
+    def __init__(self, key):
+        self.key = key
+        self.seq = 0
+
+    def seal(self, frames):
+        parts = []
+        for frame in frames:
+            self.seq += 1
+            op, length = HEADER.unpack_from(frame)
+            parts.append(HEADER.pack(op, length + TAG_SIZE))
+            parts.append(memoryview(frame)[HEADER.size:])
+            parts.append(hmac.digest(self.key, SEQ.pack(self.seq) + frame, 'sha256')[:TAG_SIZE])
+        return b"".join(parts)
+
+    def open(self, op, payload):
+        if len(payload) < TAG_SIZE:
+            raise ValueError("bus frame without an integrity tag")
+        body = payload[:-TAG_SIZE]
+        self.seq += 1
+        tag = hmac.digest(self.key, SEQ.pack(self.seq) + HEADER.pack(op, len(body)) + body, 'sha256')[:TAG_SIZE]
+        if not hmac.compare_digest(tag, payload[-TAG_SIZE:]):
+            raise ValueError("bus frame failed its integrity check")
+        return body
+
+class RemoteClient:
+    def __init__(self, bus, worker, nickname, status='idle'):
+        self.bus = bus
+        self.worker = worker
+        self.nickname = nickname
+        self.status = status
+
+    def __eq__(self, other):
+        return isinstance(other, RemoteClient) and other.worker == self.worker and other.nickname == self.nickname
+
+    def __hash__(self):
+        return hash((self.worker, self.nickname))
+
+    def send_frame(self, frame, channel='chat'):
+        return self.bus.deliver(self, frame, channel)
+
+    def sendall(self, frame):
+        self.send_frame(frame)
+
+    def close(self):
+        pass
+
+    def fileno(self):
+        return -1
+
+class ClusterBus:
+    def __init__(self, server, index, addresses, secret=b""):
+        if not 0 <= index < len(addresses) <= MAX_MEMBERS:
+            raise ValueError(f"member index {index} outside 0..{len(addresses) - 1} (at most {MAX_MEMBERS})")
+        self.server = server
+        self.index = index
+        self.addresses = addresses
+        self.size = len(addresses)
+        self.secret = secret.encode('utf-8') if isinstance(secret, str) else secret
+        self.transport = 'unix' if isinstance(addresses[index], str) else 'tcp'
+        self.lock = threading.Lock()
+        self.presence = {}
+        self.claims = {}
+        self.pending = {}
+        self.links = {}
+        self.writers = {}
+        self.peers = {i: OutboundQueue(BUS_LIMITS) for i in range(self.size) if i != index}
+        self.listener = None
+        self.running = True
+        server.sessions.set_slot_range(*slot_range(index))
+
+    def open_socket(self, address):
+        if self.transport == 'unix':
+            return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def start(self):
+        address = self.addresses[self.index]
+        self.listener = self.open_socket(address)
+        if self.transport == 'unix':
+            if os.path.exists(address):
+                os.unlink(address)
+        else:
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(address)
+        self.listener.listen(self.size)
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        for index, queue in self.peers.items():
+            threading.Thread(target=self.write_loop, args=(index, queue), daemon=True).start()
+
+    def close(self):
+        self.running = False
+        for queue in self.peers.values():
+            queue.close()
+        try:
+            self.listener.close()
+        except:
+            pass
+
+    def connect(self, index):
+        delay = 0.05
+        while self.running:
+            sock = self.open_socket(self.addresses[index])
+            try:
+                sock.settimeout(DEAD_AFTER)
+                sock.connect(self.addresses[index])
+                return sock
+            except OSError:
+                sock.close()
+                time.sleep(delay)
+                delay = min(1.0, delay * 2)
+        return None
+
+    def handshake(self, sock, index):
+        decoder = FrameDecoder(max_frame_size=4096)
+        challenge = str(read_event(sock, decoder)['nonce'])
+        nonce = secrets.token_hex(16)
+        sock.sendall(event_frame(op='hello', worker=self.index, nonce=nonce,
+                                 auth=sign(self.secret, challenge, self.index)))
+        welcome = read_event(sock, decoder)
+        if not hmac.compare_digest(str(welcome.get('auth')), sign(self.secret, nonce, index, 'welcome')):
+            raise ValueError(f"member {index} failed authentication")
+        link = LinkAuth(link_key(self.secret, challenge, nonce, self.index, index))
+        frames = []
+        for session in self.server.sessions.sessions():
+            frames.append(event_frame(op='join', nickname=session.nickname, status=session.status,
+                                      rooms=self.server.sessions.rooms_of(session.nickname)))
+            record = self.server.key_directory.get(session.nickname)
+            if record:
+                frames.append(event_frame(op='key', nickname=session.nickname, record=record, changed=False))
+        sock.sendall(link.seal(frames))
+        return link
+
+    def write_loop(self, index, queue):
+        unsent = []
+        while self.running and not queue.closed:
+            sock = self.connect(index)
+            if sock is None:
+                return
+            with self.lock:
+                self.writers[index] = sock
+            try:
+                link = self.handshake(sock, index)
+                while True:
+                    if not unsent:
+                        unsent = queue.get(HEARTBEAT)
+                        queue.done()
+                        if not unsent:
+                            if queue.closed:
+                                return
+                            sock.sendall(link.seal([bus_frame(OP_PING, b"")]))
+                            continue
+                    sock.sendall(link.seal(unsent))
+                    unsent = []
+            except (OSError, ValueError, KeyError) as e:
+                if self.running:
+                    print(f"💔 Bus link to member {index} lost: {e}")
+            finally:
+                with self.lock:
+                    if self.writers.get(index) is sock:
+                        del self.writers[index]
+                sock.close()
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.read_loop, args=(conn,), daemon=True).start()
+
+    def read_loop(self, conn):
+        decoder = FrameDecoder()
+        source = link = None
+        nonce = secrets.token_hex(16)
+        try:
+            conn.settimeout(DEAD_AFTER)
+            conn.sendall(event_frame(op='challenge', nonce=nonce))
+            while self.running:
+                data = conn.recv(RECV_SIZE)
+                if not data:
+                    break
+                decoder.feed(data)
+                for op, payload in decoder:
+                    if link is None:
+                        source, link = self.accept_hello(conn, op, payload, nonce)
+                        continue
+                    payload = link.open(op, payload)
+                    if op == OP_EVENT:
+                        self.handle_event(source, json.loads(payload))
+                    elif op != OP_PING:
+                        self.handle_frame(source, op, payload)
+        except (OSError, FrameError, ValueError, KeyError) as e:
+            if self.running:
+                print(f"⚠️ Bus read error from member {source}: {e}")
+        finally:
+            conn.close()
+            if source is not None:
+                self.link_closed(source, conn)
+
+    def accept_hello(self, conn, op, payload, nonce):
+        hello = json.loads(payload) if op == OP_EVENT else {}
+        source = hello.get('worker')
+        if hello.get('op') != 'hello' or source not in self.peers:
+            raise ValueError("expected hello from a cluster member")
+        if not hmac.compare_digest(str(hello.get('auth')), sign(self.secret, nonce, source)):
+            raise ValueError(f"member {source} failed authentication")
+        challenge = str(hello.get('nonce'))
+        conn.sendall(event_frame(op='welcome', auth=sign(self.secret, challenge, self.index, 'welcome')))
+        with self.lock:
+            self.links[source] = conn
+        return source, LinkAuth(link_key(self.secret, nonce, challenge, source, self.index))
+
+    def link_closed(self, source, conn):
+        with self.lock:
+            if self.links.get(source) is not conn:
+                return
+            del self.links[source]
+            lost = [nick for nick, remote in self.presence.items() if remote.worker == source]
+            for nickname in lost:
+                del self.presence[nickname]
+            for nickname in [nick for nick, owner in self.claims.items() if owner == source]:
+                del self.claims[nickname]
+            writer = self.writers.get(source)
+        if writer is not None:
+            try:
+                writer.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self.running:
+            print(f"🛰️ Member {source} unreachable, {len(lost)} users dropped")
+            self.server.remote_member_lost(source, lost)
+
+    def is_up(self, index):
+        return index == self.index or index in self.links
+
+    def handle_frame(self, source, op, payload):
+        server = self.server
+        if op == OP_BROADCAST:
+            server.broadcast_frame(payload)
+            return
+        channel, length = ROUTE.unpack_from(payload)
+        start = ROUTE.size + length
+        nickname = payload[ROUTE.size:start].decode('utf-8')
+        if op == OP_DELIVER:
+            session = server.sessions.get_by_nickname(nickname)
+            if session and session.media_addr is not None and CHANNELS[channel] == 'voice':
+                server.send_voice_frame(session.client, payload[start + HEADER.size:])
+            elif session:
+                server.send_frame_to_client(session.client, payload[start:], CHANNELS[channel])
+        elif op == OP_VOICE:
+            server.handle_voice_frame(self.client(source, nickname), payload[start:])
+        elif op == OP_DISPATCH:
+            server.dispatch_message(self.client(source, nickname), payload[start:])
+        elif op == OP_STORE:
+            if server.offline:
+                server.offline.put(nickname, payload[start:])
+        elif op == OP_OFFLINE:
+            server.receive_offline(nickname, SEQ.unpack_from(payload, start)[0], payload[start + SEQ.size:])
+        elif op == OP_ROOM:
+            server.room_broadcast(nickname, payload[start:], relay=False)
+
+    def handle_event(self, source, event):
+        op = event['op']
+        server = self.server
+        nickname = event.get('nickname')
+        if op == 'join':
+            remote = RemoteClient(self, source, nickname, event.get('status', 'idle'))
+            with self.lock:
+                self.presence[nickname] = remote
+                if self.home(nickname) == self.index:
+                    self.claims.setdefault(nickname, source)
+            for room in event.get('rooms') or []:
+                server.remote_room_changed(remote, room, True)
+            server.presence_update(nickname)
+        elif op == 'leave':
+            with self.lock:
+                remote = self.presence.get(nickname)
+                if remote and remote.worker == source:
+                    del self.presence[nickname]
+                if self.claims.get(nickname) == source:
+                    del self.claims[nickname]
+            server.remote_client_left(nickname)
+        elif op == 'room':
+            server.remote_room_changed(self.client(source, nickname), event['room'], event['joined'])
+        elif op == 'status':
+            remote = self.remote(nickname)
+            if remote:
+                remote.status = event['status']
+                server.presence_update(nickname)
+        elif op == 'set_status':
+            session = server.sessions.get_by_nickname(nickname)
+            if session:
+                server.set_call_status(session.client, event['status'], event.get('call_id'))
+        elif op == 'key':
+            server.remote_key_published(nickname, event['record'], event['changed'])
+        elif op == 'end_call':
+            server.end_call(event['call_id'], event['reason'])
+        elif op == 'offline_fetch':
+            server.serve_offline(source, nickname, event.get('ack', 0))
+        elif op == 'claim':
+            self.send_event(source, op='claim_reply', id=event['id'], granted=self.grant(nickname, source))
+        elif op == 'claim_reply':
+            self.resolve_claim(event['id'], event['granted'])
+
+    def send(self, index, op, payload, channel='chat'):
+        queue = self.peers.get(index)
+        if queue is None:
+            return False
+        return queue.put(bus_frame(op, payload), channel)
+
+    def send_event(self, index, **event):
+        self.send(index, OP_EVENT, json.dumps(event).encode('utf-8'))
+
+    def publish(self, **event):
+        payload = json.dumps(event).encode('utf-8')
+        for index in self.peers:
+            self.send(index, OP_EVENT, payload)
+
+    def routed(self, op, index, nickname, body, channel='chat'):
+        name = nickname.encode('utf-8')
+        return self.send(index, op, ROUTE.pack(CHANNELS.index(channel), len(name)) + name + body, channel)
+
+    def deliver(self, remote, frame, channel='chat'):
+        return self.routed(OP_DELIVER, remote.worker, remote.nickname, frame, channel)
+
+    def broadcast(self, frame):
+        for index in self.peers:
+            self.send(index, OP_BROADCAST, frame)
+
+    def room_broadcast(self, workers, room, frame):
+        for index in workers:
+            self.routed(OP_ROOM, index, room, frame)
+
+    def remote(self, nickname):
+        with self.lock:
+            return self.presence.get(nickname)
+
+    def client(self, worker, nickname):
+        remote = self.remote(nickname)
+        if remote is not None and remote.worker == worker:
+            return remote
+        return RemoteClient(self, worker, nickname)
+
+    def home(self, nickname):
+        return zlib.crc32(nickname.encode('utf-8')) % self.size
+
+    def grant(self, nickname, worker):
+        with self.lock:
+            owner = self.claims.get(nickname)
+            if owner is not None and owner != worker:
+                return False
+            self.claims[nickname] = worker
+            return True
+
+    def claim_future(self, nickname, timeout=2.0):
+        future = Future()
+        home = self.home(nickname)
+        if self.remote(nickname) is not None:
+            future.set_result(False)
+        elif home == self.index:
+            future.set_result(self.grant(nickname, self.index))
+        elif not self.is_up(home):
+            future.set_result(True)
+        else:
+            request = uuid.uuid4().hex
+            self.pending[request] = future
+            self.send_event(home, op='claim', nickname=nickname, id=request)
+            self.server.timers.schedule(timeout, self.resolve_claim, request, False)
+        return future
+
+    def resolve_claim(self, request, granted):
+        future = self.pending.pop(request, None)
+        if future is not None:
+            future.set_result(granted)
+
+    def claim(self, nickname, timeout=2.0):
+        return self.claim_future(nickname, timeout).result()
+
+    def join(self, nickname):
+        self.publish(op='join', nickname=nickname, status='idle')
+
+    def leave(self, nickname):
+        if self.home(nickname) == self.index:
+            with self.lock:
+                if self.claims.get(nickname) == self.index:
+                    del self.claims[nickname]
+        self.publish(op='leave', nickname=nickname)
+
+    def room(self, nickname, room, joined):
+        self.publish(op='room', nickname=nickname, room=room, joined=joined)
+
+    def status(self, nickname, status):
+        self.publish(op='status', nickname=nickname, status=status)
+
+    def set_status(self, remote, status, call_id=None):
+        self.send_event(remote.worker, op='set_status', nickname=remote.nickname, status=status, call_id=call_id)
+
+    def publish_key(self, nickname, record, changed):
+        self.publish(op='key', nickname=nickname, record=record, changed=changed)
+
+    def store_offline(self, nickname, payload):
+        return self.routed(OP_STORE, self.home(nickname), nickname, payload)
+
+    def fetch_offline(self, nickname, ack=0):
+        self.send_event(self.home(nickname), op='offline_fetch', nickname=nickname, ack=ack)
+
+    def send_offline(self, index, nickname, seq, chunk):
+        return self.routed(OP_OFFLINE, index, nickname, SEQ.pack(seq) + chunk)
+
+    def new_call_id(self):
+        return f"{self.index}-{uuid.uuid4()}"
+
+    def call_owner(self, call_id):
+        try:
+            owner = int(str(call_id).split('-', 1)[0])
+        except ValueError:
+            return None
+        return owner if owner != self.index and owner in self.peers else None
+
+    def forward_call(self, client, call_id, data):
+        owner = self.call_owner(call_id)
+        if owner is None:
+            return False
+        nickname = self.server.get_nickname_by_client(client)
+        return self.routed(OP_DISPATCH, owner, nickname, json.dumps(data).encode('utf-8'))
+
+    def end_call(self, call_id, reason):
+        owner = self.call_owner(call_id)
+        if owner is not None:
+            self.send_event(owner, op='end_call', call_id=call_id, reason=reason)
+
+    def forward_voice(self, client, slot, payload):
+        owner = slot >> SLOT_BITS
+        if owner == self.index or owner not in self.peers:
+            return False
+        session = self.server.sessions.get(client)
+        if session is None:
+            return False
+        return self.routed(OP_VOICE, owner, session.nickname, payload, 'voice')
+
+def run_workers(argv, workers, directory=None, secret=None):
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise RuntimeError("SO_REUSEPORT is not available on this platform")
+    if not 1 < workers <= MAX_MEMBERS:
+        raise ValueError(f"workers must be between 2 and {MAX_MEMBERS}")
+    owned = directory is None
+    directory = directory or tempfile.mkdtemp(prefix='e2e-chat-bus-')
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chat_server.py')
+    env = dict(os.environ, E2E_CHAT_CLUSTER_SECRET=secret or secrets.token_hex(32))
+    procs = []
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for index in range(workers):
+            procs.append(subprocess.Popen([sys.executable, script] + list(argv) +
+                                          ['--worker-index', str(index), '--bus-dir', directory], env=env))
+        print(f"🧩 {workers} workers sharing the port, bus at {directory}")
+        while all(proc.poll() is None for proc in procs):
+            time.sleep(0.5)
+        print("💥 A worker exited, stopping the others")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if owned:
+            shutil.rmtree(directory, ignore_errors=True)
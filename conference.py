@@ -0,0 +1,122 @@
+import heapq
+import threading
+import time
+
+SPEAKERS = 3
+MAX_PARTICIPANTS = 100
+RANK_INTERVAL = 0.02
+SPEAKER_HOLD = 0.3
+HYSTERESIS = 6
+SILENT_LEVEL = 127
+MAX_SOURCE = 0xFFFF
+
+class Participant:
+    __slots__ = ('client', 'nickname', 'source', 'loudness', 'heard_at')
+
+    def __init__(self, client, nickname, source):
+        self.client = client
+        self.nickname = nickname
+        self.source = source
+        self.loudness = 0.0
+        self.heard_at = 0.0
+
+class Conference:
+    def __init__(self, call_id, codec, speakers=SPEAKERS, max_participants=MAX_PARTICIPANTS):
+        self.call_id = call_id
+        self.codec = codec
+        self.speakers = speakers
+        self.max_participants = max_participants
+        self.lock = threading.Lock()
+        self.participants = {}
+        self.by_client = {}
+        self.invited = set()
+        self.next_source = 1
+        self.ranked = []
+        self.ranked_at = 0.0
+        self.targets = {}
+        self.forwarded = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.participants)
+
+    def add(self, client, nickname):
+        with self.lock:
+            if client in self.by_client or len(self.participants) >= self.max_participants:
+                return None
+            if self.next_source > MAX_SOURCE:
+                return None
+            participant = Participant(client, nickname, self.next_source)
+            self.next_source += 1
+            self.participants[participant.source] = participant
+            self.by_client[client] = participant
+            self.invited.discard(nickname)
+            self.targets = {}
+            self.ranked_at = 0.0
+            return participant
+
+    def remove(self, client):
+        with self.lock:
+            participant = self.by_client.pop(client, None)
+            if participant is None:
+                return None
+            del self.participants[participant.source]
+            if participant in self.ranked:
+                self.ranked = [p for p in self.ranked if p is not participant]
+            self.targets = {}
+            self.ranked_at = 0.0
+            return participant
+
+    def get(self, client):
+        return self.by_client.get(client)
+
+    def clients(self):
+        with self.lock:
+            return list(self.by_client)
+
+    def roster(self):
+        with self.lock:
+            return {p.nickname: p.source for p in self.participants.values()}
+
+    def route(self, client, source, level, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            participant = self.participants.get(source)
+            if participant is None or participant.client != client:
+                return None
+            loudness = SILENT_LEVEL - min(level, SILENT_LEVEL)
+            if loudness >= participant.loudness or now - participant.heard_at > SPEAKER_HOLD:
+                participant.loudness = loudness
+            else:
+                participant.loudness += (loudness - participant.loudness) * 0.2
+            participant.heard_at = now
+            if not self.speakers:
+                targets = self.targets.get(source)
+                if targets is None:
+                    targets = self.targets[source] = [other for other in self.by_client if other != client]
+                self.forwarded += len(targets)
+                return targets
+            if now - self.ranked_at >= RANK_INTERVAL:
+                self.rank(now)
+            targets = self.targets.get(source)
+            if targets is None:
+                self.dropped += 1
+                return []
+            self.forwarded += len(targets)
+            return targets
+
+    def rank(self, now):
+        speakers = self.speakers
+        current = set(self.ranked[:speakers])
+        active = [p for p in self.participants.values() if p.loudness > 0 and now - p.heard_at <= SPEAKER_HOLD]
+        ranked = heapq.nlargest(speakers + 1, active,
+                                key=lambda p: p.loudness + (HYSTERESIS if p in current else 0))
+        self.ranked_at = now
+        if ranked == self.ranked and self.targets:
+            return
+        self.ranked = ranked
+        everyone = list(self.by_client)
+        top = [p.client for p in ranked[:speakers]]
+        self.targets = {p.source: [client for client in everyone if client != p.client] for p in ranked[:speakers]}
+        if len(ranked) > speakers:
+            self.targets[ranked[speakers].source] = top
@@ -0,0 +1,273 @@
+import base64
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from cryptography.exceptions import InvalidSignature, InvalidTag
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.backends import default_backend
+
+from framing import CONFERENCE_HEADER, FRAME_VOICE, HEADER, VOICE_HEADER
+from keydir import fingerprint
+
+OAEP = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+PSS = padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH)
+SESSION_VERSION = 2
+NONCE_SIZE = 12
+TAG_SIZE = 16
+CALL_KEY_SIZE = 32
+VOICE_NONCE = struct.Struct('!8xI')
+
+def b64(data):
+    return base64.b64encode(data).decode('utf-8')
+
+def encrypt_envelope(msg, public_keys):
+    if not public_keys:
+        return None
+    aes_key = os.urandom(32)
+    iv = os.urandom(16)
+    cipher = Cipher(algorithms.AES(aes_key), modes.CFB(iv), backend=default_backend())
+    enc = cipher.encryptor()
+    enc_msg = enc.update(msg.encode('utf-8')) + enc.finalize()
+    return {'keys': {peer: b64(key.encrypt(aes_key, OAEP)) for peer, key in public_keys.items()},
+            'iv': b64(iv),
+            'encrypted_message': b64(enc_msg)}
+
+def decrypt_message(private_key, data):
+    aes_key = private_key.decrypt(base64.b64decode(data['encrypted_key']), OAEP)
+    iv = base64.b64decode(data['iv'])
+    enc_msg = base64.b64decode(data['encrypted_message'])
+    cipher = Cipher(algorithms.AES(aes_key), modes.CFB(iv), backend=default_backend())
+    dec = cipher.decryptor()
+    return (dec.update(enc_msg) + dec.finalize()).decode('utf-8')
+
+def hkdf(key, info):
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info.encode('utf-8'),
+                backend=default_backend()).derive(key)
+
+def wrap_call_key(public_key, call_key):
+    return b64(public_key.encrypt(call_key, OAEP))
+
+def unwrap_call_key(private_key, wrapped):
+    call_key = private_key.decrypt(base64.b64decode(wrapped), OAEP)
+    if len(call_key) != CALL_KEY_SIZE:
+        raise ValueError("bad call key")
+    return call_key
+
+class VoiceCipher:
+    def __init__(self, call_key, call_id, local, remote):
+        self.send_aead = AESGCM(hkdf(call_key, f"e2e-chat voice|{call_id}|{local}>{remote}"))
+        self.recv_aead = AESGCM(hkdf(call_key, f"e2e-chat voice|{call_id}|{remote}>{local}"))
+        self.send_nonce = bytearray(NONCE_SIZE)
+        self.recv_nonce = bytearray(NONCE_SIZE)
+        self.buffer = bytearray(HEADER.size + VOICE_HEADER.size + 4096 + TAG_SIZE)
+        self.in_place = hasattr(self.send_aead, 'encrypt_into')
+        self.sealed = 0
+        self.rejected = 0
+
+    def seal_frame(self, slot, seq, audio):
+        size = HEADER.size + VOICE_HEADER.size + len(audio) + TAG_SIZE
+        if len(self.buffer) < size:
+            self.buffer = bytearray(size)
+        frame = memoryview(self.buffer)[:size]
+        HEADER.pack_into(frame, 0, FRAME_VOICE, size - HEADER.size)
+        VOICE_HEADER.pack_into(frame, HEADER.size, slot, seq)
+        VOICE_NONCE.pack_into(self.send_nonce, 0, seq)
+        aad = frame[HEADER.size:HEADER.size + VOICE_HEADER.size]
+        body = HEADER.size + VOICE_HEADER.size
+        if self.in_place:
+            self.send_aead.encrypt_into(self.send_nonce, audio, aad, frame[body:])
+        else:
+            frame[body:] = self.send_aead.encrypt(bytes(self.send_nonce), bytes(audio), bytes(aad))
+        self.sealed += 1
+        return frame
+
+    def open_frame(self, slot, seq, data):
+        VOICE_NONCE.pack_into(self.recv_nonce, 0, seq)
+        nonce = self.recv_nonce
+        if not self.in_place:
+            nonce, data = bytes(nonce), bytes(data)
+        try:
+            return self.recv_aead.decrypt(nonce, data, VOICE_HEADER.pack(slot, seq))
+        except InvalidTag:
+            self.rejected += 1
+            return None
+
+class ConferenceCipher:
+    def __init__(self, conference_key, call_id, local, source):
+        self.key = conference_key
+        self.call_id = call_id
+        self.send_aead = AESGCM(self.sender_key(local, source))
+        self.recv_aeads = {}
+        self.send_nonce = bytearray(NONCE_SIZE)
+        self.recv_nonce = bytearray(NONCE_SIZE)
+        self.sealed = 0
+        self.rejected = 0
+
+    def sender_key(self, nickname, source):
+        return hkdf(self.key, f"e2e-chat conference|{self.call_id}|{nickname}|{source}")
+
+    def seal_frame(self, slot, seq, source, level, audio):
+        header = CONFERENCE_HEADER.pack(slot, seq, source, level)
+        VOICE_NONCE.pack_into(self.send_nonce, 0, seq)
+        body = self.send_aead.encrypt(bytes(self.send_nonce), bytes(audio), header)
+        self.sealed += 1
+        return HEADER.pack(FRAME_VOICE, len(header) + len(body)) + header + body
+
+    def open_frame(self, nickname, payload):
+        slot, seq, source, _ = CONFERENCE_HEADER.unpack_from(payload)
+        aead = self.recv_aeads.get((nickname, source))
+        if aead is None:
+            aead = self.recv_aeads[nickname, source] = AESGCM(self.sender_key(nickname, source))
+        VOICE_NONCE.pack_into(self.recv_nonce, 0, seq)
+        try:
+            return aead.decrypt(bytes(self.recv_nonce), payload[CONFERENCE_HEADER.size:],
+                                payload[:CONFERENCE_HEADER.size])
+        except InvalidTag:
+            self.rejected += 1
+            return None
+
+    def forget(self, nickname, source):
+        self.recv_aeads.pop((nickname, source), None)
+
+class SessionKeys:
+    def __init__(self, nickname, signing_key=None, lifetime=3600, max_messages=1 << 20, max_keys=256):
+        self.nickname = nickname
+        self.signing_key = signing_key
+        self.lifetime = lifetime
+        self.max_messages = max_messages
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.private = X25519PrivateKey.generate()
+        self.public_raw = self.private.public_key().public_bytes(encoding=serialization.Encoding.Raw,
+                                                                 format=serialization.PublicFormat.Raw)
+        self.peers = {}
+        self.cache = OrderedDict()
+        self.epoch = 0
+        self.epoch_started = time.time()
+        self.epoch_messages = 0
+        self.derived = 0
+
+    def public_record(self):
+        record = {'dh_key': b64(self.public_raw)}
+        if self.signing_key is not None:
+            record['dh_sig'] = b64(self.signing_key.sign(self.public_raw, PSS, hashes.SHA256()))
+        return record
+
+    def set_peer(self, nickname, dh_key, dh_sig=None, verify_key=None):
+        raw = base64.b64decode(dh_key)
+        if verify_key is not None:
+            if not dh_sig:
+                return False
+            try:
+                verify_key.verify(base64.b64decode(dh_sig), raw, PSS, hashes.SHA256())
+            except InvalidSignature:
+                return False
+        with self.lock:
+            if self.peers.get(nickname, (None,))[0] != raw:
+                self.peers[nickname] = (raw, X25519PublicKey.from_public_bytes(raw))
+        return True
+
+    def forget_peer(self, nickname):
+        with self.lock:
+            self.peers.pop(nickname, None)
+
+    def has_peer(self, nickname):
+        return nickname in self.peers
+
+    def current_epoch(self):
+        if (self.epoch_messages >= self.max_messages or
+                time.time() - self.epoch_started >= self.lifetime):
+            self.epoch = (self.epoch + 1) & 0xFFFFFFFF
+            self.epoch_started = time.time()
+            self.epoch_messages = 0
+        self.epoch_messages += 1
+        return self.epoch
+
+    def key_for(self, peer, sender, epoch):
+        with self.lock:
+            raw, public = self.peers[peer]
+            ident = (peer, raw, sender, epoch)
+            aead = self.cache.get(ident)
+            if aead is not None:
+                self.cache.move_to_end(ident)
+                return aead
+            shared = self.private.exchange(public)
+            aead = AESGCM(hkdf(shared, f"e2e-chat session v{SESSION_VERSION}|{sender}|{epoch}"))
+            self.cache[ident] = aead
+            self.derived += 1
+            while len(self.cache) > self.max_keys:
+                self.cache.popitem(last=False)
+            return aead
+
+    def seal(self, msg, peers):
+        peers = [p for p in peers if p in self.peers]
+        if not peers:
+            return None
+        with self.lock:
+            epoch = self.current_epoch()
+        content_key = AESGCM.generate_key(bit_length=256)
+        nonce = os.urandom(NONCE_SIZE)
+        aad = f"{self.nickname}|{epoch}".encode('utf-8')
+        body = AESGCM(content_key).encrypt(nonce, msg.encode('utf-8'), aad)
+        keys = {}
+        for peer in peers:
+            wrap_nonce = os.urandom(NONCE_SIZE)
+            wrapped = self.key_for(peer, self.nickname, epoch).encrypt(
+                wrap_nonce, content_key, f"{self.nickname}|{peer}|{epoch}".encode('utf-8'))
+            keys[peer] = b64(wrap_nonce + wrapped)
+        return {'v': SESSION_VERSION, 'epoch': epoch, 'keys': keys, 'iv': b64(nonce),
+                'encrypted_message': b64(body)}
+
+    def open(self, sender, data):
+        epoch = int(data['epoch'])
+        wrapped = base64.b64decode(data['encrypted_key'])
+        content_key = self.key_for(sender, sender, epoch).decrypt(
+            wrapped[:NONCE_SIZE], wrapped[NONCE_SIZE:], f"{sender}|{self.nickname}|{epoch}".encode('utf-8'))
+        body = AESGCM(content_key).decrypt(base64.b64decode(data['iv']), base64.b64decode(data['encrypted_message']),
+                                           f"{sender}|{epoch}".encode('utf-8'))
+        return body.decode('utf-8')
+
+    def stats(self):
+        return {'peers': len(self.peers), 'cached_keys': len(self.cache), 'derived': self.derived,
+                'epoch': self.epoch}
+
+class KeyCache:
+    def __init__(self, max_keys=1024):
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.parsed = 0
+
+    def load(self, record):
+        fp = fingerprint(record)
+        with self.lock:
+            entry = self.entries.get(fp)
+            if entry is not None:
+                self.entries.move_to_end(fp)
+                return fp, entry[0], entry[1]
+        key = serialization.load_pem_public_key(record['public_key'].encode('utf-8'), backend=default_backend())
+        dh_ok = False
+        if record.get('dh_key') and record.get('dh_sig'):
+            try:
+                key.verify(base64.b64decode(record['dh_sig']), base64.b64decode(record['dh_key']), PSS,
+                           hashes.SHA256())
+                dh_ok = True
+            except InvalidSignature:
+                pass
+        with self.lock:
+            self.entries[fp] = (key, dh_ok)
+            self.parsed += 1
+            while len(self.entries) > self.max_keys:
+                self.entries.popitem(last=False)
+        return fp, key, dh_ok
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,214 @@
+import os
+import socket
+import struct
+import time
+
+FRAME_TEXT = 0
+FRAME_VOICE = 1
+
+HEADER = struct.Struct('!BI')
+VOICE_HEADER = struct.Struct('!II')
+CONFERENCE_HEADER = struct.Struct('!IIHB')
+MEDIA_HEADER = struct.Struct('!8sI')
+MEDIA_TOKEN_SIZE = 8
+NO_TOKEN = bytes(MEDIA_TOKEN_SIZE)
+MAX_FRAME_SIZE = 4 * 1024 * 1024
+RECV_SIZE = 65536
+WRITE_BATCH_BYTES = 256 * 1024
+SOCKET_OPTIONS = {'nodelay': True, 'sndbuf': 0, 'rcvbuf': 0}
+
+try:
+    IOV_MAX = min(1024, os.sysconf('SC_IOV_MAX'))
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 16
+
+class FrameError(ValueError):
+    pass
+
+def encode_frame(payload, kind=FRAME_TEXT):
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameError(f"frame too large: {len(payload)} bytes")
+    return HEADER.pack(kind, len(payload)) + payload
+
+def encode_voice_frame(slot, seq, audio):
+    return HEADER.pack(FRAME_VOICE, VOICE_HEADER.size + len(audio)) + VOICE_HEADER.pack(slot, seq) + audio
+
+def parse_voice_frame(payload):
+    slot, seq = VOICE_HEADER.unpack_from(payload)
+    return slot, seq, payload[VOICE_HEADER.size:]
+
+def encode_conference_frame(slot, seq, source, level, audio):
+    return (HEADER.pack(FRAME_VOICE, CONFERENCE_HEADER.size + len(audio)) +
+            CONFERENCE_HEADER.pack(slot, seq, source, level) + audio)
+
+def parse_conference_frame(payload):
+    slot, seq, source, level = CONFERENCE_HEADER.unpack_from(payload)
+    return slot, seq, source, level, payload[CONFERENCE_HEADER.size:]
+
+def media_clock():
+    return int(time.monotonic() * 1000) & 0xFFFFFFFF
+
+def encode_media_packet(token, stamp, payload=b""):
+    return MEDIA_HEADER.pack(token, stamp) + payload
+
+def parse_media_packet(packet):
+    token, stamp = MEDIA_HEADER.unpack_from(packet)
+    return token, stamp, packet[MEDIA_HEADER.size:]
+
+class FrameDecoder:
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = b""
+        self.offset = 0
+        self.max_frame_size = max_frame_size
+
+    def feed(self, data):
+        buffer = self.buffer
+        if self.offset == len(buffer):
+            self.buffer = bytes(data)
+            self.offset = 0
+        elif type(buffer) is bytearray:
+            buffer += data
+        else:
+            pending = len(buffer) - self.offset
+            if pending < HEADER.size or HEADER.size + HEADER.unpack_from(buffer, self.offset)[1] <= pending + len(data):
+                self.buffer = buffer[self.offset:] + data
+            else:
+                self.buffer = bytearray(buffer[self.offset:])
+                self.buffer += data
+            self.offset = 0
+
+    def pending(self):
+        return len(self.buffer) - self.offset
+
+    def compact(self):
+        if self.offset and type(self.buffer) is bytearray:
+            del self.buffer[:self.offset]
+            self.offset = 0
+
+    def next_frame(self):
+        start = self.offset + HEADER.size
+        if start > len(self.buffer):
+            self.compact()
+            return None
+
+        kind, length = HEADER.unpack_from(self.buffer, self.offset)
+        if length > self.max_frame_size:
+            raise FrameError(f"frame too large: {length} bytes")
+
+        end = start + length
+        if end > len(self.buffer):
+            self.compact()
+            return None
+
+        if type(self.buffer) is bytes:
+            payload = self.buffer[start:end]
+        else:
+            with memoryview(self.buffer) as view:
+                payload = bytes(view[start:end])
+        self.offset = end
+        return kind, payload
+
+    def frames(self):
+        buffer = self.buffer
+        size = len(buffer)
+        offset = self.offset
+        header_size = HEADER.size
+        unpack_from = HEADER.unpack_from
+        max_frame_size = self.max_frame_size
+        frames = []
+
+        if type(buffer) is bytes:
+            if not offset and size >= header_size:
+                kind, length = unpack_from(buffer)
+                if header_size + length == size and length <= max_frame_size:
+                    self.buffer = b""
+                    return [(kind, buffer[header_size:])]
+            while offset + header_size <= size:
+                kind, length = unpack_from(buffer, offset)
+                if length > max_frame_size:
+                    self.offset = offset
+                    raise FrameError(f"frame too large: {length} bytes")
+                start = offset + header_size
+                offset = start + length
+                if offset > size:
+                    offset = start - header_size
+                    break
+                frames.append((kind, buffer[start:offset]))
+            self.offset = offset
+            return frames
+
+        with memoryview(buffer) as view:
+            while offset + header_size <= size:
+                kind, length = unpack_from(buffer, offset)
+                if length > max_frame_size:
+                    self.offset = offset
+                    raise FrameError(f"frame too large: {length} bytes")
+                end = offset + header_size + length
+                if end > size:
+                    break
+                frames.append((kind, bytes(view[offset + header_size:end])))
+                offset = end
+
+        self.offset = offset
+        self.compact()
+        return frames
+
+    def __iter__(self):
+        return iter(self.frames())
+
+def send_frame(sock, payload, kind=FRAME_TEXT):
+    sock.sendall(encode_frame(payload, kind))
+
+def tune_socket(sock, options=None):
+    options = SOCKET_OPTIONS if options is None else options
+    if sock.family in (socket.AF_INET, socket.AF_INET6) and options.get('nodelay') is not None:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if options['nodelay'] else 0)
+    if options.get('sndbuf'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, options['sndbuf'])
+    if options.get('rcvbuf'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, options['rcvbuf'])
+
+def send_frames(sock, frames, on_timeout=None):
+    if len(frames) == 1 or not hasattr(sock, 'sendmsg'):
+        views = [memoryview(b"".join(frames))]
+    else:
+        views = [memoryview(frame) for frame in frames]
+    calls = 0
+    start = 0
+    while start < len(views):
+        try:
+            if len(views) - start == 1:
+                sent = sock.send(views[start])
+            else:
+                sent = sock.sendmsg(views[start:start + IOV_MAX])
+        except socket.timeout:
+            if on_timeout:
+                on_timeout()
+            continue
+        calls += 1
+        while sent:
+            size = len(views[start])
+            if sent < size:
+                views[start] = views[start][sent:]
+                break
+            sent -= size
+            start += 1
+    return calls
+
+def read_frame(sock, decoder):
+    while True:
+        frame = decoder.next_frame()
+        if frame is not None:
+            return frame
+        data = sock.recv(RECV_SIZE)
+        if not data:
+            raise ConnectionError("connection closed")
+        decoder.feed(data)
+
+def read_text(sock, decoder):
+    kind, payload = read_frame(sock, decoder)
+    if kind != FRAME_TEXT:
+        raise FrameError(f"expected text frame, got kind {kind}")
+    return payload.decode('utf-8')
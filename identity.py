@@ -0,0 +1,121 @@
+import os
+import threading
+from concurrent.futures import Future
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.backends import default_backend
+
+IDENTITY_DIR = os.path.join(os.path.expanduser('~'), '.e2e_chat')
+IDENTITY_FILE = 'identity.pem'
+PASSPHRASE_FILE = 'identity.pass'
+KEY_SIZE = 2048
+
+def generate_identity():
+    return rsa.generate_private_key(public_exponent=65537, key_size=KEY_SIZE, backend=default_backend())
+
+def load_private_key(pem, passphrase):
+    try:
+        key = serialization.load_pem_private_key(pem, passphrase, backend=default_backend(),
+                                                 unsafe_skip_rsa_key_validation=True)
+    except TypeError:
+        return serialization.load_pem_private_key(pem, passphrase, backend=default_backend())
+    check = b"e2e-chat identity check"
+    try:
+        signature = key.sign(check, padding.PKCS1v15(), hashes.SHA256())
+        key.public_key().verify(signature, check, padding.PKCS1v15(), hashes.SHA256())
+    except InvalidSignature:
+        raise ValueError("identity key failed its self-check")
+    return key
+
+def write_private(path, data):
+    tmp = f"{path}.tmp"
+    try:
+        os.unlink(tmp)
+    except FileNotFoundError:
+        pass
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        os.write(fd, data)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp, path)
+
+class IdentityStore:
+    def __init__(self, directory=None, passphrase=None, prompt=None):
+        self.directory = directory or os.environ.get('E2E_CHAT_IDENTITY_DIR') or IDENTITY_DIR
+        self.path = os.path.join(self.directory, IDENTITY_FILE)
+        self.passphrase_path = os.path.join(self.directory, PASSPHRASE_FILE)
+        self.passphrase = passphrase if passphrase is not None else os.environ.get('E2E_CHAT_PASSPHRASE')
+        self.prompt = prompt
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def secret(self):
+        if not self.passphrase and self.prompt:
+            self.passphrase = self.prompt()
+        if not self.passphrase:
+            raise ValueError(f"no passphrase for {self.path}: set E2E_CHAT_PASSPHRASE")
+        return self.passphrase.encode('utf-8')
+
+    def load(self):
+        with open(self.path, 'rb') as f:
+            pem = f.read()
+        if not os.path.exists(self.passphrase_path):
+            return load_private_key(pem, self.secret())
+        with open(self.passphrase_path, 'rb') as f:
+            key = load_private_key(pem, f.read().strip())
+        try:
+            secret = self.secret()
+        except ValueError as e:
+            print(f"⚠️ Identity key left on its legacy passphrase file: {e}")
+            return key
+        self.save(key, secret)
+        os.unlink(self.passphrase_path)
+        return key
+
+    def save(self, key, secret=None):
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        secret = secret or self.secret()
+        pem = key.private_bytes(encoding=serialization.Encoding.PEM, format=serialization.PrivateFormat.PKCS8,
+                                encryption_algorithm=serialization.BestAvailableEncryption(secret))
+        write_private(self.path, pem)
+
+    def load_or_create(self):
+        if self.exists():
+            return self.load()
+        key = generate_identity()
+        self.save(key)
+        return key
+
+    def start(self):
+        future = Future()
+        if self.exists():
+            try:
+                future.set_result(self.load())
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        try:
+            secret = self.secret()
+        except ValueError as e:
+            secret = None
+            print(f"⚠️ Identity key will not be saved: {e}")
+
+        def generate():
+            try:
+                key = generate_identity()
+                try:
+                    if secret:
+                        self.save(key, secret)
+                except OSError as e:
+                    print(f"⚠️ Identity key not saved: {e}")
+                future.set_result(key)
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=generate, daemon=True).start()
+        return future
@@ -0,0 +1,166 @@
+import math
+import threading
+import time
+from collections import deque
+
+SEQ_MOD = 1 << 32
+SEQ_HALF = 1 << 31
+LOST = b""
+
+def seq_diff(a, b):
+    diff = (a - b) % SEQ_MOD
+    return diff - SEQ_MOD if diff >= SEQ_HALF else diff
+
+class JitterBuffer:
+    def __init__(self, frame_ms, target_ms=60, max_ms=300, adaptive=True, window=200, quantile=0.95, resync_ms=None):
+        self.frame_ms = float(frame_ms)
+        self.resync_ms = resync_ms
+        self.min_frames = max(1, int(math.ceil(target_ms / self.frame_ms)))
+        self.max_frames = max(self.min_frames, int(math.ceil(max_ms / self.frame_ms)))
+        self.capacity = self.max_frames * 2
+        self.adaptive = adaptive
+        self.window = window
+        self.quantile = quantile
+        self.cond = threading.Condition()
+        self.reset()
+
+    def reset(self):
+        with self.cond:
+            self.frames = {}
+            self.next_seq = None
+            self.playing = False
+            self.started = False
+            self.target = self.min_frames
+            self.playout = self.min_frames
+            self.jitter_ms = 0.0
+            self.last_transit = None
+            self.last_arrival = None
+            self.resync = False
+            self.transits = deque(maxlen=self.window)
+            self.received = 0
+            self.played = 0
+            self.lost = 0
+            self.late = 0
+            self.duplicates = 0
+            self.overflows = 0
+            self.underruns = 0
+            self.trimmed = 0
+            self.stretched = 0
+            self.max_depth = 0
+            self.cond.notify_all()
+
+    def put(self, seq, payload, now=None):
+        now = time.monotonic() if now is None else now
+        with self.cond:
+            self.received += 1
+            self.update_jitter(seq, now)
+            if self.next_seq is None:
+                self.next_seq = seq
+            ahead = seq_diff(seq, self.next_seq)
+            if ahead < 0:
+                if self.started or -ahead > self.capacity:
+                    self.late += 1
+                    return False
+                self.next_seq = seq
+            elif ahead > self.capacity * 4:
+                self.frames.clear()
+                self.next_seq = seq
+                self.playing = False
+            if seq in self.frames:
+                self.duplicates += 1
+                return False
+            if len(self.frames) >= self.capacity:
+                self.overflows += 1
+                return False
+            self.frames[seq] = payload
+            self.max_depth = max(self.max_depth, len(self.frames))
+            if self.playing or len(self.frames) >= self.target:
+                self.cond.notify()
+            return True
+
+    def pause(self):
+        with self.cond:
+            self.resync = True
+
+    def update_jitter(self, seq, now):
+        gap = (self.resync_ms is not None and self.last_arrival is not None and
+               (now - self.last_arrival) * 1000.0 > self.resync_ms)
+        if self.resync or gap:
+            self.last_transit = None
+            self.transits.clear()
+            self.resync = False
+        self.last_arrival = now
+        transit = now * 1000.0 - seq * self.frame_ms
+        if self.last_transit is not None:
+            delta = abs(transit - self.last_transit)
+            if delta < self.max_frames * self.frame_ms * 4:
+                self.jitter_ms += (delta - self.jitter_ms) / 16.0
+        self.last_transit = transit
+        transits = self.transits
+        if transits and abs(transit - transits[-1]) > self.max_frames * self.frame_ms * 4:
+            transits.clear()
+        transits.append(transit)
+        if self.adaptive and len(transits) >= 8:
+            ordered = sorted(transits)
+            spread = ordered[int(self.quantile * (len(ordered) - 1))] - ordered[0]
+            wanted = int(math.ceil(spread / self.frame_ms)) + 1
+            self.target = min(self.max_frames, max(self.min_frames, wanted))
+
+    def pop(self, timeout=None):
+        with self.cond:
+            if not self.playing:
+                if len(self.frames) < self.target:
+                    self.cond.wait(timeout)
+                if len(self.frames) < self.target:
+                    return None
+                self.playing = self.started = True
+                self.playout = self.target
+                if self.next_seq not in self.frames:
+                    self.next_seq = min(self.frames, key=lambda s: seq_diff(s, self.next_seq))
+            if not self.frames:
+                self.playing = False
+                self.underruns += 1
+                return None
+            if self.target > self.playout and len(self.frames) <= self.target:
+                self.playout += 1
+                self.stretched += 1
+                return LOST
+            while len(self.frames) > self.target and (self.target + 1 < self.playout or
+                                                      len(self.frames) > self.target * 2):
+                if self.frames.pop(self.next_seq, None) is None:
+                    break
+                self.playout = max(self.target, self.playout - 1)
+                self.trimmed += 1
+                self.next_seq = (self.next_seq + 1) % SEQ_MOD
+            payload = self.frames.pop(self.next_seq, None)
+            self.next_seq = (self.next_seq + 1) % SEQ_MOD
+            if payload is None:
+                self.lost += 1
+                return LOST
+            self.played += 1
+            return payload
+
+    def depth(self):
+        return len(self.frames)
+
+    def stats(self):
+        with self.cond:
+            return {
+                'depth': len(self.frames),
+                'max_depth': self.max_depth,
+                'target_ms': round(self.target * self.frame_ms, 1),
+                'jitter_ms': round(self.jitter_ms, 1),
+                'received': self.received,
+                'played': self.played,
+                'lost': self.lost,
+                'late': self.late,
+                'duplicates': self.duplicates,
+                'overflows': self.overflows,
+                'underruns': self.underruns,
+                'trimmed': self.trimmed,
+                'stretched': self.stretched,
+            }
+
+    def wake(self):
+        with self.cond:
+            self.cond.notify_all()
@@ -0,0 +1,99 @@
+import hashlib
+import threading
+
+KEY_FIELDS = ['public_key', 'dh_key', 'dh_sig']
+MAX_LOOKUP = 512
+MAX_OFFLINE = 4096
+
+def fingerprint(record):
+    digest = hashlib.sha256()
+    for field in KEY_FIELDS:
+        digest.update(field.encode('utf-8') + b"=" + (record.get(field) or "").encode('utf-8') + b"\n")
+    return digest.hexdigest()
+
+class KeyDirectory:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.records = {}
+        self.watchers = {}
+        self.watching = {}
+        self.offline = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, nickname):
+        return nickname in self.records
+
+    def get(self, nickname):
+        record = self.records.get(nickname)
+        if record is not None and nickname in self.offline:
+            return dict(record, offline=True)
+        return record
+
+    def is_offline(self, nickname):
+        return nickname in self.offline
+
+    def publish(self, nickname, data):
+        record = {field: data[field] for field in KEY_FIELDS if data.get(field)}
+        record['fingerprint'] = fingerprint(record)
+        with self.lock:
+            previous = self.records.get(nickname)
+            self.records[nickname] = record
+            self.offline.pop(nickname, None)
+            changed = previous is not None and previous['fingerprint'] != record['fingerprint']
+            return record, changed
+
+    def lookup(self, requester, nicknames=None, known=None):
+        known = known or {}
+        found = {}
+        unchanged = []
+        missing = []
+        with self.lock:
+            if nicknames is None:
+                nicknames = [nick for nick in self.records if nick != requester]
+                missing = [nick for nick in known if nick not in self.records]
+            for nick in nicknames[:MAX_LOOKUP]:
+                record = self.records.get(nick)
+                if record is None:
+                    missing.append(nick)
+                    continue
+                self.watchers.setdefault(nick, set()).add(requester)
+                self.watching.setdefault(requester, set()).add(nick)
+                if nick in self.offline:
+                    found[nick] = dict(record, offline=True)
+                elif known.get(nick) == record['fingerprint']:
+                    unchanged.append(nick)
+                else:
+                    found[nick] = record
+        return found, unchanged, missing
+
+    def watchers_of(self, nickname):
+        with self.lock:
+            return list(self.watchers.get(nickname, ()))
+
+    def remove(self, nickname, keep=False):
+        with self.lock:
+            for target in self.watching.pop(nickname, ()):
+                watchers = self.watchers.get(target)
+                if watchers:
+                    watchers.discard(nickname)
+            if keep and nickname in self.records:
+                self.offline[nickname] = None
+                while len(self.offline) > MAX_OFFLINE:
+                    self.remove(next(iter(self.offline)))
+                return list(self.watchers.get(nickname, ()))
+            self.records.pop(nickname, None)
+            self.offline.pop(nickname, None)
+            return list(self.watchers.pop(nickname, ()))
+
+    def others(self, nickname):
+        with self.lock:
+            return [nick for nick in self.records if nick != nickname]
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+            self.watchers.clear()
+            self.watching.clear()
+            self.offline.clear()
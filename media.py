@@ -0,0 +1,140 @@
+import os
+import socket
+import threading
+
+from framing import MEDIA_HEADER, MEDIA_TOKEN_SIZE, NO_TOKEN, media_clock
+
+PROBE_ATTEMPTS = 5
+PROBE_INTERVAL = 0.2
+SOCKET_BUFFER = 1024 * 1024
+MAX_DATAGRAM = 65535
+
+class MediaRelay:
+    def __init__(self, server, host='0.0.0.0', port=0):
+        self.server = server
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+            try:
+                self.sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER)
+            except OSError:
+                pass
+        self.sock.bind((host, port))
+        self.port = self.sock.getsockname()[1]
+        self.tokens = {}
+        self.lock = threading.Lock()
+        self.running = False
+        self.received = 0
+        self.rejected = 0
+        self.sent = 0
+
+    def start(self):
+        self.running = True
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+
+    def issue(self, client):
+        token = os.urandom(MEDIA_TOKEN_SIZE)
+        with self.lock:
+            self.tokens[token] = client
+        return token
+
+    def revoke(self, token):
+        with self.lock:
+            self.tokens.pop(token, None)
+
+    def run(self):
+        server = self.server
+        tokens = self.tokens
+        while self.running:
+            try:
+                packet, address = self.sock.recvfrom(MAX_DATAGRAM)
+            except OSError:
+                if not self.running:
+                    break
+                continue
+            self.received += 1
+            if len(packet) < MEDIA_HEADER.size:
+                self.rejected += 1
+                continue
+            token, stamp = MEDIA_HEADER.unpack_from(packet)
+            client = tokens.get(token)
+            if client is None:
+                self.rejected += 1
+                continue
+            try:
+                server.handle_media_packet(client, address, stamp, packet[MEDIA_HEADER.size:])
+            except Exception as e:
+                print(f"⚠️ Media packet error: {e}")
+
+    def send(self, address, stamp, payload):
+        try:
+            self.sock.sendmsg([MEDIA_HEADER.pack(NO_TOKEN, stamp), payload], [], 0, address)
+            self.sent += 1
+            return True
+        except OSError:
+            return False
+
+    def close(self):
+        self.running = False
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+class MediaLink:
+    def __init__(self, host, port, token, on_payload):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(0.5)
+        self.sock.connect((host, port))
+        self.token = token
+        self.on_payload = on_payload
+        self.ready = threading.Event()
+        self.running = True
+        self.sent = 0
+        self.received = 0
+        self.last_stamp = None
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def probe(self, attempts=PROBE_ATTEMPTS, interval=PROBE_INTERVAL):
+        for _ in range(attempts):
+            try:
+                self.sock.send(MEDIA_HEADER.pack(self.token, media_clock()))
+            except OSError:
+                pass
+            if self.ready.wait(interval):
+                return True
+        return False
+
+    def send(self, payload):
+        try:
+            self.sock.sendmsg([MEDIA_HEADER.pack(self.token, media_clock()), payload])
+            self.sent += 1
+            return True
+        except OSError:
+            return False
+
+    def run(self):
+        while self.running:
+            try:
+                packet = self.sock.recv(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except OSError:
+                if not self.running:
+                    break
+                continue
+            if len(packet) < MEDIA_HEADER.size:
+                continue
+            if len(packet) == MEDIA_HEADER.size:
+                self.ready.set()
+                continue
+            self.received += 1
+            self.last_stamp = MEDIA_HEADER.unpack_from(packet)[1]
+            self.on_payload(packet[MEDIA_HEADER.size:])
+
+    def close(self):
+        self.running = False
+        try:
+            self.sock.close()
+        except OSError:
+            pass
@@ -0,0 +1,345 @@
+import bisect
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = tuple(4 ** n for n in range(3, 14))
+
+class Counter:
+    def __init__(self, callback=None):
+        self.lock = threading.Lock()
+        self.callback = callback
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.lock.acquire()
+        self.value += amount
+        self.lock.release()
+
+    def get(self):
+        return self.callback() if self.callback else self.value
+
+class Gauge:
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.callback() if self.callback else self.value
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        self.lock.acquire()
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+        self.lock.release()
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q, counts=None, count=None):
+        if counts is None:
+            counts, _, count = self.snapshot()
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for index, n in enumerate(counts):
+            seen += n
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+KINDS = {'counter': Counter, 'gauge': Gauge, 'histogram': Histogram}
+
+class Family:
+    def __init__(self, name, kind, help_text, labels=(), **options):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.options = options
+        self.lock = threading.Lock()
+        self.children = {}
+        if not self.label_names:
+            self.children[()] = KINDS[kind](**options)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = self.children[values] = KINDS[self.kind](**self.options)
+        return child
+
+    def __getattr__(self, attr):
+        if attr in ('inc', 'set', 'get', 'observe', 'snapshot', 'quantile'):
+            return getattr(self.children[()], attr)
+        raise AttributeError(attr)
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def format_number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families = {}
+        self.started = time.time()
+
+    def register(self, name, kind, help_text, labels=(), **options):
+        with self.lock:
+            family = self.families.get(name)
+            if family is None:
+                family = self.families[name] = Family(name, kind, help_text, labels, **options)
+            return family
+
+    def counter(self, name, help_text, labels=(), callback=None):
+        return self.register(name, 'counter', help_text, labels, callback=callback)
+
+    def gauge(self, name, help_text, labels=(), callback=None):
+        return self.register(name, 'gauge', help_text, labels, callback=callback)
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(name, 'histogram', help_text, labels, buckets=buckets)
+
+    def render_prometheus(self):
+        lines = []
+        with self.lock:
+            families = list(self.families.values())
+        for family in families:
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for values, child in sorted(family.children.items()):
+                if family.kind != 'histogram':
+                    lines.append(f"{family.name}{format_labels(family.label_names, values)} "
+                                 f"{format_number(child.get())}")
+                    continue
+                counts, total, count = child.snapshot()
+                cumulative = 0
+                for bound, n in zip(child.buckets + (float('inf'),), counts):
+                    cumulative += n
+                    le = ('le', format_number(bound))
+                    lines.append(f"{family.name}_bucket{format_labels(family.label_names, values, le)} {cumulative}")
+                lines.append(f"{family.name}_sum{format_labels(family.label_names, values)} {format_number(total)}")
+                lines.append(f"{family.name}_count{format_labels(family.label_names, values)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def as_dict(self):
+        result = {'uptime_seconds': round(time.time() - self.started, 1), 'metrics': {}}
+        with self.lock:
+            families = list(self.families.values())
+        for family in families:
+            samples = []
+            for values, child in sorted(family.children.items()):
+                sample = {'labels': dict(zip(family.label_names, values))}
+                if family.kind == 'histogram':
+                    counts, total, count = child.snapshot()
+                    sample.update({'count': count, 'sum': total})
+                    for name, q in (('p50', 0.5), ('p99', 0.99), ('p999', 0.999)):
+                        bound = child.quantile(q, counts, count)
+                        sample[name] = None if bound == float('inf') else bound
+                else:
+                    sample['value'] = child.get()
+                samples.append(sample)
+            result['metrics'][family.name] = {'type': family.kind, 'help': family.help, 'samples': samples}
+        return result
+
+    def render_json(self):
+        return json.dumps(self.as_dict(), default=str)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path in ('/metrics', '/'):
+            body = self.registry.render_prometheus().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif path in ('/metrics.json', '/stats'):
+            body = self.registry.render_json().encode('utf-8')
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def serve_metrics(registry, host='127.0.0.1', port=9100):
+    handler = type('BoundMetricsHandler', (MetricsHandler,), {'registry': registry})
+    server = MetricsHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+class ServerMetrics:
+    def __init__(self, server, registry=None):
+        self.registry = registry = registry or MetricsRegistry()
+        self.frame_bytes = registry.counter('chat_frame_bytes_total', "Payload bytes received by message type",
+                                            ['type'])
+        self.handler_seconds = registry.histogram('chat_handler_seconds',
+                                                  "Time spent handling one frame; _count is frames received",
+                                                  ['type'])
+        self.outbound_wait = registry.histogram('chat_outbound_wait_seconds',
+                                                "Time the oldest frame of a batch waited in an outbound queue")
+        self.sent_frames = registry.counter('chat_sent_frames_total', "Frames written to client sockets")
+        self.sent_bytes = registry.counter('chat_sent_bytes_total', "Bytes written to client sockets")
+        self.presence_batches = registry.counter('chat_presence_batches_total', "Presence delta batches sent")
+        self.presence_bytes = registry.counter('chat_presence_bytes_total', "Presence delta bytes queued to subscribers")
+        self.socket_writes = registry.counter('chat_socket_writes_total',
+                                              "Write calls on client sockets (send/sendmsg; asyncio: buffered writes)")
+        self.connections = registry.counter('chat_connections_total', "Clients registered")
+        self.auth_failures = registry.counter('chat_auth_failures_total', "Rejected passwords")
+        self.call_setup = registry.histogram('chat_call_setup_seconds', "call_request to accepted call_answer")
+        self.call_bytes = registry.histogram('chat_call_voice_bytes', "Voice bytes relayed per finished call",
+                                             buckets=SIZE_BUCKETS)
+        self.call_seconds = registry.histogram('chat_call_duration_seconds', "Duration of answered calls",
+                                               buckets=(1, 5, 15, 30, 60, 300, 900, 1800, 3600, 7200))
+        self.calls_ended = registry.counter('chat_calls_ended_total', "Finished calls by reason", ['reason'])
+        self.voice_bytes = registry.counter('chat_voice_bytes_total', "Voice payload bytes relayed")
+        self.conference_frames = registry.counter('chat_conference_frames_total',
+                                                  "Conference frames received, by whether a speaker slot forwarded them",
+                                                  ['result'])
+        self.conference_forwarded = self.conference_frames.labels('forwarded')
+        self.conference_dropped = self.conference_frames.labels('dropped')
+        self.conference_copies = registry.counter('chat_conference_copies_total',
+                                                  "Conference frame copies queued to participants")
+        self.retired_dropped = {}
+        self.dropped = registry.counter('chat_outbound_dropped_frames_total', "Frames dropped by outbound queue policy",
+                                        ['channel'])
+        registry.gauge('chat_sessions_active', "Connected clients", callback=lambda: len(server.sessions))
+        registry.gauge('chat_calls_active', "Ringing or active calls", callback=lambda: len(server.sessions.calls))
+        registry.gauge('chat_outbound_queued_frames', "Frames waiting in outbound queues",
+                       callback=lambda: sum(s.outbound.depth() for s in server.sessions.sessions() if s.outbound))
+        registry.gauge('chat_rooms_active', "Rooms with at least one member", callback=lambda: len(server.sessions.rooms))
+        registry.gauge('chat_offline_messages', "Messages waiting in the offline store",
+                       callback=lambda: server.offline.messages if getattr(server, 'offline', None) else 0)
+        registry.gauge('chat_media_packets_received', "UDP media packets received by the relay",
+                       callback=lambda: server.media.received if getattr(server, 'media', None) else 0)
+        registry.gauge('chat_media_packets_rejected', "UDP media packets with an unknown token or no header",
+                       callback=lambda: server.media.rejected if getattr(server, 'media', None) else 0)
+        for channel in ('chat', 'voice'):
+            self.dropped.labels(channel).callback = self.dropped_counter(server, channel)
+        self.types = {}
+
+    def dropped_counter(self, server, channel):
+        def total():
+            live = sum(s.outbound.dropped[channel] for s in server.sessions.sessions() if s.outbound)
+            return live + self.retired_dropped.get(channel, 0)
+        return total
+
+    def frame(self, msg_type, size, seconds):
+        children = self.types.get(msg_type)
+        if children is None:
+            children = self.types[msg_type] = (self.handler_seconds.labels(msg_type),
+                                               self.frame_bytes.labels(msg_type))
+        children[0].observe(seconds)
+        children[1].inc(size)
+
+    def presence_flushed(self, subscribers, size):
+        self.presence_batches.inc()
+        self.presence_bytes.inc(subscribers * size)
+    
+    def flushed(self, wait, frames, writes=1):
+        self.outbound_wait.observe(wait)
+        self.socket_writes.inc(writes)
+        self.sent_frames.inc(len(frames))
+        self.sent_bytes.inc(sum(len(frame) for frame in frames))
+
+    def voice(self, call_info, size):
+        counter = call_info.get('voice_bytes')
+        if counter is not None:
+            counter.inc(size)
+        self.voice_bytes.inc(size)
+
+    def conference_frame(self, targets):
+        if targets:
+            self.conference_forwarded.inc()
+            self.conference_copies.inc(targets)
+        else:
+            self.conference_dropped.inc()
+
+    def call_answered(self, call_info):
+        call_info['voice_bytes'] = Counter()
+        call_info['answered_at'] = time.time()
+        self.call_setup.observe(call_info['answered_at'] - call_info['start_time'])
+
+    def call_ended(self, call_info, reason):
+        self.calls_ended.labels(reason).inc()
+        if call_info.get('answered_at'):
+            self.call_seconds.observe(time.time() - call_info['answered_at'])
+            self.call_bytes.observe(call_info['voice_bytes'].get())
+
+    def session_closed(self, session):
+        if session.outbound:
+            for channel, dropped in session.outbound.dropped.items():
+                self.retired_dropped[channel] = self.retired_dropped.get(channel, 0) + dropped
+
+class NullMetric:
+    def inc(self, amount=1):
+        pass
+
+class NullMetrics:
+    registry = None
+    connections = NullMetric()
+    auth_failures = NullMetric()
+
+    def frame(self, msg_type, size, seconds):
+        pass
+
+    def presence_flushed(self, subscribers, size):
+        pass
+    
+    def flushed(self, wait, frames, writes=1):
+        pass
+
+    def voice(self, call_info, size):
+        pass
+
+    def conference_frame(self, targets):
+        pass
+
+    def call_answered(self, call_info):
+        pass
+
+    def call_ended(self, call_info, reason):
+        pass
+
+    def session_closed(self, session):
+        pass
@@ -0,0 +1,305 @@
+import collections
+import itertools
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+RECORD = struct.Struct('!IBIQdH')
+MESSAGE = 0
+DELIVERED = 1
+SEGMENT_BYTES = 8 * 1024 * 1024
+MAX_BYTES = 256 * 1024 * 1024
+MAX_MESSAGES = 200000
+MAX_PER_USER = 5000
+TTL = 7 * 24 * 3600
+SWEEP_INTERVAL = 60.0
+
+class Segment:
+    def __init__(self, number, path, size=0):
+        self.number = number
+        self.path = path
+        self.size = size
+        self.live = 0
+        self.live_bytes = 0
+        self.nicknames = set()
+        self.map = None
+        self.mapped = 0
+
+    def read(self, offset, length):
+        end = offset + length
+        if end > self.mapped:
+            if self.map is not None:
+                self.map.close()
+            with open(self.path, 'rb') as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mapped = len(self.map)
+        return self.map[offset:end]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+            self.mapped = 0
+
+def encode_record(kind, seq, expires, nickname, payload=b""):
+    name = nickname.encode('utf-8')
+    body = RECORD.pack(0, kind, len(payload), seq, expires, len(name))[4:] + name + payload
+    return struct.pack('!I', zlib.crc32(body)) + body
+
+def scan(data, start=0):
+    offset = start
+    while offset + RECORD.size <= len(data):
+        crc, kind, length, seq, expires, name_length = RECORD.unpack_from(data, offset)
+        end = offset + RECORD.size + name_length + length
+        if end > len(data) or zlib.crc32(data[offset + 4:end]) != crc:
+            break
+        name_end = offset + RECORD.size + name_length
+        yield offset, kind, seq, expires, data[offset + RECORD.size:name_end].decode('utf-8'), name_end, length
+        offset = end
+
+class OfflineStore:
+    def __init__(self, directory, ttl=TTL, max_bytes=MAX_BYTES, segment_bytes=SEGMENT_BYTES,
+                 max_messages=MAX_MESSAGES, max_per_user=MAX_PER_USER):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.segment_bytes = min(segment_bytes, max(1, max_bytes // 4))
+        self.max_messages = max_messages
+        self.max_per_user = max_per_user
+        self.lock = threading.RLock()
+        self.index = {}
+        self.delivered = {}
+        self.segments = collections.OrderedDict()
+        self.messages = 0
+        self.next_seq = 1
+        self.dropped = 0
+        self.expired = 0
+        self.last_sweep = time.time()
+        self.active = None
+        self.file = None
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.load()
+
+    def segment_path(self, number):
+        return os.path.join(self.directory, f"seg-{number:08d}.log")
+
+    def load(self):
+        numbers = sorted(int(name[4:12]) for name in os.listdir(self.directory)
+                         if name.startswith('seg-') and name.endswith('.log'))
+        now = time.time()
+        found = []
+        for number in numbers:
+            segment = Segment(number, self.segment_path(number))
+            self.segments[number] = segment
+            size = os.path.getsize(segment.path)
+            data = segment.read(0, size) if size else b""
+            valid = 0
+            for offset, kind, seq, expires, nickname, start, length in scan(data):
+                valid = start + length
+                self.next_seq = max(self.next_seq, seq + 1)
+                if kind == DELIVERED:
+                    self.delivered[nickname] = max(self.delivered.get(nickname, 0), seq)
+                else:
+                    segment.nicknames.add(nickname)
+                    if expires > now:
+                        found.append((seq, nickname, segment, start, length, expires))
+            if valid < size:
+                segment.close()
+                print(f"⚠️ Offline store: truncating damaged tail of {segment.path} at {valid}")
+                with open(segment.path, 'r+b') as f:
+                    f.truncate(valid)
+            segment.size = valid
+        for seq, nickname, segment, start, length, expires in found:
+            if seq > self.delivered.get(nickname, 0):
+                self.add_entry(nickname, (seq, segment, start, length, expires))
+        self.open_segment(numbers[-1] + 1 if numbers else 1)
+        self.collect()
+
+    def open_segment(self, number):
+        if self.file is not None:
+            self.file.close()
+        segment = self.segments[number] = Segment(number, self.segment_path(number))
+        self.file = open(segment.path, 'ab')
+        self.active = segment
+
+    def append(self, record):
+        if self.active.size + len(record) > self.segment_bytes and self.active.size:
+            self.open_segment(self.active.number + 1)
+        segment = self.active
+        offset = segment.size
+        self.file.write(record)
+        self.file.flush()
+        segment.size += len(record)
+        return segment, offset
+
+    def disk_bytes(self):
+        return sum(segment.size for segment in self.segments.values())
+
+    def put(self, nickname, payload):
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        with self.lock:
+            queue = self.index.get(nickname)
+            if self.messages >= self.max_messages and not queue:
+                self.dropped += 1
+                return False
+            if queue and (len(queue) >= self.max_per_user or self.messages >= self.max_messages):
+                self.remove_entry(queue.popleft())
+                self.dropped += 1
+            seq = self.next_seq
+            self.next_seq += 1
+            expires = time.time() + self.ttl
+            record = encode_record(MESSAGE, seq, expires, nickname, payload)
+            segment, offset = self.append(record)
+            self.add_entry(nickname, (seq, segment, offset + len(record) - len(payload), len(payload), expires))
+            if self.disk_bytes() > self.max_bytes:
+                self.evict()
+            return True
+
+    def add_entry(self, nickname, entry):
+        self.index.setdefault(nickname, collections.deque()).append(entry)
+        segment = entry[1]
+        segment.live += 1
+        segment.live_bytes += entry[3]
+        segment.nicknames.add(nickname)
+        self.messages += 1
+
+    def remove_entry(self, entry):
+        entry[1].live -= 1
+        entry[1].live_bytes -= entry[3]
+        self.messages -= 1
+
+    def pending(self, nickname):
+        queue = self.index.get(nickname)
+        return len(queue) if queue else 0
+
+    def peek(self, nickname, limit=256, max_bytes=1024 * 1024):
+        batch = []
+        size = 0
+        now = time.time()
+        with self.lock:
+            queue = self.index.get(nickname)
+            while queue and queue[0][4] <= now:
+                self.remove_entry(queue.popleft())
+                self.expired += 1
+            for seq, segment, offset, length, expires in itertools.islice(queue or (), limit):
+                batch.append((seq, segment.read(offset, length)))
+                size += length
+                if size >= max_bytes:
+                    break
+        return batch
+
+    def ack(self, nickname, seq):
+        with self.lock:
+            queue = self.index.get(nickname)
+            while queue and queue[0][0] <= seq:
+                self.remove_entry(queue.popleft())
+            if queue is not None and not queue:
+                del self.index[nickname]
+            self.delivered[nickname] = max(self.delivered.get(nickname, 0), seq)
+            self.append(encode_record(DELIVERED, seq, 0.0, nickname))
+            self.collect()
+
+    def sweep(self, force=False):
+        now = time.time()
+        if not force and now - self.last_sweep < SWEEP_INTERVAL:
+            return 0
+        self.last_sweep = now
+        removed = 0
+        with self.lock:
+            for nickname in list(self.index):
+                queue = self.index[nickname]
+                while queue and queue[0][4] <= now:
+                    self.remove_entry(queue.popleft())
+                    removed += 1
+                if not queue:
+                    del self.index[nickname]
+            self.expired += removed
+            self.collect()
+        return removed
+
+    def collect(self):
+        for segment in list(self.segments.values()):
+            if segment is self.active:
+                break
+            if segment.live_bytes * 2 < segment.size:
+                self.compact(segment)
+
+    def still_stored(self, nickname, segment):
+        return any(nickname in other.nicknames for other in self.segments.values() if other is not segment)
+
+    def compact(self, segment):
+        data = segment.read(0, segment.size) if segment.size else b""
+        carried = set()
+        positions = {}
+        for offset, kind, seq, expires, nickname, start, length in scan(data):
+            if kind == DELIVERED:
+                seq = self.delivered.get(nickname)
+                if seq is not None and nickname not in carried and self.still_stored(nickname, segment):
+                    carried.add(nickname)
+                    self.append(encode_record(DELIVERED, seq, 0.0, nickname))
+                continue
+            queue = self.index.get(nickname)
+            if not queue or seq <= self.delivered.get(nickname, 0):
+                continue
+            if nickname not in positions:
+                positions[nickname] = {entry[0]: i for i, entry in enumerate(queue) if entry[1] is segment}
+            position = positions[nickname].get(seq)
+            if position is None:
+                continue
+            record = encode_record(MESSAGE, seq, expires, nickname, data[start:start + length])
+            target, at = self.append(record)
+            segment.live -= 1
+            segment.live_bytes -= length
+            queue[position] = (seq, target, at + len(record) - length, length, expires)
+            target.live += 1
+            target.live_bytes += length
+            target.nicknames.add(nickname)
+        self.drop_segment(segment)
+        for nickname in segment.nicknames:
+            if nickname not in self.index and not self.still_stored(nickname, None):
+                self.delivered.pop(nickname, None)
+
+    def evict(self):
+        while self.disk_bytes() > self.max_bytes and len(self.segments) > 1:
+            segment = next(iter(self.segments.values()))
+            if segment is self.active:
+                break
+            for nickname in list(self.index):
+                queue = self.index[nickname]
+                kept = collections.deque(entry for entry in queue if entry[1] is not segment)
+                lost = len(queue) - len(kept)
+                if lost:
+                    self.messages -= lost
+                    self.dropped += lost
+                    if kept:
+                        self.index[nickname] = kept
+                    else:
+                        del self.index[nickname]
+            segment.live = segment.live_bytes = 0
+            self.compact(segment)
+            print(f"⚠️ Offline store over {self.max_bytes} bytes, evicted segment {segment.number}")
+
+    def drop_segment(self, segment):
+        segment.close()
+        del self.segments[segment.number]
+        try:
+            os.unlink(segment.path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self.lock:
+            return {'messages': self.messages, 'users': len(self.index), 'segments': len(self.segments),
+                    'disk_bytes': self.disk_bytes(), 'dropped': self.dropped, 'expired': self.expired}
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            for segment in self.segments.values():
+                segment.close()
@@ -0,0 +1,137 @@
+import collections
+import threading
+import time
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+DISCONNECT = 'disconnect'
+POLICIES = [DROP_OLDEST, DROP_NEWEST, DISCONNECT]
+
+CHANNELS = ['voice', 'chat']
+
+DEFAULT_LIMITS = {
+    'chat': {'max_frames': 1024, 'max_bytes': 8 * 1024 * 1024, 'policy': DISCONNECT},
+    'voice': {'max_frames': 32, 'max_bytes': 1024 * 1024, 'policy': DROP_OLDEST},
+}
+
+def copy_limits(limits=None):
+    merged = {channel: dict(limit) for channel, limit in DEFAULT_LIMITS.items()}
+    for channel, limit in (limits or {}).items():
+        merged.setdefault(channel, {}).update(limit)
+    return merged
+
+class OutboundQueue:
+    def __init__(self, limits=None, on_ready=None):
+        self.limits = copy_limits(limits)
+        self.on_ready = on_ready
+        self.cond = threading.Condition(threading.Lock())
+        self.queues = {channel: collections.deque() for channel in CHANNELS}
+        self.queued_bytes = {channel: 0 for channel in CHANNELS}
+        self.dropped = {channel: 0 for channel in CHANNELS}
+        self.max_depth = 0
+        self.sent_frames = 0
+        self.closed = False
+        self.overflowed = False
+        self.busy = False
+        self.first_put = None
+        self.last_wait = 0.0
+
+    def depth(self):
+        return sum(len(q) for q in self.queues.values())
+
+    def empty(self):
+        return self.depth() == 0
+
+    def put(self, frame, channel='chat'):
+        limit = self.limits[channel]
+        queue = self.queues[channel]
+        with self.cond:
+            if self.closed:
+                return False
+            if len(queue) >= limit['max_frames'] or self.queued_bytes[channel] + len(frame) > limit['max_bytes']:
+                policy = limit['policy']
+                if policy == DISCONNECT:
+                    self.overflowed = True
+                    return False
+                self.dropped[channel] += 1
+                if policy == DROP_NEWEST or not queue:
+                    return True
+                self.queued_bytes[channel] -= len(queue.popleft())
+            was_empty = self.depth() == 0
+            if was_empty:
+                self.first_put = time.perf_counter()
+            queue.append(frame)
+            self.queued_bytes[channel] += len(frame)
+            depth = self.depth()
+            if depth > self.max_depth:
+                self.max_depth = depth
+            self.cond.notify()
+        if was_empty and self.on_ready:
+            self.on_ready()
+        return True
+
+    def take_locked(self, max_bytes=None):
+        frames = []
+        size = 0
+        for channel in CHANNELS:
+            queue = self.queues[channel]
+            if max_bytes is None or channel == 'voice':
+                frames.extend(queue)
+                size += self.queued_bytes[channel]
+                queue.clear()
+                self.queued_bytes[channel] = 0
+                continue
+            while queue and (size < max_bytes or not frames):
+                frame = queue.popleft()
+                frames.append(frame)
+                size += len(frame)
+                self.queued_bytes[channel] -= len(frame)
+        if frames and self.first_put is not None:
+            now = time.perf_counter()
+            self.last_wait = now - self.first_put
+            self.first_put = now if self.depth() else None
+        self.sent_frames += len(frames)
+        return frames
+
+    def take(self, max_bytes=None):
+        with self.cond:
+            return self.take_locked(max_bytes)
+
+    def get(self, timeout=None, max_bytes=None):
+        with self.cond:
+            while not self.closed and self.depth() == 0:
+                if not self.cond.wait(timeout):
+                    break
+            frames = self.take_locked(max_bytes)
+            self.busy = bool(frames)
+            return frames
+
+    def done(self):
+        with self.cond:
+            self.busy = False
+            self.cond.notify_all()
+
+    def wait_idle(self, timeout=None):
+        with self.cond:
+            return self.cond.wait_for(lambda: self.closed or (not self.busy and self.depth() == 0), timeout)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            for channel in CHANNELS:
+                self.queues[channel].clear()
+                self.queued_bytes[channel] = 0
+            self.cond.notify_all()
+        if self.on_ready:
+            self.on_ready()
+
+    def stats(self):
+        with self.cond:
+            return {
+                'depth': {channel: len(q) for channel, q in self.queues.items()},
+                'queued_bytes': dict(self.queued_bytes),
+                'dropped': dict(self.dropped),
+                'max_depth': self.max_depth,
+                'sent_frames': self.sent_frames,
+                'overflowed': self.overflowed,
+            }
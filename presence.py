@@ -0,0 +1,59 @@
+import collections
+import itertools
+import threading
+import uuid
+
+HISTORY = 4096
+
+JOIN = '+'
+LEAVE = '-'
+STATUS = '='
+
+class PresenceLog:
+    def __init__(self, history=HISTORY):
+        self.lock = threading.RLock()
+        self.epoch = uuid.uuid4().hex[:12]
+        self.version = 0
+        self.users = {}
+        self.history = collections.deque(maxlen=history)
+
+    def __len__(self):
+        return len(self.users)
+
+    def set(self, nickname, status):
+        with self.lock:
+            old = self.users.get(nickname)
+            if old == status:
+                return None
+            if status is None:
+                del self.users[nickname]
+                change = [LEAVE, nickname]
+            else:
+                self.users[nickname] = status
+                change = [JOIN if old is None else STATUS, nickname, status]
+            self.version += 1
+            self.history.append((self.version, change))
+            return change
+
+    def snapshot(self):
+        with self.lock:
+            return self.version, dict(self.users)
+
+    def since(self, version):
+        with self.lock:
+            if version > self.version:
+                return None
+            if version == self.version:
+                return []
+            if not self.history or self.history[0][0] > version + 1:
+                return None
+            start = version + 1 - self.history[0][0]
+            return [change for _, change in itertools.islice(self.history, start, None)]
+
+def apply_changes(users, changes):
+    for change in changes:
+        if change[0] == LEAVE:
+            users.pop(change[1], None)
+        else:
+            users[change[1]] = change[2]
+    return users
@@ -0,0 +1,189 @@
+import threading
+import time
+
+class Session:
+    def __init__(self, client, nickname, address=None):
+        self.client = client
+        self.nickname = nickname
+        self.address = address
+        self.status = 'idle'
+        self.call_id = None
+        self.joined_at = time.time()
+        self.last_activity = self.joined_at
+        self.idle_timer = None
+        self.presence = False
+        self.outbound = None
+        self.lazy_keys = None
+        self.media_token = None
+        self.media_addr = None
+        self.offline_seq = 0
+
+    def set_status(self, status, call_id=None):
+        self.status = status
+        self.call_id = call_id
+
+MAX_SLOT = 0xFFFFFFFF
+MAX_ABSENT = 256
+
+class SessionRegistry:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.by_nickname = {}
+        self.by_client = {}
+        self.calls = {}
+        self.slots = {}
+        self.rooms = {}
+        self.memberships = {}
+        self.absent = {}
+        self.first_slot = 1
+        self.last_slot = MAX_SLOT
+        self.next_slot = 1
+
+    def __len__(self):
+        return len(self.by_client)
+
+    def __contains__(self, client):
+        return client in self.by_client
+
+    def add(self, client, nickname, address=None):
+        with self.lock:
+            if nickname in self.by_nickname or client in self.by_client:
+                return None
+            session = Session(client, nickname, address)
+            self.by_nickname[nickname] = session
+            self.by_client[client] = session
+            return session
+
+    def remove(self, client):
+        with self.lock:
+            session = self.by_client.pop(client, None)
+            if session is None:
+                return None
+            if self.by_nickname.get(session.nickname) is session:
+                del self.by_nickname[session.nickname]
+            return session
+
+    def get(self, client):
+        return self.by_client.get(client)
+
+    def get_by_nickname(self, nickname):
+        return self.by_nickname.get(nickname)
+
+    def sessions(self):
+        with self.lock:
+            return list(self.by_client.values())
+
+    def clients(self):
+        with self.lock:
+            return list(self.by_client)
+
+    def join_room(self, room, nickname, client):
+        with self.lock:
+            members = self.rooms.setdefault(room, {})
+            if nickname in members:
+                return False
+            members[nickname] = client
+            self.memberships.setdefault(nickname, set()).add(room)
+            self.absent.get(room, {}).pop(nickname, None)
+            return True
+
+    def leave_room(self, room, nickname):
+        with self.lock:
+            members = self.rooms.get(room)
+            if not members or members.pop(nickname, None) is None:
+                return False
+            if not members:
+                del self.rooms[room]
+            rooms = self.memberships[nickname]
+            rooms.discard(room)
+            if not rooms:
+                del self.memberships[nickname]
+            return True
+
+    def leave_rooms(self, nickname, absent=False):
+        with self.lock:
+            rooms = self.memberships.pop(nickname, ())
+            for room in rooms:
+                members = self.rooms[room]
+                del members[nickname]
+                if not members:
+                    del self.rooms[room]
+                if absent:
+                    away = self.absent.setdefault(room, {})
+                    away[nickname] = None
+                    while len(away) > MAX_ABSENT:
+                        del away[next(iter(away))]
+            return sorted(rooms)
+
+    def absent_members(self, room):
+        with self.lock:
+            return list(self.absent.get(room, ()))
+
+    def room_members(self, room):
+        with self.lock:
+            return dict(self.rooms.get(room, ()))
+
+    def rooms_of(self, nickname):
+        with self.lock:
+            return sorted(self.memberships.get(nickname, ()))
+
+    def in_room(self, room, nickname):
+        return nickname in self.rooms.get(room, ())
+
+    def co_members(self, nickname):
+        with self.lock:
+            members = {}
+            for room in self.memberships.get(nickname, ()):
+                members.update(self.rooms[room])
+            members.pop(nickname, None)
+            return members
+
+    def add_call(self, call_id, call_info):
+        with self.lock:
+            self.calls[call_id] = call_info
+
+    def get_call(self, call_id):
+        return self.calls.get(call_id)
+
+    def pop_call(self, call_id):
+        with self.lock:
+            call_info = self.calls.pop(call_id, None)
+            if call_info and call_info.get('slot') is not None:
+                self.slots.pop(call_info['slot'], None)
+            return call_info
+
+    def set_slot_range(self, first, last):
+        with self.lock:
+            self.first_slot = first
+            self.last_slot = last
+            self.next_slot = first
+
+    def advance_slot(self):
+        self.next_slot = self.next_slot + 1 if self.next_slot < self.last_slot else self.first_slot
+
+    def assign_slot(self, call_info):
+        with self.lock:
+            while self.next_slot in self.slots:
+                self.advance_slot()
+            slot = self.next_slot
+            self.advance_slot()
+            self.slots[slot] = call_info
+            call_info['slot'] = slot
+            return slot
+
+    def get_call_by_slot(self, slot):
+        return self.slots.get(slot)
+
+    def call_ids(self):
+        with self.lock:
+            return list(self.calls)
+
+    def clear(self):
+        with self.lock:
+            self.by_nickname.clear()
+            self.by_client.clear()
+            self.calls.clear()
+            self.slots.clear()
+            self.rooms.clear()
+            self.memberships.clear()
+            self.absent.clear()
@@ -246,12 +246,14 @@ def main():
     print("📚 Installing dependencies...\n")
     
     cryptography_ok = install_package(venv_pip, "cryptography")
+    numpy_ok = install_package(venv_pip, "numpy")
     pyaudio_ok = install_pyaudio(venv_pip)
     
     print("\n" + "="*70)
     print("📊 INSTALLATION RESULT")
     print("="*70)
     print(f"{'✅' if cryptography_ok else '❌'} Cryptography (E2E Encryption)")
+    print(f"{'✅' if numpy_ok else '⚠️'} NumPy (Voice compression, optional)")
     print(f"{'✅' if pyaudio_ok else '❌'} PyAudio (Voice Calling)")
     print("="*70 + "\n")
     
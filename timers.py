@@ -0,0 +1,174 @@
+import math
+import threading
+import time
+
+RESOLUTION = 0.01
+SLOTS = 256
+LEVELS = 4
+
+class Timer:
+    __slots__ = ('wheel', 'callback', 'args', 'due', 'interval', 'slot')
+
+    def __init__(self, wheel, callback, args, interval=0):
+        self.wheel = wheel
+        self.callback = callback
+        self.args = args
+        self.interval = interval
+        self.due = 0
+        self.slot = None
+
+    def active(self):
+        return self.slot is not None
+
+    def cancel(self):
+        wheel = self.wheel
+        with wheel.cond:
+            self.interval = 0
+            if self.slot is not None:
+                del self.slot[self]
+                self.slot = None
+                wheel.count -= 1
+                return True
+            return False
+
+class TimerWheel:
+    def __init__(self, resolution=RESOLUTION, slots=SLOTS, levels=LEVELS):
+        if slots & (slots - 1):
+            raise ValueError("slots must be a power of two")
+        self.resolution = resolution
+        self.bits = slots.bit_length() - 1
+        self.mask = slots - 1
+        self.levels = levels
+        self.span = (1 << (self.bits * levels)) - 1
+        self.wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        self.origin = time.monotonic()
+        self.ticks = 0
+        self.count = 0
+        self.fired = 0
+        self.cond = threading.Condition(threading.Lock())
+        self.sleeping_until = 0
+        self.running = False
+        self.thread = None
+
+    def __len__(self):
+        return self.count
+
+    def elapsed_ticks(self):
+        return int((time.monotonic() - self.origin) / self.resolution)
+
+    def schedule(self, delay, callback, *args):
+        return self.add(Timer(self, callback, args), delay)
+
+    def every(self, interval, callback, *args):
+        return self.add(Timer(self, callback, args, max(1, math.ceil(interval / self.resolution))), interval)
+
+    def add(self, timer, delay):
+        due = math.ceil((time.monotonic() - self.origin + max(0.0, delay)) / self.resolution)
+        with self.cond:
+            timer.due = min(max(due, self.ticks + 1), self.ticks + self.span)
+            self.place(timer)
+            self.count += 1
+            if self.thread is None:
+                self.running = True
+                self.thread = threading.Thread(target=self.run, name='timer-wheel')
+                self.thread.daemon = True
+                self.thread.start()
+            elif timer.due < self.sleeping_until:
+                self.cond.notify()
+        return timer
+
+    def place(self, timer):
+        delta = timer.due - self.ticks
+        level = 0
+        while level < self.levels - 1 and delta >> (self.bits * (level + 1)):
+            level += 1
+        slot = self.wheels[level][(timer.due >> (self.bits * level)) & self.mask]
+        slot[timer] = None
+        timer.slot = slot
+
+    def advance(self, expired):
+        self.ticks += 1
+        ticks = self.ticks
+        for level in range(self.levels - 1, 0, -1):
+            if ticks & ((1 << (self.bits * level)) - 1) == 0:
+                slot = self.wheels[level][(ticks >> (self.bits * level)) & self.mask]
+                timers = list(slot)
+                slot.clear()
+                for timer in timers:
+                    self.place(timer)
+        slot = self.wheels[0][ticks & self.mask]
+        if slot:
+            for timer in slot:
+                timer.slot = None
+            expired.extend(slot)
+            self.count -= len(slot)
+            slot.clear()
+
+    def catch_up(self, now, expired):
+        while self.ticks < now:
+            tick = self.next_tick()
+            if tick is None or tick > now:
+                self.ticks = now
+                return
+            self.ticks = tick - 1
+            self.advance(expired)
+
+    def next_tick(self):
+        if not self.count:
+            return None
+        best = None
+        for level in range(self.levels):
+            shift = self.bits * level
+            position = self.ticks >> shift
+            wheel = self.wheels[level]
+            for step in range(1, self.mask + 2):
+                if wheel[(position + step) & self.mask]:
+                    tick = (position + step) << shift
+                    if best is None or tick < best:
+                        best = tick
+                    break
+            if best is not None and best <= ((position >> self.bits) + 1) << (shift + self.bits):
+                break
+        return best
+
+    def run(self):
+        expired = []
+        with self.cond:
+            while self.running:
+                self.catch_up(self.elapsed_ticks(), expired)
+                if expired:
+                    for timer in expired:
+                        if timer.interval:
+                            timer.due = self.ticks + timer.interval
+                            self.place(timer)
+                            self.count += 1
+                    self.cond.release()
+                    try:
+                        self.fire(expired)
+                    finally:
+                        self.cond.acquire()
+                    expired = []
+                    continue
+                wake = self.next_tick()
+                if wake is None:
+                    self.sleeping_until = float('inf')
+                    self.cond.wait()
+                else:
+                    self.sleeping_until = wake
+                    self.cond.wait(max(0.0, self.origin + wake * self.resolution - time.monotonic()))
+                self.sleeping_until = 0
+
+    def fire(self, expired):
+        for timer in expired:
+            self.fired += 1
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                print(f"⚠️ Timer callback error: {e}")
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(1.0)
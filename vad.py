@@ -0,0 +1,144 @@
+import math
+import struct
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SPEECH = 'speech'
+COMFORT = 'comfort'
+SILENT_LEVEL = 127
+COMFORT_NOISE_SIZE = 1
+FULL_SCALE_POWER = 32768.0 * 32768.0
+SPEECH_MARGIN_DB = 9.0
+FRICATIVE_MARGIN_DB = 4.0
+FRICATIVE_ZCR = 0.3
+MIN_SPEECH_DB = -60.0
+NOISE_WINDOW_MS = 2000
+HANGOVER_MS = 240
+REFRESH_MS = 500
+FADE_MS = 4
+
+def power_db(power):
+    return 10 * math.log10(power / FULL_SCALE_POWER) if power >= 1 else -SILENT_LEVEL
+
+def features(frames):
+    samples = frames.astype(np.float64)
+    power = np.einsum('ij,ij->i', samples, samples) / samples.shape[1]
+    energy = 10 * np.log10(np.maximum(power, 1.0) / FULL_SCALE_POWER)
+    energy[power < 1] = -SILENT_LEVEL
+    crossings = np.count_nonzero(np.diff(np.signbit(frames), axis=1), axis=1)
+    return energy, crossings / float(frames.shape[1] - 1)
+
+def frame_features(pcm):
+    count = len(pcm) // 2
+    if count < 2:
+        return -SILENT_LEVEL, 0.0
+    if np is not None:
+        energy, zcr = features(np.frombuffer(pcm, dtype='<i2', count=count).reshape(1, count))
+        return float(energy[0]), float(zcr[0])
+    samples = struct.unpack(f'<{count}h', pcm[:count * 2])
+    crossings = sum(1 for a, b in zip(samples, samples[1:]) if (a < 0) != (b < 0))
+    return power_db(sum(s * s for s in samples) / count), crossings / float(count - 1)
+
+def comfort_noise_marker(noise_db):
+    return bytes([min(SILENT_LEVEL, max(0, int(round(-noise_db))))])
+
+class VoiceActivityDetector:
+    def __init__(self, rate, chunk, margin_db=SPEECH_MARGIN_DB, hangover_ms=HANGOVER_MS, refresh_ms=REFRESH_MS,
+                 window_ms=NOISE_WINDOW_MS):
+        frame_ms = chunk * 1000.0 / rate
+        self.margin_db = margin_db
+        self.hangover_frames = max(1, int(math.ceil(hangover_ms / frame_ms)))
+        self.refresh_frames = max(1, int(math.ceil(refresh_ms / frame_ms)))
+        self.history = deque([MIN_SPEECH_DB - margin_db], maxlen=max(2, int(math.ceil(window_ms / frame_ms))))
+        self.noise_db = self.quiet_db = MIN_SPEECH_DB - margin_db
+        self.hangover = 0
+        self.quiet = 0
+        self.speech = 0
+        self.comfort = 0
+        self.suppressed = 0
+
+    def active(self, energy_db, zcr):
+        noise = self.noise_db = min(self.history)
+        self.history.append(energy_db)
+        return energy_db > MIN_SPEECH_DB and (
+            energy_db > noise + self.margin_db or
+            (zcr > FRICATIVE_ZCR and energy_db > noise + FRICATIVE_MARGIN_DB))
+
+    def decide(self, energy_db, zcr):
+        if self.active(energy_db, zcr):
+            self.hangover = self.hangover_frames
+        elif self.hangover:
+            self.hangover -= 1
+        else:
+            self.quiet_db = energy_db if not self.quiet else self.quiet_db + (energy_db - self.quiet_db) * 0.2
+            self.quiet += 1
+            if (self.quiet - 1) % self.refresh_frames == 0:
+                self.comfort += 1
+                return COMFORT
+            self.suppressed += 1
+            return None
+        self.quiet = 0
+        self.speech += 1
+        return SPEECH
+
+    def process(self, pcm):
+        return self.decide(*frame_features(pcm))
+
+    def process_all(self, frames):
+        energy, zcr = features(frames)
+        return [self.decide(e, z) for e, z in zip(energy.tolist(), zcr.tolist())]
+
+    def marker(self):
+        return comfort_noise_marker(self.quiet_db)
+
+    def stats(self):
+        total = self.speech + self.comfort + self.suppressed
+        return {'frames': total, 'speech': self.speech, 'comfort': self.comfort, 'suppressed': self.suppressed,
+                'sent_pct': round(100.0 * (self.speech + self.comfort) / total, 1) if total else 100.0}
+
+class ComfortNoise:
+    def __init__(self, rate, chunk, seed=None):
+        self.chunk = chunk
+        self.level = None
+        self.rng = np.random.RandomState(seed) if np is not None else None
+        self.fade = max(1, int(rate * FADE_MS / 1000.0))
+        self.ramp = np.linspace(0.0, 1.0, self.fade, endpoint=False) if np is not None else None
+        self.silence = b"\0" * (chunk * 2)
+        self.filled = 0
+
+    @property
+    def active(self):
+        return self.level is not None
+
+    def update(self, marker):
+        starting = self.level is None
+        self.level = marker[0]
+        return self.fill(starting)
+
+    def noise(self):
+        amplitude = 32768.0 * 10 ** (-self.level / 20.0)
+        return self.rng.standard_normal(self.chunk) * amplitude
+
+    def fill(self, fade_in=False):
+        self.filled += 1
+        if self.rng is None or self.level is None:
+            return self.silence
+        noise = self.noise()
+        if fade_in:
+            noise[:self.fade] *= self.ramp
+        return np.clip(noise, -32768, 32767).astype('<i2').tobytes()
+
+    def resume(self, pcm):
+        if self.level is None:
+            return pcm
+        if self.rng is not None and len(pcm) >= self.fade * 2:
+            samples = np.frombuffer(pcm, dtype='<i2').astype(np.float64)
+            head = samples[:self.fade]
+            samples[:self.fade] = head * self.ramp + self.noise()[:self.fade] * (1.0 - self.ramp)
+            pcm = np.clip(samples, -32768, 32767).astype('<i2').tobytes()
+        self.level = None
+        return pcm
@@ -0,0 +1,258 @@
+import math
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+WIDEBAND_RATE = 16000
+DEFAULT_CODEC = 'pcm16'
+SILENT_LEVEL = 127
+
+class PCM16Codec:
+    name = 'pcm16'
+    rate = None
+
+    def encode(self, samples):
+        return samples.astype('<i2').tobytes() if np is not None else samples
+
+    def decode(self, data):
+        return np.frombuffer(data, dtype='<i2') if np is not None else data
+
+MULAW_BIAS = 0x84
+MULAW_CLIP = 32635
+
+class MuLawCodec:
+    name = 'mulaw'
+    rate = WIDEBAND_RATE
+
+    def __init__(self):
+        exponents = np.zeros(256, dtype=np.int32)
+        for i in range(1, 256):
+            exponents[i] = int(i).bit_length() - 1
+        self.exponents = exponents
+
+        codes = ~np.arange(256, dtype=np.int32) & 0xFF
+        exponent = (codes >> 4) & 0x07
+        mantissa = codes & 0x0F
+        magnitude = (((mantissa << 3) + MULAW_BIAS) << exponent) - MULAW_BIAS
+        self.decode_table = np.where(codes & 0x80, -magnitude, magnitude).astype(np.int16)
+
+    def encode(self, samples):
+        samples = samples.astype(np.int32)
+        sign = (samples < 0).astype(np.int32) << 7
+        magnitude = np.minimum(np.abs(samples), MULAW_CLIP) + MULAW_BIAS
+        exponent = self.exponents[magnitude >> 7]
+        mantissa = (magnitude >> (exponent + 3)) & 0x0F
+        return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8).tobytes()
+
+    def decode(self, data):
+        return self.decode_table[np.frombuffer(data, dtype=np.uint8)]
+
+IMA_INDEX_TABLE = [-1, -1, -1, -1, 2, 4, 6, 8, -1, -1, -1, -1, 2, 4, 6, 8]
+IMA_STEP_TABLE = [
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767,
+]
+ADPCM_HEADER = struct.Struct('<hBxH')
+
+class ImaAdpcmCodec:
+    name = 'adpcm'
+    rate = WIDEBAND_RATE
+
+    def __init__(self):
+        self.predictor = 0
+        self.index = 0
+
+    def encode(self, samples):
+        predictor = self.predictor
+        index = self.index
+        step_table = IMA_STEP_TABLE
+        index_table = IMA_INDEX_TABLE
+        header = ADPCM_HEADER.pack(predictor, index, len(samples))
+        codes = np.empty(len(samples), dtype=np.uint8)
+
+        for i, sample in enumerate(samples.tolist()):
+            step = step_table[index]
+            diff = sample - predictor
+            code = 0
+            if diff < 0:
+                code = 8
+                diff = -diff
+            delta = step >> 3
+            if diff >= step:
+                code |= 4
+                diff -= step
+                delta += step
+            step >>= 1
+            if diff >= step:
+                code |= 2
+                diff -= step
+                delta += step
+            step >>= 1
+            if diff >= step:
+                code |= 1
+                delta += step
+            predictor = predictor - delta if code & 8 else predictor + delta
+            if predictor > 32767:
+                predictor = 32767
+            elif predictor < -32768:
+                predictor = -32768
+            index += index_table[code]
+            if index < 0:
+                index = 0
+            elif index > 88:
+                index = 88
+            codes[i] = code
+
+        self.predictor = predictor
+        self.index = index
+        if len(codes) % 2:
+            codes = np.append(codes, np.uint8(0))
+        return header + (codes[0::2] | (codes[1::2] << 4)).tobytes()
+
+    def decode(self, data):
+        predictor, index, count = ADPCM_HEADER.unpack_from(data)
+        packed = np.frombuffer(data, dtype=np.uint8, offset=ADPCM_HEADER.size)
+        codes = np.empty(len(packed) * 2, dtype=np.uint8)
+        codes[0::2] = packed & 0x0F
+        codes[1::2] = packed >> 4
+        step_table = IMA_STEP_TABLE
+        index_table = IMA_INDEX_TABLE
+        out = np.empty(count, dtype=np.int16)
+
+        for i, code in enumerate(codes[:count].tolist()):
+            step = step_table[index]
+            delta = step >> 3
+            if code & 4:
+                delta += step
+            if code & 2:
+                delta += step >> 1
+            if code & 1:
+                delta += step >> 2
+            predictor = predictor - delta if code & 8 else predictor + delta
+            if predictor > 32767:
+                predictor = 32767
+            elif predictor < -32768:
+                predictor = -32768
+            index += index_table[code]
+            if index < 0:
+                index = 0
+            elif index > 88:
+                index = 88
+            out[i] = predictor
+        return out
+
+class Resampler:
+    def __init__(self, src_rate, dst_rate, taps=31):
+        self.step = float(src_rate) / dst_rate
+        self.position = 0.0
+        self.tail = np.zeros(1, dtype=np.float32)
+        self.kernel = None
+        if dst_rate < src_rate:
+            cutoff = 0.45 * dst_rate / src_rate
+            n = np.arange(taps) - (taps - 1) / 2.0
+            kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+            self.kernel = (kernel / kernel.sum()).astype(np.float32)
+            self.history = np.zeros(taps - 1, dtype=np.float32)
+
+    def lowpass(self, samples):
+        data = np.concatenate((self.history, samples))
+        self.history = data[-(len(self.kernel) - 1):]
+        return np.convolve(data, self.kernel, mode='valid')
+
+    def process(self, samples):
+        samples = samples.astype(np.float32)
+        if self.kernel is not None:
+            samples = self.lowpass(samples)
+        data = np.concatenate((self.tail, samples))
+        last = len(data) - 1
+        if last < self.position:
+            self.position -= last
+            self.tail = data[-1:]
+            return np.zeros(0, dtype=np.int16)
+        count = int((last - self.position) // self.step) + 1
+        positions = self.position + np.arange(count) * self.step
+        out = np.interp(positions, np.arange(len(data)), data)
+        self.position = positions[-1] + self.step - last
+        self.tail = data[-1:]
+        return np.clip(np.round(out), -32768, 32767).astype(np.int16)
+
+CODECS = {
+    'adpcm': ImaAdpcmCodec,
+    'mulaw': MuLawCodec,
+    'pcm16': PCM16Codec,
+}
+PREFERENCE = ['adpcm', 'mulaw', 'pcm16']
+
+def available_codecs():
+    if np is None:
+        return [DEFAULT_CODEC]
+    return list(PREFERENCE)
+
+def negotiate(offered, supported=None):
+    supported = supported or available_codecs()
+    for name in offered or []:
+        if name in supported:
+            return name
+    return DEFAULT_CODEC
+
+def audio_level(pcm):
+    count = len(pcm) // 2
+    if not count:
+        return SILENT_LEVEL
+    if np is not None:
+        samples = np.frombuffer(pcm, dtype='<i2', count=count).astype(np.float64)
+        power = float(np.dot(samples, samples)) / count
+    else:
+        power = sum(sample * sample for sample in struct.unpack(f'<{count}h', pcm[:count * 2])) / count
+    if power < 1:
+        return SILENT_LEVEL
+    return min(SILENT_LEVEL, int(round(-10 * math.log10(power / 1073741824.0))))
+
+def mix(frames):
+    if len(frames) == 1 or np is None:
+        return frames[0]
+    size = min(len(frame) for frame in frames) // 2
+    total = np.zeros(size, dtype=np.int32)
+    for frame in frames:
+        total += np.frombuffer(frame, dtype='<i2', count=size)
+    return np.clip(total, -32768, 32767).astype('<i2').tobytes()
+
+class VoicePipeline:
+    def __init__(self, codec_name, device_rate):
+        if codec_name not in available_codecs():
+            codec_name = DEFAULT_CODEC
+        self.codec_name = codec_name
+        self.encoder = CODECS[codec_name]()
+        self.decoder = CODECS[codec_name]()
+        self.device_rate = device_rate
+        wire_rate = self.encoder.rate or device_rate
+        self.passthrough = np is None or (codec_name == 'pcm16' and wire_rate == device_rate)
+        if not self.passthrough and wire_rate != device_rate:
+            self.downsampler = Resampler(device_rate, wire_rate)
+            self.upsampler = Resampler(wire_rate, device_rate)
+        else:
+            self.downsampler = self.upsampler = None
+
+    def encode(self, pcm):
+        if self.passthrough:
+            return pcm
+        samples = np.frombuffer(pcm, dtype='<i2')
+        if self.downsampler:
+            samples = self.downsampler.process(samples)
+        return self.encoder.encode(samples)
+
+    def decode(self, data):
+        if self.passthrough:
+            return data
+        samples = self.decoder.decode(data)
+        if self.upsampler:
+            samples = self.upsampler.process(samples)
+        return samples.astype('<i2').tobytes()